@@ -106,10 +106,26 @@ def create_app(config_class=Config):
     from .services.auth_service import auth_service
     auth_service.init_app(app)
 
+    # Register maintenance CLI commands
+    from .cli import register_commands
+    register_commands(app)
+
     # Create database tables
     with app.app_context():
         db.create_all()
     
+    # Event-loop engine of the workflow runs, started on first use
+    from .services.async_workflow_engine import async_workflow_engine
+    async_workflow_engine.init_app(app)
+    
+    # Start the asynchronous workflow run workers, resuming interrupted runs
+    from .services.workflow_run_service import workflow_run_service
+    workflow_run_service.init_app(app)
+    
+    # Cache compiled workflow definitions, kept current across workers
+    from .services.workflow_cache import workflow_cache
+    workflow_cache.init_app(app)
+    
     return app
 
 from . import models
\ No newline at end of file
@@ -0,0 +1,66 @@
+import json
+import click
+from flask.cli import AppGroup
+
+from .services.vector_storage import STORAGE_MODES, VectorStorageConfig
+
+vectors_cli = AppGroup('vectors', help='Vector storage maintenance commands.')
+
+
+@vectors_cli.command('status')
+def vectors_status():
+    """List the vector storage settings of every knowledge base."""
+    from .models import Knowledge, DocumentVector
+    from . import db
+    from sqlalchemy import func
+
+    counts = dict(
+        db.session.query(DocumentVector.knowledge_uuid, func.count(DocumentVector.uuid))
+        .group_by(DocumentVector.knowledge_uuid)
+        .all()
+    )
+    for knowledge in Knowledge.query.order_by(Knowledge.name).all():
+        storage = VectorStorageConfig.from_knowledge(knowledge)
+        click.echo(f"{knowledge.uuid}  {knowledge.name:<30}  mode={storage.mode:<8} "
+                   f"dimensions={storage.dimensions or 'native':<6} vectors={counts.get(knowledge.uuid, 0)}")
+
+
+@vectors_cli.command('convert')
+@click.argument('knowledge_uuid')
+@click.option('--mode', type=click.Choice(STORAGE_MODES), required=True, help='Target storage mode.')
+@click.option('--dimensions', type=int, default=None, help='Matryoshka truncation (supported models only).')
+@click.option('--rescore-factor', type=int, default=None, help='Binary mode: candidates re-scored per result.')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='Vectors rewritten per transaction.')
+@click.option('--reembed', is_flag=True, help='Regenerate embeddings from the chunk text.')
+def vectors_convert(knowledge_uuid, mode, dimensions, rescore_factor, batch_size, reembed):
+    """Convert the stored vectors of a knowledge base to another storage mode."""
+    from .services.knowledge_service import KnowledgeService
+
+    result = KnowledgeService().convert_vector_storage(
+        knowledge_uuid,
+        mode=mode,
+        dimensions=dimensions,
+        rescore_factor=rescore_factor,
+        batch_size=batch_size,
+        reembed=reembed
+    )
+    click.echo(json.dumps(result, indent=2))
+
+
+@vectors_cli.command('summaries')
+@click.argument('knowledge_uuid', required=False)
+@click.option('--batch-size', type=int, default=100, show_default=True, help='Documents summarised per transaction.')
+def vectors_summaries(knowledge_uuid, batch_size):
+    """Backfill the document summary vectors used by two-stage retrieval."""
+    from .models import Knowledge
+    from .services.knowledge_service import KnowledgeService
+
+    service = KnowledgeService()
+    knowledge_ids = [knowledge_uuid] if knowledge_uuid else [k.uuid for k in Knowledge.query.all()]
+    for knowledge_id in knowledge_ids:
+        written = service.refresh_document_summaries(knowledge_id, batch_size=batch_size)
+        click.echo(f"{knowledge_id}  summaries={written}")
+
+
+def register_commands(app):
+    app.cli.add_command(vectors_cli)
@@ -17,12 +17,41 @@ class Config:
     
     # Vector DB settings
     VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', './vector_db')
+    # 'auto' uses pgvector on PostgreSQL and the embedded engine elsewhere; or 'pgvector' / 'embedded'
+    VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'auto')
+    # Embedded engine: brute force up to this many vectors per knowledge base, HNSW above
+    EMBEDDED_BRUTE_FORCE_MAX_VECTORS = int(os.getenv('EMBEDDED_BRUTE_FORCE_MAX_VECTORS', 20000))
+    HNSW_M = int(os.getenv('HNSW_M', 16))
+    HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 100))
+    HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 64))
     
     # LLM settings
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
     DEFAULT_LLM_MODEL = os.getenv('DEFAULT_LLM_MODEL', 'gemma3:12b')
     DEFAULT_EMBEDDING_MODEL = os.getenv('DEFAULT_EMBEDDING_MODEL', 'nomic-embed-text:v1.5')
     
+    # Asynchronous workflow runs
+    WORKFLOW_RUN_WORKERS_ENABLED = os.getenv('WORKFLOW_RUN_WORKERS_ENABLED', 'true').lower() == 'true'
+    WORKFLOW_RUN_WORKERS = int(os.getenv('WORKFLOW_RUN_WORKERS', 4))  # Runs executed at once per process
+    # Runs executing at once across all workers; 0 means unlimited
+    WORKFLOW_RUN_MAX_PER_WORKFLOW = int(os.getenv('WORKFLOW_RUN_MAX_PER_WORKFLOW', 2))
+    WORKFLOW_RUN_MAX_PER_API_KEY = int(os.getenv('WORKFLOW_RUN_MAX_PER_API_KEY', 2))
+    WORKFLOW_RUN_POLL_SECONDS = float(os.getenv('WORKFLOW_RUN_POLL_SECONDS', 1.0))
+    # Running rows whose heartbeat is older than this are considered interrupted and queued again
+    WORKFLOW_RUN_STALE_SECONDS = int(os.getenv('WORKFLOW_RUN_STALE_SECONDS', 60))
+    WORKFLOW_RUN_MAX_ATTEMPTS = int(os.getenv('WORKFLOW_RUN_MAX_ATTEMPTS', 3))
+    # 'threads' runs each workflow on a pool thread; 'async' runs them as coroutines of one event loop
+    WORKFLOW_RUN_ENGINE = os.getenv('WORKFLOW_RUN_ENGINE', 'threads')
+    WORKFLOW_RUN_ASYNC_MAX_IN_FLIGHT = int(os.getenv('WORKFLOW_RUN_ASYNC_MAX_IN_FLIGHT', 1000))  # Runs in flight per process
+    # Async engine: pooled HTTP connections (Ollama and HTTP request nodes) and threads for blocking nodes
+    WORKFLOW_ASYNC_HTTP_CONNECTIONS = int(os.getenv('WORKFLOW_ASYNC_HTTP_CONNECTIONS', 100))
+    WORKFLOW_ASYNC_BLOCKING_WORKERS = int(os.getenv('WORKFLOW_ASYNC_BLOCKING_WORKERS', 16))
+
+    # Workflow definition cache: seconds a cached workflow is trusted without a version check
+    # (on PostgreSQL, LISTEN/NOTIFY keeps the cache current and the check is only a fallback)
+    WORKFLOW_CACHE_CHECK_SECONDS = float(os.getenv('WORKFLOW_CACHE_CHECK_SECONDS', 5.0))
+    WORKFLOW_CACHE_LISTEN = os.getenv('WORKFLOW_CACHE_LISTEN', 'true').lower() == 'true'
+    
     # File upload settings
     UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', './uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
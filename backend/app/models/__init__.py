@@ -2,6 +2,9 @@ from .workflow import Workflow
 from .knowledge import Knowledge
 from .document import Document
 from .document_vector import DocumentVector
+from .document_summary_vector import DocumentSummaryVector
 from .knowledge_retrieval_history import KnowledgeRetrievalHistory
+from .workflow_run import WorkflowRun
+from .workflow_node_trace import WorkflowNodeTrace
 
-__all__ = ['Workflow', 'Knowledge', 'Document', 'DocumentVector', 'KnowledgeRetrievalHistory']
+__all__ = ['Workflow', 'Knowledge', 'Document', 'DocumentVector', 'DocumentSummaryVector', 'KnowledgeRetrievalHistory', 'WorkflowRun', 'WorkflowNodeTrace']
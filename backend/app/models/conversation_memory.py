@@ -19,6 +19,11 @@ class ConversationMemory(db.Model):
             process_steps: Optional processing steps information
             role_type: Optional role subtype (agent, llm, etc.) to distinguish different assistant types
         """
+        self.append_messages([self.build_message(role, content, process_steps, role_type)])
+
+    @staticmethod
+    def build_message(role: str, content: str, process_steps=None, role_type: str = None) -> dict:
+        """Build a message dict in the format stored in ``messages`` (see ``add_message``)"""
         message = {
             "id": str(uuid.uuid4()),
             "role": role,
@@ -30,8 +35,11 @@ class ConversationMemory(db.Model):
         # Add role_type if provided to distinguish between different assistant types
         if role_type:
             message["role_type"] = role_type
-            
-        self.messages = self.messages + [message]
+        return message
+
+    def append_messages(self, messages):
+        """Append already built messages in a single rewrite of the ``messages`` column"""
+        self.messages = (self.messages or []) + list(messages)
         self.updated_at = datetime.utcnow()
         
     def get_messages(self, role=None, role_type=None):
@@ -0,0 +1,35 @@
+from datetime import datetime
+import uuid
+from .. import db
+from .document_vector import VectorType, HalfVectorType, BitType
+
+class DocumentSummaryVector(db.Model):
+    """Document-level summary vector: the normalised centroid of a document's chunk embeddings.
+
+    Searched before the chunks to pick candidate documents in two-stage retrieval.
+    Stored in the same columns and storage mode as the knowledge base's ``DocumentVector`` rows.
+    """
+    __tablename__ = 'document_summary_vectors'
+    __table_args__ = (
+        db.Index('idx_document_summary_vectors_knowledge', 'knowledge_uuid'),
+    )
+
+    uuid = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
+    document_uuid = db.Column(db.UUID, nullable=False, unique=True)
+    knowledge_uuid = db.Column(db.UUID, nullable=False)
+    chunk_count = db.Column(db.Integer, nullable=False, default=0)  # Chunks averaged into the summary
+    embedding = db.Column(VectorType, nullable=True)  # float32 storage
+    embedding_half = db.Column(HalfVectorType, nullable=True)  # halfvec / binary storage
+    embedding_bits = db.Column(BitType, nullable=True)  # binary storage
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'uuid': str(self.uuid),
+            'document_uuid': str(self.document_uuid),
+            'knowledge_uuid': str(self.knowledge_uuid),
+            'chunk_count': self.chunk_count,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
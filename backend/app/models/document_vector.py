@@ -1,3 +1,4 @@
+import json
 from datetime import datetime
 import uuid
 from sqlalchemy import Column, String, ForeignKey, Text, DateTime, JSON, UUID
@@ -10,9 +11,63 @@ from .. import db
 class VectorType(UserDefinedType):
     """PostgreSQL vector type for pgvector extension"""
     
+    cache_ok = True
+    
     def get_col_spec(self, **kw):
         return "vector"
     
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            if dialect.name != 'postgresql':
+                # Stored as JSON text on databases without pgvector
+                return json.dumps([float(x) for x in value])
+            return value
+        return process
+    
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            # pgvector's text format ('[1,2,3]') is valid JSON as well
+            if isinstance(value, str):
+                return json.loads(value)
+            return value
+        return process
+
+class HalfVectorType(UserDefinedType):
+    """PostgreSQL halfvec (fp16) type for pgvector extension"""
+    
+    cache_ok = True
+    
+    def get_col_spec(self, **kw):
+        return "halfvec"
+    
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            if dialect.name != 'postgresql':
+                # Stored as JSON text on databases without pgvector
+                return json.dumps([float(x) for x in value])
+            return value
+        return process
+    
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            # pgvector's text format ('[1,2,3]') is valid JSON as well
+            if isinstance(value, str):
+                return json.loads(value)
+            return value
+        return process
+
+class BitType(UserDefinedType):
+    """PostgreSQL bit varying type used for binary quantised embeddings"""
+    
+    cache_ok = True
+    
+    def get_col_spec(self, **kw):
+        return "bit varying"
+    
     def bind_processor(self, dialect):
         def process(value):
             if value is None:
@@ -28,6 +83,9 @@ class VectorType(UserDefinedType):
 class DocumentVector(db.Model):
     """Model for document vectors using PostgreSQL pgvector extension"""
     __tablename__ = 'document_vectors'
+    __table_args__ = (
+        db.Index('idx_document_vectors_document_chunk', 'document_uuid', 'chunk_index'),
+    )
     
     uuid = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
     user_uuid = db.Column(db.UUID, nullable=True)  # Optional user association
@@ -41,12 +99,14 @@ class DocumentVector(db.Model):
     enable = db.Column(db.Boolean, default=True)
     document_type = db.Column(db.String(255), nullable=True)
     text_content = db.Column(db.Text, nullable=False)  # The actual text chunk
-    embedding = db.Column(VectorType, nullable=False)  # Vector embedding using pgvector
+    embedding = db.Column(VectorType, nullable=True)  # Vector embedding using pgvector (float32 storage)
+    embedding_half = db.Column(HalfVectorType, nullable=True)  # fp16 embedding (halfvec / binary storage)
+    embedding_bits = db.Column(BitType, nullable=True)  # Binary quantised embedding (binary storage)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     bots_uuid = db.Column(db.UUID, nullable=True)  # Optional bot association    
     
-    def to_dict(self):
+    def to_dict(self, include_embedding=True):
         return {
             'uuid': str(self.uuid),
             'user_uuid': str(self.user_uuid) if self.user_uuid else None,
@@ -55,7 +115,7 @@ class DocumentVector(db.Model):
             'total_chunks': self.total_chunks,
             'document_type': self.document_type,
             'text_content': self.text_content,
-            'embedding': self.embedding,
+            'embedding': self.embedding if include_embedding else None,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'bots_uuid': str(self.bots_uuid) if self.bots_uuid else None,
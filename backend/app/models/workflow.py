@@ -8,6 +8,8 @@ class Workflow(db.Model):
     description = db.Column(db.Text)
     nodes = db.Column(db.JSON, nullable=False)
     edges = db.Column(db.JSON, nullable=False)
+    # Result of the last save-time validation: warnings and the nodes pruned from the schedule
+    validation = db.Column(db.JSON)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -21,6 +23,7 @@ class Workflow(db.Model):
             'description': self.description,
             'nodes': self.nodes,
             'edges': self.edges,
+            'validation': self.validation,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
         }
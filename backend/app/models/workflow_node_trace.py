@@ -0,0 +1,50 @@
+from .. import db
+
+class WorkflowNodeTrace(db.Model):
+    """Timing of one node attempt of a workflow execution, written in bulk when the run ends.
+
+    Rows are append-only and never updated; they back the latency percentiles of the
+    trace endpoints. ``queue_wait_ms`` is the time between the node becoming ready
+    and starting, e.g. while every parallel slot was busy.
+    """
+    __tablename__ = 'workflow_node_trace'
+    __table_args__ = (
+        db.Index('idx_workflow_node_trace_workflow_started', 'workflow_uuid', 'started_at'),
+        db.Index('idx_workflow_node_trace_execution', 'execution_id'),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=True)
+    workflow_uuid = db.Column(db.UUID, nullable=False)
+    execution_id = db.Column(db.String(64), nullable=False)
+    node_id = db.Column(db.String(255), nullable=False)
+    node_type = db.Column(db.String(50))
+    status = db.Column(db.String(20), nullable=False)  # completed, fallback, failed, timeout or cancelled
+    attempt = db.Column(db.SmallInteger, nullable=False, default=1)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    duration_ms = db.Column(db.Float, nullable=False)
+    queue_wait_ms = db.Column(db.Float)
+    bytes_in = db.Column(db.Integer)
+    bytes_out = db.Column(db.Integer)
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    cache_hit = db.Column(db.Boolean)
+
+    def to_dict(self):
+        return {
+            'execution_id': self.execution_id,
+            'workflow_uuid': str(self.workflow_uuid),
+            'node_id': self.node_id,
+            'node_type': self.node_type,
+            'status': self.status,
+            'attempt': self.attempt,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'duration_ms': self.duration_ms,
+            'queue_wait_ms': self.queue_wait_ms,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'prompt_tokens': self.prompt_tokens,
+            'completion_tokens': self.completion_tokens,
+            'cache_hit': self.cache_hit
+        }
@@ -0,0 +1,67 @@
+from datetime import datetime
+import uuid
+from .. import db
+
+class WorkflowRun(db.Model):
+    """An asynchronous workflow execution: queued by the API, executed by the run workers.
+
+    Status moves from ``queued`` to ``running`` and ends as ``succeeded``, ``failed``
+    or ``cancelled``. Running rows carry a heartbeat so runs of a worker that died
+    can be detected and queued again.
+    """
+    __tablename__ = 'workflow_run'
+    __table_args__ = (
+        db.Index('idx_workflow_run_status_created', 'status', 'created_at'),
+        db.Index('idx_workflow_run_workflow', 'workflow_uuid'),
+    )
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+    FINAL_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    uuid = db.Column(db.UUID, primary_key=True, default=uuid.uuid4)
+    workflow_uuid = db.Column(db.UUID, db.ForeignKey('workflow.uuid', ondelete='CASCADE'), nullable=False)
+    api_key_uuid = db.Column(db.UUID, nullable=True)  # API key that queued the run, if any
+    created_by = db.Column(db.String(50))
+    status = db.Column(db.String(20), nullable=False, default=STATUS_QUEUED)
+    input = db.Column(db.Text, nullable=True)
+    conversation_id = db.Column(db.UUID, nullable=True)
+    files = db.Column(db.JSON, nullable=True)
+    result = db.Column(db.JSON, nullable=True)
+    process_steps = db.Column(db.JSON, nullable=True)
+    stats = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False)
+    worker_id = db.Column(db.String(255), nullable=True)  # host:pid of the worker executing the run
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINAL_STATUSES
+
+    def to_dict(self, include_result=False):
+        data = {
+            'run_id': str(self.uuid),
+            'workflow_uuid': str(self.workflow_uuid),
+            'status': self.status,
+            'attempts': self.attempts,
+            'cancel_requested': self.cancel_requested,
+            'conversation_id': str(self.conversation_id) if self.conversation_id else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_result:
+            data['result'] = self.result
+            data['process_steps'] = self.process_steps
+            data['stats'] = self.stats
+        return data
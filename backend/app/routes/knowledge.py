@@ -43,7 +43,9 @@ document_model = api.model('Document', {
 
 query_input = api.model('QueryInput', {
     'query': fields.String(required=True, description='Search query'),
-    'limit': fields.Integer(description='Maximum number of results to return', default=5)
+    'limit': fields.Integer(description='Maximum number of results to return', default=5),
+    'candidate_documents': fields.Integer(description='Two-stage retrieval: documents picked by summary vector before searching their chunks'),
+    'candidate_chunks': fields.Integer(description='Hybrid search: chunks taken from each of the keyword and semantic searches before re-ranking')
 })
 
 query_result = api.model('QueryResult', {
@@ -229,7 +231,9 @@ class KnowledgeRetrieveTesting(Resource):
                 dataset_id=str(knowledge_uuid),
                 query=data['query'],
                 top_k=data.get('limit', 5),
-                score_threshold=data.get('score_threshold', 0.0)
+                score_threshold=data.get('score_threshold', 0.0),
+                candidate_documents=data.get('candidate_documents'),
+                candidate_chunks=data.get('candidate_chunks')
             )
             
             # Format results to match the expected response format
@@ -398,10 +402,12 @@ class DocumentChunksResource(Resource):
             per_page, 
             keyword
         )
+        if document is None:
+            api.abort(404, f"Document with UUID {document_uuid} not found")
         
         return {
             'document': document,
-            'items': [w.to_dict() for w in result],
+            'items': [w.to_dict(include_embedding=False) for w in result],
             'total': total,
             'page': page,
             'per_page': per_page,
@@ -439,10 +445,12 @@ class DocumentChunksResource(Resource):
             per_page, 
             keyword
         )
+        if document is None:
+            api.abort(404, f"Document with UUID {document_uuid} not found")
         
         return {
             'document': document,
-            'items': [w.to_dict() for w in result],
+            'items': [w.to_dict(include_embedding=False) for w in result],
             'total': total,
             'page': page,
             'per_page': per_page,
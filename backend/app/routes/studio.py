@@ -1,9 +1,22 @@
-from flask import request, Blueprint
+from flask import request, Blueprint, Response, current_app, stream_with_context
 from flask_restx import Namespace, Resource, fields
 from ..services import WorkflowService
 from werkzeug.exceptions import BadRequest
 from ..services.auth_service import auth_service
+from ..services.workflow_run_service import workflow_run_service
+from ..services.workflow_batch_service import WorkflowBatchService, DEFAULT_PARALLELISM
+from ..services.workflow_cache import workflow_cache
+from ..services.workflow_trace_service import workflow_latency_stats, get_execution_trace
+from ..models.api_key import APIKey
+from ..utils.exc import WorkflowCancelledError, NodeTimeoutError, WorkflowValidationError
+from ..utils.logging_utils import set_process_id
+from datetime import datetime, timedelta, timezone
+import json
 import logging
+import os
+import queue
+import threading
+import uuid
 
 # Configure logging
 logging.basicConfig(
@@ -14,6 +27,10 @@ logging.basicConfig(
 # Keep the Blueprint for compatibility
 bp = Blueprint('studio', __name__)
 workflow_service = WorkflowService()
+workflow_batch_service = WorkflowBatchService(workflow_service)
+
+# Seconds without events after which a comment is sent to keep the SSE connection open
+SSE_KEEPALIVE_SECONDS = float(os.getenv('SSE_KEEPALIVE_SECONDS', '15'))
 
 # Create a namespace for studio routes
 api = Namespace('Studio', description='Studio operations')
@@ -32,6 +49,7 @@ workflow_model = api.model('Workflow', {
     'description': fields.String(description='Workflow description'),
     'nodes': fields.Raw(description='Workflow nodes'),
     'edges': fields.Raw(description='Workflow edges'),
+    'validation': fields.Raw(description='Save-time validation: warnings and nodes pruned from the schedule'),
     'created_at': fields.DateTime(description='Creation timestamp'),
     'updated_at': fields.DateTime(description='Last update timestamp')
 })
@@ -39,6 +57,7 @@ workflow_model = api.model('Workflow', {
 execution_input = api.model('ExecutionInput', {
     'input': fields.String(description='Input data for the workflow'),
     'conversation_id': fields.String(description='Optional conversation memory UUID for continuing an existing conversation'),
+    'deadline': fields.Float(description='Optional seconds the execution may take; node timeouts shrink to fit it'),
     'files': fields.List(
             fields.Nested(api.model('UploadedFile', {
                 'uuid': fields.String(description='File UUID'),
@@ -59,6 +78,25 @@ execution_result = api.model('ExecutionResult', {
     'conversation_id': fields.String(description='Unique conversation memory UUID for this session')
 })
 
+workflow_run_model = api.model('WorkflowRun', {
+    'run_id': fields.String(description='Run identifier'),
+    'workflow_uuid': fields.String(description='Workflow identifier'),
+    'status': fields.String(description='queued, running, succeeded, failed or cancelled'),
+    'attempts': fields.Integer(description='Times the run was started'),
+    'cancel_requested': fields.Boolean(description='Whether cancellation was requested'),
+    'conversation_id': fields.String(description='Conversation memory UUID of the run'),
+    'error': fields.String(description='Error message of a failed run'),
+    'created_at': fields.String(description='Queue timestamp'),
+    'started_at': fields.String(description='Start timestamp'),
+    'finished_at': fields.String(description='Completion timestamp')
+})
+
+workflow_run_result_model = api.inherit('WorkflowRunResult', workflow_run_model, {
+    'result': fields.Raw(description='Result of the workflow execution'),
+    'process_steps': fields.Raw(description='Process steps of the execution'),
+    'stats': fields.Raw(description='Execution statistics')
+})
+
 # Define models for workflow variables
 variable_output = api.model('VariableOutput', {
     'name': fields.String(description='Output variable name'),
@@ -103,6 +141,8 @@ class WorkflowResource(Resource):
             )
             logging.info(f"Workflow created successfully with ID: {workflow.uuid}")
             return workflow.to_dict(), 201
+        except WorkflowValidationError as e:
+            api.abort(400, e.message, errors=[error.to_dict() for error in e.errors])
         except Exception as e:
             logging.error(f"Failed to create workflow: {str(e)}")
             raise
@@ -176,6 +216,7 @@ class WorkflowItem(Resource):
     @api.doc('update_workflow')
     @api.expect(workflow_input)
     @api.response(200, 'Success', workflow_model)
+    @api.response(400, 'Validation Error')
     @api.response(404, 'Workflow not found')
     @auth_service.token_required
     def put(self, workflow_uuid, current_user=None):
@@ -187,10 +228,14 @@ class WorkflowItem(Resource):
             workflow = workflow_service.update_workflow(
                 workflow_uuid,
                 nodes=data.get('nodes'),
-                edges=data.get('edges')
+                edges=data.get('edges'),
+                name=data.get('name'),
+                description=data.get('description')
             )
             logging.info(f"Successfully updated workflow {workflow_uuid}")
             return workflow.to_dict()
+        except WorkflowValidationError as e:
+            api.abort(400, e.message, errors=[error.to_dict() for error in e.errors])
         except Exception as e:
             logging.error(f"Failed to update workflow {workflow_uuid}: {str(e)}")
             raise
@@ -228,16 +273,18 @@ class WorkflowVariables(Resource):
 @api.route('/workflows/execute/<uuid:workflow_uuid>')
 @api.param('workflow_uuid', 'The workflow identifier')
 class WorkflowExecution(Resource):
-    @api.doc('cancel_workflow')
+    @api.doc('cancel_workflow',
+            params={'execution_id': 'Cancel only this execution (default: every running execution of the workflow)'})
     @api.response(200, 'Success')
     @api.response(404, 'Workflow not found')
     @auth_service.dual_auth_required
     def delete(self, workflow_uuid, current_user=None):
         """Cancel a running workflow"""
-        logging.info(f"Cancelling workflow {workflow_uuid}")
+        execution_id = request.args.get('execution_id')
+        logging.info(f"Cancelling workflow {workflow_uuid}{f' execution {execution_id}' if execution_id else ''}")
         
         try:
-            cancelled = workflow_service.cancel_workflow(workflow_uuid)
+            cancelled = workflow_service.cancel_workflow(workflow_uuid, execution_id=execution_id)
             logging.info(f"{'Successfully cancelled' if cancelled else 'No active'} workflow {workflow_uuid}")
             return {'cancelled': cancelled}
         except Exception as e:
@@ -248,6 +295,7 @@ class WorkflowExecution(Resource):
     @api.response(200, 'Success', execution_result)
     @api.response(400, 'Execution error')
     @api.response(404, 'Workflow not found')
+    @api.response(504, 'A node timed out or the workflow deadline was exceeded')
     @auth_service.dual_auth_required
     def post(self, workflow_uuid, current_user=None):
         """Execute a workflow"""
@@ -268,10 +316,276 @@ class WorkflowExecution(Resource):
                 workflow_uuid=workflow_uuid, 
                 input_data=input_data,
                 conversation_id=conversation_id,
-                files=files
+                files=files,
+                deadline=data.get('deadline')
             )
             logging.info(f"Successfully executed workflow {workflow_uuid}")
             return {'result': result}
+        except WorkflowCancelledError as e:
+            logging.info(f"Workflow {workflow_uuid} was cancelled")
+            api.abort(409, str(e))
+        except NodeTimeoutError as e:
+            logging.error(f"Workflow {workflow_uuid} timed out: {str(e)}")
+            api.abort(504, str(e))
         except Exception as e:
             logging.error(f"Failed to execute workflow {workflow_uuid}: {str(e)}")
             api.abort(400, str(e))
+
+def _sse_event(event, data):
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+@api.route('/workflows/execute/<uuid:workflow_uuid>/stream')
+@api.param('workflow_uuid', 'The workflow identifier')
+class WorkflowExecutionStream(Resource):
+    @api.doc('execute_workflow_stream',
+            description='Execute a workflow and stream its progress as Server-Sent Events: '
+                        'workflow_started (with the execution_id to cancel), node_started, node_finished, '
+                        'node_failed, node_cancelled, token (LLM output as it is generated), '
+                        'then result, cancelled or error. Closing the connection cancels the execution.')
+    @api.expect(execution_input)
+    @api.produces(['text/event-stream'])
+    @api.response(200, 'Event stream')
+    @auth_service.dual_auth_required
+    def post(self, workflow_uuid, current_user=None):
+        """Execute a workflow, streaming node and token events"""
+        logging.info(f"Executing workflow {workflow_uuid} with streaming")
+        data = request.get_json() or {}
+        app = current_app._get_current_object()
+        events = queue.Queue()
+        execution_id = str(uuid.uuid4())
+        finished = threading.Event()
+        
+        def listener(event, payload):
+            events.put((event, payload))
+        
+        def run():
+            with app.app_context():
+                # Fresh ID per run: the worker thread's process ID outlives the request
+                set_process_id(str(uuid.uuid4())[:8])
+                try:
+                    result = workflow_service.execute_workflow(
+                        workflow_uuid=workflow_uuid,
+                        input_data=data.get('input'),
+                        conversation_id=data.get('conversation_id'),
+                        files=data.get('files'),
+                        listener=listener,
+                        execution_id=execution_id,
+                        deadline=data.get('deadline')
+                    )
+                    events.put(('result', {'result': result}))
+                    logging.info(f"Successfully executed workflow {workflow_uuid}")
+                except WorkflowCancelledError as e:
+                    logging.info(f"Workflow {workflow_uuid} was cancelled")
+                    events.put(('cancelled', {'execution_id': execution_id, 'error': str(e)}))
+                except Exception as e:
+                    logging.error(f"Failed to execute workflow {workflow_uuid}: {str(e)}")
+                    events.put(('error', {'error': str(e)}))
+                finally:
+                    finished.set()
+                    events.put(None)
+        
+        threading.Thread(target=run, name=f"workflow-stream-{workflow_uuid}", daemon=True).start()
+        
+        def stream():
+            try:
+                while True:
+                    try:
+                        item = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                    except queue.Empty:
+                        yield ": keep-alive\n\n"
+                        continue
+                    if item is None:
+                        break
+                    yield _sse_event(*item)
+            finally:
+                # Client went away before the end: stop spending model time on the run
+                if not finished.is_set():
+                    logging.info(f"Stream of workflow {workflow_uuid} closed by the client, cancelling execution {execution_id}")
+                    workflow_service.cancel_workflow(workflow_uuid, execution_id=execution_id)
+        
+        return Response(
+            stream_with_context(stream()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+@api.route('/workflows/execute/<uuid:workflow_uuid>/batch')
+@api.param('workflow_uuid', 'The workflow identifier')
+class WorkflowBatchExecution(Resource):
+    @api.doc('execute_workflow_batch',
+            description='Execute a workflow once per input, for offline evaluation. Inputs are JSONL, '
+                        'uploaded as the "file" form field or sent as the request body: one object per line '
+                        'with "input" (and optionally "id", "conversation_id", "files") or a bare JSON string. '
+                        'Results stream back as JSONL in completion order, one line per item with its status, '
+                        'result and latency_ms, followed by a summary line with latency percentiles.',
+            params={
+                'parallelism': f'Items executed at once (default {DEFAULT_PARALLELISM})',
+                'persist_memory': 'Save the conversation of each item (default false)',
+                'include_steps': 'Include the process steps of each item (default false)'
+            })
+    @api.produces(['application/x-ndjson'])
+    @api.response(200, 'JSONL result stream')
+    @api.response(404, 'Workflow not found')
+    @auth_service.dual_auth_required
+    def post(self, workflow_uuid, current_user=None):
+        """Execute a workflow over a batch of inputs"""
+        if workflow_cache.get_plan(workflow_uuid) is None:
+            api.abort(404, f"Workflow {workflow_uuid} not found")
+        
+        parallelism = request.args.get('parallelism', DEFAULT_PARALLELISM, type=int)
+        persist_memory = request.args.get('persist_memory', 'false').lower() == 'true'
+        include_steps = request.args.get('include_steps', 'false').lower() == 'true'
+        upload = request.files.get('file')
+        lines = upload.stream if upload else request.stream
+        logging.info(f"Executing batch of workflow {workflow_uuid} (parallelism {parallelism}, persist_memory {persist_memory})")
+        
+        def stream():
+            records = workflow_batch_service.run_batch(workflow_uuid, lines, parallelism=parallelism,
+                                                       persist_memory=persist_memory, include_steps=include_steps)
+            try:
+                for record in records:
+                    yield json.dumps(record, default=str) + "\n"
+            except Exception as e:
+                logging.error(f"Batch of workflow {workflow_uuid} failed: {str(e)}")
+                yield json.dumps({'error': str(e)}) + "\n"
+            finally:
+                # Client went away before the end: cancel the items still running
+                records.close()
+        
+        return Response(
+            stream_with_context(stream()),
+            mimetype='application/x-ndjson',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+def _get_visible_run(run_uuid, current_user):
+    """Return a run, aborting with 404 when it does not exist or belongs to another API key's workflow"""
+    run = workflow_run_service.get_run(run_uuid)
+    if run is None:
+        api.abort(404, f"Run {run_uuid} not found")
+    if isinstance(current_user, APIKey) and str(run.workflow_uuid) != str(current_user.workflow_uuid):
+        api.abort(404, f"Run {run_uuid} not found")
+    return run
+
+@api.route('/workflows/execute/<uuid:workflow_uuid>/async')
+@api.param('workflow_uuid', 'The workflow identifier')
+class WorkflowRunQueue(Resource):
+    @api.doc('enqueue_workflow_run',
+            description='Queue a workflow execution and return its run id at once; '
+                        'poll /workflows/runs/<run_id> for the status and result')
+    @api.expect(execution_input)
+    @api.response(202, 'Run queued', workflow_run_model)
+    @api.response(400, 'Invalid request')
+    @auth_service.dual_auth_required
+    def post(self, workflow_uuid, current_user=None):
+        """Queue an asynchronous workflow run"""
+        data = request.get_json() or {}
+        api_key_uuid = current_user.uuid if isinstance(current_user, APIKey) else None
+        created_by = str(current_user.id) if getattr(current_user, 'id', None) else None
+        
+        try:
+            run = workflow_run_service.enqueue(
+                workflow_uuid=workflow_uuid,
+                input_data=data.get('input'),
+                conversation_id=data.get('conversation_id'),
+                files=data.get('files'),
+                api_key_uuid=api_key_uuid,
+                created_by=created_by
+            )
+            logging.info(f"Queued run {run.uuid} of workflow {workflow_uuid}")
+            return run.to_dict(), 202
+        except ValueError as e:
+            logging.error(f"Failed to queue run of workflow {workflow_uuid}: {str(e)}")
+            api.abort(400, str(e))
+
+@api.route('/workflows/runs/<uuid:run_uuid>')
+@api.param('run_uuid', 'The run identifier')
+class WorkflowRunItem(Resource):
+    @api.doc('get_workflow_run')
+    @api.response(200, 'Success', workflow_run_model)
+    @api.response(404, 'Run not found')
+    @auth_service.dual_auth_required
+    def get(self, run_uuid, current_user=None):
+        """Get the status of a workflow run"""
+        return _get_visible_run(run_uuid, current_user).to_dict()
+    
+    @api.doc('cancel_workflow_run')
+    @api.response(200, 'Cancellation requested', workflow_run_model)
+    @api.response(404, 'Run not found')
+    @auth_service.dual_auth_required
+    def delete(self, run_uuid, current_user=None):
+        """Cancel a queued or running workflow run"""
+        run = _get_visible_run(run_uuid, current_user)
+        run = workflow_run_service.cancel_run(run.uuid)
+        return run.to_dict()
+
+@api.route('/workflows/runs/<uuid:run_uuid>/result')
+@api.param('run_uuid', 'The run identifier')
+class WorkflowRunResult(Resource):
+    @api.doc('get_workflow_run_result',
+            description='Result of a finished run; 202 with the run status while it is queued or running')
+    @api.response(200, 'Run finished', workflow_run_result_model)
+    @api.response(202, 'Run not finished yet', workflow_run_model)
+    @api.response(404, 'Run not found')
+    @auth_service.dual_auth_required
+    def get(self, run_uuid, current_user=None):
+        """Get the result of a workflow run"""
+        run = _get_visible_run(run_uuid, current_user)
+        if not run.is_finished:
+            return run.to_dict(), 202
+        return run.to_dict(include_result=True)
+
+def _parse_time_param(name):
+    """ISO 8601 query parameter as a naive UTC datetime, or None when absent"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        api.abort(400, f"Invalid {name}: expected an ISO 8601 timestamp")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+@api.route('/workflows/<uuid:workflow_uuid>/traces/stats')
+@api.param('workflow_uuid', 'The workflow identifier')
+class WorkflowTraceStats(Resource):
+    @api.doc('get_workflow_trace_stats',
+            description='Latency percentiles (p50/p95/p99, ms) of the workflow runs and of each node, '
+                        'nodes sorted by their share of the time spent in the workflow',
+            params={
+                'since': 'Start of the window, ISO 8601 (default: now minus hours)',
+                'until': 'End of the window, ISO 8601 (default: now)',
+                'hours': 'Window length in hours when since is not given (default 24)'
+            })
+    @api.response(200, 'Success')
+    @api.response(400, 'Invalid time window')
+    @auth_service.dual_auth_required
+    def get(self, workflow_uuid, current_user=None):
+        """Get node and run latency statistics of a workflow"""
+        if isinstance(current_user, APIKey) and str(workflow_uuid) != str(current_user.workflow_uuid):
+            api.abort(404, f"Workflow {workflow_uuid} not found")
+        until = _parse_time_param('until')
+        since = _parse_time_param('since')
+        if since is None:
+            hours = request.args.get('hours', 24, type=float)
+            since = (until or datetime.utcnow()) - timedelta(hours=hours)
+        return workflow_latency_stats(workflow_uuid, since, until)
+
+@api.route('/workflows/executions/<string:execution_id>/trace')
+@api.param('execution_id', 'The execution identifier (stats.execution_id of a result, or a run id)')
+class WorkflowExecutionTrace(Resource):
+    @api.doc('get_workflow_execution_trace')
+    @api.response(200, 'Success')
+    @api.response(404, 'Trace not found')
+    @auth_service.dual_auth_required
+    def get(self, execution_id, current_user=None):
+        """Get the per-node trace of one workflow execution"""
+        trace = get_execution_trace(execution_id)
+        if isinstance(current_user, APIKey):
+            trace = [record for record in trace if record['workflow_uuid'] == str(current_user.workflow_uuid)]
+        if not trace:
+            api.abort(404, f"No trace found for execution {execution_id}")
+        return {'execution_id': execution_id, 'nodes': trace}
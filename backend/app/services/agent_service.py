@@ -15,6 +15,7 @@ import re
 import time
 from langchain.agents.agent import AgentOutputParser
 from langchain.schema import OutputParserException
+from ..utils.exc import WorkflowCancelledError
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, create_process_banner, COLORS, ANSI_ENABLED
 
 # Configure logger
@@ -154,6 +155,8 @@ class AgentService:
         self.base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
         self.model = model or os.getenv('DEFAULT_LLM_MODEL', 'gemma3:12b')
         self.timeout = timeout or int(os.getenv('LLM_TIMEOUT_SECONDS', '30'))
+        # Seconds an agent run may take before it is stopped
+        self.agent_timeout = float(os.getenv('AGENT_TIMEOUT_SECONDS', '120'))
         self.cancel_event = None
         self.request_id = get_request_id()
         self.database_service = DatabaseService()
@@ -172,7 +175,11 @@ class AgentService:
 
         def on_llm_start(self, *args, **kwargs):
             if self.cancel_event and self.cancel_event.is_set():
-                raise RuntimeError("Agent request was cancelled")
+                raise WorkflowCancelledError("Agent request was cancelled")
+
+        def on_tool_start(self, *args, **kwargs):
+            if self.cancel_event and self.cancel_event.is_set():
+                raise WorkflowCancelledError("Agent request was cancelled")
                 
     class ConciseLoggingHandler(BaseCallbackHandler):
         """Custom callback handler for more concise agent logging."""
@@ -305,17 +312,18 @@ class AgentService:
             error_log = self._format_log("❌ ERROR", str(error), "RED")
             logger.error(error_log)
 
-    def _create_llm(self, settings):
+    def _create_llm(self, settings, cancel_event=None):
         """Create an LLM instance based on settings."""
         # Extract settings with defaults
         base_url = settings.get('ollamaBaseUrl', self.base_url)
         model = settings.get('model', self.model)
         temperature = float(settings.get('temperature', 0.7))
+        cancel_event = cancel_event or self.cancel_event
         
         # Create callback handlers
         callbacks = []
-        if self.cancel_event:
-            callbacks.append(self.CancellationHandler(self.cancel_event))
+        if cancel_event:
+            callbacks.append(self.CancellationHandler(cancel_event))
             
         # Create LLM instance
         llm = Ollama(
@@ -396,15 +404,21 @@ class AgentService:
         return custom_tools
 
     @log_execution_time(logger)
-    def execute_agent(self, input_data, settings, conversation_history=None):
-        """Execute an agent with the given input and settings."""
+    def execute_agent(self, input_data, settings, conversation_history=None, cancel_event=None, timeout=None):
+        """Execute an agent with the given input and settings.
+
+        Setting ``cancel_event`` stops the agent before its next LLM call or tool use
+        and releases the calling thread at once. ``timeout`` (seconds) overrides
+        ``AGENT_TIMEOUT_SECONDS`` for this run.
+        """
         process_id = get_process_id()
         create_process_banner(logger, "AGENT EXECUTION STARTED", process_id)
         
         start_time = time.time()
+        cancel_event = cancel_event or self.cancel_event
         
         # Create LLM
-        llm = self._create_llm(settings)
+        llm = self._create_llm(settings, cancel_event)
         
         # Get selected tools from settings
         selected_default_tools = settings.get('selectedTools', None)
@@ -544,8 +558,8 @@ Question: {{input}}
             
             # Create callback handlers
             callbacks = []
-            if self.cancel_event:
-                callbacks.append(self.CancellationHandler(self.cancel_event))
+            if cancel_event:
+                callbacks.append(self.CancellationHandler(cancel_event))
             callbacks.append(self.ConciseLoggingHandler(agent_service=self))
             
             # Create agent executor with custom callbacks
@@ -608,7 +622,7 @@ Question: {{input}}
                         execution_thread.start()
                         
                         # Wait for the thread to complete or timeout
-                        timeout_seconds = 120  # 2 minute timeout
+                        timeout_seconds = timeout or self.agent_timeout
                         
                         # Check periodically for loop detection or timeout
                         start_time = time.time()
@@ -625,8 +639,12 @@ Question: {{input}}
                                 logger.warning(f"Loop detected: {loop_message}")
                                 return "I noticed I was repeating the same actions without making progress. Please provide more specific instructions."
                             
-                            # Sleep briefly before checking again
-                            time.sleep(0.5)
+                            # Wait briefly before checking again, waking up at once on cancellation
+                            if cancel_event and cancel_event.wait(0.5):
+                                timeout_occurred.set()  # The agent thread stops at its next LLM call or tool use
+                                raise WorkflowCancelledError("Agent request was cancelled")
+                            elif not cancel_event:
+                                time.sleep(0.5)
                         
                         # Check if the thread is still alive (timeout occurred)
                         if execution_thread.is_alive():
@@ -672,6 +690,8 @@ Question: {{input}}
                             return "Agent stopped due to iteration limit or time limit."
                     
                     break  # Success, exit the retry loop
+                except WorkflowCancelledError:
+                    raise
                 except Exception as e:
                     retry_count += 1
                     last_error = e
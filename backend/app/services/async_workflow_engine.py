@@ -0,0 +1,521 @@
+"""
+Event-loop execution of workflow runs.
+
+``WorkflowService.execute_workflow`` holds an OS thread for the whole life of
+a run, most of which is spent waiting on Ollama or on HTTP services. The
+engine runs workflows as coroutines on one event loop per process instead,
+so a process can hold thousands of runs in flight:
+
+- LLM (text), classifier and HTTP request nodes are coroutines sharing one
+  pooled ``aiohttp`` session (``WORKFLOW_ASYNC_HTTP_CONNECTIONS`` connections).
+- The other nodes, the reads made when a run starts and the parts of native
+  nodes that render templates (which may read the run's files: LLM prompts,
+  HTTP requests, cache keys) use a bounded thread pool
+  (``WORKFLOW_ASYNC_BLOCKING_WORKERS``).
+- Database writes (conversation checkpoints and messages, traces, run
+  outcomes) go through a single writer thread, in order.
+
+The loop thread itself never touches ``db.session`` or the filesystem.
+
+Node policies, the result cache, events and traces behave as under
+``execute_workflow``: both engines share the run and node bookkeeping of
+``WorkflowService``.
+"""
+import asyncio
+import copy
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from .llm_service import ollama_usage
+from .node_cache import lookup_node_result, node_cache_ttl
+from .node_policy import NodePolicy, CancelScope
+from .nodes.HttpRequestNode import HttpRequestNode, RESPONSE_CHUNK_SIZE
+from .workflow_cache import workflow_cache
+from ..utils.exc import WorkflowCancelledError, NodeTimeoutError, WorkflowDeadlineExceededError
+from ..utils.logging_utils import setup_logger, get_process_id
+
+logger = setup_logger('async_workflow_engine')
+
+# Seconds between cancellation checks while waiting for nodes or backing off
+CANCEL_POLL_SECONDS = 0.2
+
+
+class AsyncWorkflowEngine:
+    def __init__(self):
+        self.app = None
+        self.workflow_service = None
+        self.http_connections = 100
+        self.blocking_workers = 16
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._session = None
+        self._blocking = None
+        self._writer = None
+
+    def init_app(self, app):
+        from .workflow_service import WorkflowService
+
+        self.app = app
+        self.http_connections = max(1, app.config.get('WORKFLOW_ASYNC_HTTP_CONNECTIONS', 100))
+        self.blocking_workers = max(1, app.config.get('WORKFLOW_ASYNC_BLOCKING_WORKERS', 16))
+        self.workflow_service = WorkflowService()
+
+    def start(self):
+        """Start the event loop thread and the pools of this process, if not running yet."""
+        # Threads do not survive a fork, so a forked worker starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._blocking = ThreadPoolExecutor(max_workers=self.blocking_workers,
+                                                thread_name_prefix='workflow-async-blocking')
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='workflow-async-writer')
+            self._loop = asyncio.new_event_loop()
+            started = threading.Event()
+            self._thread = threading.Thread(target=self._run_loop, args=(started,), name='workflow-async-loop',
+                                            daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+            started.wait()
+            logger.info(f"Started async workflow engine with {self.http_connections} HTTP connections "
+                        f"and {self.blocking_workers} blocking workers")
+
+    def _run_loop(self, started):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._open_session())
+        started.set()
+        self._loop.run_forever()
+
+    async def _open_session(self):
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.http_connections))
+
+    def shutdown(self, wait=True):
+        """Stop the loop; runs still in flight are abandoned, their writes are finished with ``wait``."""
+        if self._loop is None or not self._thread.is_alive():
+            return
+        asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._blocking.shutdown(wait=wait, cancel_futures=True)
+        self._writer.shutdown(wait=wait)
+        self._thread = None
+        self._loop = None
+
+    def submit(self, workflow_uuid, input_data=None, conversation_id=None, files=None, listener=None,
+               execution_id=None, deadline=None):
+        """Start a run on the loop; returns a ``concurrent.futures.Future`` of its output."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(
+            self.run_workflow(workflow_uuid, input_data, conversation_id, files, listener, execution_id, deadline),
+            self._loop
+        )
+
+    def write(self, fn, *args):
+        """Run a database write on the writer thread, in an app context; returns its future."""
+        self.start()
+        return self._writer.submit(self._call_in_app, fn, args)
+
+    def _call_in_app(self, fn, args):
+        with self.app.app_context():
+            return fn(*args)
+
+    async def _blocking_call(self, fn, *args):
+        return await self._loop.run_in_executor(self._blocking, self._call_in_app, fn, args)
+
+    async def _write(self, fn, *args):
+        return await asyncio.wrap_future(self.write(fn, *args))
+
+    def _checkpoint(self, flush):
+        """Run a conversation checkpoint on the writer; messages of a failed one are saved by the next flush."""
+        def log_failure(future):
+            if future.exception() is not None:
+                logger.warning(f"Conversation checkpoint failed: {str(future.exception())}")
+
+        self.write(flush).add_done_callback(log_failure)
+
+    @staticmethod
+    def _load_plan(workflow_uuid):
+        plan = workflow_cache.get_plan(workflow_uuid)
+        if plan is None:
+            logger.error(f"Workflow {workflow_uuid} not found")
+            raise ValueError(f"Workflow {workflow_uuid} not found")
+        return plan
+
+    async def run_workflow(self, workflow_uuid, input_data=None, conversation_id=None, files=None, listener=None,
+                           execution_id=None, deadline=None):
+        """Coroutine counterpart of ``WorkflowService.execute_workflow``, returning the same output."""
+        service = self.workflow_service
+        logger.info(f"Executing workflow {workflow_uuid} on the event loop")
+        plan = await self._blocking_call(self._load_plan, workflow_uuid)
+        context = await self._blocking_call(service._start_run, workflow_uuid, plan, input_data, conversation_id,
+                                            files, listener, execution_id, True, deadline, None, self._checkpoint)
+        try:
+            result = await self._execute_graph(plan, context['input'], context, service._start_node(plan))
+            output = service._run_output(plan, context, result)
+
+            # One write for all messages of the run
+            await self._write(context['memory'].flush)
+
+            return output
+
+        except Exception as e:
+            service._run_failed(plan, context, e)
+            raise
+        finally:
+            await self._write(service._end_run, context)
+
+    async def _execute_graph(self, plan, input_data, context, start_node, indent=''):
+        """
+        Execute workflow nodes in topological order, as tasks of the loop.
+
+        Like ``WorkflowService._execute_workflow_topological``: every ready node runs
+        at once, up to ``WORKFLOW_MAX_PARALLEL_NODES``, join nodes wait for every
+        incoming edge and conditional nodes only release their selected branch.
+        """
+        service = self.workflow_service
+        execution = context['execution']
+
+        # Per-run copy of the compiled in-degrees
+        incoming_edges_count = dict(plan.in_degree)
+
+        # The start node runs first, whatever its incoming edges
+        ready = deque([start_node['id']])
+        execution.node_ready(start_node['id'])
+        visited = set()
+        executed_nodes = []
+        node_results = {start_node['id']: input_data}
+        conditional_paths = {}
+
+        running = {}
+        try:
+            while ready or running:
+                # Nodes not started yet are skipped once the run is cancelled
+                execution.check_cancelled()
+
+                while ready and len(running) < service.max_parallel_nodes:
+                    current_id = ready.popleft()
+                    if current_id in visited:
+                        continue
+                    visited.add(current_id)
+                    task = asyncio.ensure_future(self._execute_node(plan.node_map[current_id], plan, context, indent))
+                    running[task] = current_id
+
+                if not running:
+                    continue
+
+                done, _ = await asyncio.wait(running, timeout=CANCEL_POLL_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    current_id = running.pop(task)
+                    # Re-raises the node's exception; the remaining nodes are awaited below
+                    result = task.result()
+                    execution.node_completed(current_id, context.get(f'node_{current_id}_time'))
+                    node_results[current_id] = result
+                    executed_nodes.append(current_id)
+                    for next_id in service._unblocked_successors(plan, context, current_id, incoming_edges_count,
+                                                                 conditional_paths, indent):
+                        if next_id not in visited:
+                            execution.node_ready(next_id)
+                            ready.append(next_id)
+        finally:
+            if running:
+                # A cancelled run returns at once; otherwise its running nodes finish first
+                if execution.cancelled:
+                    for task in running:
+                        task.cancel()
+                await asyncio.gather(*running, return_exceptions=True)
+
+        return service._workflow_result(plan, executed_nodes, node_results, conditional_paths, input_data)
+
+    def _native_handler(self, node_type, node_data):
+        """Coroutine executing a node of this type, or None if the node needs a thread."""
+        settings = node_data.get('settings', {})
+        if node_type == 'llm' and not settings.get('enableMultimodal', False):
+            return self._llm_node
+        if node_type == 'classifier':
+            return self._classifier_node
+        if node_type == 'http_request' and node_data.get('bodyType', '') != 'form-data':
+            return self._http_request_node
+        return None
+
+    async def _execute_node(self, current_node, plan, context, indent=''):
+        """Execute a node under its policy: attempt timeout, retries, fallback"""
+        service = self.workflow_service
+        execution = context['execution']
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+
+        handler = self._native_handler(node_type, node_data)
+        if handler is None:
+            return await self._loop.run_in_executor(self._blocking, service._execute_node_in_worker, self.app,
+                                                    get_process_id(), current_node, plan, context, indent)
+
+        policy = NodePolicy.for_node(node_type, node_data)
+        attempt = 0
+        while True:
+            attempt += 1
+            execution.check_cancelled()
+            execution.check_deadline()
+            # The attempt ends at its own timeout or at the workflow deadline, whichever comes first
+            deadline = execution.deadline
+            if policy.timeout is not None:
+                attempt_deadline = time.time() + policy.timeout
+                deadline = attempt_deadline if deadline is None else min(deadline, attempt_deadline)
+            try:
+                return await self._execute_node_attempt(handler, current_node, plan, context, indent,
+                                                        CancelScope(execution.cancel_event, deadline), attempt)
+            except WorkflowCancelledError:
+                raise
+            except Exception as e:
+                error = e
+
+            if attempt > policy.retries or execution.deadline_exceeded:
+                break
+            delay = policy.retry_delay(attempt)
+            if execution.deadline is not None:
+                delay = min(delay, max(0.0, execution.deadline - time.time()))
+            logger.warning(f"{indent}Node {current_node['id']} failed (attempt {attempt}/{policy.retries + 1}): "
+                           f"{str(error)}; retrying in {delay:.2f}s")
+            await self._backoff(execution, delay)
+
+        if policy.has_fallback:
+            logger.warning(f"{indent}Node {current_node['id']} failed after {attempt} attempt(s), using its fallback")
+            return await self._execute_node_attempt(handler, current_node, plan, context, indent, attempt=attempt,
+                                                    fallback=(policy.fallback, error))
+        raise error
+
+    @staticmethod
+    async def _backoff(execution, delay):
+        """Sleep ``delay`` seconds, waking up early once the run is cancelled."""
+        wake_at = time.time() + delay
+        while not execution.cancelled and time.time() < wake_at:
+            await asyncio.sleep(min(CANCEL_POLL_SECONDS, wake_at - time.time()))
+
+    async def _execute_node_attempt(self, handler, current_node, plan, context, indent='', cancel_scope=None,
+                                    attempt=1, fallback=None):
+        """One attempt of a node executed by ``handler``; see ``WorkflowService._execute_node_attempt``."""
+        service = self.workflow_service
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+        # Token counts reported by the LLM calls of this attempt, for the trace
+        usage = {}
+
+        node_start_time = time.time()
+        input_data = service._begin_node_attempt(current_node, plan, context, indent, attempt)
+
+        result = None
+        cache_key = None
+        cache_ttl = None
+        cache_hit = False
+        try:
+            # Opt-in memoisation, the same as the threaded engine's; keys render the node's settings
+            if fallback is None and node_cache_ttl(node_type, node_data) is not None:
+                cache_key, cache_ttl, cache_hit, result = await self._blocking_call(
+                    lookup_node_result, node_type, node_data, context, input_data, plan)
+
+            if fallback is not None:
+                result = copy.deepcopy(fallback[0])
+                logger.warning(f"{indent}Using fallback result for node {current_node['id']}: {str(result)[:100]}")
+
+            elif cache_hit:
+                logger.info(f"{indent}Cache hit for node {current_node['id']} (key {cache_key[:12]}), skipping execution")
+
+            else:
+                result, input_data = await self._with_timeout(
+                    handler(current_node, plan, context, input_data, cancel_scope, usage, indent),
+                    current_node, context, cancel_scope)
+
+            service._record_node_result(current_node, plan, context, input_data, result, node_start_time, indent,
+                                        attempt, usage, cache_key, cache_hit, cache_ttl, fallback)
+            return result
+
+        except asyncio.CancelledError:
+            # The run was cancelled while the node waited on I/O
+            service._node_failure(current_node, context, input_data,
+                                  WorkflowCancelledError(f"Node {current_node['id']} was cancelled"),
+                                  node_start_time, indent, attempt, usage, cancel_scope)
+            raise
+        except Exception as e:
+            raise service._node_failure(current_node, context, input_data, e, node_start_time, indent, attempt,
+                                        usage, cancel_scope)
+
+    @staticmethod
+    async def _with_timeout(coroutine, current_node, context, cancel_scope):
+        """Await a node coroutine until its scope's deadline, as a node timeout or a workflow deadline error."""
+        remaining = cancel_scope.remaining() if cancel_scope is not None else None
+        if remaining is None:
+            return await coroutine
+        try:
+            return await asyncio.wait_for(coroutine, remaining)
+        except asyncio.TimeoutError:
+            execution = context['execution']
+            if execution.deadline is not None and cancel_scope.deadline >= execution.deadline:
+                raise WorkflowDeadlineExceededError(
+                    f"Workflow deadline exceeded while executing node {current_node['id']}") from None
+            raise NodeTimeoutError(f"Node {current_node['id']} timed out") from None
+
+    async def _generate(self, prompt, settings, conversation_history=None, on_token=None, cancel_event=None,
+                        on_usage=None, raw=False):
+        """Ollama completion over the pooled session; the coroutine counterpart of ``LLMService.generate``."""
+        llm_service = self.workflow_service.llm_service
+        if not prompt:
+            logger.error("Prompt cannot be empty")
+            raise ValueError("Prompt cannot be empty")
+        if cancel_event is not None and cancel_event.is_set():
+            raise WorkflowCancelledError("LLM request was cancelled")
+
+        base_url = settings.get('ollamaBaseUrl', llm_service.base_url).rstrip('/')
+        streaming = settings.get('streaming', True)
+        payload = {
+            'model': settings.get('model', llm_service.model),
+            'prompt': prompt if raw else llm_service.build_prompt(prompt, settings, conversation_history),
+            'stream': streaming,
+            'options': llm_service.ollama_options(settings)
+        }
+        timeout = aiohttp.ClientTimeout(sock_connect=llm_service.timeout, sock_read=llm_service.timeout)
+        logger.info(f"Sending request to Ollama model {payload['model']}")
+        start_time = time.time()
+
+        result = ''
+        async with self._session.post(f"{base_url}/api/generate", json=payload, timeout=timeout) as response:
+            if response.status >= 400:
+                raise RuntimeError(f"Failed to generate response: Ollama returned {response.status}: "
+                                   f"{(await response.text())[:500]}")
+            if not streaming:
+                data = await response.json(content_type=None)
+                if data.get('error'):
+                    raise RuntimeError(f"Failed to generate response: {data['error']}")
+                result = data.get('response', '')
+                usage = ollama_usage(data)
+                if usage and on_usage:
+                    on_usage(usage)
+            else:
+                async for line in response.content:
+                    if cancel_event is not None and cancel_event.is_set():
+                        # Closing the response aborts the generation
+                        response.close()
+                        raise WorkflowCancelledError("LLM request was cancelled")
+                    line = line.strip()
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get('error'):
+                        raise RuntimeError(f"Failed to generate response: {data['error']}")
+                    text = data.get('response', '')
+                    if text:
+                        result += text
+                        if on_token:
+                            on_token(text)
+                    if data.get('done'):
+                        usage = ollama_usage(data)
+                        if usage and on_usage:
+                            on_usage(usage)
+                        break
+
+        logger.info(f"LLM response received in {time.time() - start_time:.2f}s, length: {len(result)} chars")
+        return result
+
+    async def _llm_node(self, current_node, plan, context, input_data, cancel_scope, usage, indent=''):
+        service = self.workflow_service
+        execution = context['execution']
+        logger.info(f"{indent}Executing LLM node with ID: {current_node['id']}")
+        settings = current_node.get('data', {}).get('settings', {})
+        context['settings'] = settings
+
+        # Conversation history, loaded once at run start
+        memory = context.get('memory')
+        conversation_history = memory.messages if memory is not None else []
+        final_prompt, input_data, assembled = await self._blocking_call(
+            service._llm_node_prompt, current_node, plan, settings, context, input_data, indent)
+
+        try:
+            result = await self._generate(final_prompt, settings, conversation_history,
+                                          on_token=service._token_emitter(execution, current_node['id']),
+                                          cancel_event=cancel_scope, on_usage=usage.update, raw=assembled)
+
+            # Handle structured output results
+            structured_output = settings.get('structuredOutput', {})
+            if structured_output.get('enabled', False) and structured_output.get('properties', []):
+                parsed = service.llm_service.parse_structured_output(result, structured_output.get('properties'))
+                if parsed.get('schema_valid', False):
+                    logger.info(f"{indent}Structured output validation successful")
+                else:
+                    logger.warning(f"{indent}Structured output validation failed: {parsed.get('validation_error')}")
+                result = parsed['content']
+        except Exception as e:
+            error_msg = f"LLM node {current_node['id']} failed: {str(e)}"
+            logger.error(f"{indent}{error_msg}")
+            raise RuntimeError(error_msg)
+        return result, input_data
+
+    async def _classifier_node(self, current_node, plan, context, input_data, cancel_scope, usage, indent=''):
+        service = self.workflow_service
+        logger.info(f"{indent}Executing classifier node with ID: {current_node['id']}")
+        settings = current_node.get('data', {}).get('settings', {})
+        query = service._classifier_query(settings, context, indent)
+
+        try:
+            # Get conversation history if memory is enabled
+            conversation_history = []
+            if settings.get('memoryEnabled', False):
+                memory = context.get('memory')
+                if memory is not None:
+                    conversation_history = memory.messages
+
+            prompt, class_names = service._classifier_prompt(settings, query)
+            logger.info(f"{indent}Classification prompt: {prompt}")
+
+            classification_result = await self._generate(prompt, service._classifier_llm_settings(settings),
+                                                         conversation_history, cancel_event=cancel_scope,
+                                                         on_usage=usage.update)
+            result = service._classifier_result(classification_result, class_names, prompt, indent)
+            logger.info(f"{indent}Classification result: {result['class_name']}")
+        except Exception as e:
+            error_msg = f"Classifier node {current_node['id']} failed: {str(e)}"
+            logger.error(f"{indent}{error_msg}")
+            raise RuntimeError(error_msg)
+        return result, input_data
+
+    async def _http_request_node(self, current_node, plan, context, input_data, cancel_scope, usage, indent=''):
+        logger.info(f"{indent}Executing HTTP Request node with ID: {current_node['id']}")
+        node = HttpRequestNode(current_node['id'], current_node.get('data', {}), context,
+                               cancel_event=cancel_scope, timeout=cancel_scope.remaining())
+        method, url, kwargs = await self._blocking_call(node.build_request)
+
+        request_kwargs = {'headers': kwargs.get('headers'), 'params': kwargs.get('params')}
+        if 'json' in kwargs:
+            request_kwargs['json'] = kwargs['json']
+        elif kwargs.get('data') is not None:
+            request_kwargs['data'] = kwargs['data']
+            if isinstance(kwargs['data'], (str, bytes)):
+                # Raw bodies are sent without a Content-Type of their own, as by requests
+                request_kwargs['skip_auto_headers'] = ('Content-Type',)
+        timeout = aiohttp.ClientTimeout(sock_connect=node.timeout, sock_read=node.timeout)
+
+        if cancel_scope.is_set():
+            raise WorkflowCancelledError(f"HTTP request of node {node.node_id} was cancelled")
+        try:
+            async with self._session.request(method, url, timeout=timeout, **request_kwargs) as response:
+                chunks = []
+                async for chunk in response.content.iter_chunked(RESPONSE_CHUNK_SIZE):
+                    if cancel_scope.is_set():
+                        response.close()
+                        raise WorkflowCancelledError(f"HTTP request of node {node.node_id} was cancelled")
+                    chunks.append(chunk)
+                text = b''.join(chunks).decode(response.get_encoding(), errors='replace')
+                return node.build_result(response.status, text, response.headers), input_data
+        except Exception as e:
+            logger.error(f"Failed to execute HTTP Request node {node.node_id}: {str(e)}")
+            raise
+
+
+async_workflow_engine = AsyncWorkflowEngine()
@@ -0,0 +1,215 @@
+"""
+Token-budgeted prompt assembly for LLM nodes.
+
+An LLM node's prompt is made of its system prompt, its query (the rendered
+user prompt and input), the chunks retrieved by knowledge nodes it references
+and the conversation history. ``assemble_context`` fits them into the node's
+context window, ``numCtx`` less the tokens reserved for the completion, filling
+the budget by priority:
+
+1. the system prompt (truncated only if it alone exceeds the budget)
+2. the query
+3. retrieved chunks, best ranked first, whole chunks only
+4. conversation history, most recent first, whole messages only
+
+The result depends only on its inputs and keeps the order of the prompt
+(system prompt, history, current message), so prompts of consecutive runs
+share their prefix and Ollama can reuse its KV cache for it.
+
+Tokens are counted with tiktoken when it is installed, otherwise estimated
+from words and punctuation. Neither is the model's own tokenizer, which
+Ollama does not expose; the reserve absorbs the difference.
+"""
+import os
+import re
+from functools import lru_cache
+from typing import List, NamedTuple, Sequence, Union
+
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('context_assembler')
+
+try:
+    import tiktoken
+except ImportError:  # Optional; token counts are estimated without it
+    tiktoken = None
+
+CONTEXT_BUDGET_ENABLED = os.getenv('LLM_CONTEXT_BUDGET_ENABLED', 'true').lower() == 'true'
+# Tokens kept free for the completion when the node sets no num_predict (at most a quarter of numCtx)
+CONTEXT_RESERVE_TOKENS = int(os.getenv('LLM_CONTEXT_RESERVE_TOKENS', 512))
+TOKENIZER_ENCODING = os.getenv('LLM_TOKENIZER_ENCODING', 'cl100k_base')
+
+TOKEN_COUNT_CACHE_SIZE = 8192
+DEFAULT_NUM_CTX = 2048
+
+CHUNK_SEPARATOR = '\n\n'
+# Tokens of a chunk or history line separator, and of the headers LLMService.compose_prompt puts around the history
+SEPARATOR_TOKENS = 1
+HISTORY_HEADER_TOKENS = 8
+
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# A message part: query text, or the ranked chunks of one knowledge node rendered in its place
+MessagePart = Union[str, Sequence[str]]
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"Tokenizer {TOKENIZER_ENCODING} unavailable, estimating token counts: {str(e)}")
+        return None
+
+
+def _count(text: str) -> int:
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    # About four characters per token for ASCII words, one per character otherwise
+    tokens = 0
+    for piece in _WORD_PATTERN.findall(text):
+        tokens += (len(piece) + 3) // 4 if piece.isascii() else len(piece)
+    return tokens
+
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def count_tokens(text: str) -> int:
+    """Tokens in ``text``; cached, as system prompts, chunks and history recur across runs."""
+    return _count(text) if text else 0
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """The longest prefix of ``text`` within ``max_tokens`` tokens."""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _count(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
+
+
+def context_budget(settings: dict) -> int:
+    """Prompt tokens an LLM node may use: ``numCtx`` less the completion's reserve."""
+    num_ctx = int(settings.get('numCtx') or DEFAULT_NUM_CTX)
+    num_predict = (settings.get('options') or {}).get('num_predict')
+    if isinstance(num_predict, int) and num_predict > 0:
+        reserve = num_predict
+    else:
+        reserve = min(CONTEXT_RESERVE_TOKENS, num_ctx // 4)
+    return max(0, num_ctx - reserve)
+
+
+class ContextAssembly(NamedTuple):
+    """An assembled prompt: its sections and what was left out to fit the budget."""
+    system_prompt: str
+    history_lines: List[str]
+    message: str
+    budget: int
+    tokens: int
+    chunks_used: int
+    chunks_total: int
+    history_total: int
+    truncated: bool
+
+    @property
+    def trimmed(self) -> bool:
+        return (self.truncated or self.chunks_used < self.chunks_total
+                or len(self.history_lines) < self.history_total)
+
+    def to_dict(self) -> dict:
+        return {
+            'budget': self.budget,
+            'tokens': self.tokens,
+            'chunks': f"{self.chunks_used}/{self.chunks_total}",
+            'history': f"{len(self.history_lines)}/{self.history_total}",
+            'truncated': self.truncated
+        }
+
+
+def assemble_context(system_prompt: str, message_parts: Sequence[MessagePart], history_lines: Sequence[str],
+                     budget: int) -> ContextAssembly:
+    """
+    Fit an LLM prompt into ``budget`` tokens (see the module docstring for the priorities).
+
+    ``message_parts`` is the current message in order: strings of query text and,
+    in place of each referenced knowledge node output, its chunks by rank. When
+    several nodes are referenced, chunks are taken rank by rank across them.
+    ``history_lines`` are oldest first, as are the lines kept.
+    """
+    remaining = budget
+    truncated = False
+
+    system_tokens = count_tokens(system_prompt)
+    if system_tokens > remaining:
+        system_prompt = truncate_to_tokens(system_prompt, remaining)
+        system_tokens, truncated = remaining, True
+    remaining -= system_tokens
+
+    # Query text, in order; what does not fit is cut off
+    texts = {}
+    for index, part in enumerate(message_parts):
+        if isinstance(part, str):
+            tokens = count_tokens(part)
+            if tokens > remaining:
+                part = truncate_to_tokens(part, remaining)
+                tokens, truncated = remaining, True
+            texts[index] = part
+            remaining -= tokens
+
+    # Retrieved chunks by rank, round robin across knowledge nodes, until one does not fit
+    sources = [index for index, part in enumerate(message_parts) if not isinstance(part, str)]
+    kept = {index: [] for index in sources}
+    chunks_total = sum(len(message_parts[index]) for index in sources)
+    full = False
+    for rank in range(max((len(message_parts[index]) for index in sources), default=0)):
+        for index in sources:
+            chunks = message_parts[index]
+            if rank >= len(chunks):
+                continue
+            tokens = count_tokens(chunks[rank]) + SEPARATOR_TOKENS
+            if tokens > remaining:
+                full = True
+                break
+            kept[index].append(chunks[rank])
+            remaining -= tokens
+        if full:
+            break
+
+    # History, newest first, until a message does not fit
+    history_kept = []
+    history_remaining = remaining - HISTORY_HEADER_TOKENS
+    for line in reversed(history_lines):
+        tokens = count_tokens(line) + SEPARATOR_TOKENS
+        if tokens > history_remaining:
+            break
+        history_kept.append(line)
+        history_remaining -= tokens
+    if history_kept:
+        history_kept.reverse()
+        remaining = history_remaining
+
+    message = ''.join(texts[index] if index in texts else CHUNK_SEPARATOR.join(kept[index])
+                      for index in range(len(message_parts)))
+    return ContextAssembly(
+        system_prompt=system_prompt,
+        history_lines=history_kept,
+        message=message,
+        budget=budget,
+        tokens=budget - remaining,
+        chunks_used=sum(len(chunks) for chunks in kept.values()),
+        chunks_total=chunks_total,
+        history_total=len(history_lines),
+        truncated=truncated
+    )
@@ -0,0 +1,112 @@
+"""
+Conversation memory of a single workflow run.
+
+The conversation is loaded once when the run starts and kept in
+``context['memory']``. Nodes read the history from the buffer and append
+their answers to it; the appended messages are written to
+``ConversationMemory`` in one update when the run ends, or every
+``flush_every`` messages if checkpoints are configured
+(``WORKFLOW_MEMORY_FLUSH_EVERY``, 0 = only at the end of the run).
+Checkpoints run inline unless the buffer has a ``checkpoint`` callable to
+hand them to (the async engine's writer thread). A buffer created with
+``persist=False`` never writes (e.g. batch evaluation).
+"""
+import threading
+import uuid
+from typing import List, Optional
+
+from .. import db
+from ..models.conversation_memory import ConversationMemory
+from ..utils.ids import as_uuid
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('conversation_buffer')
+
+
+class ConversationBuffer:
+    """Messages of one conversation as seen by a run, with the run's unsaved messages."""
+
+    def __init__(self, conversation_id, workflow_uuid, messages: Optional[List[dict]] = None,
+                 exists: bool = True, flush_every: int = 0, persist: bool = True, checkpoint=None):
+        self.conversation_id = as_uuid(conversation_id)
+        self.workflow_uuid = as_uuid(workflow_uuid)
+        self.flush_every = max(0, flush_every)
+        # Called with ``flush`` for each checkpoint; a failed one leaves the messages pending
+        self.checkpoint = checkpoint
+        self.exists = exists
+        self.persist = persist
+        self._saved = list(messages or [])
+        self._pending: List[dict] = []
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, workflow_uuid, conversation_id=None, flush_every: int = 0,
+             persist: bool = True, checkpoint=None) -> 'ConversationBuffer':
+        """Load a conversation of the workflow, or start a new one (saved on the first flush)."""
+        if conversation_id:
+            memory = ConversationMemory.query.filter_by(
+                uuid=as_uuid(conversation_id),
+                workflow_uuid=as_uuid(workflow_uuid)
+            ).first()
+            if memory:
+                logger.info(f"Found existing conversation with ID: {conversation_id} ({len(memory.messages)} messages)")
+                return cls(memory.uuid, workflow_uuid, memory.messages, exists=True,
+                           flush_every=flush_every, persist=persist, checkpoint=checkpoint)
+            logger.info(f"No conversation found with ID: {conversation_id}, creating new one")
+        else:
+            conversation_id = uuid.uuid4()
+            logger.info(f"No conversation ID provided, creating new conversation {conversation_id}")
+        return cls(conversation_id, workflow_uuid, [], exists=False, flush_every=flush_every, persist=persist,
+                   checkpoint=checkpoint)
+
+    @classmethod
+    def copy_of(cls, workflow_uuid, messages: List[dict], persist: bool = True) -> 'ConversationBuffer':
+        """A new conversation with copies of ``messages`` (saved on the first flush)."""
+        buffer = cls(uuid.uuid4(), workflow_uuid, [], exists=False, persist=persist)
+        for message in messages:
+            buffer.add_message(message['role'], message['content'], message.get('processSteps'),
+                               message.get('role_type'))
+        return buffer
+
+    @property
+    def messages(self) -> List[dict]:
+        """Saved history followed by the messages added during this run."""
+        with self._lock:
+            return self._saved + self._pending
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def add_message(self, role: str, content: str, process_steps=None, role_type: str = None) -> None:
+        """Buffer a message; written at the next flush."""
+        with self._lock:
+            self._pending.append(ConversationMemory.build_message(role, content, process_steps, role_type))
+            if self.flush_every and len(self._pending) >= self.flush_every:
+                if self.checkpoint is not None:
+                    self.checkpoint(self.flush)
+                else:
+                    self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered messages in one update of the conversation row."""
+        with self._lock:
+            if not self.persist or (not self._pending and self.exists):
+                return
+            pending = self._pending
+            try:
+                # Re-read the row, so messages written by other runs in the meantime are kept
+                memory = ConversationMemory.query.filter_by(uuid=self.conversation_id) \
+                    .populate_existing().with_for_update().first()
+                if memory is None:
+                    memory = ConversationMemory(uuid=self.conversation_id, workflow_uuid=self.workflow_uuid, messages=[])
+                    db.session.add(memory)
+                memory.append_messages(pending)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            logger.info(f"Saved {len(pending)} messages to conversation {self.conversation_id}")
+            self._saved.extend(pending)
+            self._pending = []
+            self.exists = True
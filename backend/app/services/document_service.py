@@ -7,9 +7,12 @@ from pathlib import Path
 from typing import List, Dict, Optional, BinaryIO
 import mimetypes
 from werkzeug.datastructures import FileStorage
+from sqlalchemy import func
+from sqlalchemy.orm import defer, load_only
 from app import db
 from app.models import Document
 from app.models.document_vector import DocumentVector
+from app.models.document_summary_vector import DocumentSummaryVector
 
 class DocumentService:
     """
@@ -17,6 +20,13 @@ class DocumentService:
     Handles file system operations for document management.
     """
     
+    # Columns loaded when listing chunks; the embedding columns are left out
+    CHUNK_LIST_COLUMNS = (
+        'uuid', 'user_uuid', 'document_uuid', 'knowledge_uuid', 'chunk_index', 'total_chunks',
+        'position', 'word_count', 'hit_count', 'enable', 'document_type', 'text_content',
+        'created_at', 'updated_at', 'bots_uuid'
+    )
+    
     def __init__(self, base_storage_path: str = None):
         """
         Initialize the DocumentService with a base storage path.
@@ -277,6 +287,7 @@ class DocumentService:
         if document_vectors:
             for document_vector in document_vectors:
                 db.session.delete(document_vector)
+        DocumentSummaryVector.query.filter_by(document_uuid=uuid).delete(synchronize_session=False)
 
 
         file_path = document.path
@@ -327,42 +338,45 @@ class DocumentService:
         """
         List document vector chunks with pagination.
         
+        Filtering, counting and pagination run in the database; the embedding
+        columns and the document content are never loaded.
+        
         Args:
             document_uuid: UUID of the document
             page: Page number
             page_size: Number of chunks per page
+            keyword: Optional case-insensitive filter on the chunk text
             
         Returns:
-            List of document vector chunk metadata dictionaries
+            Tuple of (chunks, document dict, total, total_pages), or
+            ([], None, 0, 0) if the document does not exist
         
         """
-
-        print(document_uuid)
-
-        document = Document.query.get(document_uuid)
+        document = Document.query.options(defer(Document.content)).get(document_uuid)
         if not document:
-            return []
+            return [], None, 0, 0
+        
+        page = max(1, int(page) if page is not None else 1)
+        per_page = max(1, int(per_page) if per_page is not None else 10)
+        
+        query = DocumentVector.query.filter(DocumentVector.document_uuid == document.uuid)
         
         if keyword:
-            document_vectors = DocumentVector.query.filter_by(document_uuid=document_uuid).filter(DocumentVector.text_content.contains(keyword)).all()
-        else:
-            document_vectors = DocumentVector.query.filter_by(document_uuid=document_uuid).all()
+            # ILIKE can use the trigram index on text_content (see migrations)
+            escaped = keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(DocumentVector.text_content.ilike(f'%{escaped}%', escape='\\'))
         
-        """
-        remove embediong attribute
-        """
-        for document_vector in document_vectors:
-            document_vector.embedding = None
-
-        total = len(document_vectors)
+        total = query.with_entities(func.count(DocumentVector.uuid)).scalar() or 0
         total_pages = math.ceil(total / per_page)
         
-        # Apply pagination
-        start = (page - 1) * per_page
-        end = start + per_page
+        document_vectors = query.options(
+            load_only(*(getattr(DocumentVector, column) for column in self.CHUNK_LIST_COLUMNS))
+        ).order_by(
+            DocumentVector.chunk_index,
+            DocumentVector.uuid
+        ).offset((page - 1) * per_page).limit(per_page).all()
         
-
-        return document_vectors[start:end], document.to_dict(), total, total_pages
+        return document_vectors, document.to_dict(), total, total_pages
 
     def _extract_text(self, file_obj, content_type: str) -> str:
         """
@@ -2,6 +2,7 @@ import os
 import time
 import requests
 import numpy as np
+from ..utils.exc import WorkflowCancelledError
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, set_process_id, create_process_banner, COLORS
 
 # Configure logger
@@ -20,18 +21,27 @@ class EmbeddingService:
         logger.info(f"Using embedding model: {self.model}")
     
     @log_execution_time(logger)
-    def generate_embeddings(self, text):
-        """Generate embeddings for a given text"""
+    def generate_embeddings(self, text, cancel_event=None, timeout=None):
+        """
+        Generate embeddings for a given text
+
+        ``cancel_event`` (e.g. a workflow node's CancelScope) is checked before the request is sent;
+        ``timeout`` (seconds) bounds the request, which has no limit by default.
+        """
         process_id = get_process_id()
         text_preview = text[:50] + '...' if len(text) > 50 else text
         logger.info(f"Generating embeddings for text: '{text_preview}' [Process: {process_id}]")
         
+        if cancel_event is not None and cancel_event.is_set():
+            raise WorkflowCancelledError("Embedding request was cancelled")
+        
         start_time = time.time()
         try:
             logger.debug(f"Sending request to {self.base_url}/api/embeddings with model {self.model}")
             response = requests.post(
                 f"{self.base_url}/api/embeddings",
-                json={"model": self.model, "prompt": text}
+                json={"model": self.model, "prompt": text},
+                timeout=timeout
             )
             
             request_time = time.time() - start_time
@@ -10,6 +10,11 @@ from ..models.knowledge_retrieval_history import KnowledgeRetrievalHistory
 from ..models.document_vector import DocumentVector
 from ..models.knowledge import Knowledge
 from ..models.document import Document
+from .vector_storage import VectorStorageConfig, prepare_query_embedding
+from .vector_backends import get_vector_backend, VectorHit
+from .node_policy import CancelScope
+from ..utils.ids import as_uuid
+from ..utils.exc import WorkflowCancelledError
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, set_process_id, create_process_banner, COLORS, ANSI_ENABLED
 
 # Configure logger
@@ -34,6 +39,9 @@ class KnowledgeRetrievalService:
         score_threshold: float = 0.0,
         reranking_model: Optional[dict] = None,
         document_ids_filter: Optional[List[str]] = None,
+        candidate_documents: Optional[int] = None,
+        candidate_chunks: Optional[int] = None,
+        cancel_event=None,
         **kwargs
     ) -> List[DocumentVector]:
         """
@@ -47,6 +55,16 @@ class KnowledgeRetrievalService:
             score_threshold: Minimum score threshold for results
             reranking_model: Configuration for reranking (not implemented)
             document_ids_filter: Optional list of document IDs to filter by
+            candidate_documents: Enables two-stage retrieval for semantic and hybrid
+                search: the number of documents picked by their summary vectors
+                before the chunks of those documents are searched
+            candidate_chunks: Hybrid search only: chunks taken from each of the keyword
+                and semantic searches before they are combined and re-ranked
+                (defaults to top_k * 2)
+            cancel_event: Cancel token (e.g. a workflow node's CancelScope), checked
+                between the retrieval stages; once it is set, retrieval stops with
+                WorkflowCancelledError instead of falling back to another search.
+                A CancelScope's remaining time also bounds the embedding request
             
         Returns:
             List of DocumentVector objects matching the query
@@ -68,6 +86,13 @@ class KnowledgeRetrievalService:
         if not query:
             logger.warning("Empty query provided, returning empty result")
             return []
+        
+        cls._check_cancelled(cancel_event)
+
+        # Ids may arrive as strings; UUID columns bind uuid.UUID values (see as_uuid)
+        dataset_id = as_uuid(dataset_id)
+        if document_ids_filter:
+            document_ids_filter = [as_uuid(doc_id) for doc_id in document_ids_filter]
 
         # Get the knowledge base to verify it exists
         start_time = time.time()
@@ -83,7 +108,7 @@ class KnowledgeRetrievalService:
         logger.info(f"Found knowledge base: {knowledge.name}")
         
         # Create retrieval history record
-        history_id = str(uuid.uuid4())
+        history_id = uuid.uuid4()
         logger.info(f"Creating retrieval history record with ID: {history_id}")
         knowledge_retrieval_history = KnowledgeRetrievalHistory(
             uuid=history_id,
@@ -97,6 +122,13 @@ class KnowledgeRetrievalService:
         db.session.commit()
         logger.debug(f"Retrieval history record created successfully")
 
+        # Two-stage retrieval: pick candidate documents by their summary vectors first
+        query_embedding = None
+        if candidate_documents and retrieval_method in (RetrievalMethod.SEMANTIC_SEARCH, RetrievalMethod.HYBRID_SEARCH):
+            query_embedding, document_ids_filter = cls._select_candidate_documents(
+                knowledge, query, candidate_documents, document_ids_filter, cancel_event
+            )
+
         # Execute the appropriate search method
         try:
             if retrieval_method == RetrievalMethod.FULL_TEXT_SEARCH or retrieval_method == "keyword":  # Support legacy 'keyword' value
@@ -115,7 +147,9 @@ class KnowledgeRetrievalService:
                     query=query,
                     top_k=top_k,
                     score_threshold=score_threshold,
-                    document_ids_filter=document_ids_filter
+                    document_ids_filter=document_ids_filter,
+                    query_embedding=query_embedding,
+                    cancel_event=cancel_event
                 )
             elif retrieval_method == RetrievalMethod.HYBRID_SEARCH:
                 logger.info(f"Executing hybrid search")
@@ -124,7 +158,10 @@ class KnowledgeRetrievalService:
                     query=query,
                     top_k=top_k,
                     score_threshold=score_threshold,
-                    document_ids_filter=document_ids_filter
+                    document_ids_filter=document_ids_filter,
+                    query_embedding=query_embedding,
+                    candidate_chunks=candidate_chunks,
+                    cancel_event=cancel_event
                 )
             else:
                 error_msg = f"Unsupported retrieval method: {retrieval_method}"
@@ -296,14 +333,18 @@ class KnowledgeRetrievalService:
         query: str,
         top_k: int = 5,
         score_threshold: float = 0.0,
-        document_ids_filter: Optional[List[str]] = None
+        document_ids_filter: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None,
+        cancel_event=None
     ) -> List[DocumentVector]:
         """
-        Perform a semantic search using vector embeddings and PostgreSQL's vector similarity.
+        Perform a semantic search using vector embeddings.
         
         This method:
-        1. Generates an embedding for the query
-        2. Uses PostgreSQL to find similar document chunks using cosine similarity
+        1. Generates an embedding for the query, unless one is passed in
+           (already prepared for the knowledge base's storage mode)
+        2. Ranks the document chunks with the configured vector backend
+           (pgvector on PostgreSQL, the embedded engine elsewhere)
         3. Returns the top-k results
         """
         # Create a unique process ID for this search operation
@@ -311,137 +352,32 @@ class KnowledgeRetrievalService:
         logger.info(f"Starting semantic search [Process: {process_id}]")
         start_time = time.time()
         
-        # Import necessary models
-        from app.models.document import Document
-        from ..services.embedding_service import EmbeddingService
-        
-        # Create embedding service instance
-        logger.info("Initializing embedding service")
-        embedding_service = EmbeddingService()
-        
         try:
-            # Generate embedding for the query
-            logger.info("Generating embedding for query")
-            embedding_start_time = time.time()
-            query_embedding = embedding_service.generate_embeddings(query)
-            embedding_time = time.time() - embedding_start_time
-            logger.info(f"Generated embedding with {len(query_embedding)} dimensions in {embedding_time:.3f}s")
-            
-            # Convert embedding to a proper PostgreSQL array format for vector type
-            # Use brackets instead of braces as required by pgvector
-            embedding_str = '[' + ','.join(str(x) for x in query_embedding) + ']'
-            
-            # Build the base query with join to Document table
-            logger.info("Building vector similarity SQL query")
-            # Use pgvector's cosine similarity function with direct embedding insertion
-            # Since the column is already of type vector, no need for casting the column
-            # We need to use direct string formatting for the vector embedding
-            # but can use bind parameters for other values
-            sql_query = f"""
-                SELECT dv.*, d.*,
-                       1 - (dv.embedding <=> '{embedding_str}'::vector) as similarity_score
-                FROM document_vectors dv
-                JOIN document d ON dv.document_uuid = d.uuid
-                WHERE dv.knowledge_uuid = :knowledge_id
-                AND dv.enable = TRUE
-                ORDER BY dv.embedding <=> '{embedding_str}'::vector
-                LIMIT :top_k
-            """
-            
-            # Add document filter if provided
-            if document_ids_filter:
-                logger.info(f"Adding document filter with {len(document_ids_filter)} document IDs")
-                doc_ids_str = "'" + "','".join(document_ids_filter) + "'"
-                sql_query = sql_query.replace(
-                    "WHERE dv.knowledge_uuid = :knowledge_id",
-                    f"WHERE dv.knowledge_uuid = :knowledge_id AND dv.document_uuid IN ({doc_ids_str})"
-                )
-            
-            # Log the SQL query
-            logger.debug(f"\n[SEMANTIC SEARCH SQL]\n{sql_query}\n")
-            logger.debug(f"Parameters: knowledge_id={knowledge_id}, top_k={top_k}, query_embedding_length={len(embedding_str)}")
-            
-            # Create parameters dictionary for bind parameters
-            params = {
-                'knowledge_id': knowledge_id,
-                'top_k': top_k
-            }
-            
-            # Execute the query with bind parameters
-            logger.info("Executing vector similarity query")
+            knowledge = Knowledge.query.get(knowledge_id)
+            storage = VectorStorageConfig.from_knowledge(knowledge)
+            if query_embedding is None:
+                query_embedding = cls._embed_query(query, storage, cancel_event)
+            cls._check_cancelled(cancel_event)
+            logger.info(f"Vector storage mode: {storage.mode}, dimensions: {len(query_embedding)}")
+            
+            # Rank the chunks with the vector backend
+            backend = get_vector_backend()
+            logger.info(f"Executing vector similarity search with the {backend.name} backend")
             query_start_time = time.time()
-            result = db.session.execute(text(sql_query), params)
+            hits = backend.search(
+                knowledge,
+                query_embedding,
+                top_k,
+                storage,
+                document_ids_filter=document_ids_filter
+            )
             query_time = time.time() - query_start_time
-            logger.info(f"Query executed in {query_time:.3f}s")
+            logger.info(f"Vector search returned {len(hits)} hits in {query_time:.3f}s")
             
             # Process results
             logger.info("Processing query results")
             process_start_time = time.time()
-            combined_results = []
-            row_count = 0
-            
-            for row in result:
-                row_count += 1
-                # Extract vector and document from row
-                vector = DocumentVector(
-                    uuid=row.uuid,
-                    document_uuid=row.document_uuid,
-                    knowledge_uuid=row.knowledge_uuid,
-                    chunk_index=row.chunk_index,
-                    total_chunks=row.total_chunks,
-                    position=row.position,
-                    word_count=row.word_count,
-                    hit_count=row.hit_count,
-                    enable=row.enable,
-                    document_type=row.document_type,
-                    text_content=row.text_content,
-                    embedding=row.embedding,
-                    created_at=row.created_at,
-                    updated_at=row.updated_at,
-                    bots_uuid=row.bots_uuid
-                )
-                
-                document = Document(
-                    uuid=row.uuid,
-                    filename=row.filename,
-                    content_type=row.content_type,
-                    embedding_status=row.embedding_status,
-                    created_at=row.created_at,
-                    updated_at=row.updated_at,
-                    knowledge_uuid=row.knowledge_uuid
-                )
-                
-                # Update hit count for returned results
-                vector.hit_count += 1
-                
-                # Combine vector and document data
-                result_data = vector.to_dict()
-                
-                # Convert UUIDs to strings
-                for key in ['uuid', 'user_uuid', 'document_uuid', 'knowledge_uuid', 'bots_uuid']:
-                    if key in result_data and result_data[key] is not None:
-                        result_data[key] = str(result_data[key])
-                
-                # Get document data
-                doc_data = document.to_dict()
-                for key in ['uuid', 'knowledge_uuid']:
-                    if key in doc_data and doc_data[key] is not None:
-                        doc_data[key] = str(doc_data[key])
-                
-                result_data['document'] = doc_data
-                
-                # Use the similarity_score directly from the query
-                # This is already calculated as 1 - (cosine distance)
-                if hasattr(row, 'similarity_score'):
-                    similarity = max(0.0, min(1.0, row.similarity_score))
-                    result_data['similarity_score'] = similarity
-                    logger.debug(f"Result {row_count} has similarity score: {similarity:.4f}")
-                else:
-                    # Fallback if similarity_score is not available
-                    result_data['similarity_score'] = 0.5
-                    logger.warning("No similarity score available for result, using default 0.5")
-                
-                combined_results.append(result_data)
+            combined_results = cls._load_vector_hits(hits)
             
             process_time = time.time() - process_start_time
             total_time = time.time() - start_time
@@ -460,7 +396,11 @@ class KnowledgeRetrievalService:
             
             return combined_results
             
+        except WorkflowCancelledError:
+            raise
         except Exception as e:
+            # A request cut short by the deadline ends the retrieval, like a cancellation
+            cls._check_cancelled(cancel_event)
             error_msg = f"Error in semantic search: {str(e)}"
             if ANSI_ENABLED:
                 logger.error(f"{COLORS['RED']}{error_msg}{COLORS['RESET']}")
@@ -481,6 +421,122 @@ class KnowledgeRetrievalService:
                 document_ids_filter=document_ids_filter
             )
 
+    @staticmethod
+    def _load_vector_hits(hits: List[VectorHit]) -> List[Dict[str, Any]]:
+        """
+        Load the chunks and documents of vector search hits, keeping the hit order.
+        
+        Returns:
+            List of chunk dicts with the document and the similarity score attached
+        """
+        if not hits:
+            return []
+        
+        vector_ids = [uuid.UUID(hit.vector_uuid) for hit in hits]
+        rows = db.session.query(DocumentVector, Document).join(
+            Document,
+            DocumentVector.document_uuid == Document.uuid
+        ).filter(
+            DocumentVector.uuid.in_(vector_ids)
+        ).all()
+        rows_by_id = {str(vector.uuid): (vector, document) for vector, document in rows}
+        
+        combined_results = []
+        for hit in hits:
+            if hit.vector_uuid not in rows_by_id:
+                continue
+            vector, document = rows_by_id[hit.vector_uuid]
+            
+            # Combine vector and document data
+            result_data = vector.to_dict()
+            
+            # Report the hit without persisting it, as before
+            result_data['hit_count'] = (vector.hit_count or 0) + 1
+            
+            # Get document data
+            doc_data = document.to_dict()
+            for key in ['uuid', 'knowledge_uuid']:
+                if key in doc_data and doc_data[key] is not None:
+                    doc_data[key] = str(doc_data[key])
+            
+            result_data['document'] = doc_data
+            
+            # Cosine similarity reported by the backend, clamped to [0, 1]
+            result_data['similarity_score'] = max(0.0, min(1.0, hit.score))
+            
+            combined_results.append(result_data)
+        
+        return combined_results
+
+    @staticmethod
+    def _check_cancelled(cancel_event) -> None:
+        if cancel_event is not None and cancel_event.is_set():
+            raise WorkflowCancelledError("Knowledge retrieval was cancelled")
+
+    @staticmethod
+    def _embed_query(query: str, storage: VectorStorageConfig, cancel_event=None) -> List[float]:
+        """Embed a query and apply the knowledge base's storage settings (Matryoshka truncation)."""
+        from ..services.embedding_service import EmbeddingService
+        
+        logger.info("Generating embedding for query")
+        embedding_start_time = time.time()
+        # The request may take what is left of the node attempt's time
+        timeout = cancel_event.remaining() if isinstance(cancel_event, CancelScope) else None
+        query_embedding = EmbeddingService().generate_embeddings(query, cancel_event=cancel_event, timeout=timeout)
+        embedding_time = time.time() - embedding_start_time
+        logger.info(f"Generated embedding with {len(query_embedding)} dimensions in {embedding_time:.3f}s")
+        return prepare_query_embedding(query_embedding, storage)
+
+    @classmethod
+    def _select_candidate_documents(
+        cls,
+        knowledge: Knowledge,
+        query: str,
+        candidate_documents: int,
+        document_ids_filter: Optional[List[str]] = None,
+        cancel_event=None
+    ):
+        """
+        Coarse stage of two-stage retrieval: rank documents by their summary vectors.
+        
+        Returns:
+            Tuple of (query_embedding, document_ids_filter). The filter is unchanged
+            when the knowledge base has no summary vectors or the stage fails, so
+            the chunk search falls back to a single stage.
+        """
+        start_time = time.time()
+        try:
+            storage = VectorStorageConfig.from_knowledge(knowledge)
+            query_embedding = cls._embed_query(query, storage, cancel_event)
+            cls._check_cancelled(cancel_event)
+            
+            # Rank more documents when an explicit filter will discard some of them
+            limit = candidate_documents
+            if document_ids_filter:
+                limit = max(candidate_documents, len(document_ids_filter))
+            hits = get_vector_backend().search_documents(knowledge, query_embedding, limit, storage)
+        except WorkflowCancelledError:
+            raise
+        except Exception as e:
+            cls._check_cancelled(cancel_event)
+            logger.warning(f"Document summary search failed, using single-stage retrieval: {str(e)}")
+            db.session.rollback()
+            return None, document_ids_filter
+        
+        candidate_ids = [as_uuid(hit.document_uuid) for hit in hits]
+        if document_ids_filter:
+            allowed = set(document_ids_filter)
+            candidate_ids = [doc_id for doc_id in candidate_ids if doc_id in allowed]
+        candidate_ids = candidate_ids[:candidate_documents]
+        
+        if not candidate_ids:
+            logger.info("No document summary vectors matched, using single-stage retrieval")
+            return query_embedding, document_ids_filter
+        
+        logger.info(f"Document stage selected {len(candidate_ids)} of {candidate_documents} requested documents "
+                    f"in {time.time() - start_time:.3f}s")
+        return query_embedding, candidate_ids
+
     @classmethod
     @log_execution_time(logger)
     def _hybrid_search(
@@ -489,7 +545,10 @@ class KnowledgeRetrievalService:
         query: str,
         top_k: int = 5,
         score_threshold: float = 0.0,
-        document_ids_filter: Optional[List[str]] = None
+        document_ids_filter: Optional[List[str]] = None,
+        query_embedding: Optional[List[float]] = None,
+        candidate_chunks: Optional[int] = None,
+        cancel_event=None
     ) -> List[DocumentVector]:
         """
         Perform a hybrid search combining keyword and semantic search.
@@ -509,27 +568,31 @@ class KnowledgeRetrievalService:
         
         try:
             # Get results from both search methods
-            # Use top_k * 2 to get more candidates for re-ranking
+            # Use top_k * 2 (or candidate_chunks) to get more candidates for re-ranking
+            chunk_limit = candidate_chunks or top_k * 2
             logger.info("Running keyword search component...")
             keyword_start_time = time.time()
             keyword_results = cls._full_text_search(
                 knowledge_id=knowledge_id,
                 query=query,
-                top_k=top_k * 2,  # Get more results for better hybrid ranking
+                top_k=chunk_limit,  # Get more results for better hybrid ranking
                 score_threshold=score_threshold,
                 document_ids_filter=document_ids_filter
             )
             keyword_time = time.time() - keyword_start_time
             logger.info(f"Keyword search returned {len(keyword_results)} results in {keyword_time:.3f}s")
             
+            cls._check_cancelled(cancel_event)
             logger.info("Running semantic search component...")
             semantic_start_time = time.time()
             semantic_results = cls._semantic_search(
                 knowledge_id=knowledge_id,
                 query=query,
-                top_k=top_k * 2,  # Get more results for better hybrid ranking
+                top_k=chunk_limit,  # Get more results for better hybrid ranking
                 score_threshold=score_threshold,
-                document_ids_filter=document_ids_filter
+                document_ids_filter=document_ids_filter,
+                query_embedding=query_embedding,
+                cancel_event=cancel_event
             )
             semantic_time = time.time() - semantic_start_time
             logger.info(f"Semantic search returned {len(semantic_results)} results in {semantic_time:.3f}s")
@@ -615,7 +678,10 @@ class KnowledgeRetrievalService:
             
             return sorted_results
             
+        except WorkflowCancelledError:
+            raise
         except Exception as e:
+            cls._check_cancelled(cancel_event)
             error_msg = f"Error in hybrid search: {str(e)}"
             if ANSI_ENABLED:
                 logger.error(f"{COLORS['RED']}{error_msg}{COLORS['RESET']}")
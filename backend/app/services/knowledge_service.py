@@ -8,11 +8,17 @@ from datetime import datetime
 from sqlalchemy import text, func
 from sqlalchemy.sql.expression import cast
 from sqlalchemy.dialects.postgresql import ARRAY, FLOAT
-from ..models import Knowledge, Document, DocumentVector, KnowledgeRetrievalHistory
+from ..models import Knowledge, Document, DocumentVector, DocumentSummaryVector, KnowledgeRetrievalHistory
 from .. import db
 from .embedding_service import EmbeddingService
 from .document_service import DocumentService
+from .vector_backends import get_vector_backend
+from .vector_storage import (
+    VectorStorageConfig, STORAGE_FLOAT32, STORAGE_HALFVEC, STORAGE_BINARY, STORAGE_COLUMNS,
+    prepare_embedding, stored_embedding, truncate_embedding, centroid_embedding
+)
 from ..config import Config as config
+from ..utils.ids import as_uuid
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, set_process_id, create_process_banner, COLORS
 
 # Configure logger
@@ -43,6 +49,11 @@ class KnowledgeService:
         if not current_app:
             logger.debug("No active Flask application context, skipping pgvector initialization")
             return
+        
+        # Other databases use the embedded vector backend
+        if db.engine.dialect.name != 'postgresql':
+            logger.info(f"Database dialect is {db.engine.dialect.name}, skipping pgvector initialization")
+            return
             
         try:
             # Check if pgvector extension is enabled
@@ -274,6 +285,9 @@ class KnowledgeService:
         knowledge = Knowledge.query.get(knowledge_uuid)
         if not knowledge:
             raise ValueError(f"Knowledge with UUID {knowledge_uuid} not found")
+        DocumentSummaryVector.query.filter(
+            DocumentSummaryVector.knowledge_uuid == knowledge.uuid
+        ).delete(synchronize_session=False)
         db.session.delete(knowledge)
         db.session.commit()
 
@@ -296,17 +310,42 @@ class KnowledgeService:
         try:
             # Check if we're updating an existing knowledge base
             if 'uuid' in data and data['uuid']:
-                knowledge = Knowledge.query.get(data['uuid'])
+                knowledge = Knowledge.query.get(as_uuid(data['uuid']))
                 if not knowledge:
                     raise ValueError(f"Knowledge with UUID {data['uuid']} not found")
                 
+                processing_config = knowledge.processing_config
+                if 'processing_config' in data:
+                    processing_config = dict(data['processing_config'] or {})
+                    stored_storage = (knowledge.processing_config or {}).get('vector_storage')
+                    if processing_config.get('vector_storage') is None:
+                        # The dataset page only sends chunk and index settings; keep the stored layout
+                        if stored_storage is not None:
+                            processing_config['vector_storage'] = stored_storage
+                    else:
+                        # Storage layout changes must go through convert_vector_storage so
+                        # existing vectors are rewritten instead of silently mixed
+                        requested_storage = VectorStorageConfig.from_dict(processing_config['vector_storage'])
+                        if requested_storage != VectorStorageConfig.from_dict(stored_storage):
+                            has_vectors = db.session.query(DocumentVector.uuid).filter(
+                                DocumentVector.knowledge_uuid == knowledge.uuid
+                            ).first() is not None
+                            if has_vectors:
+                                raise ValueError("Vector storage settings cannot be changed on a knowledge base with "
+                                                 "embedded documents; use 'flask vectors convert' instead")
+                            requested_storage.validate(knowledge.embedding_model)
+                
                 # Update existing knowledge base
                 knowledge.name = data.get('name', knowledge.name)
                 knowledge.description = data.get('description', knowledge.description)
-                knowledge.processing_config = data.get('processing_config', knowledge.processing_config)
+                knowledge.processing_config = processing_config
                 knowledge.updated_at = datetime.utcnow()
                 
             else:
+                VectorStorageConfig.from_dict(
+                    (data['processing_config'] or {}).get('vector_storage')
+                ).validate(config.DEFAULT_EMBEDDING_MODEL)
+                
                 # Create new knowledge base
                 knowledge = Knowledge(
                     name=data['name'],
@@ -328,7 +367,7 @@ class KnowledgeService:
             if document_ids:
                 # Update documents with the knowledge_uuid
                 result = db.session.query(Document).filter(
-                    Document.uuid.in_(document_ids)
+                    Document.uuid.in_([as_uuid(doc_id) for doc_id in document_ids])
                 ).update({
                     Document.knowledge_uuid: knowledge.uuid,
                     Document.updated_at: datetime.utcnow()
@@ -340,7 +379,7 @@ class KnowledgeService:
             """
             embeding documents
             """
-            self._process_document_embeddings(str(knowledge.uuid), document_ids, data['processing_config'])
+            self._process_document_embeddings(str(knowledge.uuid), document_ids, knowledge.processing_config or {})
             
             # Update documents list with status
             for doc in documents:
@@ -552,6 +591,15 @@ class KnowledgeService:
         
         embedding_service = EmbeddingService()
         
+        # Ids may arrive as strings; UUID columns bind uuid.UUID values (see as_uuid)
+        knowledge_id = as_uuid(knowledge_id)
+        document_ids = [as_uuid(doc_id) for doc_id in document_ids]
+        
+        # Vectors are stored according to the knowledge base's storage mode
+        knowledge = Knowledge.query.get(knowledge_id)
+        storage = VectorStorageConfig.from_knowledge(knowledge).validate(knowledge.embedding_model if knowledge else None)
+        logger.info(f"Vector storage mode: {storage.mode}, dimensions: {storage.dimensions or 'native'}")
+        
         # Get chunking settings from processing config
         chunk_settings = processing_config.get('chunk_setting', {})
         chunk_size = chunk_settings.get('max_chunk_len', 1024)
@@ -590,18 +638,20 @@ class KnowledgeService:
                 
                 # Generate embeddings for each chunk
                 embedding_start_time = time.time()
+                chunk_embeddings = []
                 for idx, chunk in enumerate(chunks):
                     logger.info(f"Generating embedding for chunk {idx + 1}/{len(chunks)} of document {doc_id}")
                     
                     # Generate embedding for the chunk
                     embedding = embedding_service.generate_embeddings(chunk['content'])
+                    chunk_embeddings.append(embedding)
                     
                     # Create vector for the segment
                     vector = DocumentVector(
                         uuid=uuid.uuid4(),
                         knowledge_uuid=knowledge_id,
                         document_uuid=doc_id,
-                        embedding=embedding,
+                        **prepare_embedding(embedding, storage),
                         chunk_index=idx,
                         total_chunks=len(chunks),
                         text_content=chunk['content'],
@@ -616,6 +666,9 @@ class KnowledgeService:
                 
                 embedding_time = time.time() - embedding_start_time
                 
+                # Document-level summary vector for two-stage retrieval
+                self._save_document_summary(knowledge_id, doc_id, chunk_embeddings, storage)
+                
                 # Update document status
                 document.embedding_status = 'completed'
                 document.updated_at = datetime.utcnow()
@@ -639,6 +692,13 @@ class KnowledgeService:
                 db.session.commit()
                 failed_docs += 1
         
+        # Warm the vector backend's index for the new vectors
+        if knowledge and successful_docs:
+            try:
+                get_vector_backend().refresh(knowledge)
+            except Exception as e:
+                logger.warning(f"Could not refresh vector index for knowledge base {knowledge_id}: {str(e)}")
+        
         total_time = time.time() - start_time
         completion_banner = f"{COLORS['MAGENTA']}{COLORS['BOLD']}" \
                 f"DOCUMENT EMBEDDING PROCESS COMPLETED [PROCESS: {process_id}]\n" \
@@ -756,14 +816,15 @@ class KnowledgeService:
             import numpy as np
             from sklearn.metrics.pairwise import cosine_similarity
             
-            # Convert query embedding to numpy array
-            query_vector = np.array(query_embedding).reshape(1, -1)
+            # Convert query embedding to numpy array, truncated like the stored vectors
+            storage = VectorStorageConfig.from_knowledge(Knowledge.query.get(knowledge_id))
+            query_vector = np.array(truncate_embedding(query_embedding, storage.dimensions)).reshape(1, -1)
             
             similarity_start = time.time()
             # Calculate similarity for each document vector
             for dv, doc in document_vectors:
                 # Convert document embedding to numpy array
-                doc_vector = np.array(dv.embedding).reshape(1, -1)
+                doc_vector = np.array(stored_embedding(dv)).reshape(1, -1)
                 
                 # Calculate cosine similarity
                 similarity = cosine_similarity(query_vector, doc_vector)[0][0]
@@ -807,6 +868,258 @@ class KnowledgeService:
             "distances": similarities
         }
 
+    @log_execution_time(logger)
+    def convert_vector_storage(self, knowledge_uuid, mode, dimensions=None, rescore_factor=None,
+                               batch_size=500, reembed=False):
+        """
+        Convert the stored vectors of a knowledge base to another storage mode.
+        
+        The conversion runs in two passes so searches keep working while it runs:
+        the first pass writes the columns used by the new mode next to the existing
+        ones, then the knowledge base is switched to the new mode and the second
+        pass clears the columns the new mode no longer reads. When the first pass
+        rewrites a column the current mode reads (e.g. float32 truncated to fewer
+        dimensions), it and the switch commit as one transaction, so searches
+        never see vectors of the new size under the old settings.
+        
+        Args:
+            knowledge_uuid: UUID of the knowledge base to convert
+            mode: Target storage mode (float32, halfvec or binary)
+            dimensions: Optional Matryoshka truncation for the target mode
+            rescore_factor: Candidates re-scored per result in binary mode
+            batch_size: Number of vectors rewritten per transaction
+            reembed: Regenerate embeddings from the chunk text instead of
+                converting the stored ones (required to undo a truncation)
+                
+        Returns:
+            dict: Summary with the converted vector count and the new storage settings
+        """
+        process_id = get_process_id()
+        create_process_banner(logger, "VECTOR STORAGE CONVERSION STARTED", process_id)
+        
+        knowledge = Knowledge.query.get(knowledge_uuid)
+        if not knowledge:
+            raise ValueError(f"Knowledge with UUID {knowledge_uuid} not found")
+        
+        current = VectorStorageConfig.from_knowledge(knowledge)
+        target = VectorStorageConfig(
+            mode=mode,
+            dimensions=dimensions,
+            rescore_factor=rescore_factor or current.rescore_factor
+        ).validate(knowledge.embedding_model)
+        
+        if current.dimensions and not reembed and (not target.dimensions or target.dimensions > current.dimensions):
+            raise ValueError(f"Vectors are truncated to {current.dimensions} dimensions; "
+                             f"converting to a larger size requires reembed=True")
+        
+        # Vectors rewritten in a column the current mode reads are only committed with the switch
+        in_place = bool(STORAGE_COLUMNS[current.mode] & STORAGE_COLUMNS[target.mode]) and (
+            reembed or current.dimensions != target.dimensions)
+        
+        logger.info(f"Converting knowledge base {knowledge_uuid} from {current} to {target}"
+                    f"{' in one transaction' if in_place else ''}")
+        start_time = time.time()
+        
+        # Pass 1: write the target columns next to the existing ones
+        converted = 0
+        try:
+            for batch in self._iter_vector_batches(knowledge.uuid, batch_size):
+                for vector in batch:
+                    if reembed:
+                        source = self.embedding_service.generate_embeddings(vector.text_content)
+                    else:
+                        source = stored_embedding(vector)
+                        if source is None:
+                            raise ValueError(f"Vector {vector.uuid} has no stored embedding to convert; use reembed=True")
+                    
+                    for column, value in prepare_embedding(source, target).items():
+                        if value is not None:
+                            setattr(vector, column, value)
+                    vector.updated_at = datetime.utcnow()
+                if in_place:
+                    db.session.flush()
+                    for vector in batch:
+                        db.session.expunge(vector)
+                else:
+                    db.session.commit()
+                converted += len(batch)
+                logger.info(f"Converted {converted} vectors")
+            
+            # Switch the knowledge base to the new storage mode
+            processing_config = dict(knowledge.processing_config or {})
+            processing_config['vector_storage'] = target.to_dict()
+            knowledge.processing_config = processing_config
+            knowledge.updated_at = datetime.utcnow()
+            db.session.commit()
+        except Exception:
+            # An in-place conversion commits nothing; others have only written columns searches ignore
+            db.session.rollback()
+            raise
+        
+        # Pass 2: clear the columns the new mode does not read
+        unused_columns = {
+            STORAGE_FLOAT32: {'embedding_half': None, 'embedding_bits': None},
+            STORAGE_HALFVEC: {'embedding': None, 'embedding_bits': None},
+            STORAGE_BINARY: {'embedding': None},
+        }[target.mode]
+        db.session.query(DocumentVector).filter(
+            DocumentVector.knowledge_uuid == knowledge.uuid
+        ).update(
+            {getattr(DocumentVector, column): value for column, value in unused_columns.items()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        
+        self._ensure_vector_index(knowledge.uuid, target)
+
+        # Summary vectors follow the chunks' new storage mode
+        summaries = self.refresh_document_summaries(knowledge.uuid, batch_size=batch_size)
+
+        total_time = time.time() - start_time
+        completion_banner = f"{COLORS['MAGENTA']}{COLORS['BOLD']}" \
+                f"VECTOR STORAGE CONVERSION COMPLETED [PROCESS: {process_id}]\n" \
+                f"MODE: {target.mode} | VECTORS: {converted} | TIME: {total_time:.2f}s{COLORS['RESET']}"
+        logger.info(completion_banner)
+        
+        return {
+            'knowledge_uuid': str(knowledge.uuid),
+            'converted': converted,
+            'summaries': summaries,
+            'storage': target.to_dict()
+        }
+
+    def _save_document_summary(self, knowledge_uuid, document_uuid, embeddings, storage):
+        """Replace a document's summary vector with the centroid of its chunk embeddings (not committed)."""
+        DocumentSummaryVector.query.filter(
+            DocumentSummaryVector.document_uuid == document_uuid
+        ).delete(synchronize_session=False)
+
+        centroid = centroid_embedding(embeddings)
+        if centroid is None:
+            return None
+
+        summary = DocumentSummaryVector(
+            knowledge_uuid=knowledge_uuid,
+            document_uuid=document_uuid,
+            chunk_count=len(embeddings),
+            **prepare_embedding(centroid, storage),
+            created_at=datetime.utcnow(),
+            updated_at=datetime.utcnow()
+        )
+        db.session.add(summary)
+        return summary
+
+    @log_execution_time(logger)
+    def refresh_document_summaries(self, knowledge_uuid, batch_size=100):
+        """
+        Recompute the document summary vectors of a knowledge base from its stored chunk vectors.
+
+        Used to backfill knowledge bases ingested before two-stage retrieval
+        and after a storage conversion.
+
+        Args:
+            knowledge_uuid: UUID of the knowledge base
+            batch_size: Number of documents summarised per transaction
+
+        Returns:
+            int: Number of summary vectors written
+        """
+        knowledge_uuid = as_uuid(knowledge_uuid)
+        knowledge = Knowledge.query.get(knowledge_uuid)
+        if not knowledge:
+            raise ValueError(f"Knowledge with UUID {knowledge_uuid} not found")
+        storage = VectorStorageConfig.from_knowledge(knowledge)
+
+        document_ids = [row[0] for row in db.session.query(DocumentVector.document_uuid).filter(
+            DocumentVector.knowledge_uuid == knowledge_uuid
+        ).distinct().all()]
+
+        # Summaries of documents that no longer have chunks
+        DocumentSummaryVector.query.filter(
+            DocumentSummaryVector.knowledge_uuid == knowledge_uuid,
+            DocumentSummaryVector.document_uuid.notin_(document_ids)
+        ).delete(synchronize_session=False)
+
+        written = 0
+        for position, document_id in enumerate(document_ids, 1):
+            vectors = db.session.query(DocumentVector.embedding, DocumentVector.embedding_half).filter(
+                DocumentVector.document_uuid == document_id,
+                DocumentVector.enable == True
+            ).all()
+            embeddings = [embedding for embedding in (stored_embedding(vector) for vector in vectors) if embedding]
+            if self._save_document_summary(knowledge_uuid, document_id, embeddings, storage) is not None:
+                written += 1
+            if position % batch_size == 0:
+                db.session.commit()
+        db.session.commit()
+
+        logger.info(f"Refreshed {written} document summary vectors for knowledge base {knowledge_uuid}")
+        return written
+
+    def _iter_vector_batches(self, knowledge_uuid, batch_size):
+        """Yield the vectors of a knowledge base in batches, ordered by UUID."""
+        last_uuid = None
+        while True:
+            query = DocumentVector.query.filter(DocumentVector.knowledge_uuid == knowledge_uuid)
+            if last_uuid is not None:
+                query = query.filter(DocumentVector.uuid > last_uuid)
+            batch = query.order_by(DocumentVector.uuid).limit(batch_size).all()
+            if not batch:
+                return
+            last_uuid = batch[-1].uuid
+            yield batch
+
+    def _ensure_vector_index(self, knowledge_uuid, storage):
+        """
+        Create a partial HNSW index for the knowledge base's storage mode and dimensions.
+        
+        The indexed expressions match the casts used by
+        ``KnowledgeRetrievalService._build_vector_query``. Indexes of the knowledge
+        base's previous storage settings are dropped, as no query uses their casts.
+        """
+        if db.engine.dialect.name != 'postgresql':
+            logger.debug("Skipping vector index creation on non-PostgreSQL database")
+            return
+        
+        sample = DocumentVector.query.filter(DocumentVector.knowledge_uuid == knowledge_uuid).first()
+        dimensions = len(stored_embedding(sample)) if sample else None
+        
+        if not dimensions:
+            # No vectors yet
+            expression = None
+        elif storage.mode == STORAGE_HALFVEC:
+            expression = f"(embedding_half::halfvec({dimensions})) halfvec_cosine_ops"
+        elif storage.mode == STORAGE_BINARY:
+            expression = f"(embedding_bits::bit({dimensions})) bit_hamming_ops"
+        elif storage.dimensions:
+            expression = f"(embedding::vector({dimensions})) vector_cosine_ops"
+        else:
+            # Untruncated float32 vectors use the table-wide index
+            expression = None
+        
+        knowledge_literal = str(knowledge_uuid).replace("'", "")
+        knowledge_hex = knowledge_literal.replace('-', '')
+        # Within PostgreSQL's 63 character limit on names
+        index_name = f"dv_{storage.mode}_{dimensions}_{knowledge_hex}_idx" if expression else None
+        
+        # Earlier indexes of this knowledge base, including document_vectors_{mode}_{uuid}_idx ones
+        stale_indexes = [name for (name,) in db.session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'document_vectors' AND indexname LIKE :pattern"
+        ), {'pattern': f"%{knowledge_hex}_idx"}) if name != index_name]
+        for name in stale_indexes:
+            logger.info(f"Dropping vector index {name}")
+            db.session.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        
+        if index_name:
+            logger.info(f"Creating vector index {index_name}")
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON document_vectors "
+                f"USING hnsw ({expression}) WHERE knowledge_uuid = '{knowledge_literal}'"
+            ))
+        else:
+            logger.info("No per-knowledge vector index needed")
+        db.session.commit()
+
     def get_document_retrieval_history(self, knowledge_uuid, page, per_page, keyword):
         
         """
@@ -1,6 +1,7 @@
 from langchain_community.llms import Ollama
 from langchain.schema import HumanMessage, SystemMessage
 from langchain.callbacks.base import BaseCallbackHandler
+import math
 import os
 import logging
 import threading
@@ -9,11 +10,27 @@ import json
 import re
 import jsonschema
 import time
+from ..utils.exc import WorkflowCancelledError
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, set_process_id, create_process_banner, COLORS, ANSI_ENABLED
 
 # Configure logger
 logger = setup_logger('llm_service')
 
+def ollama_usage(data):
+    """Token counts of an Ollama response (or final stream chunk), or None if it has none"""
+    if 'prompt_eval_count' not in data and 'eval_count' not in data:
+        return None
+    return {'prompt_tokens': data.get('prompt_eval_count'), 'completion_tokens': data.get('eval_count')}
+
+# Advanced options of the LLM settings passed through to Ollama
+OLLAMA_OPTION_KEYS = (
+    'num_keep', 'seed', 'num_predict', 'top_k', 'min_p', 'typical_p', 'repeat_last_n', 'repeat_penalty',
+    'presence_penalty', 'frequency_penalty', 'mirostat', 'mirostat_tau', 'mirostat_eta', 'penalize_newline',
+    'stop', 'numa', 'num_batch', 'num_gpu', 'main_gpu', 'low_vram', 'vocab_only', 'use_mmap', 'use_mlock',
+    'num_thread'
+)
+
+
 class LLMService:
     def __init__(self, base_url=None, model=None, timeout=None):
         self.base_url = base_url or os.getenv('OLLAMA_BASE_URL', 'http://100.106.220.16:11434')
@@ -29,10 +46,176 @@ class LLMService:
 
         def on_llm_start(self, *args, **kwargs):
             if self.cancel_event and self.cancel_event.is_set():
-                raise RuntimeError("LLM request was cancelled")
+                raise WorkflowCancelledError("LLM request was cancelled")
+
+    class UsageHandler(BaseCallbackHandler):
+        """Reports the token counts Ollama sends with the last chunk of a generation"""
+        def __init__(self, on_usage):
+            self.on_usage = on_usage
+
+        def on_llm_end(self, response, **kwargs):
+            for generations in response.generations:
+                for generation in generations:
+                    usage = ollama_usage(generation.generation_info or {})
+                    if usage:
+                        self.on_usage(usage)
+
+    def build_prompt(self, prompt, settings=None, conversation_history=None):
+        """The prompt sent to the model: system prompt (with structured output instructions), history and ``prompt``."""
+        settings = settings or {}
+        system_prompt = self.system_instructions(settings.get('systemPrompt', ''), settings)
+        history_lines = self.history_lines(conversation_history, settings)
+        return self.compose_prompt(system_prompt, history_lines, prompt)
+
+    def history_lines(self, conversation_history, settings=None):
+        """``role: content`` lines of the history, oldest first, within the node's message count and length limits."""
+        settings = settings or {}
+        lines = []
+        if not conversation_history:
+            return lines
+        # Get conversation history limits from settings
+        history_settings = settings.get('conversationHistory', {})
+        max_messages = history_settings.get('maxMessages', 10)  # Default to 10 messages
+        max_message_length = history_settings.get('maxMessageLength', 1000)  # Default to 1000 chars
+        include_history = history_settings.get('enabled', True)  # Default to enabled
+        
+        if not include_history:
+            logger.info("Conversation history disabled in settings")
+            return lines
+        
+        # Apply message count limit
+        limited_history = conversation_history[-max_messages:] if len(conversation_history) > max_messages else conversation_history
+        logger.info(f"DEBUG: Processing {len(limited_history)} of {len(conversation_history)} messages in conversation history (limit: {max_messages})")
+        
+        for idx, msg in enumerate(limited_history):
+            role = msg.get('role', '')
+            content = msg.get('content', '')
+            timestamp = msg.get('timestamp', '')
+            
+            # Apply message length limit
+            if content and len(content) > max_message_length:
+                content = content[:max_message_length] + "..."
+                
+            logger.info(f"DEBUG: History message #{idx+1} - Role: {role}, Timestamp: {timestamp}, Content: {content[:100]}{'...' if len(content) > 100 else ''}")
+            if role and content:
+                lines.append(f"{role}: {content}")
+                
+        logger.info(f"Using conversation history with limits: max_messages={max_messages}, max_message_length={max_message_length}")
+        return lines
+
+    def system_instructions(self, system_prompt, settings=None):
+        """The system prompt, followed by the structured output instructions if the settings enable them."""
+        settings = settings or {}
+        structured_output = settings.get('structuredOutput', {})
+        use_structured_output = structured_output.get('enabled', False)
+        schema_properties = structured_output.get('properties', [])
+        
+        # Prepare system prompt with structured output schema if enabled
+        modified_system_prompt = system_prompt
+        if use_structured_output and schema_properties:
+            # Generate JSON schema from properties
+            schema = self._generate_schema_from_properties(schema_properties)
+            
+            # Add structured output instructions to system prompt
+            schema_json = json.dumps(schema, indent=2)
+            structured_output_instructions = f"\n\nYou must respond in the following JSON format that matches this JSON schema:\n{schema_json}\n\nYour response must be valid JSON that conforms to this schema."
+            
+            if modified_system_prompt:
+                modified_system_prompt += structured_output_instructions
+            else:
+                modified_system_prompt = structured_output_instructions
+                
+            logger.info(f"Using structured output schema with {len(schema['properties'])} properties")
+            logger.debug(f"Schema: {schema_json}")
+        return modified_system_prompt
+
+    @staticmethod
+    def compose_prompt(system_prompt, history_lines, prompt):
+        """Combine system prompt, conversation history lines, and the current message into one prompt."""
+        conversation_context = ''.join(f"{line}\n" for line in history_lines)
+        if conversation_context:
+            full_prompt = f"{system_prompt}\n\nConversation history:\n{conversation_context}\nCurrent message:\n{prompt}" if system_prompt else f"Conversation history:\n{conversation_context}\nCurrent message:\n{prompt}"
+            logger.info(f"Using conversation history with {len(history_lines)} messages")
+            logger.info(f"DEBUG: Full prompt structure:\n1. System prompt: {len(system_prompt) if system_prompt else 0} chars\n2. Conversation history: {len(conversation_context)} chars\n3. Current message: {len(prompt)} chars")
+        else:
+            full_prompt = f"{system_prompt}\n\n{prompt}" if system_prompt else prompt
+            logger.info("No conversation history used in prompt")
+        return full_prompt
+
+    def parse_structured_output(self, result, schema_properties):
+        """The JSON object of a structured output response, with the outcome of its validation against the schema."""
+        # Try to extract JSON from the response
+        try:
+            # Look for JSON pattern in the response
+            json_match = re.search(r'\{[\s\S]*\}', result)
+            if json_match:
+                json_str = json_match.group(0)
+                parsed_json = json.loads(json_str)
+                
+                # Validate against the schema
+                schema = self._generate_schema_from_properties(schema_properties)
+                
+                try:
+                    jsonschema.validate(instance=parsed_json, schema=schema)
+                    logger.info("Structured output validation successful")
+                    logger.debug(f"Validated JSON: {json.dumps(parsed_json)[:200]}...")
+                    return {
+                        "content": parsed_json,
+                        "schema_valid": True,
+                        "schema": schema
+                    }
+                except jsonschema.exceptions.ValidationError as e:
+                    logger.error(f"Structured output validation failed: {str(e)}")
+                    logger.debug(f"Invalid JSON: {json.dumps(parsed_json)[:200]}...")
+                    return {
+                        "content": parsed_json,
+                        "schema_valid": False,
+                        "validation_error": str(e),
+                        "schema": schema
+                    }
+            else:
+                logger.warning("Structured output requested but no JSON found in response")
+                logger.debug(f"Raw response (first 200 chars): {result[:200]}...")
+                return {
+                    "content": result,
+                    "schema_valid": False,
+                    "validation_error": "No JSON found in response",
+                    "raw_response": result
+                }
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON from LLM response: {str(e)}")
+            logger.debug(f"Invalid JSON content (first 200 chars): {result[:200]}...")
+            return {
+                "content": result,
+                "schema_valid": False,
+                "validation_error": f"Invalid JSON: {str(e)}",
+                "raw_response": result
+            }
+
+    @staticmethod
+    def ollama_options(settings=None):
+        """Generation options of an Ollama API request (``options`` field) for the given LLM settings."""
+        settings = settings or {}
+        options = {
+            'temperature': settings.get('temperature', 0.8),
+            'num_ctx': settings.get('numCtx', 2048)
+        }
+        for key, value in (settings.get('options') or {}).items():
+            if key in OLLAMA_OPTION_KEYS and value is not None:
+                options[key] = value
+        return options
 
     @log_execution_time(logger)
-    def generate(self, prompt, settings=None, conversation_history=None):
+    def generate(self, prompt, settings=None, conversation_history=None, on_token=None, cancel_event=None,
+                 timeout=None, on_usage=None, raw=False):
+        """Generate a completion; with streaming enabled, ``on_token`` is called with every chunk as it arrives.
+
+        Setting ``cancel_event`` stops the generation: before the request, or between
+        streamed chunks, in which case the stream is closed so Ollama stops generating.
+        ``timeout`` (seconds) overrides ``LLM_TIMEOUT_SECONDS`` for this request, and
+        ``on_usage`` receives the prompt and completion token counts reported by Ollama.
+        ``raw=True`` sends ``prompt`` as is, for prompts already assembled with ``compose_prompt``.
+        """
         # Generate a unique process ID for this LLM generation
         process_id = get_process_id()
         create_process_banner(logger, "LLM GENERATION STARTED", process_id)
@@ -86,50 +269,22 @@ class LLMService:
         use_mlock = options.get('use_mlock', None)
         num_thread = options.get('num_thread', None)
         
-        # Format conversation history into prompt
-        conversation_context = ""
-        if conversation_history:
-            # Get conversation history limits from settings
-            history_settings = settings.get('conversationHistory', {})
-            max_messages = history_settings.get('maxMessages', 10)  # Default to 10 messages
-            max_message_length = history_settings.get('maxMessageLength', 1000)  # Default to 1000 chars
-            include_history = history_settings.get('enabled', True)  # Default to enabled
-            
-            if not include_history:
-                logger.info("Conversation history disabled in settings")
-            else:
-                # Apply message count limit
-                limited_history = conversation_history[-max_messages:] if len(conversation_history) > max_messages else conversation_history
-                logger.info(f"DEBUG: Processing {len(limited_history)} of {len(conversation_history)} messages in conversation history (limit: {max_messages})")
-                
-                for idx, msg in enumerate(limited_history):
-                    role = msg.get('role', '')
-                    content = msg.get('content', '')
-                    timestamp = msg.get('timestamp', '')
-                    
-                    # Apply message length limit
-                    if content and len(content) > max_message_length:
-                        content = content[:max_message_length] + "..."
-                        
-                    logger.info(f"DEBUG: History message #{idx+1} - Role: {role}, Timestamp: {timestamp}, Content: {content[:100]}{'...' if len(content) > 100 else ''}")
-                    if role and content:
-                        conversation_context += f"{role}: {content}\n"
-                        
-                logger.info(f"DEBUG: Final conversation context length: {len(conversation_context)} characters")
-                logger.info(f"Using conversation history with limits: max_messages={max_messages}, max_message_length={max_message_length}")
-
         try:
-            # Create new cancellation event
-            self.cancel_event = threading.Event()
+            # Use the caller's cancellation event, or a new one
+            self.cancel_event = cancel_event or threading.Event()
             handler = self.CancellationHandler(self.cancel_event)
+            callbacks = [handler]
+            if on_usage:
+                callbacks.append(self.UsageHandler(on_usage))
 
             # Create Ollama client with all available parameters
             ollama_params = {
                 'base_url': base_url,
                 'model': model,
                 'temperature': temperature,
-                'timeout': self.timeout,
-                'callbacks': [handler]
+                # The client takes whole seconds; the cancel event enforces the exact limit between chunks
+                'timeout': math.ceil(timeout) if timeout else self.timeout,
+                'callbacks': callbacks
             }
             
             # Add additional parameters if they're provided
@@ -160,32 +315,8 @@ class LLMService:
             
             ollama = Ollama(**ollama_params)
 
-            # Prepare system prompt with structured output schema if enabled
-            modified_system_prompt = system_prompt
-            if use_structured_output and schema_properties:
-                # Generate JSON schema from properties
-                schema = self._generate_schema_from_properties(schema_properties)
-                
-                # Add structured output instructions to system prompt
-                schema_json = json.dumps(schema, indent=2)
-                structured_output_instructions = f"\n\nYou must respond in the following JSON format that matches this JSON schema:\n{schema_json}\n\nYour response must be valid JSON that conforms to this schema."
-                
-                if modified_system_prompt:
-                    modified_system_prompt += structured_output_instructions
-                else:
-                    modified_system_prompt = structured_output_instructions
-                    
-                logger.info(f"Using structured output schema with {len(schema['properties'])} properties")
-                logger.debug(f"Schema: {schema_json}")
-            
             # Combine system prompt, conversation history, and user prompt
-            if conversation_context:
-                full_prompt = f"{modified_system_prompt}\n\nConversation history:\n{conversation_context}\nCurrent message:\n{prompt}" if modified_system_prompt else f"Conversation history:\n{conversation_context}\nCurrent message:\n{prompt}"
-                logger.info(f"Using conversation history with {conversation_context.count('\n')} messages")
-                logger.info(f"DEBUG: Full prompt structure:\n1. System prompt: {len(modified_system_prompt) if modified_system_prompt else 0} chars\n2. Conversation history: {len(conversation_context)} chars\n3. Current message: {len(prompt)} chars")
-            else:
-                full_prompt = f"{modified_system_prompt}\n\n{prompt}" if modified_system_prompt else prompt
-                logger.info("No conversation history used in prompt")
+            full_prompt = prompt if raw else self.build_prompt(prompt, settings, conversation_history)
             
             # Prepare invoke parameters
             invoke_params = {
@@ -207,73 +338,40 @@ class LLMService:
             
             logger.info(f"Sending request to Ollama model {model}")
             start_time = time.time()
-            response = ollama.invoke(**invoke_params)
             
             if streaming:
                 result = ""
                 chunk_count = 0
-                for chunk in response:
+                first_chunk_time = None
+                stream_params = {key: value for key, value in invoke_params.items() if key != 'stream'}
+                stream = ollama.stream(**stream_params)
+                for chunk in stream:
+                    if handler.cancel_event.is_set():
+                        # Closing the generator closes the HTTP response, which aborts the generation
+                        stream.close()
+                        raise WorkflowCancelledError("LLM request was cancelled")
                     chunk_count += 1
-                    if isinstance(chunk, str):
-                        result += chunk
-                    elif hasattr(chunk, 'text'):
-                        result += chunk.text
-                logger.info(f"Received {chunk_count} streaming chunks from LLM")
+                    text = chunk if isinstance(chunk, str) else getattr(chunk, 'text', '')
+                    if not text:
+                        continue
+                    if first_chunk_time is None:
+                        first_chunk_time = time.time() - start_time
+                    result += text
+                    if on_token:
+                        on_token(text)
+                if first_chunk_time is not None:
+                    logger.info(f"Received {chunk_count} streaming chunks from LLM, first after {first_chunk_time:.2f}s")
+                else:
+                    logger.info(f"Received {chunk_count} streaming chunks from LLM")
             else:
-                result = response
+                result = ollama.invoke(**invoke_params)
                 
             completion_time = time.time() - start_time
             logger.info(f"LLM response received in {completion_time:.2f}s, length: {len(str(result))} chars")
 
             # Process the result if structured output is enabled
             if use_structured_output and schema_properties:
-                # Try to extract JSON from the response
-                try:
-                    # Look for JSON pattern in the response
-                    json_match = re.search(r'\{[\s\S]*\}', result)
-                    if json_match:
-                        json_str = json_match.group(0)
-                        parsed_json = json.loads(json_str)
-                        
-                        # Validate against the schema
-                        schema = self._generate_schema_from_properties(schema_properties)
-                        
-                        try:
-                            jsonschema.validate(instance=parsed_json, schema=schema)
-                            logger.info("Structured output validation successful")
-                            logger.debug(f"Validated JSON: {json.dumps(parsed_json)[:200]}...")
-                            return {
-                                "content": parsed_json,
-                                "schema_valid": True,
-                                "schema": schema
-                            }
-                        except jsonschema.exceptions.ValidationError as e:
-                            logger.error(f"Structured output validation failed: {str(e)}")
-                            logger.debug(f"Invalid JSON: {json.dumps(parsed_json)[:200]}...")
-                            return {
-                                "content": parsed_json,
-                                "schema_valid": False,
-                                "validation_error": str(e),
-                                "schema": schema
-                            }
-                    else:
-                        logger.warning("Structured output requested but no JSON found in response")
-                        logger.debug(f"Raw response (first 200 chars): {result[:200]}...")
-                        return {
-                            "content": result,
-                            "schema_valid": False,
-                            "validation_error": "No JSON found in response",
-                            "raw_response": result
-                        }
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse JSON from LLM response: {str(e)}")
-                    logger.debug(f"Invalid JSON content (first 200 chars): {result[:200]}...")
-                    return {
-                        "content": result,
-                        "schema_valid": False,
-                        "validation_error": f"Invalid JSON: {str(e)}",
-                        "raw_response": result
-                    }
+                return self.parse_structured_output(result, schema_properties)
             
             # Create completion banner with Windows compatibility
             if ANSI_ENABLED:
@@ -287,6 +385,9 @@ class LLMService:
             
             return result
 
+        except WorkflowCancelledError:
+            logger.info(f"LLM request was cancelled for process {process_id}")
+            raise
         except Exception as e:
             if str(e) == "LLM request was cancelled":
                 logger.info(f"LLM request was cancelled for process {process_id}")
@@ -306,7 +407,8 @@ class LLMService:
             self.abort_controller = None
         
     @log_execution_time(logger)
-    def generate_multimodal(self, prompt, image_paths=None, settings=None, conversation_history=None):
+    def generate_multimodal(self, prompt, image_paths=None, settings=None, conversation_history=None, cancel_event=None,
+                            timeout=None, on_usage=None):
         """Generate text using a multimodal model with text and images
         
         Args:
@@ -314,6 +416,9 @@ class LLMService:
             image_paths (list): List of paths to image files to include
             settings (dict): Dictionary of settings for the LLM
             conversation_history (list): List of previous conversation messages
+            cancel_event (threading.Event): Checked before the request is sent
+            timeout (float): Request timeout in seconds, instead of LLM_TIMEOUT_SECONDS
+            on_usage (callable): Receives the prompt and completion token counts
             
         Returns:
             str or dict: The generated text or structured output
@@ -565,8 +670,12 @@ class LLMService:
             
             start_time = time.time()
             
+            if cancel_event is not None and cancel_event.is_set():
+                raise WorkflowCancelledError("LLM request was cancelled")
+            request_timeout = timeout or self.timeout
+            
             try:
-                response = requests.post(api_url, json=payload, timeout=self.timeout)
+                response = requests.post(api_url, json=payload, timeout=request_timeout)
                 
                 # Handle different error status codes
                 if response.status_code != 200:
@@ -602,8 +711,8 @@ class LLMService:
                 raise RuntimeError(f"Could not connect to Ollama at {api_url}. Make sure Ollama is running and accessible.")
                 
             except requests.exceptions.Timeout:
-                logger.error(f"Timeout after {self.timeout}s when connecting to {api_url}")
-                raise RuntimeError(f"Request to Ollama timed out after {self.timeout} seconds. The model may be too slow or the server overloaded.")
+                logger.error(f"Timeout after {request_timeout}s when connecting to {api_url}")
+                raise RuntimeError(f"Request to Ollama timed out after {request_timeout} seconds. The model may be too slow or the server overloaded.")
                 
             except requests.exceptions.RequestException as e:
                 logger.error(f"Request error when connecting to {api_url}: {str(e)}")
@@ -613,6 +722,9 @@ class LLMService:
             
             result_json = response.json()
             completion_time = time.time() - start_time
+            usage = ollama_usage(result_json)
+            if on_usage and usage:
+                on_usage(usage)
             
             # Extract result from response
             if "message" in result_json:
@@ -639,6 +751,9 @@ class LLMService:
             
             return result
             
+        except WorkflowCancelledError:
+            logger.info(f"LLM request was cancelled for process {process_id}")
+            raise
         except Exception as e:
             if str(e) == "LLM request was cancelled":
                 logger.info(f"LLM request was cancelled for process {process_id}")
@@ -0,0 +1,150 @@
+"""
+Opt-in memoisation of node results.
+
+A node with ``cacheEnabled`` in its settings (``cacheTtl`` seconds, default
+``WORKFLOW_NODE_CACHE_TTL``) has its result stored under a key derived from
+the node type, its settings with ``{{node.var}}`` references resolved and
+the inputs it reads (previous node result, workflow input and, for nodes
+that use it, the conversation history). A later run with the same key gets
+the stored result without executing the node.
+
+Only node types without side effects can be cached: LLM, knowledge,
+classifier and HTTP GET/HEAD requests. Sub-workflow nodes can be cached as
+well when their callee is free of side effects. Keys include the version of
+the workflow (and of a sub-workflow node's callee), so saving a workflow
+starts a new set of entries. Results are kept in a bounded LRU per process.
+
+Both workflow engines look results up with ``lookup_node_result``.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from .template_engine import render_template, MISSING_KEEP
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('node_cache')
+
+CACHEABLE_NODE_TYPES = ('llm', 'knowledge', 'classifier', 'http_request', 'subworkflow')
+CACHEABLE_HTTP_METHODS = ('GET', 'HEAD')
+
+# Node data that does not change what a node computes
+IGNORED_NODE_DATA = ('label', 'cacheEnabled', 'cacheTtl')
+
+
+class NodeResultCache:
+    """Thread-safe LRU of node results with a per-entry TTL."""
+
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """Return ``(True, value)`` for a live entry, ``(False, None)`` otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, copy.deepcopy(entry[1])
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
+
+
+node_cache = NodeResultCache(max_size=int(os.getenv('WORKFLOW_NODE_CACHE_SIZE', '1024')))
+DEFAULT_TTL = float(os.getenv('WORKFLOW_NODE_CACHE_TTL', '300'))
+
+
+def node_cache_ttl(node_type: str, node_data: dict) -> Optional[float]:
+    """TTL of a node's cached results, or None if the node is not cached."""
+    settings = node_data.get('settings') or {}
+    # HTTP request nodes keep their options at the top level of the node data
+    enabled = settings.get('cacheEnabled', node_data.get('cacheEnabled', False))
+    if not enabled:
+        return None
+    if node_type not in CACHEABLE_NODE_TYPES:
+        logger.warning(f"Caching is not supported for {node_type} nodes; executing without cache")
+        return None
+    if node_type == 'http_request' and str(node_data.get('method', 'GET')).upper() not in CACHEABLE_HTTP_METHODS:
+        logger.warning(f"Caching is only supported for {'/'.join(CACHEABLE_HTTP_METHODS)} requests; executing without cache")
+        return None
+    ttl = settings.get('cacheTtl', node_data.get('cacheTtl'))
+    try:
+        ttl = float(ttl) if ttl is not None else DEFAULT_TTL
+    except (TypeError, ValueError):
+        ttl = DEFAULT_TTL
+    return ttl if ttl > 0 else None
+
+
+def _resolve(value, context: dict):
+    """Settings with their variable references replaced by the values of this run."""
+    if isinstance(value, str):
+        return render_template(value, context, MISSING_KEEP)
+    if isinstance(value, dict):
+        return {k: _resolve(v, context) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v, context) for v in value]
+    return value
+
+
+def build_cache_key(node_type: str, node_data: dict, context: dict, input_data, plan, callee_plan=None) -> str:
+    """sha256 of the workflow version, node type, resolved settings and the inputs the node reads.
+
+    ``callee_plan`` is the plan of the workflow a sub-workflow node calls.
+    """
+    settings = {k: v for k, v in node_data.items() if k not in IGNORED_NODE_DATA}
+    inputs = {'input': context.get('input', ''), 'previous': input_data}
+
+    uses_memory = node_type in ('llm', 'subworkflow') or (
+        node_type == 'classifier' and (node_data.get('settings') or {}).get('memoryEnabled', False))
+    memory = context.get('memory')
+    if uses_memory and memory is not None:
+        inputs['history'] = [(m.get('role'), m.get('content')) for m in memory.messages]
+    if node_type == 'llm' and (node_data.get('settings') or {}).get('enableMultimodal', False):
+        run_files = context.get('run_files')
+        inputs['images'] = list(run_files.image_paths) if run_files else []
+    if node_type == 'subworkflow':
+        # The callee's nodes may read anything the run has
+        inputs['version'] = callee_plan.updated_at if callee_plan is not None else None
+        inputs['files'] = [(f.get('path'), f.get('size')) for f in context.get('files') or []]
+
+    payload = json.dumps({'workflow': [plan.workflow_uuid, plan.updated_at], 'type': node_type,
+                          'settings': _resolve(settings, context), 'inputs': inputs},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def lookup_node_result(node_type: str, node_data: dict, context: dict, input_data, plan,
+                       callee_plan=None) -> Tuple[Optional[str], Optional[float], bool, Any]:
+    """``(key, ttl, hit, result)`` of a node attempt; key and ttl are None when the node is not cached."""
+    ttl = node_cache_ttl(node_type, node_data)
+    if ttl is None:
+        return None, None, False, None
+    key = build_cache_key(node_type, node_data, context, input_data, plan, callee_plan)
+    hit, result = node_cache.get(key)
+    return key, ttl, hit, result
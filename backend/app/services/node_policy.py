@@ -0,0 +1,126 @@
+"""
+Execution policies of workflow nodes: timeout, retries and fallback.
+
+Options are read from a node's settings (or, for HTTP request nodes, the
+top level of the node data):
+
+- ``timeout``: seconds one attempt may take (``WORKFLOW_NODE_TIMEOUT_SECONDS``
+  by default, 0 = no limit)
+- ``retries``: attempts after the first one when the node fails or times out
+- ``retryBackoff``: base delay in seconds, doubled per retry with +/-50% jitter
+- ``fallbackValue``: result used when every attempt failed
+- ``fallbackBranch``: class name (classifier) or branch (ifelse: 'if', 'elif-<n>',
+  'else') taken when every attempt failed
+
+An attempt runs under a ``CancelScope`` that trips at the attempt's timeout,
+at the workflow deadline or when the run is cancelled, whichever comes
+first; node services check it like the run's cancel event.
+"""
+import os
+import random
+import threading
+import time
+from typing import Any, NamedTuple, Optional
+
+DEFAULT_NODE_TIMEOUT = float(os.getenv('WORKFLOW_NODE_TIMEOUT_SECONDS', '0'))
+DEFAULT_RETRY_BACKOFF = 0.5
+MAX_RETRIES = 10
+MAX_RETRY_DELAY = 30.0
+
+_MISSING = object()
+
+
+def node_option(node_data: dict, key: str, default=None):
+    """A node option from its settings, falling back to the top level of the node data."""
+    settings = node_data.get('settings') or {}
+    if key in settings:
+        return settings[key]
+    return node_data.get(key, default)
+
+
+def _number(value, default):
+    try:
+        return float(value) if value is not None and value != '' else default
+    except (TypeError, ValueError):
+        return default
+
+
+class NodePolicy(NamedTuple):
+    timeout: Optional[float]
+    retries: int
+    backoff: float
+    fallback: Any
+
+    @classmethod
+    def for_node(cls, node_type: str, node_data: dict) -> 'NodePolicy':
+        timeout = _number(node_option(node_data, 'timeout'), DEFAULT_NODE_TIMEOUT)
+        retries = int(_number(node_option(node_data, 'retries'), 0))
+        backoff = _number(node_option(node_data, 'retryBackoff'), DEFAULT_RETRY_BACKOFF)
+
+        fallback = _MISSING
+        branch = node_option(node_data, 'fallbackBranch')
+        if branch is not None and node_type == 'classifier':
+            fallback = {'class_name': branch, 'usage': {}}
+        elif branch is not None and node_type == 'ifelse':
+            fallback = {'branch_taken': branch, 'condition_result': branch != 'else', 'reason': 'Fallback branch'}
+        elif 'fallbackValue' in (node_data.get('settings') or {}) or 'fallbackValue' in node_data:
+            fallback = node_option(node_data, 'fallbackValue')
+
+        return cls(
+            timeout=timeout if timeout > 0 else None,
+            retries=max(0, min(retries, MAX_RETRIES)),
+            backoff=max(0.0, backoff),
+            fallback=fallback
+        )
+
+    @property
+    def has_fallback(self) -> bool:
+        return self.fallback is not _MISSING
+
+    @property
+    def is_default(self) -> bool:
+        return self.timeout is None and not self.retries and not self.has_fallback
+
+    def retry_delay(self, retry: int) -> float:
+        """Delay before retry number ``retry`` (1-based): exponential backoff with jitter."""
+        delay = self.backoff * (2 ** (retry - 1))
+        return min(MAX_RETRY_DELAY, delay * random.uniform(0.5, 1.5))
+
+
+class CancelScope:
+    """
+    Cancel token of one node attempt, with the interface of ``threading.Event``.
+
+    Set when the run's cancel event is set, when ``deadline`` (epoch seconds)
+    has passed, or when ``set()`` is called.
+    """
+
+    def __init__(self, parent: threading.Event, deadline: Optional[float] = None):
+        self.parent = parent
+        self.deadline = deadline
+        self._event = threading.Event()
+
+    @property
+    def timed_out(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline and not self.parent.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.time())
+
+    def is_set(self) -> bool:
+        return self.parent.is_set() or self._event.is_set() or (
+            self.deadline is not None and time.time() >= self.deadline)
+
+    def set(self) -> None:
+        self._event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        remaining = self.remaining()
+        if remaining is not None:
+            timeout = remaining if timeout is None else min(timeout, remaining)
+        if not self.is_set():
+            self.parent.wait(timeout)
+        return self.is_set()
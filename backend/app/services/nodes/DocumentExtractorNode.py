@@ -23,16 +23,24 @@ from docx.text.paragraph import Paragraph
 
 from pathlib import Path
 from app.utils.logging_utils import setup_logger
-from app.utils.exc import DocumentExtractorError, FileDownloadError, TextExtractionError, UnsupportedFileTypeError
+from app.utils.exc import DocumentExtractorError, FileDownloadError, TextExtractionError, UnsupportedFileTypeError, WorkflowCancelledError
 from app.config import Config as config
 # Configure logger
 logger = setup_logger('DocumentExtractorNode')
 class DocumentExtractorNode:
 
-    def __init__(self, node_id, node_data, context):
+    def __init__(self, node_id, node_data, context, cancel_event=None):
         self.node_id = node_id
         self.node_data = node_data
         self.context = context
+        # Cancel token of this attempt (defaults to the run's), checked between files and PDF pages
+        self.cancel_event = cancel_event
+        if cancel_event is None and context.get('execution') is not None:
+            self.cancel_event = context['execution'].cancel_event
+
+    def _check_cancelled(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise WorkflowCancelledError(f"Document extraction of node {self.node_id} was cancelled")
 
     def execute(self):
         try:
@@ -49,6 +57,7 @@ class DocumentExtractorNode:
 
             files = []
             for file in self.context.get('files', []):
+                self._check_cancelled()
                 if not file.get('path') or not os.path.exists(file['path']):
                     error_msg = f"File not found: {file.get('path')}"
                     logger.error(error_msg)
@@ -99,13 +108,16 @@ class DocumentExtractorNode:
             result = []
             result_text = ""
             for file in files:
+                self._check_cancelled()
                 try:
-                    extracted_text = _extract_text_from_file(file)
+                    extracted_text = _extract_text_from_file(file, self.cancel_event)
                     result.append({
                         'file_name': file.name,
                         'status': 'success'
                     })
                     result_text += extracted_text
+                except WorkflowCancelledError:
+                    raise
                 except Exception as e:
                     result.append({
                         'file_name': file.name,
@@ -123,6 +135,8 @@ class DocumentExtractorNode:
                 'text': result_text
             }
 
+        except WorkflowCancelledError:
+            raise
         except Exception as e:
             error_msg = f"Error processing files: {str(e)}"
             logger.error(error_msg, exc_info=True)
@@ -136,13 +150,13 @@ class DocumentExtractorNode:
             }
 
 
-def _extract_text_by_mime_type(*, file_content: bytes, mime_type: str) -> str:
+def _extract_text_by_mime_type(*, file_content: bytes, mime_type: str, cancel_event=None) -> str:
     """Extract text from a file based on its MIME type."""
     match mime_type:
         case "text/plain" | "text/html" | "text/htm" | "text/markdown" | "text/xml":
             return _extract_text_from_plain_text(file_content)
         case "application/pdf":
-            return _extract_text_from_pdf(file_content)
+            return _extract_text_from_pdf(file_content, cancel_event)
         case "application/msword":
             return _extract_text_from_doc(file_content)
         case "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
@@ -173,7 +187,7 @@ def _extract_text_by_mime_type(*, file_content: bytes, mime_type: str) -> str:
             raise UnsupportedFileTypeError(f"Unsupported MIME type: {mime_type}")
 
 
-def _extract_text_by_file_extension(*, file_content: bytes, file_extension: str) -> str:
+def _extract_text_by_file_extension(*, file_content: bytes, file_extension: str, cancel_event=None) -> str:
     """Extract text from a file based on its file extension."""
     match file_extension:
         case (
@@ -233,7 +247,7 @@ def _extract_text_by_file_extension(*, file_content: bytes, file_extension: str)
         case ".yaml" | ".yml":
             return _extract_text_from_yaml(file_content)
         case ".pdf":
-            return _extract_text_from_pdf(file_content)
+            return _extract_text_from_pdf(file_content, cancel_event)
         case ".doc":
             return _extract_text_from_doc(file_content)
         case ".docx":
@@ -320,17 +334,21 @@ def _extract_text_from_yaml(file_content: bytes) -> str:
             raise TextExtractionError(f"Failed to decode or parse YAML file: {e}") from e
 
 
-def _extract_text_from_pdf(file_content: bytes) -> str:
+def _extract_text_from_pdf(file_content: bytes, cancel_event=None) -> str:
     try:
         pdf_file = io.BytesIO(file_content)
         pdf_document = pypdfium2.PdfDocument(pdf_file, autoclose=True)
         text = ""
         for page in pdf_document:
+            if cancel_event is not None and cancel_event.is_set():
+                raise WorkflowCancelledError("PDF text extraction was cancelled")
             text_page = page.get_textpage()
             text += text_page.get_text_range()
             text_page.close()
             page.close()
         return text
+    except WorkflowCancelledError:
+        raise
     except Exception as e:
         raise TextExtractionError(f"Failed to extract text from PDF: {str(e)}") from e
 
@@ -438,11 +456,13 @@ class FileProperties:
         self.file_byte = file_byte
 
 
-def _extract_text_from_file(file: FileProperties):
+def _extract_text_from_file(file: FileProperties, cancel_event=None):
     if file.extension:
-        extracted_text = _extract_text_by_file_extension(file_content=file.file_byte, file_extension=file.extension)
+        extracted_text = _extract_text_by_file_extension(file_content=file.file_byte, file_extension=file.extension,
+                                                         cancel_event=cancel_event)
     elif file.mime_type:
-        extracted_text = _extract_text_by_mime_type(file_content=file.file_byte, mime_type=file.mime_type)
+        extracted_text = _extract_text_by_mime_type(file_content=file.file_byte, mime_type=file.mime_type,
+                                                    cancel_event=cancel_event)
     else:
         raise Exception("Unable to determine file type: MIME type or file extension is missing")
     return extracted_text
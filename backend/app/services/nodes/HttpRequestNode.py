@@ -6,12 +6,19 @@ import requests
 import json
 import os
 from pathlib import Path
+from app.utils.exc import WorkflowCancelledError
+from app.services.template_engine import render_template, MISSING_KEEP
 from app.utils.logging_utils import setup_logger
 
 # Configure logger
 logger = setup_logger('Http_Request_Node_Execution')
+
+# Bytes read at a time from the response body, between cancellation checks
+RESPONSE_CHUNK_SIZE = 64 * 1024
+# Seconds to wait for the connection and for each read, unless the node's policy sets a timeout
+DEFAULT_TIMEOUT = float(os.getenv('HTTP_REQUEST_TIMEOUT_SECONDS', '30'))
 class HttpRequestNode:
-    def __init__(self, node_id, node_data, context):
+    def __init__(self, node_id, node_data, context, cancel_event=None, timeout=None):
         self.node_id = node_id
         self.node_data = node_data
         self.url = node_data.get('url', '')
@@ -21,39 +28,49 @@ class HttpRequestNode:
         self.bodyType = node_data.get('bodyType', '')
         self.bodyData = node_data.get('bodyData', '')
         self.context = context
+        # Cancel token of this attempt (defaults to the run's) and its remaining time
+        self.cancel_event = cancel_event
+        self.timeout = timeout or DEFAULT_TIMEOUT
 
-    def execute(self):
+    def _request(self, method, url, **kwargs):
+        """requests.request that reads the response body in chunks, stopping once the run is cancelled or timed out"""
+        cancel_event = self.cancel_event
+        if cancel_event is None and self.context.get('execution') is not None:
+            cancel_event = self.context['execution'].cancel_event
+        if cancel_event is not None and cancel_event.is_set():
+            raise WorkflowCancelledError(f"HTTP request of node {self.node_id} was cancelled")
+        
+        response = requests.request(method, url, stream=True, timeout=self.timeout, **kwargs)
+        try:
+            chunks = []
+            for chunk in response.iter_content(chunk_size=RESPONSE_CHUNK_SIZE):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise WorkflowCancelledError(f"HTTP request of node {self.node_id} was cancelled")
+                chunks.append(chunk)
+            # Keep the body on the response, so .text and .json() work as without streaming
+            response._content = b''.join(chunks)
+        finally:
+            response.close()
+        return response
+
+    def _replace_variables(self, text):
+        """Render ``{{node.var}}`` references in text; unresolved references are kept as is"""
+        return render_template(text, self.context, MISSING_KEEP)
+
+    @property
+    def is_json_content_type(self):
+        #check is there json application in header
+        isJsonContentType = False
+        for header in self.node_data.get('headers', []):
+            if header['key'] == 'Content-Type' and header['value'] == 'application/json':
+                isJsonContentType = True
+        return isJsonContentType
+
+    def _url_headers_params(self):
+        """URL, headers dict and query string of the request, with variables replaced"""
         #Get URL
         url = self.node_data.get('url', '')
-        
-        # Helper function to replace variables in text
-        import re
-        def replace_variables(text):
-            if not text or not isinstance(text, str):
-                return text
-                
-            def replace_var(match):
-                var_ref = match.group(1).strip()
-                try:
-                    node_id, var_name = var_ref.split('.')
-                    
-                    # Find the referenced node in process steps
-                    for step in self.context.get('process_steps', []):
-                        if step['node'] == node_id:
-                            # Handle input/output variables
-                            if var_name in ['input', 'output']:
-                                value = step.get(var_name)
-                                if value is not None:
-                                    logger.info(f"Found variable {node_id}.{var_name} = {str(value)[:50]}...")
-                                    return str(value)
-                except Exception as e:
-                    logger.error(f"Error replacing variable {var_ref}: {str(e)}")
-                    
-                logger.info(f"Variable {var_ref} not found or invalid")
-                return f"{{{{{var_ref}}}}}"
-            
-            # Replace all variable references
-            return re.sub(r'\{\{\s*([^}]+?)\s*\}\}', replace_var, text)
+        replace_variables = self._replace_variables
         
         # Replace variables in URL
         if '{{' in url:
@@ -61,9 +78,6 @@ class HttpRequestNode:
             url = replace_variables(url)
             logger.info(f"URL after variable replacement: {url}")
         
-        #Get Method
-        method = self.node_data.get('method', 'GET')
-        
         #Get Headers
         headers = self.node_data.get('headers', [])
         
@@ -83,12 +97,6 @@ class HttpRequestNode:
                 
                 headersURL[key] = value
 
-        #check is there json application in header
-        isJsonContentType = False
-        for header in headers:
-            if header['key'] == 'Content-Type' and header['value'] == 'application/json':
-                isJsonContentType = True
-
         #check if is params empty then construct params from [{"key1", "value1"}, {"key2", "value2"}, ...] to "key1=value1&key2=value2"
         params = self.node_data.get('params', [])
         paramsURL = None
@@ -108,147 +116,163 @@ class HttpRequestNode:
                 processed_params.append(f"{key}={value}")
             
             paramsURL = '&'.join(processed_params)
+        return url, headersURL, paramsURL
 
-        #Get Body
-        bodyType = self.node_data.get('bodyType', '')
-        bodyData = None
+    def build_request(self):
+        """
+        Method, URL and keyword arguments (headers, params, data or json) of the request.
 
-        response = None
-
-        try:
-            
-            match bodyType:
-                case 'raw':
-                    bodyData = self.node_data.get('bodyData', '')
-                    # Replace variables in raw body data
-                    if isinstance(bodyData, str) and '{{' in bodyData:
-                        logger.info(f"Raw body before variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
-                        bodyData = replace_variables(bodyData)
-                        logger.info(f"Raw body after variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
-                    response = requests.request(method, url, headers=headersURL, params=paramsURL, data=bodyData)
-                case 'form-data':
-                    # Initialize files dictionary for file uploads
-                    files = []
-                    form_data = {}
-                    
-                    # Process each body item
-                    for body in self.node_data.get('bodyData', []):
-                        if body['type'] == 'text':
-                            form_data[body['key']] = body['value']
-                        else:
-                            # Handle file uploads
-                            if self.context.get('files'):
-                                for file in self.context.get('files'):
-                                    if file.get('path') and os.path.exists(file['path']):
-                                        file_path = file['path']
-                                        file_name = Path(file_path).name
-                                        # Use a tuple with (filename, fileobj, content_type)
-                                        logger.info(f"Adding file: {file_name}, key : {body['key']}")
-                                        files.append((body['key'], (
-                                            file_name, 
-                                            open(file_path, 'rb'),
-                                            file.get('mime_type')  # or get the actual content type
-                                        )))
-                                        logger.info(f"Preparing to upload file: {file_name}")
-                    
-                    try:
-                        # Make the request with both form data and files
-                        if files:
-                            logger.info("Sending request with files and form data")
-                            # When using files, requests will set the Content-Type to multipart/form-data
-                            response = requests.request(
-                                method, 
-                                url, 
-                                headers=headersURL, 
-                                params=paramsURL,
-                                data=form_data,  # Regular form fields
-                                files=files      # Files to upload
-                            )
-                        else:
-                            # If no files, just send form data as x-www-form-urlencoded
-                            logger.info("Sending request with form data only")
-                            headers = headersURL or {}
-                            if 'Content-Type' not in headers:
-                                headers['Content-Type'] = 'application/x-www-form-urlencoded'
-                                
-                            response = requests.request(
-                                method, 
-                                url, 
-                                headers=headers, 
-                                params=paramsURL,
-                                data=form_data
-                            )
-                            
-                    except Exception as e:
-                        logger.error(f"Error making request: {str(e)}")
-                        raise
-                    finally:
-                        # Close all file handles
-                        for file_list in files:
-                            if isinstance(file_list, tuple) and len(file_list) > 1:
-                                file_obj = file_list[1]
-                                if hasattr(file_obj, 'close'):
-                                    file_obj.close()
-
-                case 'x-www-form-urlencoded':
-                    if self.node_data.get('bodyData', []):
-                        # Create a dictionary with form data, replacing variables in values
-                        bodyData = {}
-                        for form in self.node_data.get('bodyData', []):
-                            key = form['key']
-                            value = form['value']
-                            
-                            # Replace variables in value if needed
-                            if isinstance(value, str) and '{{' in value:
-                                logger.info(f"Form value before variable replacement for key '{key}': {value[:100]}{'...' if len(value) > 100 else ''}")
-                                value = replace_variables(value)
-                                logger.info(f"Form value after variable replacement for key '{key}': {value[:100]}{'...' if len(value) > 100 else ''}")
-                            
-                            bodyData[key] = value
-
-                    response = requests.request(method, url, headers=headersURL, params=paramsURL, data=bodyData)
-                case 'binary':
-                    #TO DO
-                    bodyContent = self.node_data.get('bodyData', '')
-                    response = requests.request(method, url, headers=headersURL, params=paramsURL, data=bodyContent)
-                case 'json':
-                    bodyData = self.node_data.get('bodyData', '{}')
-                    # Replace variables in JSON body data
-                    if isinstance(bodyData, str) and '{{' in bodyData:
-                        logger.info(f"JSON body before variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
-                        bodyData = replace_variables(bodyData)
-                        logger.info(f"JSON body after variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
-                    
-                    # Parse the JSON string to a Python object
-                    try:
-                        json_data = json.loads(bodyData)
-                        response = requests.request(method, url, headers=headersURL, params=paramsURL, json=json_data)
-                    except json.JSONDecodeError as e:
-                        logger.error(f"Invalid JSON format: {str(e)}")
-                        # Fall back to sending as raw data if JSON parsing fails
-                        response = requests.request(method, url, headers=headersURL, params=paramsURL, data=bodyData)
-                case 'none':
-                    
-                    response = requests.request(method, url, headers=headersURL, params=paramsURL)
+        Covers every body type but form-data, whose file uploads ``execute`` opens itself.
+        """
+        method = self.node_data.get('method', 'GET')
+        url, headersURL, paramsURL = self._url_headers_params()
+        kwargs = {'headers': headersURL, 'params': paramsURL}
+        replace_variables = self._replace_variables
 
-                case _:
-                    bodyContent = ""
-                    response = requests.request(method, url, headers=headersURL, params=paramsURL)
-        except Exception as e:
-            logger.error(f"Failed to execute HTTP Request node {self.node_id}: {str(e)}")
-            raise e
+        #Get Body
+        bodyType = self.node_data.get('bodyType', '')
+        match bodyType:
+            case 'raw':
+                bodyData = self.node_data.get('bodyData', '')
+                # Replace variables in raw body data
+                if isinstance(bodyData, str) and '{{' in bodyData:
+                    logger.info(f"Raw body before variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
+                    bodyData = replace_variables(bodyData)
+                    logger.info(f"Raw body after variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
+                kwargs['data'] = bodyData
+            case 'x-www-form-urlencoded':
+                bodyData = None
+                if self.node_data.get('bodyData', []):
+                    # Create a dictionary with form data, replacing variables in values
+                    bodyData = {}
+                    for form in self.node_data.get('bodyData', []):
+                        key = form['key']
+                        value = form['value']
+                        
+                        # Replace variables in value if needed
+                        if isinstance(value, str) and '{{' in value:
+                            logger.info(f"Form value before variable replacement for key '{key}': {value[:100]}{'...' if len(value) > 100 else ''}")
+                            value = replace_variables(value)
+                            logger.info(f"Form value after variable replacement for key '{key}': {value[:100]}{'...' if len(value) > 100 else ''}")
+                        
+                        bodyData[key] = value
+                kwargs['data'] = bodyData
+            case 'binary':
+                #TO DO
+                kwargs['data'] = self.node_data.get('bodyData', '')
+            case 'json':
+                bodyData = self.node_data.get('bodyData', '{}')
+                # Replace variables in JSON body data
+                if isinstance(bodyData, str) and '{{' in bodyData:
+                    logger.info(f"JSON body before variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
+                    bodyData = replace_variables(bodyData)
+                    logger.info(f"JSON body after variable replacement: {bodyData[:100]}{'...' if len(bodyData) > 100 else ''}")
+                
+                # Parse the JSON string to a Python object
+                try:
+                    kwargs['json'] = json.loads(bodyData)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Invalid JSON format: {str(e)}")
+                    # Fall back to sending as raw data if JSON parsing fails
+                    kwargs['data'] = bodyData
+            case _:
+                pass
+        return method, url, kwargs
 
+    def build_result(self, status_code, text, headers):
+        """Node result of a response: the body text on errors, else status, parsed body and headers"""
         result = None
-        if response.status_code != requests.codes.ok and response.status_code != requests.codes.created :
-            result = response.text
+        if status_code != requests.codes.ok and status_code != requests.codes.created :
+            result = text
         else:
             result = {
-                    "status": response.status_code,
-                    "body": response.json(),
-                    "headers": str(response.headers),
+                    "status": status_code,
+                    "body": json.loads(text),
+                    "headers": str(dict(headers.items())),
                     "files": []
                 }
             
-            if not isJsonContentType:
+            if not self.is_json_content_type:
                 result = str(result)
         return result
+
+    def _send_form_data(self):
+        method = self.node_data.get('method', 'GET')
+        url, headersURL, paramsURL = self._url_headers_params()
+        # Initialize files dictionary for file uploads
+        files = []
+        form_data = {}
+        
+        # Process each body item
+        for body in self.node_data.get('bodyData', []):
+            if body['type'] == 'text':
+                form_data[body['key']] = body['value']
+            else:
+                # Handle file uploads
+                if self.context.get('files'):
+                    for file in self.context.get('files'):
+                        if file.get('path') and os.path.exists(file['path']):
+                            file_path = file['path']
+                            file_name = Path(file_path).name
+                            # Use a tuple with (filename, fileobj, content_type)
+                            logger.info(f"Adding file: {file_name}, key : {body['key']}")
+                            files.append((body['key'], (
+                                file_name, 
+                                open(file_path, 'rb'),
+                                file.get('mime_type')  # or get the actual content type
+                            )))
+                            logger.info(f"Preparing to upload file: {file_name}")
+        
+        try:
+            # Make the request with both form data and files
+            if files:
+                logger.info("Sending request with files and form data")
+                # When using files, requests will set the Content-Type to multipart/form-data
+                return self._request(
+                    method, 
+                    url, 
+                    headers=headersURL, 
+                    params=paramsURL,
+                    data=form_data,  # Regular form fields
+                    files=files      # Files to upload
+                )
+            else:
+                # If no files, just send form data as x-www-form-urlencoded
+                logger.info("Sending request with form data only")
+                headers = headersURL or {}
+                if 'Content-Type' not in headers:
+                    headers['Content-Type'] = 'application/x-www-form-urlencoded'
+                    
+                return self._request(
+                    method, 
+                    url, 
+                    headers=headers, 
+                    params=paramsURL,
+                    data=form_data
+                )
+                
+        except Exception as e:
+            logger.error(f"Error making request: {str(e)}")
+            raise
+        finally:
+            # Close all file handles
+            for file_list in files:
+                if isinstance(file_list, tuple) and len(file_list) > 1:
+                    file_obj = file_list[1]
+                    if hasattr(file_obj, 'close'):
+                        file_obj.close()
+
+    def execute(self):
+        response = None
+
+        try:
+            if self.node_data.get('bodyType', '') == 'form-data':
+                response = self._send_form_data()
+            else:
+                method, url, kwargs = self.build_request()
+                response = self._request(method, url, **kwargs)
+        except Exception as e:
+            logger.error(f"Failed to execute HTTP Request node {self.node_id}: {str(e)}")
+            raise e
+
+        return self.build_result(response.status_code, response.text, response.headers)
@@ -0,0 +1,126 @@
+"""
+Files uploaded with a workflow run, inspected only when a node needs them.
+
+Creating a ``RunFiles`` does no I/O. The files are sorted into images and
+text files the first time a node asks for the images (multimodal LLM nodes)
+or for the text content (``{{start-xxx.file_content}}``). The first text
+file is then read in chunks, up to ``WORKFLOW_FILE_CONTENT_MAX_CHARS``
+(0 = no limit). Both results are kept for the rest of the run, so parallel
+nodes share one read.
+"""
+import mimetypes
+import os
+import threading
+from typing import List, Optional
+
+from ..utils.logging_utils import setup_logger
+
+try:
+    import imghdr
+except ImportError:  # removed in Python 3.13
+    imghdr = None
+
+logger = setup_logger('run_files')
+
+MAX_CONTENT_CHARS = int(os.getenv('WORKFLOW_FILE_CONTENT_MAX_CHARS', '0'))
+READ_CHUNK_CHARS = 1024 * 1024
+
+
+def _is_image(file_path: str) -> bool:
+    # imghdr sniffs the header; mimetypes covers formats it does not know
+    if imghdr is not None and imghdr.what(file_path) is not None:
+        return True
+    if not mimetypes.inited:
+        mimetypes.init()
+    mime_type, _ = mimetypes.guess_type(file_path)
+    return bool(mime_type and mime_type.startswith('image/'))
+
+
+def _read_text(file_path: str, max_chars: int = 0) -> str:
+    """Read a text file in chunks, stopping after ``max_chars`` characters when set."""
+    parts, size = [], 0
+    with open(file_path, 'r') as f:
+        while True:
+            chunk_size = READ_CHUNK_CHARS if not max_chars else min(READ_CHUNK_CHARS, max_chars - size)
+            if chunk_size <= 0:
+                if f.read(1):
+                    logger.warning(f"Truncated {os.path.basename(file_path)} to {max_chars} characters")
+                break
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parts.append(chunk)
+            size += len(chunk)
+    return ''.join(parts)
+
+
+class RunFiles:
+    """The uploaded files of one run, with lazily computed image paths and text content."""
+
+    def __init__(self, files: Optional[List[dict]] = None, max_content_chars: int = MAX_CONTENT_CHARS):
+        self.files = files or []
+        self.max_content_chars = max_content_chars
+        self._lock = threading.Lock()
+        self._image_paths = None
+        self._text_files = None
+        self._text_content = None
+
+    def __bool__(self):
+        return bool(self.files)
+
+    def _classify(self) -> None:
+        image_files, text_files = [], []
+        for file in self.files:
+            file_path = file.get('path')
+            if not file_path or not os.path.exists(file_path):
+                logger.warning(f"File path not found or invalid: {file_path}")
+                continue
+            try:
+                if _is_image(file_path):
+                    image_files.append(file_path)
+                    logger.info(f"Added image file: {file.get('filename')}")
+                else:
+                    text_files.append(file)
+                    logger.info(f"Added text file: {file.get('filename')}")
+            except Exception as e:
+                logger.error(f"Error determining file type for {file_path}: {str(e)}")
+                # Default to treating as text file if we can't determine type
+                text_files.append(file)
+        self._image_paths = image_files
+        self._text_files = text_files
+
+    @property
+    def image_paths(self) -> List[str]:
+        """Paths of the image files, for multimodal LLM nodes."""
+        if not self.files:
+            return []
+        with self._lock:
+            if self._image_paths is None:
+                self._classify()
+            return self._image_paths
+
+    @property
+    def text_file(self) -> Optional[dict]:
+        """The first text file, whose content is ``file_content``."""
+        if not self.files:
+            return None
+        with self._lock:
+            if self._text_files is None:
+                self._classify()
+            return self._text_files[0] if self._text_files else None
+
+    @property
+    def text_content(self) -> str:
+        """Content of the first text file, read on first use."""
+        text_file = self.text_file
+        if text_file is None:
+            return ''
+        with self._lock:
+            if self._text_content is None:
+                try:
+                    self._text_content = _read_text(text_file['path'], self.max_content_chars)
+                    logger.info(f"Added content from text file: {os.path.basename(text_file['path'])}")
+                except Exception as e:
+                    logger.error(f"Error reading text file: {str(e)}")
+                    self._text_content = ''
+            return self._text_content
@@ -0,0 +1,143 @@
+"""
+Coalescing of identical concurrent workflow executions (single flight).
+
+While a coalesced execution is running, an identical request waits for
+it and receives a copy of its output instead of starting another run.
+Requests are identical when their key matches. The key is a canonical
+hash of the workflow version, input, files and deadline.
+
+A request sharing a run waits as an execution of its own, so cancelling
+the workflow stops it; if the run it shares is cancelled by someone else,
+the waiting requests run the workflow again, one of them for all.
+
+Only stateless executions are coalesced: no conversation ID, no event
+listener and no caller-chosen execution ID. The shared run saves no
+conversation; each caller gets a new conversation of its own with the
+run's messages, so callers never see each other's follow-ups. Coalescing
+is opt-in. Turn it on
+with the start node's ``coalesceRuns`` setting, or for every workflow
+with ``WORKFLOW_COALESCE_RUNS``, because it also dedupes the side effects
+of the workflow's nodes (e.g. POST requests).
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Callable, Optional, Tuple
+
+from .node_policy import node_option
+from ..utils.exc import WorkflowCancelledError
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('single_flight')
+
+COALESCE_BY_DEFAULT = os.getenv('WORKFLOW_COALESCE_RUNS', 'false').lower() == 'true'
+
+
+def coalescing_enabled(plan) -> bool:
+    """Whether identical runs of this workflow may share one execution."""
+    start_node = plan.start_node
+    if start_node is None:
+        return False
+    return bool(node_option(start_node.get('data', {}), 'coalesceRuns', COALESCE_BY_DEFAULT))
+
+
+def coalesce_key(plan, input_data, files=None, deadline=None) -> str:
+    """sha256 of the workflow version and the inputs of a run."""
+    payload = json.dumps({
+        'workflow_uuid': plan.workflow_uuid,
+        'updated_at': plan.updated_at,
+        'input': input_data,
+        'files': [{'path': f.get('path'), 'filename': f.get('filename'), 'size': f.get('size')}
+                  for f in (files or [])],
+        'deadline': deadline
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+def _follower_error(error: BaseException) -> BaseException:
+    """A new exception like the leader's, so followers never raise (and mutate) the same instance."""
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(str(error))
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its outcome."""
+
+    def __init__(self, retry_errors: Tuple[type, ...] = ()):
+        self._calls = {}
+        self._lock = threading.Lock()
+        # Leader errors that are not the followers' outcome: they call again instead
+        self.retry_errors = retry_errors
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, fn: Callable[[], Any],
+           wait: Optional[Callable[[threading.Event], None]] = None) -> Tuple[Any, bool]:
+        """Return ``(result, shared)``; ``shared`` is True when another caller's run was reused.
+
+        Followers wait with ``wait(done)`` (default ``done.wait()``), which may raise to
+        give up. When the leader fails with one of ``retry_errors`` its followers call
+        again, one of them leading; other errors are raised in each follower as a copy
+        chained to the leader's exception.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                    leader = True
+                else:
+                    call.followers += 1
+                    self.shared += 1
+                    leader = False
+
+            if leader:
+                break
+            if wait is not None:
+                wait(call.done)
+            else:
+                call.done.wait()
+            error = call.error
+            if error is None:
+                return call.result, True
+            if not isinstance(error, self.retry_errors):
+                raise _follower_error(error) from error
+            logger.info(f"Run {key[:12]} failed with {type(error).__name__} in another request, running it again")
+            with self._lock:
+                self.shared -= 1
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.followers:
+                logger.info(f"Shared run {key[:12]} with {call.followers} identical requests")
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'in_flight': len(self._calls), 'executed': self.executed, 'shared': self.shared}
+
+
+# A cancelled leader was cancelled for its own request, not for the requests sharing its run
+workflow_single_flight = SingleFlight(retry_errors=(WorkflowCancelledError,))
@@ -0,0 +1,154 @@
+"""
+Shared ``{{node_id.var_name}}`` template rendering for workflow nodes.
+
+Templates are parsed once into literal and variable parts (cached by source
+text, so every run of a workflow version reuses them) and rendered in a
+single pass. Variables are looked up in ``context['steps_by_node']``, the
+process steps indexed by node id, instead of scanning the step list.
+
+Nodes differ only in what they render for a variable that cannot be
+resolved, chosen with ``missing``:
+
+- ``MISSING_PLACEHOLDER``: ``{{Variable node.var not found}}`` (LLM prompts, ifelse conditions)
+- ``MISSING_EMPTY``: an empty string (answer text)
+- ``MISSING_KEEP``: the reference unchanged, ``{{node.var}}`` (HTTP requests)
+"""
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from .workflow_compiler import VARIABLE_PATTERN, VariableRef, parse_variable_ref
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('template_engine')
+
+MISSING_PLACEHOLDER = 'placeholder'
+MISSING_EMPTY = 'empty'
+MISSING_KEEP = 'keep'
+
+TEMPLATE_CACHE_SIZE = 4096
+
+# Step fields exposed as variables, besides input and output
+CLASSIFIER_VARIABLES = ('class_name', 'usage')
+
+
+class Template:
+    """A parsed template: literals at even positions of ``parts``, ``VariableRef`` at odd ones."""
+
+    __slots__ = ('source', 'parts')
+
+    def __init__(self, source: str, parts: Tuple):
+        self.source = source
+        self.parts = parts
+
+    @property
+    def variables(self) -> Tuple[VariableRef, ...]:
+        return self.parts[1::2]
+
+    def render(self, context: dict, missing: str = MISSING_PLACEHOLDER) -> str:
+        parts = self.parts
+        if len(parts) == 1:
+            return parts[0]
+        steps_by_node = context.get('steps_by_node') or {}
+        out = [parts[0]]
+        for index in range(1, len(parts), 2):
+            ref = parts[index]
+            value = resolve_variable(ref, context, steps_by_node)
+            if value is None:
+                logger.debug(f"Variable {ref.raw} not found")
+                value = _missing_value(ref, missing)
+            out.append(value)
+            out.append(parts[index + 1])
+        return ''.join(out)
+
+    def render_parts(self, context: dict, missing: str = MISSING_PLACEHOLDER,
+                     expand: Optional[Callable[[VariableRef], Optional[list]]] = None) -> List:
+        """
+        Render into a list of strings, except for variables ``expand`` returns a list for,
+        which are kept as that list (e.g. the chunks of a knowledge node, see ``context_assembler``).
+        Adjacent strings are merged.
+        """
+        steps_by_node = context.get('steps_by_node') or {}
+        out = [self.parts[0]]
+        for index in range(1, len(self.parts), 2):
+            ref = self.parts[index]
+            expanded = expand(ref) if expand is not None else None
+            if expanded is not None:
+                out.append(expanded)
+                out.append(self.parts[index + 1])
+                continue
+            value = resolve_variable(ref, context, steps_by_node)
+            if value is None:
+                logger.debug(f"Variable {ref.raw} not found")
+                value = _missing_value(ref, missing)
+            if isinstance(out[-1], str):
+                out[-1] += value + self.parts[index + 1]
+            else:
+                out.append(value + self.parts[index + 1])
+        return out
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source: str) -> Template:
+    """Parse a template string; cached, so each distinct template is parsed once per process."""
+    parts = []
+    position = 0
+    for match in VARIABLE_PATTERN.finditer(source):
+        parts.append(source[position:match.start()])
+        parts.append(parse_variable_ref(match.group(1)))
+        position = match.end()
+    parts.append(source[position:])
+    return Template(source, tuple(parts))
+
+
+def render_template(text, context: dict, missing: str = MISSING_PLACEHOLDER):
+    """Render ``text`` against a run context; values other than non-empty strings are returned unchanged."""
+    if not text or not isinstance(text, str) or '{{' not in text:
+        return text
+    return compile_template(text).render(context, missing)
+
+
+def resolve_variable(ref: VariableRef, context: dict, steps_by_node: Optional[dict] = None) -> Optional[str]:
+    """Value of a variable reference as a string, or None if it cannot be resolved."""
+    node_id, var_name = ref.node_id, ref.var_name
+    if node_id is None:
+        return None
+
+    # Start node variables come from the run itself
+    if node_id.startswith('start-'):
+        if var_name == 'files':
+            files = context.get('files', [])
+            if files:
+                file_list = [f"{f.get('filename', 'unnamed')} ({f.get('size', 0)} bytes)" for f in files]
+                return "\n".join([f"Files available ({len(files)}):"] + file_list)
+            return "No files available"
+        if var_name == 'file_content':
+            # Read on first reference and kept for the rest of the run
+            run_files = context.get('run_files')
+            file_content = run_files.text_content if run_files else ''
+            if file_content:
+                filename = run_files.text_file.get('filename', 'unnamed')
+                return f"File Content ({filename}):\n\n" + file_content
+            return "No file content available"
+        if var_name == 'input':
+            input_data = context.get('input', '')
+            return str(input_data) if input_data else ""
+
+    if steps_by_node is None:
+        steps_by_node = context.get('steps_by_node') or {}
+    step = steps_by_node.get(node_id)
+    if not step:
+        return None
+    if var_name in ('input', 'output'):
+        value = step.get(var_name)
+        return str(value) if value is not None else None
+    if step.get('type') == 'classifier' and var_name in CLASSIFIER_VARIABLES and var_name in step:
+        return str(step[var_name])
+    return None
+
+
+def _missing_value(ref: VariableRef, missing: str) -> str:
+    if missing == MISSING_EMPTY:
+        return ''
+    if missing == MISSING_KEEP:
+        return f"{{{{{ref.raw}}}}}"
+    return f"{{{{Variable {ref.raw} not found}}}}"
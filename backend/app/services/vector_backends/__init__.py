@@ -0,0 +1,44 @@
+import os
+import threading
+from flask import current_app
+
+from ... import db
+from .base import VectorBackend, VectorHit, DocumentHit
+from .pgvector_backend import PgVectorBackend
+from .embedded_backend import EmbeddedVectorBackend
+
+__all__ = ['VectorBackend', 'VectorHit', 'DocumentHit', 'PgVectorBackend', 'EmbeddedVectorBackend', 'get_vector_backend']
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_vector_backend(name=None) -> VectorBackend:
+    """
+    Return the vector backend configured by ``VECTOR_BACKEND``.
+
+    ``auto`` selects pgvector on PostgreSQL and the embedded engine on any
+    other database. Backends are created once per process.
+    """
+    name = name or current_app.config.get('VECTOR_BACKEND', 'auto')
+    if name == 'auto':
+        name = PgVectorBackend.name if db.engine.dialect.name == 'postgresql' else EmbeddedVectorBackend.name
+
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == PgVectorBackend.name:
+                backend = PgVectorBackend()
+            elif name == EmbeddedVectorBackend.name:
+                config = current_app.config
+                backend = EmbeddedVectorBackend(
+                    index_path=os.path.join(config.get('VECTOR_DB_PATH', './vector_db'), 'hnsw'),
+                    brute_force_max=config.get('EMBEDDED_BRUTE_FORCE_MAX_VECTORS', 20000),
+                    m=config.get('HNSW_M', 16),
+                    ef_construction=config.get('HNSW_EF_CONSTRUCTION', 100),
+                    ef_search=config.get('HNSW_EF_SEARCH', 64)
+                )
+            else:
+                raise ValueError(f"Unknown vector backend: {name}")
+            _backends[name] = backend
+        return backend
@@ -0,0 +1,52 @@
+from typing import List, Optional, NamedTuple
+
+
+class VectorHit(NamedTuple):
+    """A single similarity search result: the matched vector and its cosine similarity."""
+    vector_uuid: str
+    score: float
+
+
+class DocumentHit(NamedTuple):
+    """A document summary search result: the matched document and its cosine similarity."""
+    document_uuid: str
+    score: float
+
+
+class VectorBackend:
+    """
+    Interface of the engines that run vector similarity search for
+    ``KnowledgeRetrievalService``.
+
+    Backends only rank vectors; loading the matched rows and building the
+    result payload stays in the retrieval service.
+    """
+
+    name = 'base'
+
+    def search(self, knowledge, query_embedding: List[float], top_k: int, storage,
+               document_ids_filter: Optional[List[str]] = None) -> List[VectorHit]:
+        """
+        Return the ``top_k`` most similar vectors of a knowledge base, best first.
+
+        Args:
+            knowledge: Knowledge model instance to search
+            query_embedding: Query embedding, already truncated for the storage mode
+            top_k: Maximum number of hits to return
+            storage: VectorStorageConfig of the knowledge base
+            document_ids_filter: Optional list of document UUIDs to restrict the search to
+        """
+        raise NotImplementedError
+
+    def search_documents(self, knowledge, query_embedding: List[float], top_k: int, storage) -> List[DocumentHit]:
+        """
+        Return the ``top_k`` documents whose summary vectors are most similar, best first.
+
+        This is the coarse stage of two-stage retrieval; the chunk search then
+        runs with the returned documents as ``document_ids_filter``.
+        """
+        raise NotImplementedError
+
+    def refresh(self, knowledge) -> None:
+        """Bring any derived index up to date after the vectors of a knowledge base changed."""
+        return None
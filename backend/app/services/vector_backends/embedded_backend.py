@@ -0,0 +1,275 @@
+import json
+import os
+import time
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func
+
+from ... import db
+from ...models.document_vector import DocumentVector
+from ...models.document_summary_vector import DocumentSummaryVector
+from ..vector_storage import VectorStorageConfig, STORAGE_FLOAT32
+from ...utils.logging_utils import setup_logger
+from .base import VectorBackend, VectorHit, DocumentHit
+from .hnsw import HNSWIndex
+
+logger = setup_logger('embedded_vector_backend')
+
+
+class EmbeddedVectorBackend(VectorBackend):
+    """
+    In-process similarity search for databases without pgvector (e.g. SQLite).
+
+    Small knowledge bases are searched with numpy brute force over a cached,
+    normalised matrix. Knowledge bases larger than ``brute_force_max`` use an
+    HNSW graph persisted under ``<index_path>/<knowledge_uuid>`` and loaded
+    memory-mapped. Both are rebuilt when the knowledge base's fingerprint
+    (vector count, newest vector, storage settings) changes. The graph is
+    rebuilt on a background thread; until it is ready, searches of the
+    knowledge base fall back to exact brute force over the current vectors.
+    """
+
+    name = 'embedded'
+
+    def __init__(self, index_path: str, brute_force_max: int = 20000, m: int = 16,
+                 ef_construction: int = 100, ef_search: int = 64):
+        self.index_path = index_path
+        self.brute_force_max = brute_force_max
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        # knowledge uuid -> (fingerprint, ids, matrix)
+        self._matrices = {}
+        # knowledge uuid -> (fingerprint, index, ids)
+        self._indexes = {}
+        # knowledge uuid -> thread of its running index build
+        self._building = {}
+        # knowledge uuid -> (fingerprint, document ids, matrix) of the document summary vectors
+        self._summaries = {}
+
+    def search(self, knowledge, query_embedding: List[float], top_k: int, storage: VectorStorageConfig,
+               document_ids_filter: Optional[List[str]] = None) -> List[VectorHit]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        if document_ids_filter:
+            # Filtered searches only score the vectors of the selected documents
+            ids, matrix = self._load_vectors(knowledge, storage, document_ids_filter)
+            return self._brute_force(query, ids, matrix, top_k)
+
+        fingerprint = self._fingerprint(knowledge, storage)
+        if fingerprint[0] > self.brute_force_max:
+            current = self._current_index(knowledge, fingerprint)
+            if current is not None:
+                index, ids = current
+                self._check_dimensions(query, index.vectors)
+                return [VectorHit(ids[row], score) for row, score in index.search(query, top_k, self.ef_search)]
+            # Exact search until the index of the current vectors is built
+            ids, matrix = self._get_matrix(knowledge, storage, fingerprint)
+            self._build_in_background(str(knowledge.uuid), fingerprint, ids, matrix)
+            return self._brute_force(query, ids, matrix, top_k)
+
+        ids, matrix = self._get_matrix(knowledge, storage, fingerprint)
+        return self._brute_force(query, ids, matrix, top_k)
+
+    def search_documents(self, knowledge, query_embedding: List[float], top_k: int,
+                         storage: VectorStorageConfig) -> List[DocumentHit]:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+
+        # One summary per document, so exact search stays cheap
+        ids, matrix = self._get_summary_matrix(knowledge, storage)
+        return [DocumentHit(hit.vector_uuid, hit.score) for hit in self._brute_force(query, ids, matrix, top_k)]
+
+    def refresh(self, knowledge) -> None:
+        storage = VectorStorageConfig.from_knowledge(knowledge)
+        fingerprint = self._fingerprint(knowledge, storage)
+        large = fingerprint[0] > self.brute_force_max
+        if large and self._current_index(knowledge, fingerprint) is not None:
+            return
+        ids, matrix = self._get_matrix(knowledge, storage, fingerprint)
+        if large:
+            # Ingestion starts the build, so searches rarely wait on brute force
+            self._build_in_background(str(knowledge.uuid), fingerprint, ids, matrix)
+
+    @staticmethod
+    def _check_dimensions(query: np.ndarray, matrix: np.ndarray):
+        if len(matrix) and matrix.shape[1] != query.shape[0]:
+            raise ValueError(f"Query embedding has {query.shape[0]} dimensions, "
+                             f"stored vectors have {matrix.shape[1]}")
+
+    def _brute_force(self, query: np.ndarray, ids: List[str], matrix: np.ndarray, top_k: int) -> List[VectorHit]:
+        if not len(ids):
+            return []
+        self._check_dimensions(query, matrix)
+        scores = matrix @ query
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [VectorHit(ids[row], float(scores[row])) for row in top]
+
+    def _fingerprint(self, knowledge, storage: VectorStorageConfig) -> list:
+        count, newest = db.session.query(
+            func.count(DocumentVector.uuid),
+            func.max(DocumentVector.created_at)
+        ).filter(
+            DocumentVector.knowledge_uuid == knowledge.uuid,
+            DocumentVector.enable == True
+        ).one()
+        return [
+            count,
+            newest.isoformat() if newest else None,
+            knowledge.updated_at.isoformat() if knowledge.updated_at else None,
+            storage.mode,
+            storage.dimensions
+        ]
+
+    def _load_vectors(self, knowledge, storage: VectorStorageConfig,
+                      document_ids_filter: Optional[List[str]] = None) -> Tuple[List[str], np.ndarray]:
+        column = DocumentVector.embedding if storage.mode == STORAGE_FLOAT32 else DocumentVector.embedding_half
+        query = db.session.query(DocumentVector.uuid, column).filter(
+            DocumentVector.knowledge_uuid == knowledge.uuid,
+            DocumentVector.enable == True,
+            column.isnot(None)
+        )
+        if document_ids_filter:
+            query = query.filter(DocumentVector.document_uuid.in_(document_ids_filter))
+        rows = query.order_by(DocumentVector.uuid).all()
+        if not rows:
+            return [], np.zeros((0, 0), dtype=np.float32)
+
+        ids = [str(row[0]) for row in rows]
+        matrix = np.asarray([row[1] for row in rows], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return ids, matrix / norms
+
+    def _get_matrix(self, knowledge, storage: VectorStorageConfig, fingerprint: list) -> Tuple[List[str], np.ndarray]:
+        key = str(knowledge.uuid)
+        cached = self._matrices.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1], cached[2]
+
+        start_time = time.time()
+        ids, matrix = self._load_vectors(knowledge, storage)
+        with self._lock:
+            self._matrices[key] = (fingerprint, ids, matrix)
+            # An index of other vectors is never searched again
+            cached = self._indexes.get(key)
+            if cached and cached[0] != fingerprint:
+                del self._indexes[key]
+        logger.info(f"Loaded {len(ids)} vectors for knowledge base {key} in {time.time() - start_time:.3f}s")
+        return ids, matrix
+
+    def _build_lock(self, key: str) -> threading.Lock:
+        """Lock guarding the persisted index files of a knowledge base."""
+        with self._lock:
+            return self._build_locks.setdefault(key, threading.Lock())
+
+    def _current_index(self, knowledge, fingerprint: list) -> Optional[Tuple[HNSWIndex, list]]:
+        """The HNSW index of the knowledge base at ``fingerprint``, from memory or disk, or None if not built."""
+        key = str(knowledge.uuid)
+        cached = self._indexes.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1], cached[2]
+
+        path = os.path.join(self.index_path, key)
+        with self._build_lock(key):
+            cached = self._indexes.get(key)
+            if cached and cached[0] == fingerprint:
+                return cached[1], cached[2]
+            meta_path = os.path.join(path, 'meta.json')
+            if not os.path.exists(meta_path):
+                return None
+            # Only the small meta file is read to tell whether the persisted index is current
+            with open(meta_path) as f:
+                if json.load(f).get('fingerprint') != fingerprint:
+                    return None
+            index, ids, _ = HNSWIndex.load(path)
+
+        with self._lock:
+            self._indexes[key] = (fingerprint, index, ids)
+            self._matrices.pop(key, None)
+        return index, ids
+
+    def _build_in_background(self, key: str, fingerprint: list, ids: List[str], matrix: np.ndarray) -> None:
+        """Start building the knowledge base's HNSW index unless a build of it is already running."""
+        with self._lock:
+            if key in self._building:
+                return
+            thread = threading.Thread(target=self._build_index, args=(key, fingerprint, ids, matrix),
+                                      name=f"hnsw-build-{key[:8]}", daemon=True)
+            self._building[key] = thread
+        thread.start()
+
+    def wait_for_builds(self, timeout: Optional[float] = None) -> None:
+        """Wait for the running index builds to finish (e.g. before benchmarking the HNSW path)."""
+        with self._lock:
+            threads = list(self._building.values())
+        for thread in threads:
+            thread.join(timeout)
+
+    def _build_index(self, key: str, fingerprint: list, ids: List[str], matrix: np.ndarray) -> None:
+        # Works on vectors loaded by the caller, so the thread needs no database session
+        try:
+            start_time = time.time()
+            logger.info(f"Building HNSW index for knowledge base {key} over {len(ids)} vectors")
+            built = HNSWIndex.build(matrix, m=self.m, ef_construction=self.ef_construction)
+            path = os.path.join(self.index_path, key)
+            with self._build_lock(key):
+                os.makedirs(self.index_path, exist_ok=True)
+                built.save(path, ids, fingerprint)
+                # Reload so searches run against the memory-mapped files
+                index, index_ids, _ = HNSWIndex.load(path)
+            with self._lock:
+                self._indexes[key] = (fingerprint, index, index_ids)
+                # The brute force matrix is kept if it already holds newer vectors
+                cached = self._matrices.get(key)
+                if cached and cached[0] == fingerprint:
+                    del self._matrices[key]
+            logger.info(f"Built HNSW index for knowledge base {key} in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            logger.error(f"Failed to build HNSW index for knowledge base {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+
+    def _get_summary_matrix(self, knowledge, storage: VectorStorageConfig) -> Tuple[List[str], np.ndarray]:
+        key = str(knowledge.uuid)
+        count, newest = db.session.query(
+            func.count(DocumentSummaryVector.uuid),
+            func.max(DocumentSummaryVector.updated_at)
+        ).filter(
+            DocumentSummaryVector.knowledge_uuid == knowledge.uuid
+        ).one()
+        fingerprint = [count, newest.isoformat() if newest else None, storage.mode, storage.dimensions]
+        cached = self._summaries.get(key)
+        if cached and cached[0] == fingerprint:
+            return cached[1], cached[2]
+
+        column = DocumentSummaryVector.embedding if storage.mode == STORAGE_FLOAT32 else DocumentSummaryVector.embedding_half
+        rows = db.session.query(DocumentSummaryVector.document_uuid, column).filter(
+            DocumentSummaryVector.knowledge_uuid == knowledge.uuid,
+            column.isnot(None)
+        ).order_by(DocumentSummaryVector.document_uuid).all()
+        if rows:
+            ids = [str(row[0]) for row in rows]
+            matrix = np.asarray([row[1] for row in rows], dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms
+        else:
+            ids, matrix = [], np.zeros((0, 0), dtype=np.float32)
+
+        with self._lock:
+            self._summaries[key] = (fingerprint, ids, matrix)
+        logger.info(f"Loaded {len(ids)} document summary vectors for knowledge base {key}")
+        return ids, matrix
@@ -0,0 +1,220 @@
+"""
+Hierarchical Navigable Small World graph for cosine similarity search.
+
+The index works on L2-normalised float32 vectors, so cosine distance is
+``1 - dot(a, b)``. A built index is persisted as plain ``.npy`` files and
+loaded back memory-mapped, so only the pages touched by a search are read.
+
+Layout of an index directory:
+
+    meta.json        parameters, entry point and the fingerprint of the source data
+    ids.json         vector UUIDs, in row order
+    vectors.npy      (n, dims) float32, normalised
+    levels.npy       (n,) int8, top level of every node
+    graph_0.npy      (n, 2 * m) int32 neighbours on level 0, padded with -1
+    nodes_<l>.npy    node ids present on level l >= 1
+    graph_<l>.npy    (len(nodes_<l>), m) int32 neighbours on level l, padded with -1
+"""
+import os
+import json
+import math
+import heapq
+import shutil
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+class HNSWIndex:
+    """Approximate nearest neighbour index over normalised vectors."""
+
+    def __init__(self, vectors: np.ndarray, m: int = 16, ef_construction: int = 100, seed: int = 42):
+        self.vectors = vectors
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = max(ef_construction, m)
+        self.seed = seed
+        self.entry_point = -1
+        self.max_level = -1
+        self.levels = np.zeros(len(vectors), dtype=np.int8)
+        # Level -> node -> neighbour list while building; frozen arrays once built or loaded
+        self._links = []
+        self._graphs = None
+        self._rows = None
+
+    # ------------------------------------------------------------------ build
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, m: int = 16, ef_construction: int = 100, seed: int = 42) -> 'HNSWIndex':
+        index = cls(np.ascontiguousarray(vectors, dtype=np.float32), m=m, ef_construction=ef_construction, seed=seed)
+        rng = np.random.default_rng(seed)
+        level_mult = 1.0 / math.log(max(m, 2))
+        uniform = rng.random(len(vectors))
+        levels = np.minimum(np.floor(-np.log(np.maximum(uniform, 1e-12)) * level_mult), 127).astype(np.int8)
+        index.levels = levels
+        for node in range(len(vectors)):
+            index._insert(node, int(levels[node]))
+        index._freeze()
+        return index
+
+    def _insert(self, node: int, level: int):
+        while len(self._links) <= level:
+            self._links.append({})
+        for lvl in range(level + 1):
+            self._links[lvl][node] = []
+
+        if self.entry_point < 0:
+            self.entry_point = node
+            self.max_level = level
+            return
+
+        query = self.vectors[node]
+        entry = self.entry_point
+        for lvl in range(self.max_level, level, -1):
+            entry = self._search_layer(query, [entry], 1, lvl)[0][1]
+
+        for lvl in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(query, [entry], self.ef_construction, lvl)
+            max_links = self.m0 if lvl == 0 else self.m
+            neighbours = [n for _, n in candidates[:max_links]]
+            self._links[lvl][node] = neighbours
+            for neighbour in neighbours:
+                links = self._links[lvl][neighbour]
+                links.append(node)
+                if len(links) > max_links:
+                    distances = 1.0 - self.vectors[links] @ self.vectors[neighbour]
+                    keep = np.argsort(distances)[:max_links]
+                    self._links[lvl][neighbour] = [links[i] for i in keep]
+            entry = candidates[0][1]
+
+        if level > self.max_level:
+            self.entry_point = node
+            self.max_level = level
+
+    def _freeze(self):
+        """Convert the adjacency lists to the padded arrays used for persistence."""
+        graphs, rows = [], []
+        for level, links in enumerate(self._links):
+            if level == 0:
+                graph = np.full((len(self.vectors), self.m0), -1, dtype=np.int32)
+                for node, neighbours in links.items():
+                    graph[node, :len(neighbours)] = neighbours[:self.m0]
+                graphs.append(graph)
+                rows.append(None)
+            else:
+                nodes = np.array(sorted(links), dtype=np.int32)
+                graph = np.full((len(nodes), self.m), -1, dtype=np.int32)
+                for row, node in enumerate(nodes):
+                    neighbours = links[int(node)][:self.m]
+                    graph[row, :len(neighbours)] = neighbours
+                graphs.append((nodes, graph))
+                rows.append({int(node): row for row, node in enumerate(nodes)})
+        self._graphs = graphs
+        self._rows = rows
+        self._links = []
+
+    # ----------------------------------------------------------------- search
+
+    def _neighbours(self, level: int, node: int) -> List[int]:
+        if self._graphs is None:
+            return self._links[level].get(node, [])
+        if level == 0:
+            row = self._graphs[0][node]
+        else:
+            position = self._rows[level].get(node)
+            if position is None:
+                return []
+            row = self._graphs[level][1][position]
+        return [int(n) for n in row if n >= 0]
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int, level: int) -> List[Tuple[float, int]]:
+        visited = set(entry_points)
+        entry_distances = 1.0 - self.vectors[entry_points] @ query
+        candidates = [(float(d), n) for d, n in zip(entry_distances, entry_points)]
+        heapq.heapify(candidates)
+        results = [(-d, n) for d, n in candidates]
+        heapq.heapify(results)
+
+        while candidates:
+            distance, node = heapq.heappop(candidates)
+            if len(results) >= ef and distance > -results[0][0]:
+                break
+            neighbours = [n for n in self._neighbours(level, node) if n not in visited]
+            if not neighbours:
+                continue
+            visited.update(neighbours)
+            distances = 1.0 - self.vectors[neighbours] @ query
+            for neighbour_distance, neighbour in zip(distances, neighbours):
+                neighbour_distance = float(neighbour_distance)
+                if len(results) < ef or neighbour_distance < -results[0][0]:
+                    heapq.heappush(candidates, (neighbour_distance, neighbour))
+                    heapq.heappush(results, (-neighbour_distance, neighbour))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted((-d, n) for d, n in results)
+
+    def search(self, query: np.ndarray, top_k: int, ef_search: int = 64) -> List[Tuple[int, float]]:
+        """Return up to ``top_k`` (row, cosine similarity) pairs, best first."""
+        if self.entry_point < 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        entry = self.entry_point
+        for level in range(self.max_level, 0, -1):
+            entry = self._search_layer(query, [entry], 1, level)[0][1]
+        found = self._search_layer(query, [entry], max(ef_search, top_k), 0)
+        return [(node, 1.0 - distance) for distance, node in found[:top_k]]
+
+    # ------------------------------------------------------------ persistence
+
+    def save(self, path: str, ids: List[str], fingerprint: Optional[list] = None):
+        """Write the index atomically: files go to a temp directory that replaces ``path``."""
+        tmp_path = f"{path}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'vectors.npy'), self.vectors)
+        np.save(os.path.join(tmp_path, 'levels.npy'), self.levels)
+        np.save(os.path.join(tmp_path, 'graph_0.npy'), self._graphs[0])
+        for level in range(1, len(self._graphs)):
+            nodes, graph = self._graphs[level]
+            np.save(os.path.join(tmp_path, f'nodes_{level}.npy'), nodes)
+            np.save(os.path.join(tmp_path, f'graph_{level}.npy'), graph)
+        with open(os.path.join(tmp_path, 'ids.json'), 'w') as f:
+            json.dump(ids, f)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({
+                'm': self.m,
+                'ef_construction': self.ef_construction,
+                'entry_point': self.entry_point,
+                'max_level': self.max_level,
+                'levels': len(self._graphs),
+                'count': len(self.vectors),
+                'fingerprint': fingerprint
+            }, f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple['HNSWIndex', List[str], dict]:
+        """Load a persisted index memory-mapped. Returns (index, ids, meta)."""
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, 'ids.json')) as f:
+            ids = json.load(f)
+
+        index = cls(np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+                    m=meta['m'], ef_construction=meta['ef_construction'])
+        index.levels = np.load(os.path.join(path, 'levels.npy'), mmap_mode='r')
+        index.entry_point = meta['entry_point']
+        index.max_level = meta['max_level']
+        graphs = [np.load(os.path.join(path, 'graph_0.npy'), mmap_mode='r')]
+        rows = [None]
+        for level in range(1, meta['levels']):
+            nodes = np.load(os.path.join(path, f'nodes_{level}.npy'))
+            graphs.append((nodes, np.load(os.path.join(path, f'graph_{level}.npy'), mmap_mode='r')))
+            rows.append({int(node): row for row, node in enumerate(nodes)})
+        index._graphs = graphs
+        index._rows = rows
+        return index, ids, meta
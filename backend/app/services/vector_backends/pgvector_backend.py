@@ -0,0 +1,141 @@
+from typing import List, Optional
+from sqlalchemy import text, bindparam
+
+from ... import db
+from ..vector_storage import (
+    VectorStorageConfig, STORAGE_BINARY, STORAGE_HALFVEC, format_vector, to_bits
+)
+from ...utils.logging_utils import setup_logger
+from .base import VectorBackend, VectorHit, DocumentHit
+
+logger = setup_logger('pgvector_backend')
+
+
+class PgVectorBackend(VectorBackend):
+    """Similarity search in PostgreSQL with the pgvector extension."""
+
+    name = 'pgvector'
+
+    def search(self, knowledge, query_embedding: List[float], top_k: int, storage: VectorStorageConfig,
+               document_ids_filter: Optional[List[str]] = None) -> List[VectorHit]:
+        sql_query, params = self.build_query(
+            knowledge_id=knowledge.uuid,
+            query_embedding=query_embedding,
+            storage=storage,
+            top_k=top_k,
+            document_ids_filter=document_ids_filter
+        )
+        logger.debug(f"\n[SEMANTIC SEARCH SQL]\n{sql_query}\n")
+        logger.debug(f"Parameters: knowledge_id={knowledge.uuid}, top_k={top_k}, query_embedding_length={len(query_embedding)}")
+
+        result = db.session.execute(sql_query, params)
+        return [VectorHit(str(row.uuid), float(row.similarity_score)) for row in result]
+
+    def search_documents(self, knowledge, query_embedding: List[float], top_k: int,
+                         storage: VectorStorageConfig) -> List[DocumentHit]:
+        sql_query, params = self.build_document_query(
+            knowledge_id=knowledge.uuid,
+            query_embedding=query_embedding,
+            storage=storage,
+            top_k=top_k
+        )
+        logger.debug(f"\n[DOCUMENT SUMMARY SEARCH SQL]\n{sql_query}\n")
+
+        result = db.session.execute(sql_query, params)
+        return [DocumentHit(str(row.document_uuid), float(row.similarity_score)) for row in result]
+
+    @classmethod
+    def build_query(
+        cls,
+        knowledge_id: str,
+        query_embedding: List[float],
+        storage: VectorStorageConfig,
+        top_k: int,
+        document_ids_filter: Optional[List[str]] = None
+    ):
+        """
+        Build the pgvector similarity query for a knowledge base's storage mode.
+
+        The column casts (``::halfvec(n)``, ``::bit(n)``) match the per-knowledge-base
+        HNSW expression indexes created by ``KnowledgeService.convert_vector_storage``.
+
+        Returns:
+            Tuple of (TextClause, params)
+        """
+        filters = ["dv.knowledge_uuid = :knowledge_id", "dv.enable = TRUE"]
+        params = {'knowledge_id': str(knowledge_id)}
+
+        # Add document filter if provided
+        if document_ids_filter:
+            logger.info(f"Adding document filter with {len(document_ids_filter)} document IDs")
+            filters.append("dv.document_uuid IN :document_ids")
+            params['document_ids'] = [str(doc_id) for doc_id in document_ids_filter]
+
+        statement, params = cls._build_similarity_query(
+            'document_vectors', 'uuid', filters, params, query_embedding, storage, top_k
+        )
+        if document_ids_filter:
+            statement = statement.bindparams(bindparam('document_ids', expanding=True))
+        return statement, params
+
+    @classmethod
+    def build_document_query(
+        cls,
+        knowledge_id: str,
+        query_embedding: List[float],
+        storage: VectorStorageConfig,
+        top_k: int
+    ):
+        """
+        Build the similarity query over the document summary vectors of a knowledge base.
+
+        Returns:
+            Tuple of (TextClause, params)
+        """
+        return cls._build_similarity_query(
+            'document_summary_vectors', 'document_uuid',
+            ["dv.knowledge_uuid = :knowledge_id"], {'knowledge_id': str(knowledge_id)},
+            query_embedding, storage, top_k
+        )
+
+    @staticmethod
+    def _build_similarity_query(table: str, id_column: str, filters: List[str], params: dict,
+                                query_embedding: List[float], storage: VectorStorageConfig, top_k: int):
+        dimensions = len(query_embedding)
+        params = dict(params, top_k=top_k, query_embedding=format_vector(query_embedding))
+        where_clause = " AND ".join(filters)
+
+        if storage.mode == STORAGE_BINARY:
+            # Hamming distance over the bit column picks the candidates,
+            # the fp16 copy re-scores them with cosine distance
+            params['query_bits'] = to_bits(query_embedding)
+            params['candidate_limit'] = top_k * storage.rescore_factor
+            sql_query = f"""
+                SELECT dv.{id_column},
+                       1 - (dv.embedding_half::halfvec({dimensions}) <=> CAST(:query_embedding AS halfvec({dimensions}))) as similarity_score
+                FROM (
+                    SELECT dv.{id_column}, dv.embedding_half FROM {table} dv
+                    WHERE {where_clause}
+                    ORDER BY dv.embedding_bits::bit({dimensions}) <~> CAST(:query_bits AS bit({dimensions}))
+                    LIMIT :candidate_limit
+                ) dv
+                ORDER BY similarity_score DESC
+                LIMIT :top_k
+            """
+        else:
+            if storage.mode == STORAGE_HALFVEC:
+                distance = f"dv.embedding_half::halfvec({dimensions}) <=> CAST(:query_embedding AS halfvec({dimensions}))"
+            elif storage.dimensions:
+                distance = f"dv.embedding::vector({dimensions}) <=> CAST(:query_embedding AS vector({dimensions}))"
+            else:
+                distance = "dv.embedding <=> CAST(:query_embedding AS vector)"
+            sql_query = f"""
+                SELECT dv.{id_column},
+                       1 - ({distance}) as similarity_score
+                FROM {table} dv
+                WHERE {where_clause}
+                ORDER BY {distance}
+                LIMIT :top_k
+            """
+
+        return text(sql_query), params
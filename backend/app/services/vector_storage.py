@@ -0,0 +1,213 @@
+"""
+Vector storage modes for knowledge bases.
+
+A knowledge base keeps its storage settings in
+``processing_config['vector_storage']``:
+
+    {
+        "mode": "float32" | "halfvec" | "binary",
+        "dimensions": 256,        # optional Matryoshka truncation
+        "rescore_factor": 4       # binary mode only: candidates re-scored per result
+    }
+
+``float32`` is the historical layout (``document_vectors.embedding``).
+``halfvec`` stores fp16 vectors in ``embedding_half`` and halves the table and
+index size. ``binary`` stores one bit per dimension in ``embedding_bits`` for the
+candidate scan and keeps the fp16 copy for re-scoring the candidates.
+"""
+import math
+import struct
+from typing import Optional, List, Dict, Any
+
+STORAGE_FLOAT32 = 'float32'
+STORAGE_HALFVEC = 'halfvec'
+STORAGE_BINARY = 'binary'
+STORAGE_MODES = (STORAGE_FLOAT32, STORAGE_HALFVEC, STORAGE_BINARY)
+
+# DocumentVector columns each mode writes and searches
+STORAGE_COLUMNS = {
+    STORAGE_FLOAT32: frozenset({'embedding'}),
+    STORAGE_HALFVEC: frozenset({'embedding_half'}),
+    STORAGE_BINARY: frozenset({'embedding_half', 'embedding_bits'}),
+}
+
+DEFAULT_RESCORE_FACTOR = 4
+
+# Embedding models trained with Matryoshka representation learning, i.e. whose
+# leading dimensions remain a usable embedding after truncation.
+MATRYOSHKA_MODELS = (
+    'nomic-embed-text',
+    'mxbai-embed-large',
+    'snowflake-arctic-embed2',
+    'snowflake-arctic-embed:335m',
+)
+
+# pgvector limits for indexable columns
+MAX_HALFVEC_INDEX_DIMENSIONS = 4000
+MAX_BIT_INDEX_DIMENSIONS = 64000
+
+
+def supports_matryoshka(embedding_model: Optional[str]) -> bool:
+    """Return True when the embedding model tolerates dimension truncation."""
+    if not embedding_model:
+        return False
+    name = embedding_model.lower()
+    return any(name.startswith(model) for model in MATRYOSHKA_MODELS)
+
+
+class VectorStorageConfig:
+    """Storage settings of a single knowledge base."""
+
+    def __init__(self, mode: str = STORAGE_FLOAT32, dimensions: Optional[int] = None,
+                 rescore_factor: int = DEFAULT_RESCORE_FACTOR):
+        self.mode = mode or STORAGE_FLOAT32
+        self.dimensions = int(dimensions) if dimensions else None
+        self.rescore_factor = max(1, int(rescore_factor or DEFAULT_RESCORE_FACTOR))
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> 'VectorStorageConfig':
+        data = data or {}
+        return cls(
+            mode=data.get('mode', STORAGE_FLOAT32),
+            dimensions=data.get('dimensions'),
+            rescore_factor=data.get('rescore_factor', DEFAULT_RESCORE_FACTOR)
+        )
+
+    @classmethod
+    def from_knowledge(cls, knowledge) -> 'VectorStorageConfig':
+        processing_config = (knowledge.processing_config or {}) if knowledge else {}
+        return cls.from_dict(processing_config.get('vector_storage'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'mode': self.mode,
+            'dimensions': self.dimensions,
+            'rescore_factor': self.rescore_factor
+        }
+
+    def validate(self, embedding_model: Optional[str] = None):
+        """Raise ValueError if the settings cannot be used with the given model."""
+        if self.mode not in STORAGE_MODES:
+            raise ValueError(f"Unsupported vector storage mode: {self.mode}. "
+                             f"Expected one of: {', '.join(STORAGE_MODES)}")
+        if self.dimensions is not None:
+            if self.dimensions <= 0:
+                raise ValueError("Vector dimensions must be a positive integer")
+            if embedding_model and not supports_matryoshka(embedding_model):
+                raise ValueError(f"Embedding model {embedding_model} does not support "
+                                 f"Matryoshka dimension truncation")
+        if self.mode == STORAGE_HALFVEC and self.dimensions and self.dimensions > MAX_HALFVEC_INDEX_DIMENSIONS:
+            raise ValueError(f"halfvec storage supports at most {MAX_HALFVEC_INDEX_DIMENSIONS} dimensions")
+        if self.mode == STORAGE_BINARY and self.dimensions and self.dimensions > MAX_BIT_INDEX_DIMENSIONS:
+            raise ValueError(f"binary storage supports at most {MAX_BIT_INDEX_DIMENSIONS} dimensions")
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, VectorStorageConfig) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"VectorStorageConfig(mode={self.mode!r}, dimensions={self.dimensions}, rescore_factor={self.rescore_factor})"
+
+
+def truncate_embedding(embedding: List[float], dimensions: Optional[int]) -> List[float]:
+    """Keep the leading ``dimensions`` values and re-normalise to unit length."""
+    values = [float(x) for x in embedding]
+    if not dimensions or dimensions >= len(values):
+        return values
+    values = values[:dimensions]
+    norm = math.sqrt(sum(x * x for x in values))
+    if norm == 0:
+        return values
+    return [x / norm for x in values]
+
+
+def to_half_precision(embedding: List[float]) -> List[float]:
+    """Round every value to the nearest IEEE 754 half-precision float."""
+    packed = struct.pack(f'<{len(embedding)}e', *embedding)
+    return list(struct.unpack(f'<{len(embedding)}e', packed))
+
+
+def to_bits(embedding: List[float]) -> str:
+    """Binary-quantise an embedding to a pgvector bit string (1 for positive values)."""
+    return ''.join('1' if x > 0 else '0' for x in embedding)
+
+
+def format_vector(embedding: List[float]) -> str:
+    """Format an embedding as a pgvector text literal."""
+    return '[' + ','.join(str(float(x)) for x in embedding) + ']'
+
+
+def parse_vector(value) -> Optional[List[float]]:
+    """Parse a pgvector text value ('[1,2,3]') or a sequence into a list of floats."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.strip().strip('[]{}')
+        if not value:
+            return []
+        return [float(x) for x in value.split(',')]
+    return [float(x) for x in value]
+
+
+def prepare_embedding(embedding: List[float], storage: VectorStorageConfig) -> Dict[str, Any]:
+    """
+    Build the ``DocumentVector`` column values for an embedding.
+
+    Returns a dict with ``embedding``, ``embedding_half`` and ``embedding_bits``
+    keys; the columns not used by the storage mode are set to None.
+    """
+    values = truncate_embedding(embedding, storage.dimensions)
+
+    if storage.mode == STORAGE_HALFVEC:
+        return {'embedding': None, 'embedding_half': to_half_precision(values), 'embedding_bits': None}
+    if storage.mode == STORAGE_BINARY:
+        return {'embedding': None, 'embedding_half': to_half_precision(values), 'embedding_bits': to_bits(values)}
+    return {'embedding': values, 'embedding_half': None, 'embedding_bits': None}
+
+
+def prepare_query_embedding(embedding: List[float], storage: VectorStorageConfig) -> List[float]:
+    """Apply the knowledge base's truncation to a query embedding."""
+    return truncate_embedding(embedding, storage.dimensions)
+
+
+def centroid_embedding(embeddings: List[List[float]]) -> Optional[List[float]]:
+    """Normalised mean of a set of embeddings, used as a document's summary vector."""
+    if not embeddings:
+        return None
+    dimensions = min(len(embedding) for embedding in embeddings)
+    values = [0.0] * dimensions
+    for embedding in embeddings:
+        for i in range(dimensions):
+            values[i] += float(embedding[i])
+    norm = math.sqrt(sum(x * x for x in values))
+    if norm == 0:
+        return values
+    return [x / norm for x in values]
+
+
+def stored_embedding(vector) -> Optional[List[float]]:
+    """Return the most precise embedding stored on a ``DocumentVector`` row."""
+    if vector.embedding is not None:
+        return parse_vector(vector.embedding)
+    if getattr(vector, 'embedding_half', None) is not None:
+        return parse_vector(vector.embedding_half)
+    return None
+
+
+def bytes_per_vector(mode: str, dimensions: int) -> int:
+    """Approximate on-disk size of one stored vector, excluding row overhead."""
+    if mode == STORAGE_HALFVEC:
+        return 4 + 2 * dimensions
+    if mode == STORAGE_BINARY:
+        # bit column plus the halfvec copy kept for re-scoring
+        return (8 + math.ceil(dimensions / 8)) + (4 + 2 * dimensions)
+    return 4 + 4 * dimensions
+
+
+def index_bytes_per_vector(mode: str, dimensions: int) -> int:
+    """Approximate size of the vector payload held by the HNSW index per row."""
+    if mode == STORAGE_HALFVEC:
+        return 2 * dimensions
+    if mode == STORAGE_BINARY:
+        return math.ceil(dimensions / 8)
+    return 4 * dimensions
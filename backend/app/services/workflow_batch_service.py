@@ -0,0 +1,165 @@
+"""
+Batch execution of a workflow over many inputs, for offline evaluation.
+
+Items are read lazily from an iterable (the lines of a JSONL upload or of
+a streamed request body), executed with bounded parallelism against one
+compiled plan and yielded in completion order with their latency. The last
+record yielded is a summary with latency percentiles.
+"""
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator, Optional
+
+from flask import current_app
+
+from .workflow_cache import workflow_cache
+from .workflow_trace_service import percentile
+from ..utils.exc import WorkflowCancelledError
+from ..utils.logging_utils import setup_logger, set_process_id
+
+logger = setup_logger('workflow_batch_service')
+
+DEFAULT_PARALLELISM = int(os.getenv('WORKFLOW_BATCH_PARALLELISM', '4'))
+MAX_PARALLELISM = int(os.getenv('WORKFLOW_BATCH_MAX_PARALLELISM', '16'))
+MAX_ITEMS = int(os.getenv('WORKFLOW_BATCH_MAX_ITEMS', '10000'))
+
+
+def parse_batch_item(line) -> Optional[dict]:
+    """One JSONL line: an object with ``input`` (and optionally ``id``, ``conversation_id``, ``files``) or a bare string."""
+    if isinstance(line, bytes):
+        line = line.decode('utf-8')
+    line = line.strip()
+    if not line:
+        return None
+    item = json.loads(line)
+    if isinstance(item, str):
+        return {'input': item}
+    if not isinstance(item, dict):
+        raise ValueError(f"Batch items must be JSON objects or strings, got {type(item).__name__}")
+    return item
+
+
+class WorkflowBatchService:
+    def __init__(self, workflow_service):
+        self.workflow_service = workflow_service
+
+    def run_batch(self, workflow_uuid, lines: Iterable, parallelism: int = DEFAULT_PARALLELISM,
+                  persist_memory: bool = False, include_steps: bool = False) -> Iterator[dict]:
+        """
+        Execute the workflow once per item and yield one record per item, then a summary.
+
+        Closing the generator (e.g. the client disconnects) cancels the items still running.
+        """
+        plan = workflow_cache.get_plan(workflow_uuid)
+        if plan is None:
+            raise ValueError(f"Workflow {workflow_uuid} not found")
+        parallelism = max(1, min(parallelism, MAX_PARALLELISM))
+        app = current_app._get_current_object()
+        batch_id = str(uuid.uuid4())[:8]
+        logger.info(f"Batch {batch_id}: running workflow {workflow_uuid} with parallelism {parallelism}, "
+                    f"persist_memory={persist_memory}")
+
+        def run_item(index, item):
+            with app.app_context():
+                set_process_id(f"{batch_id}-{index}")
+                record = {'index': index, 'id': item.get('id')}
+                started = time.time()
+                try:
+                    output = self.workflow_service.execute_workflow(
+                        workflow_uuid=workflow_uuid,
+                        input_data=item.get('input'),
+                        conversation_id=item.get('conversation_id'),
+                        files=item.get('files'),
+                        execution_id=execution_ids[index],
+                        plan=plan,
+                        persist_memory=persist_memory
+                    )
+                    record['status'] = 'succeeded'
+                    record['result'] = output['result']
+                    if persist_memory:
+                        record['conversation_id'] = output['conversation_id']
+                    if include_steps:
+                        record['process_steps'] = output['process_steps']
+                except WorkflowCancelledError as e:
+                    record['status'] = 'cancelled'
+                    record['error'] = str(e)
+                except Exception as e:
+                    record['status'] = 'failed'
+                    record['error'] = str(e)
+                record['latency_ms'] = round((time.time() - started) * 1000, 1)
+                return record
+
+        execution_ids = {}
+        pending = {}
+        latencies = []
+        counts = {'succeeded': 0, 'failed': 0, 'cancelled': 0, 'invalid': 0}
+        started = time.time()
+        items = enumerate(lines)
+        exhausted = False
+        completed = False
+        pool = ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix=f"workflow-batch-{batch_id}")
+        try:
+            while True:
+                # Keep the pool busy without reading the whole input up front
+                while not exhausted and len(pending) < parallelism * 2:
+                    try:
+                        index, line = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    if index >= MAX_ITEMS:
+                        exhausted = True
+                        yield {'index': index, 'status': 'invalid', 'error': f"Batch limit of {MAX_ITEMS} items reached"}
+                        counts['invalid'] += 1
+                        break
+                    try:
+                        item = parse_batch_item(line)
+                    except ValueError as e:
+                        counts['invalid'] += 1
+                        yield {'index': index, 'status': 'invalid', 'error': str(e)}
+                        continue
+                    if item is None:
+                        continue
+                    execution_ids[index] = f"batch-{batch_id}-{index}"
+                    pending[pool.submit(run_item, index, item)] = index
+
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    record = future.result()
+                    counts[record['status']] += 1
+                    latencies.append(record['latency_ms'])
+                    yield record
+
+            latencies.sort()
+            total = sum(counts.values())
+            completed = True
+            logger.info(f"Batch {batch_id}: {total} items in {time.time() - started:.2f}s "
+                        f"({counts['succeeded']} succeeded, {counts['failed']} failed)")
+            yield {'summary': {
+                'workflow_uuid': str(workflow_uuid),
+                'items': total,
+                **counts,
+                'parallelism': parallelism,
+                'total_time_ms': round((time.time() - started) * 1000, 1),
+                'latency_ms': {
+                    'min': latencies[0] if latencies else None,
+                    'mean': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    'p50': percentile(latencies, 50),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None
+                }
+            }}
+        finally:
+            if not completed:
+                logger.info(f"Batch {batch_id} stopped early, cancelling {len(pending)} items")
+                for future, index in pending.items():
+                    future.cancel()
+                    self.workflow_service.cancel_workflow(workflow_uuid, execution_id=execution_ids[index])
+            pool.shutdown(wait=completed)
@@ -0,0 +1,206 @@
+"""
+Process-level cache of workflow definitions.
+
+Executions and variable lookups get the compiled plan of a workflow from
+here, without loading its ``nodes``/``edges`` from the database each time.
+The plan of a saved workflow is cached when it is saved, or on its first
+use after that.
+
+A cached plan is trusted while it is known to be current:
+
+- On PostgreSQL, saving a workflow sends a ``NOTIFY`` on the
+  ``workflow_changed`` channel in the saving transaction. A listener thread
+  in every worker process drops the plans that the notification makes
+  stale, so a hot workflow costs no database reads at all. A plan loaded
+  while a notification for its workflow arrives is not trusted until its
+  version is checked again, as it may predate the change.
+- Without a working listener (other databases, or while the listener
+  reconnects), a plan is revalidated with a ``SELECT updated_at`` once it
+  was last checked more than ``WORKFLOW_CACHE_CHECK_SECONDS`` ago.
+"""
+import os
+import select
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import text
+
+from .. import db
+from ..models import Workflow
+from .workflow_compiler import WorkflowPlan, cached_workflow_plan, get_workflow_plan, invalidate_workflow_plan
+from ..utils.ids import as_uuid
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('workflow_cache')
+
+NOTIFY_CHANNEL = 'workflow_changed'
+# Seconds between reconnection attempts of the listener
+LISTEN_RETRY_SECONDS = 5.0
+
+
+def _version(updated_at) -> str:
+    return updated_at.isoformat() if updated_at is not None else ''
+
+
+class WorkflowCache:
+    def __init__(self):
+        self.app = None
+        self.check_seconds = 5.0
+        self.listen_enabled = True
+        # workflow uuid -> time its cached plan was last confirmed current
+        self._checked = {}
+        # workflow uuid -> change notifications received, to spot those arriving during a load
+        self._notifications = {}
+        self._checked_lock = threading.Lock()
+        self._listening = threading.Event()
+        self._stopping = threading.Event()
+        self._listener = None
+        self._listener_pid = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        self.check_seconds = app.config.get('WORKFLOW_CACHE_CHECK_SECONDS', 5.0)
+        self.listen_enabled = app.config.get('WORKFLOW_CACHE_LISTEN', True)
+
+    @staticmethod
+    def _is_postgres() -> bool:
+        return db.engine.dialect.name == 'postgresql'
+
+    def get_plan(self, workflow_uuid) -> Optional[WorkflowPlan]:
+        """The compiled plan of a workflow, or None if it does not exist."""
+        self._ensure_listener()
+        key = str(workflow_uuid)
+        # Taken before reading the database: a change notified after this may be missing from what we read
+        notifications = self._notification_count(key)
+        plan = cached_workflow_plan(key)
+        if plan is not None:
+            with self._checked_lock:
+                checked_at = self._checked.get(key)
+            if checked_at is not None and (self._listening.is_set() or time.time() - checked_at < self.check_seconds):
+                return plan
+
+            # Version check: one narrow query instead of loading the definition
+            updated_at = db.session.query(Workflow.updated_at).filter(Workflow.uuid == as_uuid(key)).scalar()
+            if updated_at is None:
+                self.invalidate(key)
+                return None
+            if updated_at == plan.updated_at:
+                self._mark_checked(key, notifications)
+                return plan
+            logger.info(f"Workflow {key} changed since it was cached, reloading")
+
+        workflow = db.session.get(Workflow, as_uuid(key))
+        if workflow is None:
+            return None
+        return self.refresh(workflow, notifications)
+
+    def refresh(self, workflow, notifications: Optional[int] = None) -> WorkflowPlan:
+        """
+        Cache the plan of a just loaded or saved workflow.
+
+        ``notifications`` is the workflow's notification count from before it was
+        loaded; if more have arrived since, the plan is cached but not marked checked.
+        """
+        plan = get_workflow_plan(workflow)
+        self._mark_checked(str(workflow.uuid), notifications)
+        return plan
+
+    def invalidate(self, workflow_uuid) -> None:
+        key = str(workflow_uuid)
+        invalidate_workflow_plan(key)
+        with self._checked_lock:
+            self._checked.pop(key, None)
+
+    def notify_changed(self, workflow) -> None:
+        """Tell the other worker processes a workflow changed; call in the saving transaction, after a flush."""
+        if not self._is_postgres():
+            return
+        db.session.execute(text("SELECT pg_notify(:channel, :payload)"), {
+            'channel': NOTIFY_CHANNEL,
+            'payload': f"{workflow.uuid} {_version(workflow.updated_at)}"
+        })
+
+    def _notification_count(self, key: str) -> int:
+        with self._checked_lock:
+            return self._notifications.get(key, 0)
+
+    def _mark_checked(self, key: str, notifications: Optional[int] = None) -> None:
+        with self._checked_lock:
+            if notifications is not None and self._notifications.get(key, 0) != notifications:
+                logger.info(f"Workflow {key} changed while it was loaded, checking its version on next use")
+                self._checked.pop(key, None)
+                return
+            self._checked[key] = time.time()
+
+    def _on_notify(self, payload: str) -> None:
+        key, _, version = payload.partition(' ')
+        with self._checked_lock:
+            self._notifications[key] = self._notifications.get(key, 0) + 1
+        plan = cached_workflow_plan(key)
+        # This process's own saves are already cached at the new version
+        if plan is not None and _version(plan.updated_at) != version:
+            logger.info(f"Workflow {key} was changed by another process, dropping its cached plan")
+            self.invalidate(key)
+
+    def _ensure_listener(self) -> None:
+        if not self.listen_enabled or self.app is None:
+            return
+        # Threads do not survive a fork, so a forked worker starts its own
+        if self._listener is not None and self._listener_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                return
+            if not self._is_postgres():
+                self.listen_enabled = False
+                return
+            self._listening.clear()
+            self._stopping.clear()
+            self._listener = threading.Thread(target=self._listen_loop, name='workflow-cache-listener', daemon=True)
+            self._listener_pid = os.getpid()
+            self._listener.start()
+
+    def _listen_loop(self) -> None:
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                with self.app.app_context():
+                    raw_connection = db.engine.raw_connection()
+                # LISTEN needs a long-lived autocommit connection of its own, outside the pool
+                raw_connection.detach()
+                connection = raw_connection.driver_connection
+                connection.autocommit = True
+                connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Notifications may have been missed while disconnected
+                with self._checked_lock:
+                    self._checked.clear()
+                self._listening.set()
+                logger.info(f"Listening for workflow changes on channel {NOTIFY_CHANNEL}")
+
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [], LISTEN_RETRY_SECONDS) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self._on_notify(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Workflow change listener failed, checking versions until it reconnects: {str(e)}")
+            finally:
+                self._listening.clear()
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            self._stopping.wait(LISTEN_RETRY_SECONDS)
+
+    def shutdown(self) -> None:
+        self._stopping.set()
+        if self._listener is not None:
+            self._listener.join(timeout=LISTEN_RETRY_SECONDS + 1)
+        self._listener = None
+
+
+workflow_cache = WorkflowCache()
@@ -0,0 +1,495 @@
+"""
+Compile a workflow's nodes and edges into an immutable execution plan.
+
+The plan holds everything the executor used to rebuild on every request:
+the node index, incoming/outgoing adjacency in edge order, topological
+levels, the branch maps of classifier and ifelse nodes, the workflows called
+by sub-workflow nodes and the variable references (``{{node_id.var_name}}``)
+used in each node's settings.
+Plans are cached per workflow UUID and ``updated_at``, so the graph work
+is O(V+E) once per save instead of once per run.
+
+Compiling also validates the graph. Errors (duplicate node IDs, edges to
+unknown nodes, cycles, several start nodes, nodes that can never run,
+sub-workflow nodes without a workflow to call) make a workflow invalid and are rejected when it is saved. Warnings flag nodes
+that are unreachable from the start node; those are pruned from the
+schedule together with the nodes that can never run, so the executor
+never waits on them.
+"""
+import re
+import copy
+import threading
+from collections import OrderedDict, deque
+from types import MappingProxyType, SimpleNamespace
+from typing import Dict, List, NamedTuple, Optional
+
+from .node_policy import node_option
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('workflow_compiler')
+
+VARIABLE_PATTERN = re.compile(r'\{\{\s*([^}]+?)\s*\}\}')
+
+CONDITIONAL_NODE_TYPES = ('classifier', 'ifelse')
+SUBWORKFLOW_NODE_TYPE = 'subworkflow'
+
+# Error codes of a workflow validation
+DUPLICATE_NODE = 'duplicate_node'
+MISSING_NODE_ID = 'missing_node_id'
+DANGLING_EDGE = 'dangling_edge'
+CYCLE = 'cycle'
+MULTIPLE_START_NODES = 'multiple_start_nodes'
+UNSATISFIABLE_JOIN = 'unsatisfiable_join'
+MISSING_SUBWORKFLOW = 'missing_subworkflow'
+# Checked by WorkflowService on save, against the saved workflows
+UNKNOWN_SUBWORKFLOW = 'unknown_subworkflow'
+SUBWORKFLOW_CYCLE = 'subworkflow_cycle'
+# Warning codes
+NO_START_NODE = 'no_start_node'
+UNREACHABLE_NODE = 'unreachable_node'
+DANGLING_BRANCH = 'dangling_branch'
+
+PLAN_CACHE_SIZE = 256
+
+
+class VariableRef(NamedTuple):
+    """A parsed ``{{node_id.var_name}}`` reference."""
+    raw: str
+    node_id: Optional[str]
+    var_name: Optional[str]
+
+
+def parse_variable_ref(raw: str) -> VariableRef:
+    """Split ``node_id.var_name``; references without exactly one dot are kept unresolved."""
+    raw = raw.strip()
+    parts = raw.split('.')
+    if len(parts) != 2:
+        return VariableRef(raw, None, None)
+    return VariableRef(raw, parts[0], parts[1])
+
+
+def find_variable_refs(value) -> List[VariableRef]:
+    """Collect the variable references in a (possibly nested) settings value."""
+    refs = []
+    if isinstance(value, str):
+        if '{{' in value:
+            refs.extend(parse_variable_ref(match) for match in VARIABLE_PATTERN.findall(value))
+    elif isinstance(value, dict):
+        for item in value.values():
+            refs.extend(find_variable_refs(item))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            refs.extend(find_variable_refs(item))
+    return refs
+
+
+class WorkflowIssue(NamedTuple):
+    """A validation error or warning, with the nodes it concerns."""
+    code: str
+    message: str
+    node_ids: tuple = ()
+
+    def to_dict(self) -> dict:
+        return {'code': self.code, 'message': self.message, 'node_ids': list(self.node_ids)}
+
+
+class WorkflowValidation(NamedTuple):
+    """Result of validating a workflow graph."""
+    errors: tuple
+    warnings: tuple
+    pruned_ids: frozenset
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> dict:
+        return {
+            'valid': self.is_valid,
+            'errors': [issue.to_dict() for issue in self.errors],
+            'warnings': [issue.to_dict() for issue in self.warnings],
+            'pruned_node_ids': sorted(self.pruned_ids)
+        }
+
+
+class WorkflowPlan:
+    """
+    Immutable, precomputed execution graph of one workflow version.
+
+    The node dicts in ``node_map`` are private copies of ``Workflow.nodes``
+    shared by every run of the plan; executors must treat them as read-only.
+    Values derived from the plan on demand are kept with it (see ``derived``),
+    so they are dropped together with a stale plan.
+    """
+
+    __slots__ = (
+        'workflow_uuid', 'workflow_name', 'updated_at', 'node_ids', 'node_map', 'node_types',
+        'in_edges', 'out_edges', 'in_degree', 'levels', 'start_node_id',
+        'terminal_ids', 'branch_maps', 'subworkflow_ids', 'variable_refs', 'has_cycle', 'validation',
+        '_derived'
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__[:-1]:
+            object.__setattr__(self, name, fields[name])
+        object.__setattr__(self, '_derived', {})
+
+    def __setattr__(self, name, value):
+        raise AttributeError('WorkflowPlan is immutable')
+
+    @property
+    def pruned_ids(self) -> frozenset:
+        """Nodes left out of the schedule: unreachable from the start node or never runnable."""
+        return self.validation.pruned_ids
+
+    @property
+    def start_node(self) -> Optional[dict]:
+        return self.node_map.get(self.start_node_id) if self.start_node_id else None
+
+    def node_type(self, node_id: str) -> Optional[str]:
+        return self.node_types.get(node_id)
+
+    def derived(self, key, compute):
+        """Value derived from the plan, computed by ``compute()`` on first use and kept with the plan."""
+        value = self._derived.get(key)
+        if value is None:
+            value = self._derived.setdefault(key, compute())
+        return value
+
+    def first_predecessor(self, node_id: str) -> Optional[str]:
+        """Source of the first edge into ``node_id`` (in edge order), used as the node's input."""
+        sources = self.in_edges.get(node_id, ())
+        return sources[0] if sources else None
+
+    def branch_target(self, node_id: str, branch: str) -> Optional[str]:
+        """Node selected by a classifier class name or an ifelse branch ('if', 'elif-<n>', 'else')."""
+        return self.branch_maps.get(node_id, {}).get(branch)
+
+    def subworkflow_id(self, node_id: str) -> Optional[str]:
+        """UUID of the workflow a sub-workflow node calls."""
+        return self.subworkflow_ids.get(node_id)
+
+    def ancestors(self, node_id: str) -> List[str]:
+        """Nodes with a path to ``node_id``, in depth-first order along the incoming edges."""
+        seen, order = set(), []
+        pending = list(reversed(self.in_edges.get(node_id, ())))
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            order.append(current)
+            pending.extend(reversed(self.in_edges.get(current, ())))
+        return order
+
+
+def subworkflow_target(node_data: dict) -> Optional[str]:
+    """UUID of the workflow called by a sub-workflow node, from its ``workflow_id``."""
+    target = node_data.get('workflow_id')
+    return str(target).strip() if target else None
+
+
+def _branch_map(node_type: str, settings: dict) -> Dict[str, str]:
+    next_steps = settings.get('nextSteps') or {}
+    if not isinstance(next_steps, dict):
+        return {}
+    if node_type == 'classifier':
+        return {str(name): target for name, target in next_steps.items() if target}
+
+    branches = {}
+    if next_steps.get('if'):
+        branches['if'] = next_steps['if']
+    elifs = next_steps.get('elif')
+    if isinstance(elifs, list):
+        for index, target in enumerate(elifs):
+            if target:
+                branches[f'elif-{index}'] = target
+    if next_steps.get('else'):
+        branches['else'] = next_steps['else']
+    return branches
+
+
+def _possible_branches(node_type: str, node_data: dict) -> List[str]:
+    """Branches a classifier or ifelse node can select at run time."""
+    settings = node_data.get('settings') or {}
+    if node_type == 'classifier':
+        classes = settings.get('classes') or []
+        names = [str(c['name']) for c in classes if isinstance(c, dict) and c.get('name') is not None]
+        # Without classes the classifier answers 'Unknown'
+        branches = names or ['Unknown']
+    else:
+        conditions = settings.get('conditions') or []
+        branches = ['else']
+        if conditions:
+            branches = ['if'] + [f'elif-{index}' for index in range(len(conditions) - 1)] + ['else']
+    fallback_branch = node_option(node_data, 'fallbackBranch')
+    if fallback_branch is not None:
+        branches.append(str(fallback_branch))
+    return branches
+
+
+def _validate_schedule(node_ids, node_map, node_types, in_edges, out_edges, branch_maps, start_node_id):
+    """
+    Find the nodes that can never be scheduled from the start node.
+
+    A node runs once every node with an edge into it has run and released it;
+    a classifier or ifelse node only releases the target of the branch it
+    selects, or all its successors when the branch has no target. A node that
+    needs two different branches of the same conditional node can never run.
+    """
+    errors, warnings = [], []
+
+    reachable = {start_node_id}
+    pending = [start_node_id]
+    while pending:
+        node_id = pending.pop()
+        for target_id in out_edges[node_id]:
+            if target_id not in reachable:
+                reachable.add(target_id)
+                pending.append(target_id)
+    unreachable = [node_id for node_id in node_ids if node_id not in reachable]
+    if unreachable:
+        warnings.append(WorkflowIssue(
+            UNREACHABLE_NODE,
+            f"{len(unreachable)} node(s) cannot be reached from the start node and are skipped: {', '.join(unreachable)}",
+            tuple(unreachable)))
+
+    # Branches that decide each conditional node's successors, when none of them falls through
+    exclusive_targets = {}
+    for node_id, branches in branch_maps.items():
+        possible = _possible_branches(node_types[node_id], node_map[node_id].get('data', {}))
+        if all(branch in branches for branch in possible):
+            exclusive_targets[node_id] = {branches[branch] for branch in possible}
+
+    # Branch choices every run of a node depends on, as {conditional node: selected target}
+    choices = {start_node_id: {}}
+    never_runs = {}
+    order = _topological_order(node_ids, in_edges, out_edges, start_node_id)
+    for node_id in order:
+        if node_id == start_node_id or node_id not in reachable:
+            continue
+        required = {}
+        reason = None
+        for source_id in in_edges[node_id]:
+            if source_id not in choices:
+                reason = f"it waits for node {source_id}, which never runs"
+                break
+            if source_id in exclusive_targets and node_id not in exclusive_targets[source_id]:
+                reason = f"no branch of node {source_id} leads to it"
+                break
+            for conditional_id, target_id in list(choices[source_id].items()) + (
+                    [(source_id, node_id)] if source_id in exclusive_targets else []):
+                if required.setdefault(conditional_id, target_id) != target_id:
+                    reason = (f"it waits for both the {required[conditional_id]} and the {target_id} "
+                              f"branches of node {conditional_id}, and only one of them is taken")
+                    break
+            if reason:
+                break
+        if reason:
+            never_runs[node_id] = reason
+        else:
+            choices[node_id] = required
+
+    for node_id, reason in never_runs.items():
+        errors.append(WorkflowIssue(UNSATISFIABLE_JOIN, f"Node {node_id} can never run: {reason}", (node_id,)))
+
+    return errors, warnings, frozenset(unreachable) | frozenset(never_runs)
+
+
+def _topological_order(node_ids, in_edges, out_edges, start_node_id) -> List[str]:
+    """Kahn's order of an acyclic graph, ignoring edges into the start node (it always runs first)."""
+    remaining = {node_id: len(in_edges[node_id]) for node_id in node_ids}
+    remaining[start_node_id] = 0
+    ready = deque(node_id for node_id in node_ids if remaining[node_id] == 0)
+    order = []
+    while ready:
+        node_id = ready.popleft()
+        order.append(node_id)
+        for target_id in out_edges[node_id]:
+            if target_id == start_node_id:
+                continue
+            remaining[target_id] -= 1
+            if remaining[target_id] == 0:
+                ready.append(target_id)
+    return order
+
+
+def compile_workflow(workflow) -> WorkflowPlan:
+    """Build and validate the execution plan of a workflow model (or any object with nodes, edges, uuid, updated_at)."""
+    nodes = copy.deepcopy(workflow.nodes or [])
+    edges = workflow.edges or []
+    errors, warnings = [], []
+
+    node_map, node_types, node_ids = {}, {}, []
+    for index, node in enumerate(nodes):
+        node_id = node.get('id') if isinstance(node, dict) else None
+        if node_id is None:
+            errors.append(WorkflowIssue(MISSING_NODE_ID, f"Node at position {index} has no id"))
+            continue
+        if node_id in node_map:
+            errors.append(WorkflowIssue(DUPLICATE_NODE, f"Node id {node_id} is used by more than one node", (node_id,)))
+            continue
+        node_map[node_id] = node
+        node_types[node_id] = node.get('data', {}).get('nodeType')
+        node_ids.append(node_id)
+
+    in_edges = {node_id: [] for node_id in node_ids}
+    out_edges = {node_id: [] for node_id in node_ids}
+    for edge in edges:
+        source_id, target_id = edge.get('source'), edge.get('target')
+        if source_id not in node_map or target_id not in node_map:
+            logger.warning(f"Ignoring edge {source_id} -> {target_id} of workflow {workflow.uuid}: unknown node")
+            unknown = [node_id for node_id in (source_id, target_id) if node_id not in node_map]
+            errors.append(WorkflowIssue(
+                DANGLING_EDGE,
+                f"Edge {source_id} -> {target_id} refers to unknown node(s): "
+                f"{', '.join(str(node_id) for node_id in unknown)}",
+                tuple(node_id for node_id in (source_id, target_id) if node_id in node_map)))
+            continue
+        out_edges[source_id].append(target_id)
+        in_edges[target_id].append(source_id)
+
+    # Kahn's algorithm; a node's level is the length of the longest path reaching it
+    in_degree = {node_id: len(sources) for node_id, sources in in_edges.items()}
+    remaining = dict(in_degree)
+    level_of = {}
+    ready = deque(node_id for node_id in node_ids if remaining[node_id] == 0)
+    for node_id in ready:
+        level_of[node_id] = 0
+    # Only nodes released by all their predecessors are ordered; the rest are on or after a cycle
+    ordered = set()
+    while ready:
+        node_id = ready.popleft()
+        ordered.add(node_id)
+        for target_id in out_edges[node_id]:
+            level_of[target_id] = max(level_of.get(target_id, 0), level_of[node_id] + 1)
+            remaining[target_id] -= 1
+            if remaining[target_id] == 0:
+                ready.append(target_id)
+    has_cycle = len(ordered) < len(node_ids)
+    if has_cycle:
+        logger.warning(f"Workflow {workflow.uuid} contains a cycle; "
+                       f"{len(node_ids) - len(ordered)} nodes have no topological level")
+        cyclic = tuple(node_id for node_id in node_ids if node_id not in ordered)
+        errors.append(WorkflowIssue(
+            CYCLE, f"The workflow contains a cycle through or after node(s): {', '.join(cyclic)}", cyclic))
+
+    branch_maps, subworkflow_ids, variable_refs = {}, {}, {}
+    for node_id, node in node_map.items():
+        settings = node.get('data', {}).get('settings', {}) or {}
+        if node_types[node_id] in CONDITIONAL_NODE_TYPES:
+            branch_maps[node_id] = MappingProxyType(_branch_map(node_types[node_id], settings))
+            for branch, target_id in branch_maps[node_id].items():
+                if target_id not in node_map or target_id not in out_edges[node_id]:
+                    warnings.append(WorkflowIssue(
+                        DANGLING_BRANCH,
+                        f"Branch '{branch}' of node {node_id} points to {target_id}, "
+                        f"which {'does not exist' if target_id not in node_map else 'is not connected to it'}",
+                        (node_id,)))
+        if node_types[node_id] == SUBWORKFLOW_NODE_TYPE:
+            target = subworkflow_target(node.get('data', {}))
+            if target:
+                subworkflow_ids[node_id] = target
+            else:
+                errors.append(WorkflowIssue(
+                    MISSING_SUBWORKFLOW, f"Sub-workflow node {node_id} does not select a workflow to call", (node_id,)))
+        refs = find_variable_refs(node.get('data', {}))
+        if refs:
+            variable_refs[node_id] = tuple(refs)
+
+    start_ids = [node_id for node_id in node_ids if node_types[node_id] == 'start']
+    start_node_id = start_ids[0] if start_ids else None
+    if len(start_ids) > 1:
+        errors.append(WorkflowIssue(
+            MULTIPLE_START_NODES, f"The workflow has {len(start_ids)} start nodes; only one is allowed", tuple(start_ids)))
+    elif node_ids and not start_ids:
+        warnings.append(WorkflowIssue(NO_START_NODE, "The workflow has no start node and cannot be run"))
+
+    pruned_ids = frozenset()
+    # Branch joins are only checked from a single start node
+    if len(start_ids) == 1 and not has_cycle:
+        schedule_errors, schedule_warnings, pruned_ids = _validate_schedule(
+            node_ids, node_map, node_types, in_edges, out_edges, branch_maps, start_node_id)
+        errors.extend(schedule_errors)
+        warnings.extend(schedule_warnings)
+    validation = WorkflowValidation(tuple(errors), tuple(warnings), pruned_ids)
+
+    # Pruned nodes are never scheduled: no levels, and no edges leading to them
+    levels = []
+    for node_id in node_ids:
+        if node_id in ordered and node_id not in pruned_ids:
+            while len(levels) <= level_of[node_id]:
+                levels.append([])
+            levels[level_of[node_id]].append(node_id)
+    while levels and not levels[-1]:
+        levels.pop()
+    scheduled_out_edges = {node_id: tuple(target_id for target_id in targets if target_id not in pruned_ids)
+                           for node_id, targets in out_edges.items()}
+
+    return WorkflowPlan(
+        workflow_uuid=str(workflow.uuid),
+        workflow_name=getattr(workflow, 'name', None),
+        updated_at=workflow.updated_at,
+        node_ids=tuple(node_ids),
+        node_map=MappingProxyType(node_map),
+        node_types=MappingProxyType(node_types),
+        in_edges=MappingProxyType({node_id: tuple(sources) for node_id, sources in in_edges.items()}),
+        out_edges=MappingProxyType(scheduled_out_edges),
+        in_degree=MappingProxyType(in_degree),
+        levels=tuple(tuple(level) for level in levels),
+        start_node_id=start_node_id,
+        terminal_ids=frozenset(node_id for node_id in node_ids
+                               if node_id not in pruned_ids and not scheduled_out_edges[node_id]),
+        branch_maps=MappingProxyType(branch_maps),
+        subworkflow_ids=MappingProxyType(subworkflow_ids),
+        variable_refs=MappingProxyType(variable_refs),
+        has_cycle=has_cycle,
+        validation=validation
+    )
+
+
+def validate_workflow(nodes, edges) -> WorkflowValidation:
+    """Validate nodes and edges as they would be saved."""
+    draft = SimpleNamespace(uuid=None, name=None, updated_at=None, nodes=nodes, edges=edges)
+    return compile_workflow(draft).validation
+
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def get_workflow_plan(workflow) -> WorkflowPlan:
+    """Return the cached plan of a workflow, compiling it when missing or older than ``updated_at``."""
+    key = str(workflow.uuid)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None and plan.updated_at == workflow.updated_at:
+            _plan_cache.move_to_end(key)
+            return plan
+
+    plan = compile_workflow(workflow)
+    logger.info(f"Compiled workflow {key}: {len(plan.node_ids)} nodes in {len(plan.levels)} levels")
+    if plan.pruned_ids:
+        logger.warning(f"Workflow {key}: {len(plan.pruned_ids)} nodes are never scheduled: {', '.join(sorted(plan.pruned_ids))}")
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        _plan_cache.move_to_end(key)
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return plan
+
+
+def cached_workflow_plan(workflow_uuid) -> Optional[WorkflowPlan]:
+    """The cached plan of a workflow, without checking that it is current."""
+    key = str(workflow_uuid)
+    with _plan_cache_lock:
+        plan = _plan_cache.get(key)
+        if plan is not None:
+            _plan_cache.move_to_end(key)
+        return plan
+
+
+def invalidate_workflow_plan(workflow_uuid) -> None:
+    """Drop the cached plan of a workflow (called when it is saved)."""
+    with _plan_cache_lock:
+        _plan_cache.pop(str(workflow_uuid), None)
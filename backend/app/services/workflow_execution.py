@@ -0,0 +1,206 @@
+"""
+Per-run state of a workflow execution.
+
+``WorkflowService`` is shared by every request of a worker, so anything that
+belongs to a single run (its ID, progress counters, timings, cancel token and
+the lock guarding its context) lives on a ``WorkflowExecution`` instead. The
+execution travels with the run in ``context['execution']`` and is registered
+while it runs, so other threads can look it up by ID (e.g. to cancel it).
+
+An optional listener receives the run's progress events as they happen
+(``node_started``, ``node_finished``, ``node_failed`` and ``token``), which is
+what the streaming execution endpoint forwards to the client.
+
+A sub-workflow node runs its callee under a child execution (see ``child``),
+which is not registered: cancelling the calling run stops it.
+"""
+import time
+import threading
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from ..utils.exc import WorkflowCancelledError, WorkflowDeadlineExceededError
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('workflow_execution')
+
+
+def _size(value) -> Optional[int]:
+    """Size in bytes of a node input or output, as text."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return len(value)
+    return len(str(value).encode('utf-8'))
+
+
+class WorkflowExecution:
+    """Run state, cancel token and metrics of one workflow execution."""
+
+    def __init__(self, execution_id: str, workflow_uuid, node_count: int = 0,
+                 listener: Optional[Callable[[str, dict], None]] = None, deadline_seconds: Optional[float] = None):
+        self.execution_id = execution_id
+        self.workflow_uuid = str(workflow_uuid)
+        self.node_count = node_count
+        self.nodes_executed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        # Epoch time by which the run must finish; node timeouts shrink to fit it
+        self.deadline = self.started_at + deadline_seconds if deadline_seconds else None
+        # Set to ask the run to stop; checked between nodes, LLM tokens, agent steps and HTTP chunks
+        self.cancel_event = threading.Event()
+        # Guards the run's context, counters and conversation memory writes
+        self.lock = threading.RLock()
+        # node id -> execution time in seconds
+        self.node_times: Dict[str, float] = {}
+        # Called with (event, data) for every progress event of the run
+        self.listener = listener
+        # node id -> time the node became ready to run, for its queue wait
+        self.ready_at: Dict[str, float] = {}
+        # One record per node attempt, saved to workflow_node_trace when the run ends
+        self.traces: List[dict] = []
+
+    def child(self, workflow_uuid, cancel_event=None, deadline: Optional[float] = None,
+              listener: Optional[Callable[[str, dict], None]] = None) -> 'WorkflowExecution':
+        """
+        Execution of a sub-workflow run inline by this one.
+
+        It shares this run's ID, lock and trace records, so the callee's nodes are
+        traced under the calling run. It stops on ``cancel_event`` (default: this
+        run's) and at ``deadline`` (default: this run's).
+        """
+        child = WorkflowExecution(self.execution_id, workflow_uuid, listener=listener)
+        child.cancel_event = cancel_event if cancel_event is not None else self.cancel_event
+        child.deadline = deadline if deadline is not None else self.deadline
+        child.lock = self.lock
+        child.traces = self.traces
+        return child
+
+    @property
+    def streaming(self) -> bool:
+        return self.listener is not None
+
+    def emit(self, event: str, data: dict) -> None:
+        """Send a progress event to the listener; listener errors never fail the run."""
+        if self.listener is None:
+            return
+        try:
+            self.listener(event, data)
+        except Exception as e:
+            logger.warning(f"Execution {self.execution_id}: listener failed on {event} event: {str(e)}")
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self) -> None:
+        if not self.cancel_event.is_set():
+            logger.info(f"Cancelling execution {self.execution_id} of workflow {self.workflow_uuid}")
+        self.cancel_event.set()
+
+    def check_cancelled(self) -> None:
+        """Raise ``WorkflowCancelledError`` if the run has been cancelled."""
+        if self.cancel_event.is_set():
+            raise WorkflowCancelledError(f"Workflow execution {self.execution_id} was cancelled")
+
+    @property
+    def deadline_exceeded(self) -> bool:
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def check_deadline(self) -> None:
+        """Raise ``WorkflowDeadlineExceededError`` if the run has reached its deadline."""
+        if self.deadline_exceeded:
+            raise WorkflowDeadlineExceededError(
+                f"Workflow execution {self.execution_id} exceeded its deadline of {self.deadline - self.started_at:.1f}s")
+
+    def node_ready(self, node_id: str) -> None:
+        """Note that a node's dependencies are satisfied; its queue wait runs from here."""
+        self.ready_at[node_id] = time.time()
+
+    def record_node_trace(self, node_id: str, node_type: str, status: str, started_at: float, attempt: int = 1,
+                          input_data=None, output=None, usage: Optional[dict] = None,
+                          cache_hit: Optional[bool] = None) -> None:
+        """Record the timing and sizes of one node attempt that ended now."""
+        finished_at = time.time()
+        ready_at = self.ready_at.get(node_id)
+        record = {
+            'workflow_uuid': uuid.UUID(self.workflow_uuid),
+            'execution_id': self.execution_id,
+            'node_id': node_id,
+            'node_type': node_type,
+            'status': status,
+            'attempt': attempt,
+            'started_at': datetime.utcfromtimestamp(started_at),
+            'finished_at': datetime.utcfromtimestamp(finished_at),
+            'duration_ms': round((finished_at - started_at) * 1000, 3),
+            'queue_wait_ms': round(max(0.0, started_at - ready_at) * 1000, 3) if ready_at and attempt == 1 else None,
+            'bytes_in': _size(input_data),
+            'bytes_out': _size(output),
+            'prompt_tokens': (usage or {}).get('prompt_tokens'),
+            'completion_tokens': (usage or {}).get('completion_tokens'),
+            'cache_hit': cache_hit
+        }
+        with self.lock:
+            self.traces.append(record)
+
+    def node_completed(self, node_id: str, execution_time: Optional[float] = None) -> None:
+        """Count a finished node and record its execution time."""
+        with self.lock:
+            self.nodes_executed += 1
+            if execution_time is not None:
+                self.node_times[node_id] = execution_time
+
+    def finish(self) -> None:
+        if self.finished_at is None:
+            self.finished_at = time.time()
+
+    @property
+    def execution_time(self) -> float:
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def progress(self) -> str:
+        return f"{self.nodes_executed}/{self.node_count}"
+
+    def to_dict(self) -> dict:
+        return {
+            'execution_id': self.execution_id,
+            'workflow_uuid': self.workflow_uuid,
+            'nodes_executed': self.nodes_executed,
+            'total_nodes': self.node_count,
+            'execution_time': self.execution_time,
+            'cancelled': self.cancelled,
+            'deadline': self.deadline,
+            'node_times': dict(self.node_times)
+        }
+
+
+_active_executions: Dict[str, WorkflowExecution] = {}
+_active_executions_lock = threading.Lock()
+
+
+def register_execution(execution: WorkflowExecution) -> None:
+    with _active_executions_lock:
+        _active_executions[execution.execution_id] = execution
+
+
+def unregister_execution(execution: WorkflowExecution) -> None:
+    with _active_executions_lock:
+        if _active_executions.get(execution.execution_id) is execution:
+            del _active_executions[execution.execution_id]
+
+
+def get_execution(execution_id: str) -> Optional[WorkflowExecution]:
+    """Return the running execution with the given ID, if any in this process."""
+    with _active_executions_lock:
+        return _active_executions.get(execution_id)
+
+
+def list_executions(workflow_uuid=None) -> List[WorkflowExecution]:
+    """Running executions of this process, optionally of one workflow only."""
+    with _active_executions_lock:
+        executions = list(_active_executions.values())
+    if workflow_uuid is not None:
+        executions = [execution for execution in executions if execution.workflow_uuid == str(workflow_uuid)]
+    return executions
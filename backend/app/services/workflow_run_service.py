@@ -0,0 +1,410 @@
+"""
+Asynchronous workflow runs.
+
+``enqueue`` stores a ``WorkflowRun`` row and returns at once; a dispatcher
+thread in every worker process claims queued rows and executes them on a
+bounded thread pool, or, with ``WORKFLOW_RUN_ENGINE=async``, as coroutines of
+the async workflow engine (up to ``WORKFLOW_RUN_ASYNC_MAX_IN_FLIGHT`` runs
+per process, see async_workflow_engine). Claims are atomic (``UPDATE ... WHERE status = 'queued'``),
+so several processes can share the queue, and the concurrency limits per
+workflow and per API key are counted over the running rows of all of them.
+
+Running rows are heartbeated by their worker. Rows whose heartbeat goes
+stale, e.g. after a crash or a restart, are queued again, up to
+``WORKFLOW_RUN_MAX_ATTEMPTS`` executions.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from datetime import datetime, timedelta
+
+from .. import db
+from ..models import Workflow, WorkflowRun
+from .async_workflow_engine import async_workflow_engine
+from .workflow_execution import get_execution
+from ..utils.ids import as_uuid
+from ..utils.exc import WorkflowCancelledError
+from ..utils.logging_utils import setup_logger, set_process_id
+
+logger = setup_logger('workflow_run_service')
+
+# Queued rows inspected per dispatch round
+CLAIM_BATCH_SIZE = 100
+
+
+def _to_json(value):
+    """Round-trip through JSON so results with non-JSON values can be stored."""
+    return json.loads(json.dumps(value, default=str))
+
+
+class WorkflowRunService:
+    def __init__(self):
+        self.app = None
+        self.workflow_service = None
+        self.enabled = False
+        # 'threads' executes each run on a pool thread, 'async' on the async workflow engine
+        self.engine = 'threads'
+        self.max_workers = 4
+        self.max_in_flight = 1000
+        self.max_per_workflow = 2
+        self.max_per_api_key = 2
+        self.poll_seconds = 1.0
+        self.stale_seconds = 60
+        self.max_attempts = 3
+        self.worker_id = None
+        self._pool = None
+        self._dispatcher = None
+        self._dispatcher_pid = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # run uuid -> future of the runs executing in this process
+        self._running = {}
+        self._running_lock = threading.Lock()
+
+    def init_app(self, app):
+        """Read the run settings and re-queue runs interrupted by a previous shutdown."""
+        from .workflow_service import WorkflowService
+
+        self.app = app
+        self.enabled = app.config.get('WORKFLOW_RUN_WORKERS_ENABLED', True)
+        self.engine = app.config.get('WORKFLOW_RUN_ENGINE', 'threads')
+        self.max_workers = max(1, app.config.get('WORKFLOW_RUN_WORKERS', 4))
+        self.max_in_flight = max(1, app.config.get('WORKFLOW_RUN_ASYNC_MAX_IN_FLIGHT', 1000))
+        self.max_per_workflow = app.config.get('WORKFLOW_RUN_MAX_PER_WORKFLOW', 2)
+        self.max_per_api_key = app.config.get('WORKFLOW_RUN_MAX_PER_API_KEY', 2)
+        self.poll_seconds = app.config.get('WORKFLOW_RUN_POLL_SECONDS', 1.0)
+        self.stale_seconds = app.config.get('WORKFLOW_RUN_STALE_SECONDS', 60)
+        self.max_attempts = app.config.get('WORKFLOW_RUN_MAX_ATTEMPTS', 3)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.workflow_service = WorkflowService()
+
+        if not self.enabled:
+            logger.info("Workflow run workers disabled; runs are only queued by this process")
+            return
+
+        with app.app_context():
+            try:
+                requeued = self.requeue_interrupted_runs(startup=True)
+                has_queued = db.session.query(WorkflowRun.uuid).filter_by(status=WorkflowRun.STATUS_QUEUED).first() is not None
+            except Exception as e:
+                logger.error(f"Could not recover workflow runs: {str(e)}")
+                db.session.rollback()
+                return
+        if requeued:
+            logger.info(f"Re-queued {requeued} interrupted workflow runs")
+        if has_queued:
+            self.start()
+
+    def start(self):
+        """Start the dispatcher and the run pool of this process, if not running yet."""
+        if not self.enabled:
+            return
+        with self._start_lock:
+            # Threads do not survive a fork, so a forked worker starts its own
+            if self._dispatcher is not None and self._dispatcher.is_alive() and self._dispatcher_pid == os.getpid():
+                return
+            self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+            self._stopping.clear()
+            self._running = {}
+            if self.engine != 'async':
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='workflow-run')
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='workflow-run-dispatcher', daemon=True)
+            self._dispatcher_pid = os.getpid()
+            self._dispatcher.start()
+            if self.engine == 'async':
+                logger.info(f"Started workflow run dispatcher {self.worker_id} with up to {self.max_in_flight} "
+                            f"runs in flight on the async engine")
+            else:
+                logger.info(f"Started workflow run dispatcher {self.worker_id} with {self.max_workers} workers")
+
+    @property
+    def capacity(self):
+        """Runs this process executes at once."""
+        return self.max_in_flight if self.engine == 'async' else self.max_workers
+
+    def shutdown(self, wait=True):
+        """Stop dispatching; with ``wait``, block until the runs in progress finish."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._dispatcher is not None:
+            self._dispatcher.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+        elif wait:
+            with self._running_lock:
+                running = list(self._running.values())
+            futures_wait(running)
+        self._dispatcher = None
+        self._pool = None
+
+    def enqueue(self, workflow_uuid, input_data=None, conversation_id=None, files=None,
+                api_key_uuid=None, created_by=None):
+        """Queue a workflow run and return its ``WorkflowRun`` row."""
+        workflow_uuid = as_uuid(workflow_uuid)
+        if db.session.get(Workflow, workflow_uuid) is None:
+            raise ValueError(f"Workflow {workflow_uuid} not found")
+
+        run = WorkflowRun(
+            workflow_uuid=workflow_uuid,
+            api_key_uuid=as_uuid(api_key_uuid),
+            created_by=created_by,
+            status=WorkflowRun.STATUS_QUEUED,
+            input=input_data,
+            conversation_id=as_uuid(conversation_id),
+            files=files or []
+        )
+        db.session.add(run)
+        db.session.commit()
+        logger.info(f"Queued run {run.uuid} of workflow {workflow_uuid}")
+
+        self.start()
+        self._wakeup.set()
+        return run
+
+    def get_run(self, run_uuid):
+        return db.session.get(WorkflowRun, as_uuid(run_uuid))
+
+    def cancel_run(self, run_uuid):
+        """Cancel a queued run, or ask the worker executing it to stop. Returns the run, or None."""
+        run = self.get_run(run_uuid)
+        if run is None or run.is_finished:
+            return run
+
+        now = datetime.utcnow()
+        cancelled = WorkflowRun.query.filter_by(uuid=run.uuid, status=WorkflowRun.STATUS_QUEUED).update(
+            {'status': WorkflowRun.STATUS_CANCELLED, 'cancel_requested': True, 'finished_at': now},
+            synchronize_session=False
+        )
+        if not cancelled:
+            # Already claimed: the worker picks the flag up on its next heartbeat
+            WorkflowRun.query.filter_by(uuid=run.uuid).update({'cancel_requested': True}, synchronize_session=False)
+        db.session.commit()
+        db.session.refresh(run)
+
+        execution = get_execution(str(run.uuid))
+        if execution is not None:
+            execution.cancel()
+        logger.info(f"Cancellation of run {run.uuid} requested (status: {run.status})")
+        return run
+
+    def requeue_interrupted_runs(self, startup=False):
+        """
+        Queue again the running rows whose worker stopped heartbeating.
+
+        At startup, the rows claimed under this process's worker ID (same host and
+        PID, e.g. a restarted container) are interrupted whatever their heartbeat.
+        Runs that already used all their attempts are failed instead.
+        """
+        stale_before = datetime.utcnow() - timedelta(seconds=self.stale_seconds)
+        with self._running_lock:
+            local_runs = [as_uuid(run_uuid) for run_uuid in self._running]
+
+        interrupted = WorkflowRun.query.filter(WorkflowRun.status == WorkflowRun.STATUS_RUNNING)
+        if startup:
+            interrupted = interrupted.filter(db.or_(
+                WorkflowRun.worker_id == self.worker_id,
+                WorkflowRun.heartbeat_at.is_(None),
+                WorkflowRun.heartbeat_at < stale_before
+            ))
+        else:
+            interrupted = interrupted.filter(db.or_(
+                WorkflowRun.heartbeat_at.is_(None),
+                WorkflowRun.heartbeat_at < stale_before
+            ))
+        if local_runs:
+            interrupted = interrupted.filter(WorkflowRun.uuid.notin_(local_runs))
+
+        requeued = 0
+        for run in interrupted.all():
+            if run.cancel_requested or run.attempts >= self.max_attempts:
+                run.status = WorkflowRun.STATUS_CANCELLED if run.cancel_requested else WorkflowRun.STATUS_FAILED
+                run.error = run.error or f"Run interrupted after {run.attempts} attempts"
+                run.finished_at = datetime.utcnow()
+                logger.warning(f"Run {run.uuid} interrupted on {run.worker_id}; marked {run.status}")
+            else:
+                logger.warning(f"Run {run.uuid} interrupted on {run.worker_id}; queued again")
+                run.status = WorkflowRun.STATUS_QUEUED
+                run.worker_id = None
+                run.heartbeat_at = None
+                requeued += 1
+        db.session.commit()
+        return requeued
+
+    def _dispatch_loop(self):
+        heartbeat_interval = max(1.0, self.stale_seconds / 4)
+        last_heartbeat = 0.0
+        with self.app.app_context():
+            while not self._stopping.is_set():
+                try:
+                    now = time.monotonic()
+                    if now - last_heartbeat >= heartbeat_interval:
+                        self._heartbeat()
+                        self.requeue_interrupted_runs()
+                        last_heartbeat = now
+                    self._claim_runs()
+                except Exception as e:
+                    logger.error(f"Workflow run dispatcher error: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+                self._wakeup.wait(self.poll_seconds)
+                self._wakeup.clear()
+
+    def _heartbeat(self):
+        """Refresh the heartbeat of the local runs and forward cancellations requested elsewhere."""
+        with self._running_lock:
+            local_runs = [as_uuid(run_uuid) for run_uuid in self._running]
+        if not local_runs:
+            return
+        WorkflowRun.query.filter(
+            WorkflowRun.uuid.in_(local_runs),
+            WorkflowRun.status == WorkflowRun.STATUS_RUNNING
+        ).update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+
+        cancelled = db.session.query(WorkflowRun.uuid).filter(
+            WorkflowRun.uuid.in_(local_runs),
+            WorkflowRun.cancel_requested.is_(True)
+        ).all()
+        for (run_uuid,) in cancelled:
+            execution = get_execution(str(run_uuid))
+            if execution is not None and not execution.cancelled:
+                logger.info(f"Cancelling run {run_uuid} on request")
+                execution.cancel()
+
+    def _claim_runs(self):
+        with self._running_lock:
+            free = self.capacity - len(self._running)
+        if free <= 0:
+            return
+
+        # Concurrency limits count the running rows of every worker
+        running = db.session.query(WorkflowRun.workflow_uuid, WorkflowRun.api_key_uuid).filter(
+            WorkflowRun.status == WorkflowRun.STATUS_RUNNING
+        ).all()
+        per_workflow = Counter(str(workflow_uuid) for workflow_uuid, _ in running)
+        per_api_key = Counter(str(api_key_uuid) for _, api_key_uuid in running if api_key_uuid)
+
+        queued = WorkflowRun.query.filter_by(status=WorkflowRun.STATUS_QUEUED) \
+            .order_by(WorkflowRun.created_at).limit(CLAIM_BATCH_SIZE).all()
+        for run in queued:
+            if free <= 0:
+                break
+            workflow_key = str(run.workflow_uuid)
+            api_key = str(run.api_key_uuid) if run.api_key_uuid else None
+            if self.max_per_workflow and per_workflow[workflow_key] >= self.max_per_workflow:
+                continue
+            if api_key and self.max_per_api_key and per_api_key[api_key] >= self.max_per_api_key:
+                continue
+
+            now = datetime.utcnow()
+            claimed = WorkflowRun.query.filter_by(uuid=run.uuid, status=WorkflowRun.STATUS_QUEUED).update({
+                'status': WorkflowRun.STATUS_RUNNING,
+                'worker_id': self.worker_id,
+                'started_at': now,
+                'heartbeat_at': now,
+                'attempts': WorkflowRun.attempts + 1
+            }, synchronize_session=False)
+            db.session.commit()
+            if not claimed:
+                # Taken by another worker in the meantime
+                continue
+
+            per_workflow[workflow_key] += 1
+            if api_key:
+                per_api_key[api_key] += 1
+            free -= 1
+
+            run_key = str(run.uuid)
+            if self.engine == 'async':
+                with self._running_lock:
+                    future = async_workflow_engine.submit(
+                        run.workflow_uuid,
+                        input_data=run.input,
+                        conversation_id=str(run.conversation_id) if run.conversation_id else None,
+                        files=run.files,
+                        execution_id=run_key
+                    )
+                    self._running[run_key] = future
+                future.add_done_callback(lambda future, run_uuid=run.uuid: self._async_run_done(run_uuid, future))
+            else:
+                with self._running_lock:
+                    future = self._pool.submit(self._execute_run, run.uuid)
+                    self._running[run_key] = future
+                future.add_done_callback(lambda _, run_key=run_key: self._run_finished(run_key))
+            logger.info(f"Claimed run {run_key} of workflow {workflow_key}")
+
+    def _run_finished(self, run_key):
+        with self._running_lock:
+            self._running.pop(run_key, None)
+        self._wakeup.set()
+
+    def _async_run_done(self, run_uuid, future):
+        """Record the outcome of a run of the async engine on its writer, then free its slot."""
+        write = async_workflow_engine.write(self._record_future_outcome, run_uuid, future)
+        write.add_done_callback(lambda _, run_key=str(run_uuid): self._run_finished(run_key))
+
+    def _record_future_outcome(self, run_uuid, future):
+        set_process_id(str(run_uuid)[:8])
+        if future.cancelled():
+            error = WorkflowCancelledError(f"Run {run_uuid} was cancelled")
+        else:
+            error = future.exception()
+        if error is not None:
+            logger.error(f"Run {run_uuid} stopped with an error: {str(error)}")
+        self._record_outcome(run_uuid, None if error is not None else future.result(), error)
+
+    def _execute_run(self, run_uuid):
+        with self.app.app_context():
+            set_process_id(str(run_uuid)[:8])
+            output = error = None
+            try:
+                run = db.session.get(WorkflowRun, run_uuid)
+                if not run.cancel_requested:
+                    output = self.workflow_service.execute_workflow(
+                        workflow_uuid=run.workflow_uuid,
+                        input_data=run.input,
+                        conversation_id=str(run.conversation_id) if run.conversation_id else None,
+                        files=run.files,
+                        execution_id=str(run.uuid)
+                    )
+            except Exception as e:
+                logger.error(f"Run {run_uuid} stopped with an error: {str(e)}")
+                error = e
+            self._record_outcome(run_uuid, output, error)
+
+    def _record_outcome(self, run_uuid, output=None, error=None):
+        """Store the status and result or error of a finished run; without either, it was cancelled before starting."""
+        try:
+            db.session.rollback()
+            run = db.session.get(WorkflowRun, run_uuid)
+            db.session.refresh(run)
+            if error is not None:
+                cancelled = run.cancel_requested or isinstance(error, WorkflowCancelledError)
+                run.status = WorkflowRun.STATUS_CANCELLED if cancelled else WorkflowRun.STATUS_FAILED
+                run.error = str(error)
+            elif output is None:
+                run.status = WorkflowRun.STATUS_CANCELLED
+            else:
+                run.status = WorkflowRun.STATUS_SUCCEEDED
+                run.result = _to_json(output.get('result'))
+                run.process_steps = _to_json(output.get('process_steps'))
+                run.stats = _to_json(output.get('stats'))
+                run.conversation_id = as_uuid(output.get('conversation_id'))
+            run.finished_at = datetime.utcnow()
+            run.heartbeat_at = None
+            db.session.commit()
+            logger.info(f"Run {run_uuid} finished with status {run.status}")
+        except Exception as e:
+            logger.error(f"Could not record the outcome of run {run_uuid}: {str(e)}")
+            db.session.rollback()
+        finally:
+            db.session.remove()
+
+
+workflow_run_service = WorkflowRunService()
@@ -1,31 +1,54 @@
 from .nodes.HttpRequestNode import HttpRequestNode
 from .nodes.DocumentExtractorNode import DocumentExtractorNode
 from ..models import Workflow
-from ..models.conversation_memory import ConversationMemory
 from .. import db
+from flask import current_app
 from .llm_service import LLMService
 from .knowledge_service import KnowledgeService
 from .agent_service import AgentService
+from .workflow_compiler import (validate_workflow, subworkflow_target, WorkflowIssue, SUBWORKFLOW_NODE_TYPE,
+                                UNKNOWN_SUBWORKFLOW, SUBWORKFLOW_CYCLE)
+from .workflow_cache import workflow_cache
+from .template_engine import render_template, compile_template, MISSING_PLACEHOLDER, MISSING_EMPTY
+from .context_assembler import assemble_context, context_budget, CONTEXT_BUDGET_ENABLED
+from .conversation_buffer import ConversationBuffer
+from .run_files import RunFiles
+from .single_flight import workflow_single_flight, coalescing_enabled, coalesce_key
+from .node_cache import node_cache, lookup_node_result
+from .node_policy import NodePolicy, CancelScope, node_option
+from .workflow_trace_service import save_execution_traces
+from .workflow_execution import WorkflowExecution, register_execution, unregister_execution, get_execution, list_executions
+from ..utils.exc import WorkflowCancelledError, NodeTimeoutError, WorkflowDeadlineExceededError, WorkflowValidationError
+import copy
 import logging
 import os
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
 from ..utils.logging_utils import setup_logger, log_execution_time, get_request_id, get_process_id, set_process_id, create_process_banner, COLORS, ANSI_ENABLED
 
 # Configure logger
 logger = setup_logger('workflow_service')
 
+# Seconds between cancellation checks while waiting for parallel nodes
+CANCEL_POLL_SECONDS = 0.2
+
 class WorkflowService:
     def __init__(self):
         self.llm_service = LLMService()
         self.knowledge_service = KnowledgeService()
         self.agent_service = AgentService()
         self.max_depth = int(os.getenv('MAX_WORKFLOW_DEPTH', '50'))
-        self.current_workflow_id = None
-        self.execution_id = None
-        self.node_count = 0
-        self.nodes_executed = 0
+        # Upper bound on nodes of one run executing at the same time
+        self.max_parallel_nodes = max(1, int(os.getenv('WORKFLOW_MAX_PARALLEL_NODES', '4')))
+        # Save a run's conversation messages every N messages; 0 saves them once, at the end of the run
+        self.memory_flush_every = max(0, int(os.getenv('WORKFLOW_MEMORY_FLUSH_EVERY', '0')))
+        # Seconds a run may take unless the request or the start node sets a deadline; 0 = no deadline
+        self.default_deadline = float(os.getenv('WORKFLOW_DEADLINE_SECONDS', '0'))
+        # Sub-workflow nodes may nest calls this deep
+        self.max_subworkflow_depth = max(1, int(os.getenv('WORKFLOW_SUBWORKFLOW_MAX_DEPTH', '5')))
         self.request_id = get_request_id()
         logger.info(f"Initializing WorkflowService with request_id={self.request_id}")
 
@@ -41,19 +64,99 @@ class WorkflowService:
             logger.info(f"Workflow contains {len(nodes)} nodes")
         if edges:
             logger.info(f"Workflow contains {len(edges)} edges")
+        
+        validation = self._validate_graph(nodes, edges)
             
         workflow = Workflow(
             name=name,
             description=description,
             nodes=nodes,
-            edges=edges
+            edges=edges,
+            validation=validation.to_dict()
         )
         db.session.add(workflow)
         db.session.commit()
+        # Compile now, so the first run finds the plan cached
+        workflow_cache.refresh(workflow)
         
         logger.info(f"Successfully created workflow with UUID: {workflow.uuid}")
         return workflow
 
+    def _graph_validation(self, nodes, edges, workflow_uuid=None):
+        """Validation of a graph, including its sub-workflow calls against the saved workflows."""
+        validation = validate_workflow(nodes, edges)
+        subworkflow_errors = self._subworkflow_issues(nodes, workflow_uuid)
+        if subworkflow_errors:
+            validation = validation._replace(errors=validation.errors + tuple(subworkflow_errors))
+        for warning in validation.warnings:
+            logger.warning(f"Workflow validation: {warning.message}")
+        return validation
+
+    def _validate_graph(self, nodes, edges, workflow_uuid=None):
+        """Validate a graph before it is saved; raises WorkflowValidationError on errors."""
+        validation = self._graph_validation(nodes, edges, workflow_uuid)
+        if not validation.is_valid:
+            error = WorkflowValidationError(validation.errors)
+            logger.error(error.message)
+            raise error
+        return validation
+
+    @staticmethod
+    def _subworkflow_plan(workflow_uuid):
+        """Cached plan of a workflow called by a sub-workflow node, or None if there is no such workflow."""
+        try:
+            return workflow_cache.get_plan(workflow_uuid)
+        except ValueError:
+            # Not a UUID
+            return None
+
+    def _subworkflow_issues(self, nodes, workflow_uuid=None):
+        """Errors of the sub-workflow nodes of a graph: calls to unknown workflows, and calls back to itself."""
+        issues = []
+        for node in nodes or []:
+            node_data = node.get('data', {}) if isinstance(node, dict) else {}
+            if node_data.get('nodeType') != SUBWORKFLOW_NODE_TYPE:
+                continue
+            # Nodes without a workflow are reported by validate_workflow
+            target = subworkflow_target(node_data)
+            if not target:
+                continue
+            if workflow_uuid is not None and target == str(workflow_uuid):
+                issues.append(WorkflowIssue(
+                    SUBWORKFLOW_CYCLE, f"Sub-workflow node {node['id']} calls its own workflow", (node['id'],)))
+                continue
+            callee_plan = self._subworkflow_plan(target)
+            if callee_plan is None:
+                issues.append(WorkflowIssue(
+                    UNKNOWN_SUBWORKFLOW, f"Sub-workflow node {node['id']} calls workflow {target}, which does not exist",
+                    (node['id'],)))
+                continue
+            call_path = self._call_path(callee_plan, str(workflow_uuid)) if workflow_uuid is not None else None
+            if call_path:
+                issues.append(WorkflowIssue(
+                    SUBWORKFLOW_CYCLE,
+                    f"Sub-workflow node {node['id']} calls workflow {target}, which calls this workflow back: "
+                    f"{' -> '.join(call_path)}",
+                    (node['id'],)))
+        return issues
+
+    def _call_path(self, plan, workflow_uuid):
+        """Chain of sub-workflow calls from ``plan`` to ``workflow_uuid``, or None if it is never called."""
+        pending = [(plan, [plan.workflow_uuid])]
+        seen = {plan.workflow_uuid}
+        while pending:
+            current, path = pending.pop()
+            for callee in current.subworkflow_ids.values():
+                if callee == workflow_uuid:
+                    return path + [callee]
+                if callee in seen:
+                    continue
+                seen.add(callee)
+                callee_plan = self._subworkflow_plan(callee)
+                if callee_plan is not None:
+                    pending.append((callee_plan, path + [callee]))
+        return None
+
     @log_execution_time(logger)
     def get_workflow(self, workflow_uuid):
         logger.info(f"Fetching workflow with UUID: {workflow_uuid}")
@@ -120,7 +223,14 @@ class WorkflowService:
         return result
         
     @log_execution_time(logger)
-    def update_workflow(self, workflow_uuid, nodes=None, edges=None):
+    def update_workflow(self, workflow_uuid, nodes=None, edges=None, name=None, description=None):
+        """
+        Save the given parts of a workflow.
+
+        A new graph must pass validation (WorkflowValidationError). Saves of the name or
+        description only record the stored graph's validation without enforcing it, so
+        workflows saved before a check was added can still be renamed.
+        """
         process_id = get_process_id()
         create_process_banner(logger, "WORKFLOW UPDATE STARTED", process_id)
         
@@ -131,15 +241,39 @@ class WorkflowService:
             old_node_count = len(workflow.nodes) if workflow.nodes else 0
             new_node_count = len(nodes) if nodes else 0
             logger.info(f"Updating nodes for workflow {workflow_uuid}: {old_node_count} → {new_node_count} nodes")
-            workflow.nodes = nodes
             
         if edges is not None:
             old_edge_count = len(workflow.edges) if workflow.edges else 0
             new_edge_count = len(edges) if edges else 0
             logger.info(f"Updating edges for workflow {workflow_uuid}: {old_edge_count} → {new_edge_count} edges")
+        
+        graph_changed = nodes is not None or edges is not None
+        validate = self._validate_graph if graph_changed else self._graph_validation
+        validation = validate(
+            nodes if nodes is not None else workflow.nodes,
+            edges if edges is not None else workflow.edges,
+            workflow_uuid
+        )
+        if not validation.is_valid:
+            logger.warning(f"Saving workflow {workflow_uuid} without graph changes; "
+                           f"its stored graph has {len(validation.errors)} validation errors")
+        if nodes is not None:
+            workflow.nodes = nodes
+        if edges is not None:
             workflow.edges = edges
-            
+        if name is not None:
+            workflow.name = name
+        if description is not None:
+            workflow.description = description
+        workflow.validation = validation.to_dict()
+        
+        # Other worker processes drop their cached plan when this commits
+        db.session.flush()
+        workflow_cache.notify_changed(workflow)
         db.session.commit()
+        workflow_cache.invalidate(workflow_uuid)
+        # Compile now, so the first run finds the plan cached
+        workflow_cache.refresh(workflow)
         
         # Create completion banner with Windows compatibility
         if ANSI_ENABLED:
@@ -170,35 +304,30 @@ class WorkflowService:
         logger.info(f"Getting variables for workflow {workflow_uuid}, node {current_node_id}")
         
         try:
-            workflow = self.get_workflow(workflow_uuid)
+            plan = workflow_cache.get_plan(workflow_uuid)
         except Exception as e:
             logger.error(f"Failed to get workflow {workflow_uuid}: {str(e)}")
             raise ValueError(f"Workflow {workflow_uuid} not found") from e
             
-        if not workflow:
+        if plan is None:
             logger.error(f"Workflow {workflow_uuid} not found")
             raise ValueError(f"Workflow {workflow_uuid} not found")
             
-        nodes = workflow.nodes or []
-        edges = workflow.edges or []
-        logger.info(f"Workflow has {len(nodes)} nodes and {len(edges)} edges")
+        logger.info(f"Workflow has {len(plan.node_ids)} nodes")
 
-        # Find all nodes that come before the current node
-        previous_nodes = []
-        current_node = next((node for node in nodes if node['id'] == current_node_id), None)
-        
-        if not current_node:
+        if current_node_id not in plan.node_map:
             raise ValueError(f"Node {current_node_id} not found in workflow")
 
-        def find_previous_nodes(node_id):
-            incoming_edges = [edge for edge in edges if edge['target'] == node_id]
-            for edge in incoming_edges:
-                source_node = next((node for node in nodes if node['id'] == edge['source']), None)
-                if source_node and source_node not in previous_nodes:
-                    previous_nodes.append(source_node)
-                    find_previous_nodes(source_node['id'])
+        # Kept with the cached plan, so computed once per workflow version and node
+        catalogue = plan.derived(('variables', current_node_id),
+                                 lambda: self._variable_catalogue(plan, current_node_id))
+        return copy.deepcopy(catalogue)
 
-        find_previous_nodes(current_node_id)
+    @staticmethod
+    def _variable_catalogue(plan, current_node_id):
+        """Outputs of the nodes that come before ``current_node_id`` in a plan."""
+        # Find all nodes that come before the current node
+        previous_nodes = [plan.node_map[node_id] for node_id in plan.ancestors(current_node_id)]
 
         # Map node outputs
         variables = []
@@ -273,6 +402,12 @@ class WorkflowService:
                     'type': 'text',
                     'description': 'Extracted text from files'
                 })
+            elif node_type == 'subworkflow':
+                outputs.append({
+                    'name': 'output',
+                    'type': 'object',
+                    'description': 'Result of the called workflow'
+                })
             if outputs:
                 variables.append({
                     'node_id': node['id'],
@@ -284,7 +419,17 @@ class WorkflowService:
         return variables
 
     @log_execution_time(logger)
-    def execute_workflow(self, workflow_uuid, input_data=None, conversation_id=None, files=None):
+    def execute_workflow(self, workflow_uuid, input_data=None, conversation_id=None, files=None, listener=None,
+                         execution_id=None, plan=None, persist_memory=True, deadline=None, coalesce=None):
+        """Run a workflow; ``listener(event, data)``, if given, receives node and token events as they happen.
+
+        ``execution_id`` registers the run under a caller-chosen ID (e.g. a ``WorkflowRun`` UUID)
+        instead of a new UUID, so it can be looked up while running. ``plan`` runs an already
+        compiled plan without loading the workflow again (batch runs), and ``persist_memory=False``
+        reads the conversation but never writes it. ``deadline`` (seconds) bounds the whole run;
+        it defaults to the start node's ``deadline`` setting, then ``WORKFLOW_DEADLINE_SECONDS``.
+        ``coalesce=False`` never shares the run with identical concurrent requests (see single_flight).
+        """
         # Create a unique process ID for this workflow execution
         process_id = get_process_id()
         set_process_id(process_id)
@@ -296,43 +441,98 @@ class WorkflowService:
         
         # Get workflow
         logger.info(f"Starting execution of workflow {workflow_uuid}")
-        workflow = self.get_workflow(workflow_uuid)
-        if not workflow:
-            logger.error(f"Workflow {workflow_uuid} not found")
-            raise ValueError(f"Workflow {workflow_uuid} not found")
+        if plan is None:
+            # Compiled execution graph, cached until the workflow is saved again
+            plan = workflow_cache.get_plan(workflow_uuid)
+            if plan is None:
+                logger.error(f"Workflow {workflow_uuid} not found")
+                raise ValueError(f"Workflow {workflow_uuid} not found")
+        
+        # Identical stateless requests running at the same time share one execution
+        if coalesce is None:
+            coalesce = conversation_id is None and listener is None and execution_id is None \
+                and coalescing_enabled(plan)
+        if coalesce:
+            return self._execute_coalesced(workflow_uuid, plan, input_data, files, persist_memory, deadline,
+                                           process_id)
+        output, _ = self._run_workflow(workflow_uuid, plan, input_data, conversation_id, files, listener,
+                                       execution_id, persist_memory, deadline, process_id)
+        return output
 
-        # Get or create conversation memory
+    def _execute_coalesced(self, workflow_uuid, plan, input_data, files, persist_memory, deadline, process_id):
+        """
+        Run a stateless request, sharing one execution with identical concurrent requests.
+
+        The shared execution saves no conversation. Each request gets a new conversation of
+        its own with the run's messages, so the follow-ups of unrelated callers never share
+        a history.
+        """
+        key = coalesce_key(plan, input_data, files, deadline)
+        (output, run_memory), shared = workflow_single_flight.do(key, lambda: self._run_workflow(
+            workflow_uuid, plan, input_data, files=files, persist_memory=False, deadline=deadline,
+            process_id=process_id), wait=lambda done: self._wait_for_shared_run(plan, done))
+        output = copy.deepcopy(output)
+        if shared:
+            logger.info(f"Reusing the output of an identical run of workflow {workflow_uuid}")
+            output['stats']['coalesced'] = True
+
+        # The shared run started a new, unsaved conversation: its messages are the run's
+        memory = ConversationBuffer.copy_of(workflow_uuid, run_memory.messages, persist=persist_memory)
+        memory.flush()
+        output['conversation_id'] = output['stats']['conversation_id'] = str(memory.conversation_id)
+        return output
+
+    def _run_workflow(self, workflow_uuid, plan, input_data=None, conversation_id=None, files=None, listener=None,
+                      execution_id=None, persist_memory=True, deadline=None, process_id=None):
+        """Execute one run; returns its output and its conversation buffer."""
+        context = self._start_run(workflow_uuid, plan, input_data, conversation_id, files, listener, execution_id,
+                                  persist_memory, deadline, process_id)
+        try:
+            # Execute workflow using topological sorting
+            logger.info("Beginning topological execution of workflow nodes")
+            result = self._execute_workflow_topological(
+                plan=plan,
+                input_data=context['input'],
+                context=context,
+                start_node=self._start_node(plan)
+            )
+            output = self._run_output(plan, context, result)
+            
+            # One write for all messages of the run
+            context['memory'].flush()
+            
+            return output, context['memory']
+            
+        except Exception as e:
+            self._run_failed(plan, context, e)
+            raise
+        finally:
+            self._end_run(context)
+
+    @staticmethod
+    def _wait_for_shared_run(plan, done):
+        """Wait for the run an identical request leads, as a registered execution that can be cancelled."""
+        waiter = WorkflowExecution(str(uuid.uuid4()), plan.workflow_uuid, node_count=len(plan.node_ids))
+        register_execution(waiter)
+        try:
+            while not done.wait(CANCEL_POLL_SECONDS):
+                waiter.check_cancelled()
+            # Cancelled together with the shared run: not run again
+            waiter.check_cancelled()
+        finally:
+            unregister_execution(waiter)
+
+    def _start_run(self, workflow_uuid, plan, input_data=None, conversation_id=None, files=None, listener=None,
+                   execution_id=None, persist_memory=True, deadline=None, process_id=None, checkpoint=None):
+        """
+        Load the conversation, create and register the run's execution and return the run's context.
+
+        ``checkpoint`` runs the conversation's checkpoint flushes (see ``ConversationBuffer``).
+        """
+        # Conversation memory is loaded once per run; messages added during the run are saved at the end
         logger.info(f"Retrieving conversation memory for workflow {workflow_uuid}")
-        
-        # If conversation_id is provided, try to find that specific conversation
-        if conversation_id:
-            logger.info(f"Looking for existing conversation with ID: {conversation_id}")
-            memory = ConversationMemory.query.filter_by(
-                uuid=conversation_id,
-                workflow_uuid=workflow_uuid
-            ).first()
-            if memory:
-                logger.info(f"Found existing conversation with ID: {conversation_id}")
-                # DEBUG: Log the content of the conversation memory
-                logger.info(f"DEBUG: Conversation memory contains {len(memory.messages)} messages")
-                for idx, msg in enumerate(memory.messages):
-                    logger.info(f"DEBUG: Memory message #{idx+1} - Role: {msg.get('role')}, Content: {msg.get('content')[:100]}{'...' if len(msg.get('content', '')) > 100 else ''}")
-            else:
-                logger.info(f"No conversation found with ID: {conversation_id}, creating new one")
-                memory = ConversationMemory(
-                    uuid=conversation_id,
-                    workflow_uuid=workflow_uuid, 
-                    messages=[]
-                )
-                db.session.add(memory)
-                db.session.commit()
-        else:
-            # Create a new conversation if no conversation_id is provided
-            logger.info(f"No conversation ID provided, creating new conversation")
-            memory = ConversationMemory(workflow_uuid=workflow_uuid, messages=[])
-            db.session.add(memory)
-            db.session.commit()
-            logger.info(f"Created new conversation with ID: {memory.uuid}")
+        memory = ConversationBuffer.load(workflow_uuid, conversation_id, flush_every=self.memory_flush_every,
+                                         persist=persist_memory, checkpoint=checkpoint)
 
         # Initialize input data
         if input_data is None:
@@ -344,233 +544,172 @@ class WorkflowService:
         # Add user message to memory
         logger.info("Adding user message to conversation memory")
         memory.add_message('user', input_data)
-        db.session.commit()
         
-        # Initialize workflow execution
-        self.current_workflow_uuid = workflow_uuid
-        self.execution_id = process_id
-        execution_start_time = time.time()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Per-run state; the service instance is shared by concurrent requests
+        if deadline is None and plan.start_node:
+            deadline = node_option(plan.start_node.get('data', {}), 'deadline')
+        if deadline is None:
+            deadline = self.default_deadline
+        # The thread's process ID is reused across requests; traces need an ID unique to this run
+        execution = WorkflowExecution(execution_id or str(uuid.uuid4()), workflow_uuid, listener=listener,
+                                      deadline_seconds=float(deadline) if deadline else None)
         
         # Initialize context
         context = {
             'input': input_data,
             'process_steps': [],
+            # node id -> process step, for O(1) variable lookups
+            'steps_by_node': {},
+            'execution': execution,
             'workflow_uuid': workflow_uuid,
-            'execution_id': self.execution_id,
-            'start_time': execution_start_time,
-            'conversation_id': str(memory.uuid) if memory else None,
-            'files': files or []
+            'execution_id': execution.execution_id,
+            'start_time': execution.started_at,
+            'conversation_id': str(memory.conversation_id),
+            'memory': memory,
+            'files': files or [],
+            # Uploaded files are sorted and read only when a node uses them
+            'run_files': RunFiles(files)
         }
-        
-        # Add file content if files are provided
-        if files and len(files) > 0:
-            # Separate text files and image files
-            text_files = []
-            image_files = []
-            
-            for file in files:
-                file_path = file.get('path')
-                if not file_path or not os.path.exists(file_path):
-                    logger.warning(f"File path not found or invalid: {file_path}")
-                    continue
-                    
-                # Check if file is an image
-                try:
-                    # Use file extension to determine if it's an image
-                    import imghdr
-                    import mimetypes
-                    
-                    # Initialize mimetypes if not already done
-                    if not mimetypes.inited:
-                        mimetypes.init()
-                    
-                    # Get file type using imghdr (more reliable for images)
-                    img_type = imghdr.what(file_path)
-                    
-                    # If imghdr couldn't determine type, fall back to mimetypes
-                    if img_type is None:
-                        mime_type, _ = mimetypes.guess_type(file_path)
-                        is_image = mime_type and mime_type.startswith('image/')
-                    else:
-                        is_image = True
-                    
-                    if is_image:
-                        image_files.append(file_path)
-                        logger.info(f"Added image file: {file.get('filename')}")
-                    else:
-                        text_files.append(file_path)
-                        logger.info(f"Added text file: {file.get('filename')}")
-                except Exception as e:
-                    logger.error(f"Error determining file type for {file_path}: {str(e)}")
-                    # Default to treating as text file if we can't determine type
-                    text_files.append(file_path)
-            
-            # Add image paths to context for multimodal LLM processing
-            context['image_paths'] = image_files
-            logger.info(f"Added {len(image_files)} image files to context")
-            
-            # Add text content from the first text file
-            if text_files:
-                try:
-                    with open(text_files[0], 'r') as f:
-                        context['file_content'] = f.read()
-                    logger.info(f"Added content from text file: {os.path.basename(text_files[0])}")
-                except Exception as e:
-                    logger.error(f"Error reading text file: {str(e)}")
-                    context['file_content'] = ''
-            else:
-                context['file_content'] = ''
-                if image_files:
-                    logger.info("No text files found, only images")
-                else:
-                    logger.warning("No valid files found")
-
+        if files:
+            logger.info(f"Run has {len(files)} uploaded files")
         
         # Create workflow header banner
-        create_process_banner(logger, f"WORKFLOW EXECUTION STARTED - {workflow.name}", process_id)
-        logger.info(f"Workflow: {workflow.name} (UUID: {workflow_uuid})")
-        logger.info(f"Execution ID: {self.execution_id} | Timestamp: {timestamp}")
+        create_process_banner(logger, f"WORKFLOW EXECUTION STARTED - {plan.workflow_name}", process_id)
+        logger.info(f"Workflow: {plan.workflow_name} (UUID: {workflow_uuid})")
+        logger.info(f"Execution ID: {execution.execution_id} | Timestamp: {self._run_timestamp(execution)}")
         
-        try:
-            # Count total nodes
-            self.node_count = len(workflow.nodes)
-            self.nodes_executed = 0
-            logger.info(f"Workflow contains {self.node_count} nodes to execute")
-            
-            # Find start node
-            logger.info("Looking for start node in workflow")
-            start_node = next((node for node in workflow.nodes if node.get('data', {}).get('nodeType') == 'start'), None)
-            if not start_node:
-                logger.error("No start node found in workflow")
-                raise ValueError("No start node found in workflow")
-            
-            logger.info(f"Found start node: {start_node['id']}")
-            
-            # Execute workflow using topological sorting
-            logger.info("Beginning topological execution of workflow nodes")
-            result = self._execute_workflow_topological(
-                workflow=workflow,
-                input_data=input_data,
-                context=context,
-                start_node=start_node
-            )
-            
-            # Log completion
-            execution_time = time.time() - execution_start_time
-            
-            # Create completion banner with Windows compatibility
-            if ANSI_ENABLED:
-                completion_banner = f"{COLORS['MAGENTA']}{COLORS['BOLD']}" \
-                        f"WORKFLOW EXECUTION COMPLETED [UUID: {workflow_uuid}] [EXEC: {self.execution_id}]\n" \
-                        f"WORKFLOW: {workflow.name} | TOTAL TIME: {execution_time:.2f}s | NODES: {self.nodes_executed}/{self.node_count}{COLORS['RESET']}"
-            else:
-                completion_banner = f"WORKFLOW EXECUTION COMPLETED [UUID: {workflow_uuid}] [EXEC: {self.execution_id}]\n" \
-                        f"WORKFLOW: {workflow.name} | TOTAL TIME: {execution_time:.2f}s | NODES: {self.nodes_executed}/{self.node_count}"
-            logger.info(completion_banner)
-            
-            # Add execution stats to result
-            execution_stats = {
-                'execution_time': execution_time,
-                'nodes_executed': self.nodes_executed,
-                'total_nodes': self.node_count,
-                'execution_id': self.execution_id,
-                'timestamp': timestamp,
-                'conversation_id': str(memory.uuid) if memory else None
-            }
-            
-            return {
-                'result': result,
-                'process_steps': context['process_steps'],
-                'stats': execution_stats,
-                'conversation_id': str(memory.uuid) if memory else None
-            }
-            
-        except Exception as e:
-            # Create error banner with Windows compatibility
-            if ANSI_ENABLED:
-                error_banner = f"{COLORS['RED']}{COLORS['BOLD']}" \
-                        f"WORKFLOW EXECUTION FAILED [UUID: {workflow_uuid}] [EXEC: {self.execution_id}]\n" \
-                        f"ERROR: {str(e)}{COLORS['RESET']}"
-            else:
-                error_banner = f"WORKFLOW EXECUTION FAILED [UUID: {workflow_uuid}] [EXEC: {self.execution_id}]\n" \
-                        f"ERROR: {str(e)}"
-            logger.error(error_banner)
-            raise
-        finally:
-            self.current_workflow_uuid = None
-            self.execution_id = None
-            self.node_count = 0
-            self.nodes_executed = 0
-            
-    def _execute_workflow_recursive(self, workflow, input_data, context, current_node=None, indent='', visited=None):
-        """Execute workflow nodes recursively (legacy method, kept for reference)"""
-        if not current_node:
-            return None
+        register_execution(execution)
+        execution.emit('workflow_started', {'execution_id': execution.execution_id, 'workflow_uuid': str(workflow_uuid)})
+        # Count total nodes
+        execution.node_count = len(plan.node_ids) - len(plan.pruned_ids)
+        logger.info(f"Workflow contains {execution.node_count} nodes to execute")
+        return context
 
-        # Initialize visited nodes set
-        if visited is None:
-            visited = set()
+    @staticmethod
+    def _run_timestamp(execution):
+        return datetime.fromtimestamp(execution.started_at).strftime("%Y-%m-%d %H:%M:%S")
 
-        # Check if node has already been visited
-        if current_node['id'] in visited:
-            logger.warning(f"{indent}Node {current_node['id']} has already been executed, skipping")
-            return input_data
+    @staticmethod
+    def _start_node(plan):
+        """The node a run of ``plan`` starts from."""
+        logger.info("Looking for start node in workflow")
+        start_node = plan.start_node
+        if not start_node:
+            logger.error("No start node found in workflow")
+            raise ValueError("No start node found in workflow")
+        logger.info(f"Found start node: {start_node['id']}")
+        return start_node
 
-        # Mark node as visited
-        visited.add(current_node['id'])
-
-        # Execute current node
-        result = self._execute_node(current_node, workflow.nodes, workflow.edges, context, indent)
-        self.nodes_executed += 1
-        
-        # Find next nodes
-        next_nodes = []
-        for edge in workflow.edges:
-            if edge['source'] == current_node['id']:
-                next_node = next((node for node in workflow.nodes if node['id'] == edge['target']), None)
-                if next_node:
-                    next_nodes.append(next_node)
-        
-        # Execute next nodes
-        for next_node in next_nodes:
-            result = self._execute_workflow_recursive(
-                workflow=workflow,
-                input_data=result,
-                context=context,
-                current_node=next_node,
-                indent=indent + '  ',
-                visited=visited
-            )
+    def _run_output(self, plan, context, result):
+        """Log the completion of a run and return its output: result, process steps and stats."""
+        execution = context['execution']
+        memory = context['memory']
+        workflow_uuid = execution.workflow_uuid
         
-        return result
+        # Log completion
+        execution.finish()
+        execution_time = execution.execution_time
+        
+        # Create completion banner with Windows compatibility
+        if ANSI_ENABLED:
+            completion_banner = f"{COLORS['MAGENTA']}{COLORS['BOLD']}" \
+                    f"WORKFLOW EXECUTION COMPLETED [UUID: {workflow_uuid}] [EXEC: {execution.execution_id}]\n" \
+                    f"WORKFLOW: {plan.workflow_name} | TOTAL TIME: {execution_time:.2f}s | NODES: {execution.progress}{COLORS['RESET']}"
+        else:
+            completion_banner = f"WORKFLOW EXECUTION COMPLETED [UUID: {workflow_uuid}] [EXEC: {execution.execution_id}]\n" \
+                    f"WORKFLOW: {plan.workflow_name} | TOTAL TIME: {execution_time:.2f}s | NODES: {execution.progress}"
+        logger.info(completion_banner)
+        
+        # Add execution stats to result
+        execution_stats = {
+            'execution_time': execution_time,
+            'nodes_executed': execution.nodes_executed,
+            'total_nodes': execution.node_count,
+            'execution_id': execution.execution_id,
+            'timestamp': self._run_timestamp(execution),
+            'conversation_id': str(memory.conversation_id)
+        }
+        
+        return {
+            'result': result,
+            'process_steps': context['process_steps'],
+            'stats': execution_stats,
+            'conversation_id': str(memory.conversation_id)
+        }
+
+    @staticmethod
+    def _run_failed(plan, context, e):
+        """Log a run that stopped with ``e``."""
+        execution = context['execution']
+        workflow_uuid = execution.workflow_uuid
+        if isinstance(e, WorkflowCancelledError):
+            logger.warning(f"WORKFLOW EXECUTION CANCELLED [UUID: {workflow_uuid}] [EXEC: {execution.execution_id}] "
+                           f"after {execution.execution_time:.2f}s | NODES: {execution.progress}")
+            return
+        # Create error banner with Windows compatibility
+        if ANSI_ENABLED:
+            error_banner = f"{COLORS['RED']}{COLORS['BOLD']}" \
+                    f"WORKFLOW EXECUTION FAILED [UUID: {workflow_uuid}] [EXEC: {execution.execution_id}]\n" \
+                    f"ERROR: {str(e)}{COLORS['RESET']}"
+        else:
+            error_banner = f"WORKFLOW EXECUTION FAILED [UUID: {workflow_uuid}] [EXEC: {execution.execution_id}]\n" \
+                    f"ERROR: {str(e)}"
+        logger.error(error_banner)
+
+    @staticmethod
+    def _end_run(context):
+        """Unregister a finished run and save its traces and remaining conversation messages."""
+        execution = context['execution']
+        memory = context['memory']
+        execution.finish()
+        unregister_execution(execution)
+        save_execution_traces(execution)
+        # Failed and cancelled runs keep the messages of the nodes that completed
+        if memory.pending_count:
+            try:
+                memory.flush()
+            except Exception as e:
+                logger.error(f"Failed to save conversation memory {memory.conversation_id}: {str(e)}")
+            
+    def cancel_workflow(self, workflow_uuid, execution_id=None):
+        """
+        Cancel the running executions of a workflow in this process, or only ``execution_id``.
+        
+        Cancellation is cooperative: nodes not started yet are skipped, and running LLM
+        streams, agents and HTTP requests stop at their next check. Returns True if an
+        execution was cancelled.
+        """
+        if execution_id:
+            execution = get_execution(str(execution_id))
+            executions = [execution] if execution and execution.workflow_uuid == str(workflow_uuid) else []
+        else:
+            executions = list_executions(workflow_uuid)
+        
+        for execution in executions:
+            execution.cancel()
+        logger.info(f"Cancelled {len(executions)} running executions of workflow {workflow_uuid}")
+        return bool(executions)
+        
+    def _execute_workflow_topological(self, plan, input_data, context, start_node=None, indent=''):
+        """
+        Execute workflow nodes in topological order to ensure proper execution sequence.
         
-    def _execute_workflow_topological(self, workflow, input_data, context, start_node=None, indent=''):
-        """Execute workflow nodes in topological order to ensure proper execution sequence"""
+        Nodes whose dependencies are all satisfied run concurrently on a bounded
+        thread pool (``WORKFLOW_MAX_PARALLEL_NODES``); a node that becomes ready
+        alone runs inline. Join nodes wait for every incoming edge, and classifier
+        and ifelse nodes only release the node on their selected branch.
+        """
         if not start_node:
             return None
             
-        # Build dependency graph
-        dependency_graph = {}
-        incoming_edges_count = {}
-        node_map = {}
-        
-        # Initialize graph
-        for node in workflow.nodes:
-            node_id = node['id']
-            dependency_graph[node_id] = []
-            incoming_edges_count[node_id] = 0
-            node_map[node_id] = node
-            
-        # Build edges
-        for edge in workflow.edges:
-            source_id = edge['source']
-            target_id = edge['target']
-            dependency_graph[source_id].append(target_id)
-            incoming_edges_count[target_id] = incoming_edges_count.get(target_id, 0) + 1
+        execution = context['execution']
+        
+        # Per-run copy of the compiled in-degrees
+        incoming_edges_count = dict(plan.in_degree)
             
-        # Find nodes with no incoming edges (start with start node)
-        queue = [start_node['id']]
+        # The start node runs first, whatever its incoming edges
+        ready = deque([start_node['id']])
+        execution.node_ready(start_node['id'])
         visited = set()
         executed_nodes = []
         node_results = {}
@@ -581,108 +720,135 @@ class WorkflowService:
         # Track conditional paths for classifier nodes
         conditional_paths = {}
         
-        # Process nodes in topological order
-        while queue:
-            current_id = queue.pop(0)
-            
-            if current_id in visited:
-                continue
-                
-            # Check if all dependencies are satisfied
-            if incoming_edges_count[current_id] > 0:
-                # Not all dependencies are executed yet, put it back in queue
-                queue.append(current_id)
-                continue
-                
-            # Get the node
-            current_node = node_map[current_id]
-            
-            # Collect inputs from all incoming edges
-            input_values = []
-            for edge in workflow.edges:
-                if edge['target'] == current_id and edge['source'] in node_results:
-                    input_values.append(node_results[edge['source']])
-            
-            # Use the first input value or the original input
-            node_input = input_values[0] if input_values else input_data
-            
-            # Execute the node
-            logger.info(f"{indent}Executing node {current_id} with {len(input_values)} input sources")
-            result = self._execute_node(current_node, workflow.nodes, workflow.edges, context, indent)
-            self.nodes_executed += 1
-            
-            # Store the result
+        def release(node_id):
+            execution.node_ready(node_id)
+            ready.append(node_id)
+        
+        def complete(current_id, result):
+            """Record a finished node and release the successors it unblocks."""
+            execution.node_completed(current_id, context.get(f'node_{current_id}_time'))
             node_results[current_id] = result
-            visited.add(current_id)
             executed_nodes.append(current_id)
-            
-            # Check if this is a conditional node (classifier or ifelse) and handle conditional paths
-            node_type = current_node.get('data', {}).get('nodeType')
-            if node_type in ['classifier', 'ifelse']:
-                # Find the process step for this node to get the result
-                node_step = next((step for step in context.get('process_steps', []) 
-                                 if step['node'] == current_id), None)
+            for next_id in self._unblocked_successors(plan, context, current_id, incoming_edges_count,
+                                                      conditional_paths, indent):
+                if next_id not in visited:
+                    release(next_id)
+        
+        def log_inputs(current_id):
+            input_count = sum(1 for source_id in plan.in_edges[current_id] if source_id in node_results)
+            logger.info(f"{indent}Executing node {current_id} with {input_count} input sources")
+        
+        pool = None
+        running = {}
+        try:
+            while ready or running:
+                # Nodes not started yet are skipped once the run is cancelled
+                execution.check_cancelled()
                 
-                if node_step and 'next_node_id' in node_step:
-                    # Get the next node ID based on the result
-                    next_node_id = node_step['next_node_id']
-                    
-                    if node_type == 'classifier':
-                        logger.info(f"{indent}Classifier node {current_id} determined next node: {next_node_id} based on class '{node_step.get('class_name', '')}'")                        
-                    elif node_type == 'ifelse':
-                        logger.info(f"{indent}IF/ELSE node {current_id} determined next node: {next_node_id} based on branch '{node_step.get('branch_taken', '')}'")                        
-                    
-                    # Store the conditional path
-                    conditional_paths[current_id] = next_node_id
-                    
-                    # Only add the specific next node to the queue
-                    if next_node_id in node_map:
-                        # Decrement the incoming edge count for the next node
-                        incoming_edges_count[next_node_id] -= 1
-                        
-                        # Add to queue if all dependencies are satisfied
-                        if incoming_edges_count[next_node_id] == 0 and next_node_id not in visited:
-                            queue.append(next_node_id)
-                    else:
-                        logger.warning(f"{indent}Next node {next_node_id} not found in workflow")
-                    
-                    # Skip adding other successor nodes for this conditional node
+                # Run a lone ready node inline, without the thread pool overhead
+                if not running and (len(ready) == 1 or self.max_parallel_nodes == 1):
+                    current_id = ready.popleft()
+                    if current_id in visited:
+                        continue
+                    visited.add(current_id)
+                    log_inputs(current_id)
+                    complete(current_id, self._execute_node(plan.node_map[current_id], plan, context, indent))
                     continue
-            
-            # For non-classifier nodes or classifiers without conditional paths,
-            # add all successor nodes to queue and decrement their incoming edge count
-            for next_id in dependency_graph[current_id]:
-                # Skip nodes that are not in the conditional path of a classifier
-                skip = False
-                for classifier_id, target_id in conditional_paths.items():
-                    if current_id == classifier_id and next_id != target_id:
-                        # This is a classifier node and the next_id is not the chosen path
-                        logger.info(f"{indent}Skipping node {next_id} as it's not in the conditional path")
-                        skip = True
-                        break
                 
-                if skip:
+                # Fan out every ready node, up to the pool size
+                while ready and len(running) < self.max_parallel_nodes:
+                    current_id = ready.popleft()
+                    if current_id in visited:
+                        continue
+                    visited.add(current_id)
+                    if pool is None:
+                        pool = ThreadPoolExecutor(
+                            max_workers=self.max_parallel_nodes,
+                            thread_name_prefix=f"workflow-{execution.execution_id}"
+                        )
+                    log_inputs(current_id)
+                    future = pool.submit(
+                        self._execute_node_in_worker,
+                        current_app._get_current_object(),
+                        get_process_id(),
+                        plan.node_map[current_id],
+                        plan,
+                        context,
+                        indent
+                    )
+                    running[future] = current_id
+                
+                if not running:
                     continue
-                    
-                incoming_edges_count[next_id] -= 1
-                if incoming_edges_count[next_id] == 0 and next_id not in visited:
-                    queue.append(next_id)
+                
+                logger.info(f"{indent}Running {len(running)} nodes in parallel: {', '.join(running.values())}")
+                done = set()
+                while not done and not execution.cancelled:
+                    done, _ = wait(running, timeout=CANCEL_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    current_id = running.pop(future)
+                    # Re-raises the node's exception; the remaining nodes are cancelled below
+                    complete(current_id, future.result())
+        finally:
+            if pool is not None:
+                # A cancelled run returns at once; its running nodes stop at their next cancellation check
+                pool.shutdown(wait=not execution.cancelled, cancel_futures=True)
         
-        # Find terminal nodes (nodes with no outgoing edges or nodes that were executed last)
-        terminal_nodes = []
-        for node_id in executed_nodes:
-            # Check if this node is a terminal node (no outgoing edges)
-            is_terminal = not dependency_graph[node_id]
-            
-            # Or if it's the target of a conditional path and was executed
-            is_conditional_target = node_id in conditional_paths.values() and node_id in visited
+        return self._workflow_result(plan, executed_nodes, node_results, conditional_paths, input_data)
+
+    @staticmethod
+    def _unblocked_successors(plan, context, current_id, incoming_edges_count, conditional_paths, indent=''):
+        """
+        Count the edges from a finished node as satisfied and return the successors with none left.
+
+        Classifier and ifelse nodes only satisfy the edge to the node on their selected branch.
+        """
+        # Check if this is a conditional node (classifier or ifelse) and handle conditional paths
+        node_type = plan.node_type(current_id)
+        if node_type in ['classifier', 'ifelse']:
+            # Find the process step for this node to get the result
+            node_step = context['steps_by_node'].get(current_id)
             
-            if is_terminal or is_conditional_target:
-                terminal_nodes.append(node_id)
+            if node_step and 'next_node_id' in node_step:
+                # Get the next node ID based on the result
+                next_node_id = node_step['next_node_id']
+                
+                if node_type == 'classifier':
+                    logger.info(f"{indent}Classifier node {current_id} determined next node: {next_node_id} based on class '{node_step.get('class_name', '')}'")                        
+                elif node_type == 'ifelse':
+                    logger.info(f"{indent}IF/ELSE node {current_id} determined next node: {next_node_id} based on branch '{node_step.get('branch_taken', '')}'")                        
+                
+                # Store the conditional path
+                conditional_paths[current_id] = next_node_id
+                
+                # Only release the specific next node
+                if next_node_id not in plan.node_map:
+                    logger.warning(f"{indent}Next node {next_node_id} not found in workflow")
+                    return []
+                # Decrement the incoming edge count for the next node
+                incoming_edges_count[next_node_id] -= 1
+                # Ready once all dependencies are satisfied
+                return [next_node_id] if incoming_edges_count[next_node_id] == 0 else []
+        
+        # For non-conditional nodes or conditional nodes without a selected path,
+        # decrement the incoming edge count of all successor nodes
+        unblocked = []
+        for next_id in plan.out_edges[current_id]:
+            incoming_edges_count[next_id] -= 1
+            if incoming_edges_count[next_id] == 0:
+                unblocked.append(next_id)
+        return unblocked
+
+    @staticmethod
+    def _workflow_result(plan, executed_nodes, node_results, conditional_paths, input_data):
+        """The result of a run: that of its last answer node, else of its last executed node."""
+        # Find terminal nodes (nodes with no outgoing edges or nodes that were executed last)
+        conditional_targets = set(conditional_paths.values())
+        terminal_nodes = [node_id for node_id in executed_nodes
+                          if node_id in plan.terminal_ids or node_id in conditional_targets]
         
         # Return result from terminal nodes, prioritizing 'answer' type nodes
-        answer_nodes = [node_id for node_id in terminal_nodes 
-                      if node_map[node_id].get('data', {}).get('nodeType') == 'answer']
+        answer_nodes = [node_id for node_id in terminal_nodes if plan.node_type(node_id) == 'answer']
         
         if answer_nodes:
             # If we have answer nodes, return the result from the last one
@@ -693,60 +859,369 @@ class WorkflowService:
         else:
             # Fallback to input
             return input_data
-            
-    @log_execution_time(logger)
-    def _execute_node(self, current_node, nodes, edges, context, indent=''):
-        """Execute a single node in the workflow"""
-        # Create a unique ID for this node execution
-        node_execution_id = str(uuid.uuid4())[:6]
-        node_start_time = time.time()
+
+    def _execute_subworkflow(self, current_node, callee_plan, context, input_data, cancel_scope=None, indent=''):
+        """
+        Run the plan of the workflow a sub-workflow node calls, inline in the calling run.
+
+        The callee starts with the node's ``input`` setting rendered, or else with the
+        previous node's result as is, and its result is returned without serialising it.
+        It has a context of its own but shares the run's conversation memory, uploaded
+        files, cancel token and deadline (shortened to the node's timeout, if any).
+        Returns ``(result, run)``, ``run`` summarising the callee's execution.
+        """
+        execution = context['execution']
+        call_stack = context.get('subworkflow_stack') or (str(context['workflow_uuid']),)
+        if callee_plan.workflow_uuid in call_stack:
+            raise RuntimeError(f"Sub-workflow node {current_node['id']} calls workflow {callee_plan.workflow_uuid} "
+                               f"recursively: {' -> '.join(call_stack + (callee_plan.workflow_uuid,))}")
+        if len(call_stack) > self.max_subworkflow_depth:
+            raise RuntimeError(f"Sub-workflow node {current_node['id']} exceeds the maximum sub-workflow depth "
+                               f"of {self.max_subworkflow_depth}")
+        if callee_plan.start_node is None:
+            raise ValueError(f"Workflow {callee_plan.workflow_uuid} called by node {current_node['id']} has no start node")
         
-        # Get node details
-        node_data = current_node.get('data', {})
-        node_type = node_data.get('nodeType')
-        node_label = node_data.get('label', current_node['id'])
+        settings = current_node.get('data', {}).get('settings', {}) or {}
+        callee_input = input_data
+        if settings.get('input'):
+            callee_input = render_template(settings['input'], context, MISSING_PLACEHOLDER)
         
-        # Create node header banner with detailed information and Windows compatibility
-        if ANSI_ENABLED:
-            node_header = f"{COLORS['CYAN']}{COLORS['BOLD']}{indent}" \
-                         f"NODE EXECUTION STARTED [ID: {node_execution_id}]\n" \
-                         f"{indent}NODE: {node_label} ({current_node['id']}) | TYPE: {node_type} | PROGRESS: {self.nodes_executed}/{self.node_count}{COLORS['RESET']}"
+        listener = None
+        if execution.streaming:
+            # The callee's events reach the caller's listener, tagged with the calling node
+            listener = lambda event, data: execution.emit(event, {**data, 'subworkflow_node_id': current_node['id']})
+        deadline = execution.deadline
+        if cancel_scope is not None and cancel_scope.deadline is not None:
+            deadline = cancel_scope.deadline if deadline is None else min(deadline, cancel_scope.deadline)
+        child = execution.child(callee_plan.workflow_uuid, cancel_event=cancel_scope, deadline=deadline,
+                                listener=listener)
+        child.node_count = len(callee_plan.node_ids) - len(callee_plan.pruned_ids)
+        
+        sub_context = {
+            'input': callee_input,
+            'process_steps': [],
+            'steps_by_node': {},
+            'execution': child,
+            'workflow_uuid': callee_plan.workflow_uuid,
+            'execution_id': execution.execution_id,
+            'start_time': child.started_at,
+            'conversation_id': context.get('conversation_id'),
+            'memory': context.get('memory'),
+            'files': context.get('files', []),
+            'run_files': context.get('run_files'),
+            'subworkflow_stack': call_stack + (callee_plan.workflow_uuid,)
+        }
+        logger.info(f"{indent}Calling workflow {callee_plan.workflow_name} ({callee_plan.workflow_uuid}) "
+                    f"with {child.node_count} nodes")
+        try:
+            result = self._execute_workflow_topological(
+                plan=callee_plan,
+                input_data=callee_input,
+                context=sub_context,
+                start_node=callee_plan.start_node,
+                indent=indent + '  '
+            )
+        finally:
+            child.finish()
+        logger.info(f"{indent}Workflow {callee_plan.workflow_uuid} returned after {child.execution_time:.3f}s "
+                    f"({child.progress} nodes)")
+        
+        return result, {
+            'workflow_uuid': callee_plan.workflow_uuid,
+            'workflow_name': callee_plan.workflow_name,
+            'version': callee_plan.updated_at.isoformat() if callee_plan.updated_at else None,
+            'nodes_executed': child.nodes_executed,
+            'total_nodes': child.node_count,
+            'execution_time': child.execution_time,
+            'process_steps': sub_context['process_steps']
+        }
+
+    def _llm_node_prompt(self, current_node, plan, settings, context, input_data, indent='', assemble=True):
+        """
+        The prompt of an LLM node and its input, with their ``{{node.var}}`` references rendered,
+        and whether the prompt is complete.
+
+        With ``assemble`` (and the context budget enabled) the prompt is complete: system prompt,
+        conversation history and message fitted to the node's context window by
+        ``context_assembler``, to be sent with ``raw=True``. Otherwise it is the system prompt,
+        user prompt and input, to which ``LLMService`` adds the history.
+        """
+        # Variables in prompts render as "{{Variable node.var not found}}" when unresolved
+        def replace_prompt_variables(text):
+            return render_template(text, context, MISSING_PLACEHOLDER)
+        
+        system_prompt = settings.get('systemPrompt', '')
+        if system_prompt:
+            system_prompt = replace_prompt_variables(system_prompt)
+            logger.info(f"{indent}System prompt after variable replacement: {system_prompt[:100]}{'...' if len(system_prompt) > 100 else ''}")
+        
+        if input_data:
+            # Also replace variables in input data if it's a string
+            if isinstance(input_data, str) and '{{' in input_data:
+                input_data = replace_prompt_variables(input_data)
+                logger.info(f"{indent}Input data after variable replacement: {input_data[:100]}{'...' if len(input_data) > 100 else ''}")
+        
+        user_prompt = settings.get('userPrompt', '')
+        if not (assemble and CONTEXT_BUDGET_ENABLED):
+            prompt_parts = [system_prompt] if system_prompt else []
+            if user_prompt:
+                user_prompt = replace_prompt_variables(user_prompt)
+                logger.info(f"{indent}User prompt after variable replacement: {user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}")
+                prompt_parts.append(user_prompt)
+            if input_data:
+                prompt_parts.append(str(input_data))
+            return '\n\n'.join(prompt_parts), input_data, False
+        
+        # Knowledge node outputs, in the user prompt or as input, are packed chunk by chunk
+        steps_by_node = context.get('steps_by_node', {})
+        
+        def knowledge_chunks(node_id):
+            step = steps_by_node.get(node_id)
+            if not step or step.get('type') != 'knowledge':
+                return None
+            # A cached knowledge result has no chunk list and counts as one chunk
+            return context.get(f'node_{node_id}_chunks') or ([str(step['output'])] if step.get('output') else [])
+        
+        message_parts = []
+        referenced = set()
+        if user_prompt:
+            template = compile_template(user_prompt)
+            referenced = {ref.node_id for ref in template.variables if ref.var_name == 'output'}
+            message_parts = template.render_parts(
+                context, MISSING_PLACEHOLDER, lambda ref: knowledge_chunks(ref.node_id) if ref.var_name == 'output' else None)
+        if input_data:
+            prev_node_id = plan.first_predecessor(current_node['id'])
+            chunks = knowledge_chunks(prev_node_id) if prev_node_id else None
+            # Chunks the user prompt already places are not repeated as input
+            if chunks is None or prev_node_id not in referenced:
+                if message_parts:
+                    message_parts.append('\n\n')
+                message_parts.append(chunks if chunks is not None else str(input_data))
+        
+        memory = context.get('memory')
+        history_lines = self.llm_service.history_lines(memory.messages if memory is not None else [], settings)
+        assembly = assemble_context(self.llm_service.system_instructions(system_prompt, settings), message_parts,
+                                    history_lines, context_budget(settings))
+        log = logger.warning if assembly.trimmed else logger.info
+        log(f"{indent}Context of node {current_node['id']}: {assembly.tokens}/{assembly.budget} tokens, "
+            f"{assembly.chunks_used}/{assembly.chunks_total} chunks, "
+            f"{len(assembly.history_lines)}/{assembly.history_total} history messages"
+            f"{', truncated' if assembly.truncated else ''}")
+        with context['execution'].lock:
+            context[f'node_{current_node["id"]}_context'] = assembly.to_dict()
+        
+        prompt = self.llm_service.compose_prompt(assembly.system_prompt, assembly.history_lines, assembly.message)
+        return prompt, input_data, True
+
+    @staticmethod
+    def _classifier_query(settings, context, indent=''):
+        """Text a classifier node classifies: its ``input_variable`` if set and found, else the workflow input."""
+        # Use input variable from settings if provided, otherwise fall back to original input
+        input_variable = settings.get('input_variable', '')
+        if input_variable:
+            # Extract node_id and var_name from input_variable (format: node_id.var_name)
+            try:
+                node_id, var_name = input_variable.split('.')
+                # Find the referenced node in process steps
+                step = context.get('steps_by_node', {}).get(node_id)
+                if step and var_name in step:
+                    query = step[var_name]
+                    logger.info(f"{indent}Using input from {input_variable}: {str(query)[:100]}{'...' if len(str(query)) > 100 else ''}")
+                else:
+                    query = context.get('input', '')
+                    logger.warning(f"{indent}Could not find variable {input_variable}, falling back to original input")
+            except Exception as e:
+                query = context.get('input', '')
+                logger.error(f"{indent}Error processing input variable {input_variable}: {str(e)}, falling back to original input")
         else:
-            node_header = f"{indent}NODE EXECUTION STARTED [ID: {node_execution_id}]\n" \
-                         f"{indent}NODE: {node_label} ({current_node['id']}) | TYPE: {node_type} | PROGRESS: {self.nodes_executed}/{self.node_count}"
-        logger.info(node_header)
+            # Fall back to original input if no input_variable is set
+            query = context.get('input', '')
+            logger.info(f"{indent}No input variable set, using original input")
+        return query
+
+    @staticmethod
+    def _classifier_prompt(settings, query):
+        """Classification prompt of a classifier node for ``query``, and its class names."""
+        # Get classes from settings
+        classes = settings.get('classes', [])
+        class_names = [c.get('name') for c in classes]
+        class_descriptions = [c.get('description') for c in classes]
         
-        # Log more detailed information about the node
-        logger.info(f"{indent}Node depth: {indent.count('  ')} | Context steps: {len(context.get('process_steps', []))}")
+        # Build prompt for classification
+        instruction = settings.get('instruction', '')
+        prompt = f"""You are a question classifier. Classify the following input into one of these categories:
+{', '.join(class_names)}
+
+"""
         
-        # Check for max depth to prevent infinite recursion
-        if indent.count('  ') >= self.max_depth:
-            error_msg = f"Maximum workflow depth {self.max_depth} exceeded at node {current_node['id']}"
-            if ANSI_ENABLED:
-                logger.error(f"{COLORS['RED']}{COLORS['BOLD']}ERROR: {error_msg}{COLORS['RESET']}")
+        # Add class descriptions if available
+        for i, (name, desc) in enumerate(zip(class_names, class_descriptions)):
+            if desc:
+                prompt += f"Class '{name}': {desc}\n"
+        
+        # Add custom instruction if provided
+        if instruction:
+            prompt += f"\n{instruction}\n"
+        
+        # Add the input to classify
+        prompt += f"\nInput to classify: {query}\n\nOutput only the class name without any explanation."
+        return prompt, class_names
+
+    @staticmethod
+    def _classifier_llm_settings(settings):
+        return {
+            'model': settings.get('model', 'llama2'),
+            'ollamaBaseUrl': settings.get('ollamaBaseUrl', 'http://localhost:11434'),
+            'temperature': 0.1,  # Lower temperature for more deterministic classification
+        }
+
+    @staticmethod
+    def _classifier_result(classification_result, class_names, prompt, indent=''):
+        """Result of a classifier node: the class the LLM answered, matched against the node's classes."""
+        # Extract the class name from the result
+        class_name = classification_result.strip()
+        
+        # Check if the class name is in the list of valid classes
+        if class_name not in class_names:
+            # Try to find the closest match
+            for name in class_names:
+                if name.lower() in class_name.lower():
+                    class_name = name
+                    break
             else:
-                logger.error(f"ERROR: {error_msg}")
-            raise RuntimeError(error_msg)
+                # If still not found, use the first class as default
+                logger.warning(f"{indent}Classification result '{class_name}' not in valid classes {class_names}. Using first class as default.")
+                class_name = class_names[0] if class_names else "Unknown"
+        
+        # Create result object with class name and usage info
+        result = {
+            'class_name': class_name,
+            'usage': {
+                'prompt_tokens': len(prompt.split()),
+                'completion_tokens': len(class_name.split()),
+                'total_tokens': len(prompt.split()) + len(class_name.split())
+            }
+        }
+        return result
+
+    @staticmethod
+    def _token_emitter(execution, node_id):
+        """LLM ``on_token`` callback forwarding tokens to the run's listener, or None when nobody listens."""
+        if not execution.streaming:
+            return None
+        return lambda token: execution.emit('token', {'node_id': node_id, 'token': token})
+
+    def _execute_node_in_worker(self, app, process_id, current_node, plan, context, indent=''):
+        """Run ``_execute_node`` on a pool thread, with its own app context and database session."""
+        with app.app_context():
+            set_process_id(process_id)
+            return self._execute_node(current_node, plan, context, indent)
             
-        # Get input from previous node if it exists
-        prev_edges = [edge for edge in edges if edge['target'] == current_node['id']]
-        input_data = context.get('input', '')
-        if prev_edges and node_type != 'start':
-            prev_node_id = prev_edges[0]['source']
-            input_data = context.get(f'node_{prev_node_id}_result', input_data)
+    @log_execution_time(logger)
+    def _execute_node(self, current_node, plan, context, indent=''):
+        """Execute a single node in the workflow under its policy: attempt timeout, retries, fallback"""
+        execution = context['execution']
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+        policy = NodePolicy.for_node(node_type, node_data)
+        if policy.is_default and execution.deadline is None:
+            return self._execute_node_attempt(current_node, plan, context, indent)
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            execution.check_cancelled()
+            execution.check_deadline()
+            # The attempt ends at its own timeout or at the workflow deadline, whichever comes first
+            deadline = execution.deadline
+            if policy.timeout is not None:
+                attempt_deadline = time.time() + policy.timeout
+                deadline = attempt_deadline if deadline is None else min(deadline, attempt_deadline)
+            try:
+                return self._execute_node_attempt(current_node, plan, context, indent,
+                                                  cancel_scope=CancelScope(execution.cancel_event, deadline),
+                                                  attempt=attempt)
+            except WorkflowCancelledError:
+                raise
+            except Exception as e:
+                error = e
+            
+            if attempt > policy.retries or execution.deadline_exceeded:
+                break
+            delay = policy.retry_delay(attempt)
+            if execution.deadline is not None:
+                delay = min(delay, max(0.0, execution.deadline - time.time()))
+            logger.warning(f"{indent}Node {current_node['id']} failed (attempt {attempt}/{policy.retries + 1}): "
+                           f"{str(error)}; retrying in {delay:.2f}s")
+            # Backoff, waking up at once on cancellation
+            execution.cancel_event.wait(delay)
+        
+        if policy.has_fallback:
+            logger.warning(f"{indent}Node {current_node['id']} failed after {attempt} attempt(s), using its fallback")
+            return self._execute_node_attempt(current_node, plan, context, indent, attempt=attempt,
+                                              fallback=(policy.fallback, error))
+        raise error
+    
+    def _execute_node_attempt(self, current_node, plan, context, indent='', cancel_scope=None, attempt=1,
+                              fallback=None):
+        """
+        Execute one attempt of a node.
+
+        ``cancel_scope`` bounds the attempt in time (see ``CancelScope``); ``fallback``, a
+        ``(value, error)`` pair, records the node with ``value`` as result instead of executing it.
+        """
+        execution = context['execution']
+        # Node services stop on the run's cancellation, and on the attempt's timeout if it has one
+        cancel_event = cancel_scope if cancel_scope is not None else execution.cancel_event
+        request_timeout = cancel_scope.remaining() if cancel_scope is not None else None
+        # Token counts reported by the LLM calls of this attempt, for the trace
+        usage = {}
+        
+        node_start_time = time.time()
+        
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+        input_data = self._begin_node_attempt(current_node, plan, context, indent, attempt)
+        
+        # Process steps of the nodes executed so far, by node id
+        steps_by_node = context.setdefault('steps_by_node', {})
         
         # Execute based on node type with detailed logging
         result = None
+        cache_key = None
+        cache_ttl = None
+        cache_hit = False
+        subworkflow_run = None
         try:
-            if node_type == 'llm':
+            # Sub-workflow nodes run the cached plan of the workflow they call
+            callee_plan = None
+            if node_type == 'subworkflow' and fallback is None:
+                callee_uuid = plan.subworkflow_id(current_node['id'])
+                callee_plan = self._subworkflow_plan(callee_uuid) if callee_uuid else None
+                if callee_plan is None:
+                    raise ValueError(f"Sub-workflow node {current_node['id']}: workflow {callee_uuid} not found")
+            
+            # Opt-in memoisation: same node, resolved settings and inputs -> stored result
+            if fallback is None:
+                cache_key, cache_ttl, cache_hit, result = lookup_node_result(
+                    node_type, node_data, context, input_data, plan, callee_plan)
+            
+            if fallback is not None:
+                result = copy.deepcopy(fallback[0])
+                logger.warning(f"{indent}Using fallback result for node {current_node['id']}: {str(result)[:100]}")
+            
+            elif cache_hit:
+                logger.info(f"{indent}Cache hit for node {current_node['id']} (key {cache_key[:12]}), skipping execution")
+            
+            elif node_type == 'llm':
                 logger.info(f"{indent}Executing LLM node with ID: {current_node['id']}")
                 settings = node_data.get('settings', {})
                 context['settings'] = settings
                 
                 # Check if multimodal is enabled
                 enable_multimodal = settings.get('enableMultimodal', False)
-                image_paths = context.get('image_paths', [])
-                has_images = enable_multimodal and image_paths and len(image_paths) > 0
+                image_paths = context['run_files'].image_paths if enable_multimodal else []
+                has_images = enable_multimodal and len(image_paths) > 0
                 
                 if has_images:
                     logger.info(f"{indent}Multimodal mode enabled with {len(image_paths)} images")
@@ -788,108 +1263,15 @@ class WorkflowService:
                 
                 logger.info('\n'.join(settings_str))
                 
-                # Get conversation history - FIXED to use specific conversation_id
-                # Get the current conversation ID from the context
-                current_conversation_id = context.get('conversation_id')
-                if not current_conversation_id:
-                    logger.warning("No conversation ID found in context, conversation history will not be used")
+                # Conversation history, loaded once at run start
+                memory = context.get('memory')
+                if memory is None:
+                    logger.warning("No conversation memory in context, conversation history will not be used")
                     conversation_history = []
                 else:
-                    # Get only the specific conversation memory by its ID
-                    logger.info(f"Looking for conversation memory with ID: {current_conversation_id}")
-                    memory = ConversationMemory.query.get(current_conversation_id)
-                    conversation_history = []
-                    if memory:
-                        conversation_history = memory.messages
-                        # DEBUG: Log the conversation history being passed to the LLM
-                        logger.info(f"DEBUG: Passing {len(conversation_history)} messages to LLM from conversation {current_conversation_id}")
-                        for idx, msg in enumerate(conversation_history):
-                            logger.info(f"DEBUG: LLM history message #{idx+1} - Role: {msg.get('role')}, Content: {msg.get('content')[:100]}{'...' if len(msg.get('content', '')) > 100 else ''}")
-                    else:
-                        logger.warning(f"Conversation memory with ID {current_conversation_id} not found")  
-                # Build prompt parts
-                prompt_parts = []
-                
-                # Helper function to replace variables in prompts
-                import re
-                def replace_prompt_variables(text):
-                    if not text:
-                        return text
-                        
-                    def replace_var(match):
-                        var_ref = match.group(1).strip()
-                        try:
-                            node_id, var_name = var_ref.split('.')
-                            
-                            # Special handling for start node variables
-                            # Check if the node_id starts with 'start-'
-                            is_start_node = node_id.startswith('start-')
-                            
-                            # Special handling for files and file_content from context
-                            if is_start_node and var_name == 'files':
-                                files = context.get('files', [])
-                                if files:
-                                    file_list = [f"{f.get('filename', 'unnamed')} ({f.get('size', 0)} bytes)" for f in files]
-                                    return "\n".join([f"Files available ({len(files)}):"] + file_list)
-                                return "No files available"
-                                
-                            if is_start_node and var_name == 'file_content':
-                                file_content = context.get('file_content', '')
-                                files = context.get('files', [])
-                                if file_content:
-                                    filename = files[0].get('filename', 'unnamed') if files else 'unknown'
-                                    header = f"File Content ({filename}):\n\n"
-                                    return header + file_content
-                                return "No file content available"
-                                
-                            # Handle input from start node
-                            if is_start_node and var_name == 'input':
-                                input_data = context.get('input', '')
-                                if input_data:
-                                    return str(input_data)
-                                return ""
-                            
-                            # Find the referenced node in process steps
-                            for step in context.get('process_steps', []):
-                                if step['node'] == node_id:
-                                    # Handle input/output variables
-                                    if var_name in ['input', 'output']:
-                                        value = step.get(var_name)
-                                        if value is not None:
-                                            logger.info(f"{indent}  Found variable {node_id}.{var_name} = {str(value)[:50]}...")
-                                            return str(value)
-                        except Exception as e:
-                            logger.error(f"Error replacing variable {var_ref}: {str(e)}")
-                            
-                        logger.info(f"{indent}  Variable {var_ref} not found or invalid")
-                        return f"{{{{Variable {var_ref} not found}}}}"
-                    
-                    # Replace all variable references
-                    return re.sub(r'\{\{\s*([^}]+?)\s*\}\}', replace_var, text)
-                
-                # Add system prompt if provided
-                system_prompt = settings.get('systemPrompt', '')
-                if system_prompt:
-                    system_prompt = replace_prompt_variables(system_prompt)
-                    logger.info(f"{indent}System prompt after variable replacement: {system_prompt[:100]}{'...' if len(system_prompt) > 100 else ''}")
-                    prompt_parts.append(system_prompt)
-                
-                # Add user prompt if provided
-                user_prompt = settings.get('userPrompt', '')
-                if user_prompt:
-                    user_prompt = replace_prompt_variables(user_prompt)
-                    logger.info(f"{indent}User prompt after variable replacement: {user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}")
-                    prompt_parts.append(user_prompt)
-                
-                # Add input data
-                if input_data:
-                    # Also replace variables in input data if it's a string
-                    if isinstance(input_data, str) and '{{' in input_data:
-                        input_data = replace_prompt_variables(input_data)
-                        logger.info(f"{indent}Input data after variable replacement: {input_data[:100]}{'...' if len(input_data) > 100 else ''}")
-                    prompt_parts.append(str(input_data))
-                
-                final_prompt = '\n\n'.join(prompt_parts)
+                    conversation_history = memory.messages
+                final_prompt, input_data, assembled = self._llm_node_prompt(current_node, plan, settings, context,
+                                                                            input_data, indent, assemble=not has_images)
 
                 try:
                     # Use multimodal generation if enabled and images are available
@@ -908,7 +1290,10 @@ class WorkflowService:
                                 prompt=final_prompt,
                                 image_paths=image_paths,
                                 settings=settings,
-                                conversation_history=conversation_history
+                                conversation_history=conversation_history,
+                                cancel_event=cancel_event,
+                                timeout=request_timeout,
+                                on_usage=usage.update
                             )
                         except Exception as e:
                             # Provide more user-friendly error message for multimodal failures
@@ -931,7 +1316,12 @@ class WorkflowService:
                         result = self.llm_service.generate(
                             prompt=final_prompt,
                             settings=settings,
-                            conversation_history=conversation_history
+                            conversation_history=conversation_history,
+                            on_token=self._token_emitter(execution, current_node['id']),
+                            cancel_event=cancel_event,
+                            timeout=request_timeout,
+                            on_usage=usage.update,
+                            raw=assembled
                         )
                     
                     # Handle structured output results
@@ -980,18 +1370,16 @@ class WorkflowService:
                 
                 try:
                     # Get conversation history
-                    current_conversation_id = context.get('conversation_id')
-                    conversation_history = []
-                    if current_conversation_id:
-                        memory = ConversationMemory.query.get(current_conversation_id)
-                        if memory:
-                            conversation_history = memory.messages
+                    memory = context.get('memory')
+                    conversation_history = memory.messages if memory is not None else []
                     
                     # Execute agent
                     result = self.agent_service.execute_agent(
                         input_data=query,
                         settings=settings,
-                        conversation_history=conversation_history
+                        conversation_history=conversation_history,
+                        cancel_event=cancel_event,
+                        timeout=request_timeout
                     )
                     
                 except Exception as e:
@@ -1057,7 +1445,10 @@ class WorkflowService:
                     retrieval_method=retrieval_method,
                     dataset_id=knowledge_id,
                     query=query,
-                    top_k=limit
+                    top_k=limit,
+                    candidate_documents=settings.get('candidate_documents'),
+                    candidate_chunks=settings.get('candidate_chunks'),
+                    cancel_event=cancel_event
                 )
                 
                 # Process results from KnowledgeRetrievalService
@@ -1071,6 +1462,10 @@ class WorkflowService:
                     # Just return the combined context as the result
                     result = combined_context
                     
+                    # Ranked chunks, for LLM nodes to fit into their context window
+                    with context['execution'].lock:
+                        context[f'node_{current_node["id"]}_chunks'] = documents
+                    
                     logger.info(f"{indent}Retrieved {len(retrieval_results)} knowledge chunks")
                     logger.info(f"{indent}Combined context length: {len(combined_context)} characters")
                 else:
@@ -1090,35 +1485,8 @@ class WorkflowService:
                 # Log answer text before interpolation
                 logger.info(f"{indent}Answer text before interpolation: {answer_text}")
                 
-                # Replace variables in the format {{nodeId.variableName}}
-                import re
-                def replace_variable(match):
-                    var_ref = match.group(1).strip()
-                    node_id, var_name = var_ref.split('.')
-                    
-                    # Find the referenced node in process steps
-                    for step in context.get('process_steps', []):
-                        if step['node'] == node_id:
-                            # Handle input/output variables
-                            if var_name in ['input', 'output']:
-                                value = step.get(var_name)
-                                if value is not None:
-                                    logger.info(f"{indent}  Found variable {node_id}.{var_name} = {str(value)[:50]}...")
-                                    return str(value)
-                            
-                            # Handle classifier-specific variables
-                            if step['type'] == 'classifier':
-                                if var_name == 'class_name' and 'class_name' in step:
-                                    logger.info(f"{indent}  Found classifier variable {node_id}.{var_name} = {step['class_name']}")
-                                    return str(step['class_name'])
-                                elif var_name == 'usage' and 'usage' in step:
-                                    logger.info(f"{indent}  Found classifier variable {node_id}.{var_name} = {step['usage']}")
-                                    return str(step['usage'])
-                    logger.info(f"{indent}  Variable {node_id}.{var_name} not found")
-                    return ''
-                
-                # Replace all variable references
-                result = re.sub(r'\{\{\s*([^}]+?)\s*\}\}', replace_variable, answer_text)
+                # Replace variables in the format {{nodeId.variableName}}; unresolved ones render empty
+                result = render_template(answer_text, context, MISSING_EMPTY)
                 
                 # Log answer text after interpolation
                 logger.info(f"{indent}Answer text after interpolation: {result}")
@@ -1135,28 +1503,7 @@ class WorkflowService:
                 logger.info(f"{indent}Executing classifier node with ID: {current_node['id']}")
                 settings = node_data.get('settings', {})
                 
-                # Use input variable from settings if provided, otherwise fall back to original input
-                input_variable = settings.get('input_variable', '')
-                if input_variable:
-                    # Extract node_id and var_name from input_variable (format: node_id.var_name)
-                    try:
-                        node_id, var_name = input_variable.split('.')
-                        # Find the referenced node in process steps
-                        for step in context.get('process_steps', []):
-                            if step['node'] == node_id and var_name in step:
-                                query = step[var_name]
-                                logger.info(f"{indent}Using input from {input_variable}: {str(query)[:100]}{'...' if len(str(query)) > 100 else ''}")
-                                break
-                        else:
-                            query = context.get('input', '')
-                            logger.warning(f"{indent}Could not find variable {input_variable}, falling back to original input")
-                    except Exception as e:
-                        query = context.get('input', '')
-                        logger.error(f"{indent}Error processing input variable {input_variable}: {str(e)}, falling back to original input")
-                else:
-                    # Fall back to original input if no input_variable is set
-                    query = context.get('input', '')
-                    logger.info(f"{indent}No input variable set, using original input")
+                query = self._classifier_query(settings, context, indent)
                 
                 # Log classifier settings
                 settings_str = [
@@ -1173,35 +1520,11 @@ class WorkflowService:
                     # Get conversation history if memory is enabled
                     conversation_history = []
                     if settings.get('memoryEnabled', False):
-                        current_conversation_id = context.get('conversation_id')
-                        if current_conversation_id:
-                            memory = ConversationMemory.query.get(current_conversation_id)
-                            if memory:
-                                conversation_history = memory.messages
-                    
-                    # Get classes from settings
-                    classes = settings.get('classes', [])
-                    class_names = [c.get('name') for c in classes]
-                    class_descriptions = [c.get('description') for c in classes]
-                    
-                    # Build prompt for classification
-                    instruction = settings.get('instruction', '')
-                    prompt = f"""You are a question classifier. Classify the following input into one of these categories:
-{', '.join(class_names)}
-
-"""
-                    
-                    # Add class descriptions if available
-                    for i, (name, desc) in enumerate(zip(class_names, class_descriptions)):
-                        if desc:
-                            prompt += f"Class '{name}': {desc}\n"
-                    
-                    # Add custom instruction if provided
-                    if instruction:
-                        prompt += f"\n{instruction}\n"
+                        memory = context.get('memory')
+                        if memory is not None:
+                            conversation_history = memory.messages
                     
-                    # Add the input to classify
-                    prompt += f"\nInput to classify: {query}\n\nOutput only the class name without any explanation."
+                    prompt, class_names = self._classifier_prompt(settings, query)
 
                     # Log prompt before classification
                     logger.info(f"{indent}Classification prompt: {prompt}")
@@ -1209,40 +1532,16 @@ class WorkflowService:
                     # Use LLM service to classify
                     classification_result = self.llm_service.generate(
                         prompt=prompt,
-                        settings={
-                            'model': settings.get('model', 'llama2'),
-                            'ollamaBaseUrl': settings.get('ollamaBaseUrl', 'http://localhost:11434'),
-                            'temperature': 0.1,  # Lower temperature for more deterministic classification
-                        },
-                        conversation_history=conversation_history if settings.get('memoryEnabled', False) else []
+                        settings=self._classifier_llm_settings(settings),
+                        conversation_history=conversation_history if settings.get('memoryEnabled', False) else [],
+                        cancel_event=cancel_event,
+                        timeout=request_timeout,
+                        on_usage=usage.update
                     )
                     
-                    # Extract the class name from the result
-                    class_name = classification_result.strip()
-                    
-                    # Check if the class name is in the list of valid classes
-                    if class_name not in class_names:
-                        # Try to find the closest match
-                        for name in class_names:
-                            if name.lower() in class_name.lower():
-                                class_name = name
-                                break
-                        else:
-                            # If still not found, use the first class as default
-                            logger.warning(f"{indent}Classification result '{class_name}' not in valid classes {class_names}. Using first class as default.")
-                            class_name = class_names[0] if class_names else "Unknown"
-                    
-                    # Create result object with class name and usage info
-                    result = {
-                        'class_name': class_name,
-                        'usage': {
-                            'prompt_tokens': len(prompt.split()),
-                            'completion_tokens': len(class_name.split()),
-                            'total_tokens': len(prompt.split()) + len(class_name.split())
-                        }
-                    }
+                    result = self._classifier_result(classification_result, class_names, prompt, indent)
                     
-                    logger.info(f"{indent}Classification result: {class_name}")
+                    logger.info(f"{indent}Classification result: {result['class_name']}")
                     
                 except Exception as e:
                     error_msg = f"Classifier node {current_node['id']} failed: {str(e)}"
@@ -1258,14 +1557,15 @@ class WorkflowService:
             elif node_type == 'http_request':
                 logger.info(f"{indent}Executing HTTP Request node with ID: {current_node['id']}")
                 ### please utilize HttpRequestNode class to execute http request
-                httpRequestNode = HttpRequestNode(current_node['id'], node_data, context)
+                httpRequestNode = HttpRequestNode(current_node['id'], node_data, context,
+                                                  cancel_event=cancel_event, timeout=request_timeout)
                 result = httpRequestNode.execute()
             
             #DOC EXTRACTOR
             elif node_type == 'doc_extractor':
                 logger.info(f"{indent}Executing Document Extractor node with ID: {current_node['id']}")
                 ### please utilize DocumentExtractorNode class to extract text from document
-                documentExtractorNode = DocumentExtractorNode(current_node['id'], node_data, context)
+                documentExtractorNode = DocumentExtractorNode(current_node['id'], node_data, context, cancel_event)
                 result = documentExtractorNode.execute()
             
             # IF/ELSE Node
@@ -1296,33 +1596,8 @@ class WorkflowService:
                     reason = 'All conditions evaluated to false'
                     
                     # Helper function to replace variables in condition values
-                    import re
                     def replace_condition_variables(text):
-                        if not isinstance(text, str):
-                            return text
-                            
-                        def replace_var(match):
-                            var_ref = match.group(1).strip()
-                            try:
-                                node_id, var_name = var_ref.split('.')
-                                
-                                # Find the referenced node in process steps
-                                for step in context.get('process_steps', []):
-                                    if step['node'] == node_id:
-                                        # Handle input/output variables
-                                        if var_name in ['input', 'output']:
-                                            value = step.get(var_name)
-                                            if value is not None:
-                                                logger.info(f"{indent}  Found variable {node_id}.{var_name} = {str(value)[:50]}...")
-                                                return str(value)
-                            except Exception as e:
-                                logger.error(f"Error replacing variable {var_ref}: {str(e)}")
-                                
-                            logger.info(f"{indent}  Variable {var_ref} not found or invalid")
-                            return f"{{{{Variable {var_ref} not found}}}}"
-                        
-                        # Replace all variable references
-                        return re.sub(r'\{\{\s*([^}]+?)\s*\}\}', replace_var, text)
+                        return render_template(text, context, MISSING_PLACEHOLDER)
                     
                     # Helper function to evaluate a single condition
                     def evaluate_condition(condition):
@@ -1435,6 +1710,12 @@ class WorkflowService:
                     logger.info(f"{indent}IF/ELSE evaluation complete. Branch taken: {branch_taken}")
                     logger.info(f"{indent}Reason: {reason}")
                 
+            # Sub-workflow: the called workflow runs inline, in this run
+            elif node_type == 'subworkflow':
+                logger.info(f"{indent}Executing sub-workflow node with ID: {current_node['id']}")
+                result, subworkflow_run = self._execute_subworkflow(current_node, callee_plan, context, input_data,
+                                                                    cancel_scope, indent)
+                
             else:
                 if ANSI_ENABLED:
                     logger.warning(f"{COLORS['YELLOW']}{indent}Unknown node type: {node_type}{COLORS['RESET']}")
@@ -1442,40 +1723,102 @@ class WorkflowService:
                     logger.warning(f"{indent}Unknown node type: {node_type}")
                 result = input_data
 
-            # Calculate node execution time and log results
-            node_execution_time = time.time() - node_start_time
-            truncated_result = str(result)[:100] + '...' if len(str(result)) > 100 else str(result)
-            
-            logger.info(f"{COLORS['GREEN']}{indent}Node {current_node['id']} completed in {node_execution_time:.3f}s{COLORS['RESET']}")
-            logger.info(f"{indent}Result: {truncated_result}")
+            self._record_node_result(current_node, plan, context, input_data, result, node_start_time, indent,
+                                     attempt, usage, cache_key, cache_hit, cache_ttl, fallback, subworkflow_run)
+            return result
             
-            # Store assistant responses in conversation memory for LLM and Agent nodes
-            if node_type in ['llm', 'agent'] and result:
-                current_conversation_id = context.get('conversation_id')
-                if current_conversation_id:
-                    memory = ConversationMemory.query.get(current_conversation_id)
-                    if memory:
-                        logger.info(f"{indent}Adding assistant response to conversation memory with role_type: {node_type}")
-                        memory.add_message('assistant', str(result), role_type=node_type)
-                        db.session.commit()
-                        logger.info(f"{indent}Assistant response added to conversation memory with role_type: {node_type}")
-                    else:
-                        logger.warning(f"{indent}Conversation memory with ID {current_conversation_id} not found, cannot store assistant response")
-                else:
-                    logger.warning(f"{indent}No conversation ID in context, cannot store assistant response")
+        except Exception as e:
+            raise self._node_failure(current_node, context, input_data, e, node_start_time, indent, attempt, usage,
+                                     cancel_scope)
+
+    def _begin_node_attempt(self, current_node, plan, context, indent='', attempt=1):
+        """Announce a node attempt (log banner, ``node_started`` event) and return the node's input."""
+        execution = context['execution']
+        # Create a unique ID for this node execution
+        node_execution_id = str(uuid.uuid4())[:6]
+        
+        # Get node details
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+        node_label = node_data.get('label', current_node['id'])
+        
+        # Create node header banner with detailed information and Windows compatibility
+        if ANSI_ENABLED:
+            node_header = f"{COLORS['CYAN']}{COLORS['BOLD']}{indent}" \
+                         f"NODE EXECUTION STARTED [ID: {node_execution_id}]\n" \
+                         f"{indent}NODE: {node_label} ({current_node['id']}) | TYPE: {node_type} | PROGRESS: {execution.progress}{COLORS['RESET']}"
+        else:
+            node_header = f"{indent}NODE EXECUTION STARTED [ID: {node_execution_id}]\n" \
+                         f"{indent}NODE: {node_label} ({current_node['id']}) | TYPE: {node_type} | PROGRESS: {execution.progress}"
+        logger.info(node_header)
+        execution.check_cancelled()
+        started_event = {'node_id': current_node['id'], 'node_type': node_type, 'label': node_label}
+        if attempt > 1:
+            started_event['attempt'] = attempt
+        execution.emit('node_started', started_event)
+        
+        # Log more detailed information about the node
+        logger.info(f"{indent}Node depth: {indent.count('  ')} | Context steps: {len(context.get('process_steps', []))}")
+        
+        # Check for max depth to prevent infinite recursion
+        if indent.count('  ') >= self.max_depth:
+            error_msg = f"Maximum workflow depth {self.max_depth} exceeded at node {current_node['id']}"
+            if ANSI_ENABLED:
+                logger.error(f"{COLORS['RED']}{COLORS['BOLD']}ERROR: {error_msg}{COLORS['RESET']}")
+            else:
+                logger.error(f"ERROR: {error_msg}")
+            raise RuntimeError(error_msg)
             
+        # Get input from previous node if it exists
+        prev_node_id = plan.first_predecessor(current_node['id'])
+        input_data = context.get('input', '')
+        if prev_node_id and node_type != 'start':
+            input_data = context.get(f'node_{prev_node_id}_result', input_data)
+        return input_data
+
+    def _record_node_result(self, current_node, plan, context, input_data, result, node_start_time, indent='',
+                            attempt=1, usage=None, cache_key=None, cache_hit=False, cache_ttl=None, fallback=None,
+                            subworkflow_run=None):
+        """Store a finished node attempt in the run: result cache, memory, context, process step, event and trace."""
+        execution = context['execution']
+        node_data = current_node.get('data', {})
+        node_type = node_data.get('nodeType')
+        steps_by_node = context.setdefault('steps_by_node', {})
+        context_lock = execution.lock
+        
+        if cache_key and not cache_hit:
+            node_cache.set(cache_key, result, cache_ttl)
+
+        # Calculate node execution time and log results
+        node_execution_time = time.time() - node_start_time
+        truncated_result = str(result)[:100] + '...' if len(str(result)) > 100 else str(result)
+
+        logger.info(f"{COLORS['GREEN']}{indent}Node {current_node['id']} completed in {node_execution_time:.3f}s{COLORS['RESET']}")
+        logger.info(f"{indent}Result: {truncated_result}")
+
+        # Store assistant responses in conversation memory for LLM and Agent nodes
+        if node_type in ['llm', 'agent'] and result:
+            memory = context.get('memory')
+            if memory is not None:
+                # Buffered; saved with the rest of the run's messages
+                logger.info(f"{indent}Adding assistant response to conversation memory with role_type: {node_type}")
+                memory.add_message('assistant', str(result), role_type=node_type)
+            else:
+                logger.warning(f"{indent}No conversation memory in context, cannot store assistant response")
+
+        with context_lock:
             # Update context with result and execution metadata
             context[f'node_{current_node["id"]}_result'] = result
             context[f'node_{current_node["id"]}_input'] = input_data
             context[f'node_{current_node["id"]}_time'] = node_execution_time
-            
+
             # Add process step if not already added
             if 'process_steps' not in context:
                 context['process_steps'] = []
-                
+
             # Check if this node already has a step recorded
-            existing_step = next((s for s in context['process_steps'] if s['node'] == current_node['id']), None)
-            
+            existing_step = steps_by_node.get(current_node['id'])
+
             if not existing_step:
                 # Create step with additional structured output metadata if applicable
                 step = {
@@ -1487,80 +1830,77 @@ class WorkflowService:
                     'output': result,
                     'status': 'completed'
                 }
-                
+                if cache_key:
+                    step['cache_hit'] = cache_hit
+                if fallback is not None:
+                    step['status'] = 'fallback'
+                    step['error'] = str(fallback[1])
+                if attempt > 1:
+                    step['attempts'] = attempt
+
                 # Special handling for classifier node output
                 if node_type == 'classifier' and isinstance(result, dict):
                     # Store the class_name as a separate field for easier access
                     step['class_name'] = result.get('class_name', '')
                     step['usage'] = result.get('usage', {})
-                    
+
                     # Log the classification result
                     logger.info(f"{indent}Classification result stored in process step: {step['class_name']}")
-                    
+
                     # Store the next step mapping based on the classification result
-                    settings = node_data.get('settings', {})
-                    next_steps = settings.get('nextSteps', {})
-                    if step['class_name'] in next_steps:
-                        step['next_node_id'] = next_steps[step['class_name']]
+                    next_node_id = plan.branch_target(current_node['id'], step['class_name'])
+                    if next_node_id:
+                        step['next_node_id'] = next_node_id
                         logger.info(f"{indent}Next step for class '{step['class_name']}': {step['next_node_id']}")
                     else:
                         logger.info(f"{indent}No next step mapping found for class '{step['class_name']}'")                
-                
+
                 # Special handling for ifelse node output
                 elif node_type == 'ifelse' and isinstance(result, dict):
                     # Store the branch taken and condition result
                     step['branch_taken'] = result.get('branch_taken', 'else')
                     step['condition_result'] = result.get('condition_result', False)
                     step['reason'] = result.get('reason', '')
-                    
+
                     # Log the branch taken
                     logger.info(f"{indent}IF/ELSE branch taken stored in process step: {step['branch_taken']}")
-                    
-                    # Store the next step mapping based on the branch taken
-                    settings = node_data.get('settings', {})
-                    next_steps = settings.get('nextSteps', {})
-                    
+
                     # Determine the next node based on the branch taken
-                    next_node_id = None
-                    if step['branch_taken'] == 'if' and 'if' in next_steps:
-                        next_node_id = next_steps['if']
-                    elif step['branch_taken'].startswith('elif-'):
-                        # Extract the elif index from the branch name
-                        try:
-                            elif_idx = int(step['branch_taken'].split('-')[1])
-                            if 'elif' in next_steps and isinstance(next_steps['elif'], list) and elif_idx < len(next_steps['elif']):
-                                next_node_id = next_steps['elif'][elif_idx]
-                        except (ValueError, IndexError):
-                            logger.warning(f"{indent}Invalid ELIF index in branch taken: {step['branch_taken']}")
-                    elif step['branch_taken'] == 'else' and 'else' in next_steps:
-                        next_node_id = next_steps['else']
-                    
+                    next_node_id = plan.branch_target(current_node['id'], step['branch_taken'])
+
                     if next_node_id:
                         step['next_node_id'] = next_node_id
                         logger.info(f"{indent}Next step for branch '{step['branch_taken']}': {step['next_node_id']}")
                     else:
                         logger.info(f"{indent}No next step mapping found for branch '{step['branch_taken']}'")                
-                
+
+                # The callee's own steps, nested under the sub-workflow node
+                elif node_type == 'subworkflow' and subworkflow_run is not None:
+                    step['subworkflow'] = subworkflow_run
+
                 # Add structured output metadata if this is an LLM node with structured output enabled
                 if node_type == 'llm':
                     settings = node_data.get('settings', {})
                     structured_output = settings.get('structuredOutput', {})
                     use_structured_output = structured_output.get('enabled', False)
-                    
+
                     # Add multimodal information if enabled
                     enable_multimodal = settings.get('enableMultimodal', False)
-                    image_paths = context.get('image_paths', [])
-                    has_images = enable_multimodal and image_paths and len(image_paths) > 0
-                    
+                    image_paths = context['run_files'].image_paths if enable_multimodal else []
+                    has_images = enable_multimodal and len(image_paths) > 0
+
                     if has_images:
                         step['multimodal_enabled'] = True
                         step['image_count'] = len(image_paths)
                         step['image_paths'] = [os.path.basename(path) for path in image_paths]
-                    
+
+                    if f'node_{current_node["id"]}_context' in context and not cache_hit:
+                        step['context'] = context[f'node_{current_node["id"]}_context']
+
                     if use_structured_output:
                         step['structured_output_enabled'] = True
                         step['structured_output_schema'] = structured_output.get('properties', [])
-                        
+
                         # If we have validation results, include them
                         if isinstance(result, dict) and 'schema_valid' in result:
                             step['structured_output_valid'] = result.get('schema_valid', False)
@@ -1568,37 +1908,82 @@ class WorkflowService:
                                 step['structured_output_error'] = result.get('validation_error', 'Unknown validation error')
 
                 context['process_steps'].append(step)
+                steps_by_node[current_node['id']] = step
             else:
                 # Use the existing step for logging
                 step = existing_step
-            
-            # Log process step details
-            logger.info(f"{indent}Adding process step:")
-            logger.info(f"{indent}  Node: {step['node']}")
-            logger.info(f"{indent}  Type: {step['type']}")
-            logger.info(f"{indent}  Input: {step['input']}")
-            logger.info(f"{indent}  Output: {step['output']}")
-            
-            # Step is already stored in context
-            
-            # Log completion
-            logger.info(f"{COLORS['BOLD']}{indent}Node {current_node['id']} execution completed{COLORS['RESET']}")
-            
-            # Create node footer with Windows compatibility
-            if ANSI_ENABLED:
-                node_footer = f"{COLORS['CYAN']}{indent}{'-' * 70}{COLORS['RESET']}"
-            else:
-                node_footer = f"{indent}{'-' * 70}"
-            logger.info(node_footer)
-            
-            return result
-            
-        except Exception as e:
-            # Log node failure with detailed error information and Windows compatibility
-            if ANSI_ENABLED:
-                node_failure = f"{COLORS['RED']}{COLORS['BOLD']}{indent}" \
-                              f"NODE FAILED: {current_node['id']} | ERROR: {str(e)}{COLORS['RESET']}"
+
+        # Log process step details
+        logger.info(f"{indent}Adding process step:")
+        logger.info(f"{indent}  Node: {step['node']}")
+        logger.info(f"{indent}  Type: {step['type']}")
+        logger.info(f"{indent}  Input: {step['input']}")
+        logger.info(f"{indent}  Output: {step['output']}")
+
+        # Step is already stored in context
+
+        # Log completion
+        logger.info(f"{COLORS['BOLD']}{indent}Node {current_node['id']} execution completed{COLORS['RESET']}")
+
+        # Create node footer with Windows compatibility
+        if ANSI_ENABLED:
+            node_footer = f"{COLORS['CYAN']}{indent}{'-' * 70}{COLORS['RESET']}"
+        else:
+            node_footer = f"{indent}{'-' * 70}"
+        logger.info(node_footer)
+
+        finished_event = {
+            'node_id': current_node['id'],
+            'node_type': node_type,
+            'execution_time': node_execution_time,
+            'output': step['output']
+        }
+        if cache_key:
+            finished_event['cache_hit'] = cache_hit
+        if fallback is not None:
+            finished_event['fallback'] = True
+        execution.emit('node_finished', finished_event)
+        execution.record_node_trace(current_node['id'], node_type, 'fallback' if fallback is not None else 'completed',
+                                    node_start_time, attempt, input_data, result, usage,
+                                    cache_hit if cache_key else None)
+
+    def _node_failure(self, current_node, context, input_data, e, node_start_time, indent='', attempt=1, usage=None,
+                      cancel_scope=None):
+        """Record a failed node attempt and return the exception to raise for it."""
+        execution = context['execution']
+        node_type = current_node.get('data', {}).get('nodeType')
+        
+        if execution.cancelled:
+            # Node handlers wrap errors in RuntimeError; surface the cancellation itself
+            logger.info(f"{indent}Node {current_node['id']} stopped: execution cancelled")
+            execution.emit('node_cancelled', {'node_id': current_node['id'], 'node_type': node_type})
+            execution.record_node_trace(current_node['id'], node_type, 'cancelled', node_start_time, attempt,
+                                        input_data, usage=usage)
+            if isinstance(e, WorkflowCancelledError):
+                return e
+            error = WorkflowCancelledError(f"Workflow execution {execution.execution_id} was cancelled")
+            error.__cause__ = e
+            return error
+
+        if cancel_scope is not None and cancel_scope.timed_out and not isinstance(e, NodeTimeoutError):
+            # The services stop on the scope like on a cancellation; report it as the timeout it is
+            if execution.deadline_exceeded:
+                timeout_error = WorkflowDeadlineExceededError(
+                    f"Workflow deadline exceeded while executing node {current_node['id']}")
             else:
-                node_failure = f"{indent}NODE FAILED: {current_node['id']} | ERROR: {str(e)}"
-            logger.error(node_failure)
-            raise
+                timeout_error = NodeTimeoutError(f"Node {current_node['id']} timed out")
+            timeout_error.__cause__ = e
+            e = timeout_error
+
+        # Log node failure with detailed error information and Windows compatibility
+        if ANSI_ENABLED:
+            node_failure = f"{COLORS['RED']}{COLORS['BOLD']}{indent}" \
+                          f"NODE FAILED: {current_node['id']} | ERROR: {str(e)}{COLORS['RESET']}"
+        else:
+            node_failure = f"{indent}NODE FAILED: {current_node['id']} | ERROR: {str(e)}"
+        logger.error(node_failure)
+        execution.emit('node_failed', {'node_id': current_node['id'], 'node_type': node_type, 'error': str(e)})
+        execution.record_node_trace(current_node['id'], node_type,
+                                    'timeout' if isinstance(e, NodeTimeoutError) else 'failed',
+                                    node_start_time, attempt, input_data, usage=usage)
+        return e
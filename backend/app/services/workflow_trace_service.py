@@ -0,0 +1,126 @@
+"""
+Persistence and aggregation of per-node execution traces.
+
+Every workflow execution collects one trace record per node attempt on its
+``WorkflowExecution``; they are written to ``workflow_node_trace`` in a
+single bulk insert when the run ends (``WORKFLOW_TRACE_ENABLED``). The
+statistics functions compute latency percentiles per node and per run over
+a time window, to find the node that dominates a workflow's latency.
+"""
+import math
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import insert
+
+from .. import db
+from ..models.workflow_node_trace import WorkflowNodeTrace
+from ..utils.logging_utils import setup_logger
+
+logger = setup_logger('workflow_trace_service')
+
+TRACE_ENABLED = os.getenv('WORKFLOW_TRACE_ENABLED', 'true').lower() == 'true'
+# Most recent rows of the window used for statistics
+STATS_MAX_ROWS = int(os.getenv('WORKFLOW_TRACE_STATS_MAX_ROWS', '200000'))
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile of an ascending list, or None if it is empty."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def _latency_summary(values) -> dict:
+    values = sorted(values)
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': round(sum(values) / len(values), 1) if values else None,
+        'max': values[-1] if values else None
+    }
+
+
+def save_execution_traces(execution) -> int:
+    """Bulk insert the trace records of a finished execution; failures are logged, never raised."""
+    records = list(execution.traces)
+    if not TRACE_ENABLED or not records:
+        return 0
+    try:
+        db.session.execute(insert(WorkflowNodeTrace), records)
+        db.session.commit()
+        logger.debug(f"Saved {len(records)} trace records of execution {execution.execution_id}")
+        return len(records)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to save traces of execution {execution.execution_id}: {str(e)}")
+        return 0
+
+
+def get_execution_trace(execution_id: str) -> List[dict]:
+    """Trace records of one execution, in start order."""
+    rows = WorkflowNodeTrace.query.filter_by(execution_id=str(execution_id)) \
+        .order_by(WorkflowNodeTrace.started_at, WorkflowNodeTrace.id).all()
+    return [row.to_dict() for row in rows]
+
+
+def workflow_latency_stats(workflow_uuid, since: datetime, until: Optional[datetime] = None) -> dict:
+    """Latency percentiles (ms) of a workflow's runs and of each of its nodes between ``since`` and ``until``."""
+    query = db.session.query(
+        WorkflowNodeTrace.execution_id, WorkflowNodeTrace.node_id, WorkflowNodeTrace.node_type,
+        WorkflowNodeTrace.status, WorkflowNodeTrace.started_at, WorkflowNodeTrace.finished_at,
+        WorkflowNodeTrace.duration_ms, WorkflowNodeTrace.queue_wait_ms, WorkflowNodeTrace.prompt_tokens,
+        WorkflowNodeTrace.completion_tokens, WorkflowNodeTrace.cache_hit
+    ).filter(WorkflowNodeTrace.workflow_uuid == workflow_uuid, WorkflowNodeTrace.started_at >= since)
+    if until is not None:
+        query = query.filter(WorkflowNodeTrace.started_at < until)
+    rows = query.order_by(WorkflowNodeTrace.started_at.desc()).limit(STATS_MAX_ROWS).all()
+
+    nodes = defaultdict(lambda: {'durations': [], 'waits': [], 'statuses': defaultdict(int),
+                                 'cache_hits': 0, 'prompt_tokens': 0, 'completion_tokens': 0})
+    runs = {}
+    for row in rows:
+        node = nodes[row.node_id]
+        node['node_type'] = row.node_type
+        node['durations'].append(row.duration_ms)
+        if row.queue_wait_ms is not None:
+            node['waits'].append(row.queue_wait_ms)
+        node['statuses'][row.status] += 1
+        node['cache_hits'] += 1 if row.cache_hit else 0
+        node['prompt_tokens'] += row.prompt_tokens or 0
+        node['completion_tokens'] += row.completion_tokens or 0
+
+        started, finished = runs.get(row.execution_id, (row.started_at, row.finished_at))
+        runs[row.execution_id] = (min(started, row.started_at), max(finished, row.finished_at))
+
+    total_node_time = sum(sum(node['durations']) for node in nodes.values()) or 1
+    node_stats = []
+    for node_id, node in nodes.items():
+        node_stats.append({
+            'node_id': node_id,
+            'node_type': node['node_type'],
+            'count': len(node['durations']),
+            'statuses': dict(node['statuses']),
+            'cache_hits': node['cache_hits'],
+            'duration_ms': _latency_summary(node['durations']),
+            'queue_wait_ms': _latency_summary(node['waits']),
+            # Share of the time spent in all nodes of the workflow
+            'time_share': round(sum(node['durations']) / total_node_time, 4),
+            'prompt_tokens': node['prompt_tokens'],
+            'completion_tokens': node['completion_tokens']
+        })
+    node_stats.sort(key=lambda stats: stats['time_share'], reverse=True)
+
+    run_durations = [(finished - started).total_seconds() * 1000 for started, finished in runs.values()]
+    return {
+        'workflow_uuid': str(workflow_uuid),
+        'since': since.isoformat(),
+        'until': until.isoformat() if until else None,
+        'truncated': len(rows) >= STATS_MAX_ROWS,
+        'runs': {'count': len(runs), 'duration_ms': _latency_summary(run_durations)},
+        'nodes': node_stats
+    }
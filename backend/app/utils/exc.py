@@ -53,3 +53,39 @@ class TextExtractionError(DocumentExtractorError):
                 'message': self.message if hasattr(self, 'message') else str(self)
             }
         }
+
+
+class WorkflowCancelledError(RuntimeError):
+    """Exception raised inside a workflow execution once it has been cancelled."""
+    
+    def __init__(self, message="Workflow execution was cancelled", *args, **kwargs):
+        self.message = message
+        super().__init__(message, *args, **kwargs)
+
+
+class NodeTimeoutError(TimeoutError):
+    """Exception raised when a workflow node runs longer than its timeout or the workflow deadline."""
+    
+    def __init__(self, message="Workflow node timed out", *args, **kwargs):
+        self.message = message
+        super().__init__(message, *args, **kwargs)
+
+
+class WorkflowDeadlineExceededError(NodeTimeoutError):
+    """Exception raised when a workflow execution reaches its deadline before finishing."""
+
+
+class WorkflowValidationError(ValueError):
+    """Exception raised when a workflow graph is saved with validation errors."""
+    
+    def __init__(self, errors, message=None, *args, **kwargs):
+        self.errors = list(errors)
+        self.message = message or "Invalid workflow: " + "; ".join(error.message for error in self.errors)
+        super().__init__(self.message, *args, **kwargs)
+    
+    def to_dict(self):
+        return {
+            'error_type': self.__class__.__name__,
+            'message': self.message,
+            'errors': [error.to_dict() for error in self.errors]
+        }
@@ -0,0 +1,14 @@
+"""Identifier helpers shared by the services."""
+import uuid
+
+
+def as_uuid(value):
+    """
+    Coerce a UUID given as a string to ``uuid.UUID``; None is returned unchanged.
+
+    The models' ``Uuid`` columns bind ``uuid.UUID`` values: on SQLite a string
+    id fails to bind, so ids from requests and JSON are coerced before queries.
+    """
+    if value is None or isinstance(value, uuid.UUID):
+        return value
+    return uuid.UUID(str(value))
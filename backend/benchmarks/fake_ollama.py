@@ -0,0 +1,241 @@
+"""
+Local stand-in for the Ollama HTTP API, for benchmarks.
+
+Embeddings are deterministic: every token (lower-cased word) maps to a fixed
+pseudo-random unit vector derived from its hash, and a text embeds to the
+normalised sum of its token vectors. Texts sharing words therefore land close
+to each other, which is enough to exercise retrieval ranking, and the same
+text always gets the same vector, across runs and machines.
+
+Completions are canned text of ``--tokens`` words. They are streamed as
+NDJSON chunks (one word per chunk) at ``--token-rate`` tokens per second,
+or returned in one response when the request sets ``"stream": false``.
+The final chunk carries ``prompt_eval_count`` and ``eval_count`` like Ollama.
+``--latency`` delays every response before its first byte (time to first token).
+
+Endpoints:
+    POST /api/embeddings   {"model", "prompt"} -> {"embedding": [...]}
+    POST /api/embed        {"model", "input"}  -> {"embeddings": [[...], ...]}
+    POST /api/generate     {"model", "prompt", "stream"} -> {"response", "done", ...} chunks
+    POST /api/chat         {"model", "messages", "stream"} -> {"message", "done", ...} chunks
+    GET  /api/tags         list of the fake models
+    GET  /api/version      {"version": "fake"}
+
+Usage:
+    python benchmarks/fake_ollama.py --port 11435 --dimensions 768
+    python benchmarks/fake_ollama.py --port 11435 --latency 0.2 --tokens 64 --token-rate 50
+    OLLAMA_BASE_URL=http://127.0.0.1:11435 flask run
+"""
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+COMPLETION_WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+    'labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris'
+).split()
+
+
+@lru_cache(maxsize=200000)
+def _token_vector(token, dimensions):
+    seed = int.from_bytes(hashlib.sha256(token.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return vector / np.linalg.norm(vector)
+
+
+def embed_text(text, dimensions=768):
+    """Deterministic embedding of ``text`` as a list of floats."""
+    tokens = TOKEN_PATTERN.findall((text or '').lower())
+    vector = np.zeros(dimensions)
+    for token in tokens:
+        vector += _token_vector(token, dimensions)
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        # Empty text still gets a stable, valid unit vector
+        return _token_vector('', dimensions).tolist()
+    return (vector / norm).tolist()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeOllama/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b'{}'
+        return json.loads(body or b'{}')
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _delay(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def _send_chunk(self, payload):
+        """One NDJSON line of a chunked (streamed) response."""
+        line = json.dumps(payload).encode('utf-8') + b'\n'
+        self.wfile.write(f"{len(line):x}\r\n".encode('ascii') + line + b'\r\n')
+        self.wfile.flush()
+
+    def _complete(self, payload, prompt, make_chunk):
+        """Stream or return the canned completion; ``make_chunk(text)`` shapes one chunk."""
+        words = [COMPLETION_WORDS[i % len(COMPLETION_WORDS)] + ' ' for i in range(self.server.tokens)]
+        final = {
+            'model': payload.get('model'),
+            'done': True,
+            'done_reason': 'stop',
+            'prompt_eval_count': len(TOKEN_PATTERN.findall(prompt)),
+            'eval_count': len(words)
+        }
+        self._delay()
+        interval = 1.0 / self.server.token_rate if self.server.token_rate else 0.0
+
+        if not payload.get('stream', True):
+            if interval:
+                time.sleep(interval * len(words))
+            self._send_json({**make_chunk(''.join(words)), **final})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for word in words:
+                if interval:
+                    time.sleep(interval)
+                self._send_chunk({'model': payload.get('model'), **make_chunk(word), 'done': False})
+            self._send_chunk({**make_chunk(''), **final})
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled the generation
+            self.close_connection = True
+
+    @property
+    def route(self):
+        # Clients differ on trailing slashes (e.g. LangChain posts to /api/generate/)
+        return self.path.split('?', 1)[0].rstrip('/') or '/'
+
+    def do_GET(self):
+        if self.route == '/api/tags':
+            self._send_json({'models': [{'name': name, 'model': name} for name in self.server.models]})
+        elif self.route in ('/', '/api/version'):
+            self.server.count_request(self.route)
+            self._send_json({'version': 'fake'})
+        else:
+            self._send_json({'error': f'unknown path {self.path}'}, status=404)
+
+    def do_POST(self):
+        try:
+            payload = self._read_json()
+        except ValueError:
+            self._send_json({'error': 'invalid JSON'}, status=400)
+            return
+
+        self.server.count_request(self.route)
+        if self.route == '/api/embeddings':
+            self._delay()
+            self._send_json({'embedding': embed_text(payload.get('prompt', ''), self.server.dimensions)})
+        elif self.route == '/api/embed':
+            self._delay()
+            inputs = payload.get('input', '')
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json({
+                'model': payload.get('model'),
+                'embeddings': [embed_text(text, self.server.dimensions) for text in inputs]
+            })
+        elif self.route == '/api/generate':
+            prompt = f"{payload.get('system', '')} {payload.get('prompt', '')}"
+            self._complete(payload, prompt, lambda text: {'response': text})
+        elif self.route == '/api/chat':
+            prompt = ' '.join(str(message.get('content', '')) for message in payload.get('messages') or [])
+            self._complete(payload, prompt, lambda text: {'message': {'role': 'assistant', 'content': text}})
+        else:
+            self._send_json({'error': f'unknown path {self.path}'}, status=404)
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    """Threaded fake Ollama server; use ``start()``/``stop()`` to run it in the background."""
+
+    daemon_threads = True
+    handler_class = FakeOllamaHandler
+
+    def __init__(self, host='127.0.0.1', port=0, dimensions=768, latency=0.0,
+                 models=('nomic-embed-text',), verbose=False, tokens=32, token_rate=0.0):
+        super().__init__((host, port), self.handler_class)
+        self.dimensions = dimensions
+        self.latency = latency
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.models = list(models)
+        self.verbose = verbose
+        self.request_counts = {}
+        self._counts_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count_request(self, path):
+        with self._counts_lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-ollama', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake Ollama server with deterministic embeddings and canned completions.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--dimensions', type=int, default=768)
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every response')
+    parser.add_argument('--tokens', type=int, default=32, help='Words in every completion')
+    parser.add_argument('--token-rate', type=float, default=0.0, help='Completion tokens per second (0 = no delay)')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(args.host, args.port, dimensions=args.dimensions,
+                              latency=args.latency, verbose=args.verbose,
+                              tokens=args.tokens, token_rate=args.token_rate)
+    print(f"Fake Ollama listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
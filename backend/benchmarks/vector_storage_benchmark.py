@@ -0,0 +1,149 @@
+"""
+Recall versus memory benchmark for the knowledge base vector storage modes.
+
+Compares float32, halfvec and binary (with fp16 re-scoring) storage, each with
+optional Matryoshka truncation, against exact float32 cosine search.
+
+Usage:
+    python benchmarks/vector_storage_benchmark.py
+    python benchmarks/vector_storage_benchmark.py --vectors 50000 --dimensions 768 --top-k 10
+    python benchmarks/vector_storage_benchmark.py --embeddings corpus.npy --queries queries.npy --output results.json
+
+Synthetic vectors are drawn from a clustered distribution whose variance decays
+across dimensions, which loosely mimics Matryoshka-trained embeddings. Pass real
+embeddings (``.npy``, one row per vector) for numbers that reflect your model.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+# Add the parent directory to the path so we can import from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.vector_storage import (
+    STORAGE_FLOAT32, STORAGE_HALFVEC, STORAGE_BINARY,
+    bytes_per_vector, index_bytes_per_vector
+)
+
+
+def synthetic_embeddings(count, dimensions, clusters, seed):
+    rng = np.random.default_rng(seed)
+    scale = 1.0 / np.sqrt(np.arange(1, dimensions + 1))
+    centers = rng.normal(size=(clusters, dimensions)) * scale
+    assignment = rng.integers(0, clusters, size=count)
+    vectors = centers[assignment] + 0.35 * rng.normal(size=(count, dimensions)) * scale
+    return vectors.astype(np.float32)
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    idx = np.argpartition(-scores, kth=min(k, scores.shape[1] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def recall(found, truth):
+    hits = sum(len(set(f).intersection(t)) for f, t in zip(found, truth))
+    return hits / float(truth.size)
+
+
+def search(corpus, queries, mode, dimensions, k, rescore_factor):
+    corpus = normalize(corpus[:, :dimensions])
+    queries = normalize(queries[:, :dimensions])
+
+    if mode == STORAGE_FLOAT32:
+        return top_k(queries @ corpus.T, k)
+
+    half_corpus = corpus.astype(np.float16).astype(np.float32)
+    if mode == STORAGE_HALFVEC:
+        return top_k(queries @ half_corpus.T, k)
+
+    # Binary: Hamming distance on sign bits selects candidates, fp16 re-scores them
+    corpus_bits = corpus > 0
+    query_bits = queries > 0
+    agreement = query_bits.astype(np.int32) @ corpus_bits.T.astype(np.int32) \
+        + (~query_bits).astype(np.int32) @ (~corpus_bits).T.astype(np.int32)
+    candidates = top_k(agreement.astype(np.float32), k * rescore_factor)
+    results = []
+    for query, row in zip(queries, candidates):
+        scores = half_corpus[row] @ query
+        results.append(row[np.argsort(-scores)[:k]])
+    return np.array(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=20000, help='Synthetic corpus size')
+    parser.add_argument('--queries-count', type=int, default=200, help='Synthetic query count')
+    parser.add_argument('--dimensions', type=int, default=768, help='Synthetic embedding size')
+    parser.add_argument('--clusters', type=int, default=200, help='Synthetic topic clusters')
+    parser.add_argument('--embeddings', help='Corpus embeddings (.npy) instead of synthetic vectors')
+    parser.add_argument('--queries', help='Query embeddings (.npy); defaults to a corpus sample')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    parser.add_argument('--truncate', default='512,256,128', help='Matryoshka sizes to evaluate')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.embeddings:
+        corpus = np.load(args.embeddings).astype(np.float32)
+    else:
+        corpus = synthetic_embeddings(args.vectors, args.dimensions, args.clusters, args.seed)
+    if args.queries:
+        queries = np.load(args.queries).astype(np.float32)
+    else:
+        rng = np.random.default_rng(args.seed + 1)
+        sample = rng.choice(len(corpus), size=min(args.queries_count, len(corpus)), replace=False)
+        queries = corpus[sample] + 0.1 * rng.normal(size=(len(sample), corpus.shape[1])).astype(np.float32)
+
+    native = corpus.shape[1]
+    sizes = [native] + [int(d) for d in args.truncate.split(',') if d and int(d) < native]
+    truth = search(corpus, queries, STORAGE_FLOAT32, native, args.top_k, 1)
+
+    print(f"Corpus: {len(corpus)} x {native}, queries: {len(queries)}, recall@{args.top_k}\n")
+    print(f"{'mode':<8} {'dims':>5} {'recall':>8} {'bytes/vec':>10} {'index B/vec':>12} {'table MB/1M':>12} {'ms/query':>9}")
+
+    results = []
+    for dimensions in sizes:
+        for mode in (STORAGE_FLOAT32, STORAGE_HALFVEC, STORAGE_BINARY):
+            start = time.perf_counter()
+            found = search(corpus, queries, mode, dimensions, args.top_k, args.rescore_factor)
+            elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+            row = {
+                'mode': mode,
+                'dimensions': dimensions,
+                'recall': recall(found, truth),
+                'bytes_per_vector': bytes_per_vector(mode, dimensions),
+                'index_bytes_per_vector': index_bytes_per_vector(mode, dimensions),
+                'ms_per_query': elapsed_ms
+            }
+            results.append(row)
+            print(f"{mode:<8} {dimensions:>5} {row['recall']:>8.4f} {row['bytes_per_vector']:>10} "
+                  f"{row['index_bytes_per_vector']:>12} {row['bytes_per_vector'] / 1024 / 1024 * 1e6:>12.1f} "
+                  f"{elapsed_ms:>9.3f}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'corpus_size': len(corpus),
+                'native_dimensions': native,
+                'queries': len(queries),
+                'top_k': args.top_k,
+                'rescore_factor': args.rescore_factor,
+                'results': results
+            }, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
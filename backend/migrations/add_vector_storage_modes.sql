@@ -0,0 +1,15 @@
+-- Vector storage modes per knowledge base (requires pgvector >= 0.7 for halfvec and bit operators)
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- float32 vectors are no longer mandatory: halfvec and binary knowledge bases leave them empty
+ALTER TABLE document_vectors ALTER COLUMN embedding DROP NOT NULL;
+
+-- fp16 copy used by halfvec storage and for re-scoring binary candidates
+ALTER TABLE document_vectors ADD COLUMN IF NOT EXISTS embedding_half halfvec;
+
+-- Binary quantised embedding used by binary storage
+ALTER TABLE document_vectors ADD COLUMN IF NOT EXISTS embedding_bits bit varying;
+
+-- Existing knowledge bases keep float32 storage. Convert them with:
+--   flask vectors convert <knowledge_uuid> --mode halfvec [--dimensions 256]
+-- which rewrites the vectors and creates a partial HNSW index for the knowledge base.
@@ -0,0 +1,4 @@
+-- Save-time validation result of a workflow: warnings (e.g. nodes unreachable
+-- from the start node) and the nodes pruned from its execution schedule.
+-- Written by create_workflow/update_workflow; NULL until a workflow is saved again.
+ALTER TABLE workflow ADD COLUMN IF NOT EXISTS validation JSON;
@@ -0,0 +1,19 @@
+-- Document-level summary vectors for two-stage (coarse-to-fine) retrieval.
+-- One row per document: the normalised centroid of its chunk embeddings, stored
+-- in the same columns as document_vectors for the knowledge base's storage mode.
+CREATE TABLE IF NOT EXISTS document_summary_vectors (
+    uuid UUID PRIMARY KEY,
+    document_uuid UUID NOT NULL UNIQUE,
+    knowledge_uuid UUID NOT NULL,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    embedding vector,
+    embedding_half halfvec,
+    embedding_bits bit varying,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_document_summary_vectors_knowledge ON document_summary_vectors (knowledge_uuid);
+
+-- Existing knowledge bases get their summaries with:
+--   flask vectors summaries [<knowledge_uuid>]
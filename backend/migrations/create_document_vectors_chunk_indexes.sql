@@ -0,0 +1,8 @@
+-- Indexes backing the paginated chunk listing of a document
+
+-- Ordered page scans per document
+CREATE INDEX IF NOT EXISTS idx_document_vectors_document_chunk ON document_vectors (document_uuid, chunk_index);
+
+-- Trigram index so keyword filters (ILIKE '%term%') do not scan every chunk
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_document_vectors_text_trgm ON document_vectors USING gin (text_content gin_trgm_ops);
@@ -0,0 +1,24 @@
+-- Per-node timing of workflow executions, one row per node attempt.
+-- Append-only: rows are bulk inserted when a run ends and read by the
+-- /studio/workflows/<uuid>/traces/stats percentile queries.
+CREATE TABLE IF NOT EXISTS workflow_node_trace (
+    id BIGSERIAL PRIMARY KEY,
+    workflow_uuid UUID NOT NULL,
+    execution_id VARCHAR(64) NOT NULL,
+    node_id VARCHAR(255) NOT NULL,
+    node_type VARCHAR(50),
+    status VARCHAR(20) NOT NULL,
+    attempt SMALLINT NOT NULL DEFAULT 1,
+    started_at TIMESTAMP NOT NULL,
+    finished_at TIMESTAMP NOT NULL,
+    duration_ms DOUBLE PRECISION NOT NULL,
+    queue_wait_ms DOUBLE PRECISION,
+    bytes_in INTEGER,
+    bytes_out INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    cache_hit BOOLEAN
+);
+
+CREATE INDEX IF NOT EXISTS idx_workflow_node_trace_workflow_started ON workflow_node_trace (workflow_uuid, started_at);
+CREATE INDEX IF NOT EXISTS idx_workflow_node_trace_execution ON workflow_node_trace (execution_id);
@@ -0,0 +1,29 @@
+-- Asynchronous workflow runs queued through /studio/workflows/runs.
+-- Rows are claimed by the run workers (status queued -> running) and keep the
+-- result and process steps, so results survive worker restarts.
+CREATE TABLE IF NOT EXISTS workflow_run (
+    uuid UUID PRIMARY KEY,
+    workflow_uuid UUID NOT NULL,
+    api_key_uuid UUID,
+    created_by VARCHAR(50),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    input TEXT,
+    conversation_id UUID,
+    files JSON,
+    result JSON,
+    process_steps JSON,
+    stats JSON,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+    worker_id VARCHAR(255),
+    heartbeat_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (workflow_uuid) REFERENCES workflow(uuid) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_workflow_run_status_created ON workflow_run (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_workflow_run_workflow ON workflow_run (workflow_uuid);
@@ -0,0 +1,29 @@
+"""
+Shared fixtures: an application on a temporary SQLite database
+"""
+import os
+import sys
+
+import pytest
+
+# Add the parent directory to the path so we can import from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.config import Config
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path_factory.mktemp('db') / 'test.db')
+        VECTOR_DB_PATH = str(tmp_path_factory.mktemp('vectors'))
+        TESTING = True
+
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def app_context(app):
+    with app.app_context():
+        yield app
@@ -0,0 +1,93 @@
+"""
+Tests for the event-loop engine: database and file access stay off the loop thread
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from app.models.conversation_memory import ConversationMemory
+from app.services import run_files
+from app.services.async_workflow_engine import async_workflow_engine
+from app.utils.ids import as_uuid
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """/api/generate streaming a fixed answer"""
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for line in ({'response': 'Hello', 'done': False}, {'response': '', 'done': True}):
+            self.wfile.write((json.dumps(line) + '\n').encode())
+
+
+@pytest.fixture(scope='module')
+def ollama_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+@pytest.fixture
+def loop_access(app_context, monkeypatch):
+    """Names of the threads that ran SQL statements and read run files during the test."""
+    threads = {'sql': set(), 'files': set()}
+
+    def record_statement(*args):
+        threads['sql'].add(threading.current_thread().name)
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record_statement)
+    read_text = run_files._read_text
+
+    def record_read(*args, **kwargs):
+        threads['files'].add(threading.current_thread().name)
+        return read_text(*args, **kwargs)
+
+    monkeypatch.setattr(run_files, '_read_text', record_read)
+    yield threads
+    event.remove(engine, 'before_cursor_execute', record_statement)
+
+
+def test_loop_thread_stays_off_the_database_and_files(app_context, ollama_url, loop_access, monkeypatch, tmp_path):
+    from app.routes.studio import workflow_service
+    # Checkpoint after every message
+    monkeypatch.setattr(async_workflow_engine.workflow_service, 'memory_flush_every', 1)
+
+    notes = tmp_path / 'notes.txt'
+    notes.write_text('meeting at noon')
+    nodes = [
+        {'id': 'start-1', 'data': {'nodeType': 'start', 'label': 'Start'}},
+        {'id': 'llm-1', 'data': {'nodeType': 'llm', 'label': 'LLM', 'settings': {
+            'model': 'm', 'ollamaBaseUrl': ollama_url,
+            'userPrompt': '{{start-1.input}}\n{{start-1.file_content}}'}}},
+        {'id': 'ans', 'data': {'nodeType': 'answer', 'label': 'Answer', 'settings': {
+            'answerText': '{{llm-1.output}} / {{start-1.file_content}}'}}},
+    ]
+    edges = [{'source': 'start-1', 'target': 'llm-1'}, {'source': 'llm-1', 'target': 'ans'}]
+    workflow_uuid = workflow_service.create_workflow('async', 'engine test', nodes, edges).uuid
+
+    output = async_workflow_engine.submit(
+        workflow_uuid, 'summarise', files=[{'path': str(notes), 'filename': 'notes.txt'}]).result(timeout=30)
+
+    assert output['result'] == 'Hello / File Content (notes.txt):\n\nmeeting at noon'
+    assert loop_access['files'] and loop_access['sql']
+    assert 'workflow-async-loop' not in loop_access['files']
+    assert 'workflow-async-loop' not in loop_access['sql']
+
+    # The checkpoints and the final flush saved the whole conversation
+    db.session.remove()
+    memory = db.session.get(ConversationMemory, as_uuid(output['conversation_id']))
+    assert [m['role'] for m in memory.messages] == ['user', 'assistant']
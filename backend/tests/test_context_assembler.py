@@ -0,0 +1,172 @@
+"""
+Tests for token-budgeted prompt assembly of LLM nodes
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services import context_assembler
+from app.services.context_assembler import (
+    HISTORY_HEADER_TOKENS, SEPARATOR_TOKENS, assemble_context, context_budget, count_tokens, truncate_to_tokens
+)
+
+
+def words(n, word='aaaa'):
+    """``n`` estimated tokens: one per four-letter word."""
+    return ' '.join([word] * n)
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Count tokens with the word and punctuation estimate, whether or not tiktoken is installed."""
+    monkeypatch.setattr(context_assembler, '_encoding', lambda: None)
+    count_tokens.cache_clear()
+    yield
+    count_tokens.cache_clear()
+
+
+def test_token_estimate():
+    assert count_tokens('') == 0
+    # About four characters per ASCII word token, one per punctuation mark
+    assert count_tokens('hello world!') == 2 + 2 + 1
+    assert count_tokens('a, bb; tokenization') == 1 + 1 + 1 + 1 + 3
+    # One per character of other words
+    assert count_tokens('こんにちは 世界') == 7
+    assert count_tokens(words(20)) == 20
+
+
+def test_truncate_to_tokens():
+    text = words(50)
+    truncated = truncate_to_tokens(text, 20)
+    assert text.startswith(truncated) and count_tokens(truncated) == 20
+    assert count_tokens(truncated + 'a') == 21
+    assert truncate_to_tokens(text, 50) == text
+    assert truncate_to_tokens(text, 0) == ''
+
+
+def test_context_budget():
+    assert context_budget({}) == 2048 - 512
+    assert context_budget({'numCtx': 1000}) == 1000 - 250
+    assert context_budget({'numCtx': 4096, 'options': {'num_predict': 100}}) == 3996
+
+
+def test_fills_by_priority():
+    system, query = words(10), words(20)
+    chunks = [words(10, 'cccc'), words(10, 'dddd'), words(10, 'eeee')]
+    history = ['user: ' + words(8), 'assistant: ' + words(8)]
+    chunk_tokens = 10 + SEPARATOR_TOKENS
+    budget = 10 + 20 + 2 * chunk_tokens + 5
+
+    assembly = assemble_context(system, [query, '\n\n', chunks], history, budget)
+    # The best two chunks fit; the third does not, and there is no room left for history
+    assert assembly.system_prompt == system
+    assert assembly.message == query + '\n\n' + chunks[0] + '\n\n' + chunks[1]
+    assert assembly.history_lines == []
+    assert (assembly.chunks_used, assembly.chunks_total, assembly.history_total) == (2, 3, 2)
+    assert assembly.tokens == budget - 5 and not assembly.truncated and assembly.trimmed
+    assert assembly.to_dict() == {'budget': budget, 'tokens': budget - 5, 'chunks': '2/3', 'history': '0/2',
+                                  'truncated': False}
+
+
+def test_chunks_taken_rank_by_rank_across_knowledge_nodes():
+    first = [words(5, 'aaaa'), words(5, 'bbbb')]
+    second = [words(5, 'cccc'), words(5, 'dddd')]
+    # The ' | ' between them is one token
+    budget = 1 + 3 * (5 + SEPARATOR_TOKENS)
+
+    assembly = assemble_context('', [first, ' | ', second], [], budget)
+    assert assembly.message == first[0] + '\n\n' + first[1] + ' | ' + second[0]
+    assert assembly.chunks_used == 3
+
+
+def test_query_truncated_to_what_the_system_prompt_leaves():
+    system, query = words(10), words(50)
+
+    assembly = assemble_context(system, [query, [words(5, 'cccc')]], ['user: hi'], 30)
+    assert assembly.system_prompt == system
+    assert query.startswith(assembly.message) and count_tokens(assembly.message) == 20
+    assert assembly.truncated and assembly.tokens == 30
+    assert assembly.chunks_used == 0 and assembly.history_lines == []
+
+
+def test_system_prompt_truncated_only_beyond_the_budget():
+    system = words(40)
+
+    assembly = assemble_context(system, [words(10)], [], 25)
+    assert count_tokens(assembly.system_prompt) == 25 and system.startswith(assembly.system_prompt)
+    assert assembly.message == '' and assembly.truncated
+
+
+def test_history_dropped_oldest_first_before_the_query_is_truncated():
+    system, query = words(10), words(20)
+    history = [f'user: {words(8, word)}' for word in ('oldr', 'midl', 'newr')]
+    line_tokens = count_tokens(history[0]) + SEPARATOR_TOKENS
+
+    # Room for the two most recent messages
+    budget = 10 + 20 + HISTORY_HEADER_TOKENS + 2 * line_tokens
+    assembly = assemble_context(system, [query], history, budget)
+    assert assembly.history_lines == history[1:]
+    assert assembly.message == query and not assembly.truncated
+    assert assembly.tokens == budget
+
+    # The whole history goes before any of the query does
+    assembly = assemble_context(system, [query], history, 10 + 20 + HISTORY_HEADER_TOKENS)
+    assert assembly.history_lines == [] and assembly.message == query and not assembly.truncated
+    assembly = assemble_context(system, [query], history, 25)
+    assert assembly.history_lines == [] and assembly.truncated and count_tokens(assembly.message) == 15
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """/api/generate answering with a fixed text and recording the prompts it was sent"""
+    prompts = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        FakeOllama.prompts.append(payload['prompt'])
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for line in ({'response': 'Noted', 'done': False}, {'response': '', 'done': True}):
+            self.wfile.write((json.dumps(line) + '\n').encode())
+
+
+@pytest.fixture(scope='module')
+def ollama_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeOllama)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_llm_node_prompt_has_its_system_prompt_once(app_context, ollama_url):
+    from app.routes.studio import workflow_service
+    nodes = [
+        {'id': 'start-1', 'data': {'nodeType': 'start', 'label': 'Start'}},
+        {'id': 'llm-1', 'data': {'nodeType': 'llm', 'label': 'LLM', 'settings': {
+            'model': 'm', 'ollamaBaseUrl': ollama_url, 'streaming': False,
+            'systemPrompt': 'You are SYSTEM-MARKER.', 'userPrompt': 'Question: {{start-1.input}}'}}},
+        {'id': 'ans', 'data': {'nodeType': 'answer', 'label': 'Answer',
+                               'settings': {'answerText': '{{llm-1.output}}'}}},
+    ]
+    edges = [{'source': 'start-1', 'target': 'llm-1'}, {'source': 'llm-1', 'target': 'ans'}]
+    workflow_uuid = workflow_service.create_workflow('context', 'assembler test', nodes, edges).uuid
+    FakeOllama.prompts.clear()
+
+    first = workflow_service.execute_workflow(workflow_uuid, 'first question')
+    second = workflow_service.execute_workflow(workflow_uuid, 'second question',
+                                               conversation_id=first['conversation_id'])
+    assert second['result'] == 'Noted'
+
+    prompt = FakeOllama.prompts[-1]
+    assert prompt.count('SYSTEM-MARKER') == 1
+    assert prompt.startswith('You are SYSTEM-MARKER.')
+    # History between the system prompt and the current message
+    assert 'first question' in prompt
+    assert prompt.index('first question') < prompt.index('Question: second question')
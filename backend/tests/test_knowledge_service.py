@@ -0,0 +1,127 @@
+"""
+Tests for knowledge base vector storage: settings updates and conversions
+"""
+import numpy as np
+import pytest
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Document, DocumentVector, Knowledge
+from app.services import embedding_service
+from app.services.knowledge_service import KnowledgeService
+from app.services.vector_storage import VectorStorageConfig
+
+CHUNK_SETTING = {'chunk_setting': {'max_chunk_len': 100}}
+
+
+@pytest.fixture
+def knowledge_service(app_context, monkeypatch):
+    def generate_embeddings(self, text, cancel_event=None, timeout=None):
+        vector = np.arange(1, 9, dtype=float)
+        vector[len(text) % 8] += 1
+        return vector.tolist()
+
+    monkeypatch.setattr(embedding_service.EmbeddingService, 'generate_embeddings', generate_embeddings)
+    return KnowledgeService()
+
+
+def add_document(content='python programming'):
+    document = Document(filename='notes.txt', content=content, content_type='text/plain')
+    db.session.add(document)
+    db.session.commit()
+    return {'id': str(document.uuid)}
+
+
+def test_ui_update_keeps_the_stored_vector_storage(knowledge_service):
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'name': 'kb',
+        'processing_config': dict(CHUNK_SETTING, vector_storage={'mode': 'halfvec'}),
+        'documents': [add_document()]
+    })
+    assert DocumentVector.query.filter_by(knowledge_uuid=knowledge.uuid).count() == 1
+
+    # What the dataset page sends on rename and on upload: no vector_storage
+    ui_config = dict(CHUNK_SETTING, index_method='high_quality')
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'uuid': str(knowledge.uuid), 'name': 'renamed', 'processing_config': ui_config,
+        'documents': [add_document('flask routes')]
+    })
+    assert knowledge.name == 'renamed'
+    assert knowledge.processing_config['index_method'] == 'high_quality'
+    assert knowledge.processing_config['vector_storage'] == {'mode': 'halfvec'}
+    vectors = DocumentVector.query.filter_by(knowledge_uuid=knowledge.uuid).all()
+    assert len(vectors) == 2
+    assert all(v.embedding is None and v.embedding_half is not None for v in vectors)
+
+    # Naming another layout is still refused once there are vectors
+    with pytest.raises(Exception, match='cannot be changed'):
+        knowledge_service.initialize_knowledge({
+            'uuid': str(knowledge.uuid), 'processing_config': dict(CHUNK_SETTING, vector_storage={'mode': 'binary'})
+        })
+    # Restating the stored layout is not a change
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'uuid': str(knowledge.uuid), 'processing_config': dict(CHUNK_SETTING, vector_storage={'mode': 'halfvec'})
+    })
+    assert knowledge.name == 'renamed'
+
+
+def test_ui_update_without_vectors_keeps_the_chosen_storage(knowledge_service):
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'name': 'empty', 'processing_config': dict(CHUNK_SETTING, vector_storage={'mode': 'binary'})
+    })
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'uuid': str(knowledge.uuid), 'name': 'empty', 'processing_config': dict(CHUNK_SETTING)
+    })
+    assert knowledge.processing_config['vector_storage'] == {'mode': 'binary'}
+
+    # Without vectors the layout can still be changed
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'uuid': str(knowledge.uuid), 'processing_config': dict(CHUNK_SETTING, vector_storage={'mode': 'halfvec'})
+    })
+    assert knowledge.processing_config['vector_storage'] == {'mode': 'halfvec'}
+
+
+def committed_state(knowledge_uuid):
+    """Storage settings and vector sizes as other connections see them."""
+    with Session(db.engine) as session:
+        knowledge = session.get(Knowledge, knowledge_uuid)
+        vectors = session.query(DocumentVector).filter_by(knowledge_uuid=knowledge_uuid).order_by(DocumentVector.uuid)
+        return VectorStorageConfig.from_knowledge(knowledge), [len(v.embedding) for v in vectors if v.embedding]
+
+
+def test_truncation_in_place_commits_with_the_switch(knowledge_service, monkeypatch):
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'name': 'float', 'processing_config': dict(CHUNK_SETTING),
+        'documents': [add_document('one'), add_document('two two'), add_document('three three three')]
+    })
+    commit = db.session.commit
+    seen = []
+
+    def checked_commit():
+        commit()
+        storage, sizes = committed_state(knowledge.uuid)
+        seen.append((storage.dimensions, sizes))
+        # Searches embed queries at the committed size; the vectors must match it
+        assert set(sizes) == {storage.dimensions or 8}
+
+    monkeypatch.setattr(db.session, 'commit', checked_commit)
+    result = knowledge_service.convert_vector_storage(knowledge.uuid, 'float32', dimensions=4, batch_size=1)
+    monkeypatch.setattr(db.session, 'commit', commit)
+
+    assert result['converted'] == 3
+    assert seen[0] == (4, [4, 4, 4])
+    assert committed_state(knowledge.uuid) == (VectorStorageConfig('float32', 4), [4, 4, 4])
+
+
+def test_failed_truncation_in_place_changes_nothing(knowledge_service):
+    knowledge, _, _ = knowledge_service.initialize_knowledge({
+        'name': 'float', 'processing_config': dict(CHUNK_SETTING),
+        'documents': [add_document('one'), add_document('two two')]
+    })
+    last = DocumentVector.query.filter_by(knowledge_uuid=knowledge.uuid).order_by(DocumentVector.uuid.desc()).first()
+    last.embedding = None
+    db.session.commit()
+
+    with pytest.raises(ValueError, match='no stored embedding'):
+        knowledge_service.convert_vector_storage(knowledge.uuid, 'float32', dimensions=4, batch_size=1)
+    assert committed_state(knowledge.uuid) == (VectorStorageConfig(), [8])
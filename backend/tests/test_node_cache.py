@@ -0,0 +1,105 @@
+"""
+Tests for the node result cache: cache keys, TTLs and the LRU
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services import node_cache as node_cache_module
+from app.services.node_cache import NodeResultCache, build_cache_key, lookup_node_result, node_cache_ttl
+
+PLAN = SimpleNamespace(workflow_uuid='wf-1', updated_at='2026-01-01T00:00:00')
+LLM_NODE = {'nodeType': 'llm', 'label': 'Answer', 'settings': {'model': 'llama3', 'prompt': 'Say {{code-1.output}}',
+                                                              'cacheEnabled': True, 'cacheTtl': 60}}
+
+
+def _context(name='Ada', **values):
+    context = {'input': 'hello', 'memory': None, 'steps_by_node': {'code-1': {'output': name}}}
+    context.update(values)
+    return context
+
+
+def test_key_is_stable_for_the_same_inputs():
+    first = build_cache_key('llm', LLM_NODE, _context(), 'prev', PLAN)
+    second = build_cache_key('llm', dict(LLM_NODE), _context(), 'prev', PLAN)
+    assert first == second
+
+
+def test_key_ignores_label_and_cache_settings():
+    relabelled = dict(LLM_NODE, label='Renamed', cacheEnabled=False)
+    assert (build_cache_key('llm', LLM_NODE, _context(), 'prev', PLAN)
+            == build_cache_key('llm', relabelled, _context(), 'prev', PLAN))
+
+
+def test_key_changes_with_resolved_settings_and_inputs():
+    base = build_cache_key('llm', LLM_NODE, _context(), 'prev', PLAN)
+    assert base != build_cache_key('llm', LLM_NODE, _context('Bob'), 'prev', PLAN)
+    assert base != build_cache_key('llm', LLM_NODE, _context(), 'other', PLAN)
+    assert base != build_cache_key('llm', LLM_NODE, _context(input='bye'), 'prev', PLAN)
+
+
+def test_key_changes_with_workflow_version():
+    saved = SimpleNamespace(workflow_uuid='wf-1', updated_at='2026-02-01T00:00:00')
+    other = SimpleNamespace(workflow_uuid='wf-2', updated_at=PLAN.updated_at)
+    base = build_cache_key('llm', LLM_NODE, _context(), 'prev', PLAN)
+    assert base != build_cache_key('llm', LLM_NODE, _context(), 'prev', saved)
+    assert base != build_cache_key('llm', LLM_NODE, _context(), 'prev', other)
+
+
+def test_subworkflow_key_changes_with_callee_version():
+    node = {'nodeType': 'subworkflow', 'settings': {'workflowId': 'callee', 'cacheEnabled': True}}
+    callee = SimpleNamespace(workflow_uuid='callee', updated_at='v1')
+    saved_callee = SimpleNamespace(workflow_uuid='callee', updated_at='v2')
+    assert (build_cache_key('subworkflow', node, _context(), None, PLAN, callee)
+            != build_cache_key('subworkflow', node, _context(), None, PLAN, saved_callee))
+
+
+def test_ttl_of_cached_and_uncached_nodes():
+    assert node_cache_ttl('llm', LLM_NODE) == 60
+    assert node_cache_ttl('llm', {'settings': {'cacheEnabled': True}}) == node_cache_module.DEFAULT_TTL
+    assert node_cache_ttl('llm', {'settings': {'cacheEnabled': True, 'cacheTtl': 'soon'}}) == node_cache_module.DEFAULT_TTL
+    assert node_cache_ttl('llm', {'settings': {'cacheEnabled': True, 'cacheTtl': 0}}) is None
+    assert node_cache_ttl('llm', {'settings': {'model': 'llama3'}}) is None
+    assert node_cache_ttl('code', {'settings': {'cacheEnabled': True}}) is None
+
+
+def test_ttl_of_http_requests_depends_on_method():
+    assert node_cache_ttl('http_request', {'method': 'GET', 'cacheEnabled': True, 'cacheTtl': 5}) == 5
+    assert node_cache_ttl('http_request', {'method': 'post', 'cacheEnabled': True}) is None
+
+
+def test_entries_expire_after_their_ttl():
+    cache = NodeResultCache()
+    cache.set('key', {'text': 'cached'}, 0.05)
+    assert cache.get('key') == (True, {'text': 'cached'})
+    time.sleep(0.1)
+    assert cache.get('key') == (False, None)
+    assert cache.stats()['size'] == 0
+
+
+def test_entries_are_copies_and_evicted_least_recently_used():
+    cache = NodeResultCache(max_size=2)
+    value = {'items': [1]}
+    cache.set('a', value, 60)
+    value['items'].append(2)
+    cache.set('b', 'b', 60)
+    assert cache.get('a') == (True, {'items': [1]})
+    cache.set('c', 'c', 60)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a')[0] and cache.get('c')[0]
+
+
+def test_lookup_node_result(monkeypatch):
+    cache = NodeResultCache()
+    monkeypatch.setattr(node_cache_module, 'node_cache', cache)
+    assert lookup_node_result('llm', {'settings': {}}, _context(), 'prev', PLAN) == (None, None, False, None)
+
+    key, ttl, hit, result = lookup_node_result('llm', LLM_NODE, _context(), 'prev', PLAN)
+    assert (ttl, hit, result) == (60, False, None)
+    assert key == build_cache_key('llm', LLM_NODE, _context(), 'prev', PLAN)
+    cache.set(key, 'stored', ttl)
+    assert lookup_node_result('llm', LLM_NODE, _context(), 'prev', PLAN) == (key, 60, True, 'stored')
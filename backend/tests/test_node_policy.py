@@ -0,0 +1,167 @@
+"""
+Tests for node execution policies: NodePolicy, CancelScope and timeouts of knowledge nodes
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+import requests
+
+from app import db
+from app.models import Document
+from app.services import embedding_service
+from app.services.node_policy import CancelScope, MAX_RETRIES, MAX_RETRY_DELAY, NodePolicy
+from app.services.workflow_execution import list_executions
+from app.utils.exc import NodeTimeoutError, WorkflowCancelledError
+
+
+def test_default_policy():
+    policy = NodePolicy.for_node('llm', {'settings': {}})
+    assert policy.is_default
+    assert policy.timeout is None and policy.retries == 0 and not policy.has_fallback
+
+
+def test_options_from_settings_or_node_data():
+    policy = NodePolicy.for_node('llm', {'settings': {'timeout': '2.5', 'retries': 2, 'retryBackoff': 0.1}})
+    assert (policy.timeout, policy.retries, policy.backoff) == (2.5, 2, 0.1)
+    # HTTP request nodes keep their options at the top level of the node data
+    policy = NodePolicy.for_node('http_request', {'timeout': 1, 'retries': 1000, 'fallbackValue': None})
+    assert (policy.timeout, policy.retries) == (1, MAX_RETRIES)
+    assert policy.has_fallback and policy.fallback is None
+    assert NodePolicy.for_node('llm', {'settings': {'timeout': 0, 'retries': 'x'}}).is_default
+
+
+def test_fallback_branches():
+    classifier = NodePolicy.for_node('classifier', {'settings': {'fallbackBranch': 'other'}})
+    assert classifier.fallback == {'class_name': 'other', 'usage': {}}
+    ifelse = NodePolicy.for_node('ifelse', {'settings': {'fallbackBranch': 'else'}})
+    assert ifelse.fallback['branch_taken'] == 'else' and ifelse.fallback['condition_result'] is False
+    # Other node types have no branches to fall back to
+    assert not NodePolicy.for_node('llm', {'settings': {'fallbackBranch': 'else'}}).has_fallback
+
+
+def test_retry_delay_backs_off_with_jitter():
+    policy = NodePolicy.for_node('llm', {'settings': {'retries': 3, 'retryBackoff': 1}})
+    for retry in range(1, 4):
+        base = 2 ** (retry - 1)
+        assert 0.5 * base <= policy.retry_delay(retry) <= 1.5 * base
+    assert policy.retry_delay(20) == MAX_RETRY_DELAY
+
+
+def test_cancel_scope_follows_its_parent():
+    parent = threading.Event()
+    scope = CancelScope(parent)
+    assert not scope.is_set() and scope.remaining() is None
+    parent.set()
+    assert scope.is_set() and not scope.timed_out
+
+
+def test_cancel_scope_trips_at_its_deadline():
+    scope = CancelScope(threading.Event(), time.time() + 0.1)
+    assert not scope.is_set() and 0 < scope.remaining() <= 0.1
+    start = time.time()
+    assert scope.wait(5)
+    assert time.time() - start < 1
+    assert scope.is_set() and scope.timed_out and scope.remaining() == 0
+
+
+def test_cancel_scope_set():
+    parent = threading.Event()
+    scope = CancelScope(parent, time.time() + 60)
+    scope.set()
+    assert scope.is_set() and not parent.is_set() and not scope.timed_out
+
+
+@pytest.fixture
+def knowledge_workflow(app_context, monkeypatch):
+    """A start -> knowledge -> answer workflow whose query embedding runs until ``slow`` says otherwise."""
+    requests_seen = []
+    slow = {'mode': None}
+
+    def generate_embeddings(self, text, cancel_event=None, timeout=None):
+        if cancel_event is not None and cancel_event.is_set():
+            raise WorkflowCancelledError("Embedding request was cancelled")
+        requests_seen.append(timeout)
+        if slow['mode'] == 'timeout':
+            # A request that outlives its timeout
+            time.sleep(timeout or 5)
+            raise requests.exceptions.ReadTimeout("Read timed out")
+        if slow['mode'] == 'cancel':
+            # The run is cancelled while the request is in flight
+            for execution in list_executions():
+                execution.cancel()
+        vector = np.zeros(8)
+        vector[len(text) % 8] = 1
+        return vector.tolist()
+
+    monkeypatch.setattr(embedding_service.EmbeddingService, 'generate_embeddings', generate_embeddings)
+
+    from app.routes.studio import workflow_service
+    from app.services.knowledge_service import KnowledgeService
+    document = Document(filename='notes.txt', content='python programming', content_type='text/plain')
+    db.session.add(document)
+    db.session.commit()
+    knowledge, _, _ = KnowledgeService().initialize_knowledge({
+        'name': 'kb',
+        'processing_config': {'chunk_setting': {'max_chunk_len': 100}},
+        'documents': [{'id': str(document.uuid)}]
+    })
+
+    def create(**policy):
+        settings = {'retrieval_method': 'semantic'}
+        settings.update(policy)
+        nodes = [
+            {'id': 'start-1', 'data': {'nodeType': 'start', 'label': 'Start'}},
+            {'id': 'kn', 'data': {'nodeType': 'knowledge', 'label': 'Knowledge', 'settings': settings,
+                                  'knowledge_id': str(knowledge.uuid)}},
+            {'id': 'ans', 'data': {'nodeType': 'answer', 'label': 'Answer',
+                                   'settings': {'answerText': '>> {{kn.output}}'}}},
+        ]
+        edges = [{'source': 'start-1', 'target': 'kn'}, {'source': 'kn', 'target': 'ans'}]
+        return workflow_service.create_workflow('knowledge', 'policy test', nodes, edges).uuid
+
+    requests_seen.clear()
+    yield workflow_service, create, slow, requests_seen
+
+
+def test_knowledge_node_times_out_then_falls_back(knowledge_workflow):
+    workflow_service, create, slow, requests_seen = knowledge_workflow
+    workflow_uuid = create(timeout=0.3, fallbackValue='FALLBACK')
+    slow['mode'] = 'timeout'
+
+    start = time.time()
+    output = workflow_service.execute_workflow(workflow_uuid, 'what is python')
+    assert time.time() - start < 2
+    assert output['result'] == '>> FALLBACK'
+    step = next(s for s in output['process_steps'] if s['node'] == 'kn')
+    assert step['status'] == 'fallback'
+    # The embedding request only got what was left of the attempt's time
+    assert len(requests_seen) == 1 and 0 < requests_seen[0] <= 0.3
+
+
+def test_knowledge_node_timeout_without_fallback(knowledge_workflow):
+    workflow_service, create, slow, requests_seen = knowledge_workflow
+    workflow_uuid = create(timeout=0.3)
+    slow['mode'] = 'timeout'
+
+    with pytest.raises(NodeTimeoutError):
+        workflow_service.execute_workflow(workflow_uuid, 'what is python')
+    # No full-text search fallback after the deadline
+    assert len(requests_seen) == 1
+
+
+def test_knowledge_node_stops_on_cancellation(knowledge_workflow):
+    workflow_service, create, slow, requests_seen = knowledge_workflow
+    workflow_uuid = create()
+    slow['mode'] = 'cancel'
+
+    with pytest.raises(WorkflowCancelledError):
+        workflow_service.execute_workflow(workflow_uuid, 'what is python')
+
+
+def test_knowledge_node_without_policy(knowledge_workflow):
+    workflow_service, create, slow, requests_seen = knowledge_workflow
+    output = workflow_service.execute_workflow(create(), 'what is python')
+    assert output['result'] == '>> python programming'
+    assert requests_seen == [None]
@@ -0,0 +1,139 @@
+"""
+Tests for coalescing identical concurrent workflow executions
+"""
+import threading
+import time
+
+import pytest
+
+from app import db
+from app.models.conversation_memory import ConversationMemory
+from app.services.single_flight import SingleFlight, workflow_single_flight
+from app.utils.exc import WorkflowCancelledError
+from app.utils.ids import as_uuid
+
+
+def run_concurrently(count, fn):
+    """Call ``fn(i)`` from ``count`` threads; returns the results, or the exceptions raised, by index."""
+    results = [None] * count
+
+    def call(i):
+        try:
+            results[i] = fn(i)
+        except BaseException as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def wait_for_followers(flight, key, count):
+    """Block the leader until ``count`` callers wait for its call."""
+    deadline = time.time() + 5
+    while flight._calls[key].followers < count:
+        assert time.time() < deadline, "followers never joined the call"
+        time.sleep(0.01)
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        wait_for_followers(flight, 'k', 3)
+        calls.append(1)
+        return {'value': 42}
+
+    results = run_concurrently(4, lambda i: flight.do('k', fn))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result == {'value': 42} for result, _ in results)
+    assert flight.stats() == {'in_flight': 0, 'executed': 1, 'shared': 3}
+
+
+def test_followers_raise_a_copy_of_the_leaders_error():
+    flight = SingleFlight()
+
+    def fn():
+        wait_for_followers(flight, 'k', 2)
+        raise ValueError('boom')
+
+    errors = run_concurrently(3, lambda i: flight.do('k', fn))
+    assert all(isinstance(e, ValueError) and str(e) == 'boom' for e in errors)
+    assert len({id(e) for e in errors}) == 3
+
+
+def test_followers_run_again_after_a_retry_error():
+    flight = SingleFlight(retry_errors=(WorkflowCancelledError,))
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) == 1:
+            wait_for_followers(flight, 'k', 2)
+            raise WorkflowCancelledError('cancelled for its own request')
+        # One of the followers leads the new call for both
+        wait_for_followers(flight, 'k', 1)
+        return 'done'
+
+    results = run_concurrently(3, lambda i: flight.do('k', fn))
+    assert sum(isinstance(r, WorkflowCancelledError) for r in results) == 1
+    assert sorted(r for r in results if isinstance(r, tuple)) == [('done', False), ('done', True)]
+    assert len(calls) == 2
+
+
+@pytest.fixture
+def coalesced_workflow(app):
+    from app.routes.studio import workflow_service
+    nodes = [
+        {'id': 'start-1', 'data': {'nodeType': 'start', 'label': 'Start', 'settings': {'coalesceRuns': True}}},
+        {'id': 'ans', 'data': {'nodeType': 'answer', 'label': 'Answer',
+                               'settings': {'answerText': 'FAQ: {{start-1.input}}'}}},
+    ]
+    edges = [{'source': 'start-1', 'target': 'ans'}]
+    with app.app_context():
+        workflow_uuid = workflow_service.create_workflow('faq', 'coalesce test', nodes, edges).uuid
+    return workflow_service, workflow_uuid
+
+
+def test_coalesced_callers_get_their_own_conversations(app, coalesced_workflow, monkeypatch):
+    workflow_service, workflow_uuid = coalesced_workflow
+    callers = 3
+    run = workflow_service._run_workflow
+    runs = []
+
+    def leader_run(*args, **kwargs):
+        runs.append(kwargs.get('persist_memory'))
+        # Hold the shared run until the other callers wait for it
+        wait_for_followers(workflow_single_flight, next(iter(workflow_single_flight._calls)), callers - 1)
+        return run(*args, **kwargs)
+
+    monkeypatch.setattr(workflow_service, '_run_workflow', leader_run)
+
+    def execute(i):
+        with app.app_context():
+            return workflow_service.execute_workflow(workflow_uuid, 'opening hours?')
+
+    outputs = run_concurrently(callers, execute)
+    assert runs == [False]
+    assert all(output['result'] == 'FAQ: opening hours?' for output in outputs)
+    assert sum(bool(output['stats'].get('coalesced')) for output in outputs) == callers - 1
+
+    conversation_ids = [output['conversation_id'] for output in outputs]
+    assert len(set(conversation_ids)) == callers
+    assert all(output['stats']['conversation_id'] == output['conversation_id'] for output in outputs)
+    with app.app_context():
+        for conversation_id in conversation_ids:
+            memory = db.session.get(ConversationMemory, as_uuid(conversation_id))
+            assert memory.messages[0]['role'] == 'user' and memory.messages[0]['content'] == 'opening hours?'
+
+        # A follow-up in one conversation is not seen by the others
+        monkeypatch.undo()
+        workflow_service.execute_workflow(workflow_uuid, 'and on sundays?', conversation_id=conversation_ids[0])
+        db.session.remove()
+        lengths = [len(db.session.get(ConversationMemory, as_uuid(c)).messages) for c in conversation_ids]
+        assert lengths[0] > lengths[1] == lengths[2]
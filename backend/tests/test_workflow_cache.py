@@ -0,0 +1,106 @@
+"""
+Tests for the process-level workflow plan cache and its change notifications
+"""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from app.models import Workflow
+from app.services import workflow_cache as workflow_cache_module
+from app.services.workflow_cache import _version, workflow_cache
+
+
+def nodes(answer):
+    return [{'id': 'start-1', 'data': {'nodeType': 'start', 'label': 'Start'}},
+            {'id': 'ans', 'data': {'nodeType': 'answer', 'label': 'Answer', 'settings': {'answerText': answer}}}]
+
+
+EDGES = [{'source': 'start-1', 'target': 'ans'}]
+
+
+def answer_of(plan):
+    return plan.node_map['ans']['data']['settings']['answerText']
+
+
+def save_in_another_process(workflow_uuid, answer):
+    """Save a new version of the workflow outside this session; returns its notification payload."""
+    with Session(db.engine) as session:
+        workflow = session.get(Workflow, workflow_uuid)
+        workflow.nodes = nodes(answer)
+        workflow.updated_at = workflow.updated_at + timedelta(seconds=1)
+        session.commit()
+        payload = f"{workflow.uuid} {_version(workflow.updated_at)}"
+    # Later requests of this process start with a new session
+    db.session.remove()
+    return payload
+
+
+@pytest.fixture
+def cached_workflow(app_context, monkeypatch):
+    from app.routes.studio import workflow_service
+    monkeypatch.setattr(workflow_cache, 'check_seconds', 60)
+    workflow = workflow_service.create_workflow('cached', 'cache test', nodes('v1'), EDGES)
+    yield workflow.uuid
+    workflow_cache._listening.clear()
+
+
+@pytest.fixture
+def statements(app_context):
+    """SQL statements run during the test."""
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    yield seen
+    event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def test_saved_plan_is_served_without_queries(cached_workflow, statements):
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v1'
+    assert statements == []
+
+
+def test_version_check_reloads_a_changed_workflow(cached_workflow, monkeypatch):
+    save_in_another_process(cached_workflow, 'v2')
+    # Trusted until its check expires
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v1'
+    monkeypatch.setattr(workflow_cache, 'check_seconds', 0)
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v2'
+
+
+def test_notification_drops_a_stale_plan(cached_workflow, statements):
+    workflow_cache._listening.set()
+    payload = save_in_another_process(cached_workflow, 'v2')
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v1'
+    statements.clear()
+
+    workflow_cache._on_notify(payload)
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v2'
+    assert statements
+    # Current again: no more queries while listening
+    statements.clear()
+    workflow_cache.get_plan(cached_workflow)
+    assert statements == []
+
+
+def test_notification_during_a_load_is_not_lost(cached_workflow, monkeypatch):
+    workflow_cache._listening.set()
+    workflow_cache.invalidate(cached_workflow)
+    compile_plan = workflow_cache_module.get_workflow_plan
+
+    def notified_while_compiling(workflow):
+        # Another process saves v2 after this one read v1, before v1 is cached
+        workflow_cache._on_notify(save_in_another_process(cached_workflow, 'v2'))
+        return compile_plan(workflow)
+
+    monkeypatch.setattr(workflow_cache_module, 'get_workflow_plan', notified_while_compiling)
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v1'
+    monkeypatch.setattr(workflow_cache_module, 'get_workflow_plan', compile_plan)
+
+    # v1 was not marked current, so the next use checks the version despite the listener
+    assert answer_of(workflow_cache.get_plan(cached_workflow)) == 'v2'
@@ -0,0 +1,156 @@
+"""
+Tests for workflow validation: graph errors, branch joins and pruning
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.services.workflow_compiler import (
+    CYCLE, DANGLING_EDGE, MULTIPLE_START_NODES, SUBWORKFLOW_CYCLE, UNREACHABLE_NODE, UNSATISFIABLE_JOIN,
+    compile_workflow, validate_workflow
+)
+from app.utils.exc import WorkflowValidationError
+
+
+def node(node_id, node_type, **settings):
+    return {'id': node_id, 'data': {'nodeType': node_type, 'label': node_id, 'settings': settings}}
+
+
+def edge(source, target, handle=None):
+    e = {'source': source, 'target': target}
+    if handle:
+        e['sourceHandle'] = handle
+    return e
+
+
+def codes(issues):
+    return [issue.code for issue in issues]
+
+
+START = node('start-1', 'start')
+
+
+def test_linear_workflow_is_valid():
+    validation = validate_workflow([START, node('llm-1', 'llm'), node('ans', 'answer')],
+                                   [edge('start-1', 'llm-1'), edge('llm-1', 'ans')])
+    assert validation.is_valid and not validation.warnings and not validation.pruned_ids
+
+
+def test_cycle():
+    nodes = [START, node('a', 'llm'), node('b', 'llm')]
+    validation = validate_workflow(nodes, [edge('start-1', 'a'), edge('a', 'b'), edge('b', 'a')])
+    assert codes(validation.errors) == [CYCLE]
+    assert validation.errors[0].node_ids == ('a', 'b')
+
+
+def test_cycle_whose_nodes_all_have_outside_predecessors():
+    nodes = [START, node('a', 'llm'), node('b', 'llm')]
+    edges = [edge('start-1', 'a'), edge('start-1', 'b'), edge('a', 'b'), edge('b', 'a')]
+    assert codes(validate_workflow(nodes, edges).errors) == [CYCLE]
+
+
+def test_dangling_edge():
+    validation = validate_workflow([START, node('a', 'llm')], [edge('start-1', 'a'), edge('a', 'missing')])
+    assert codes(validation.errors) == [DANGLING_EDGE]
+    assert validation.errors[0].node_ids == ('a',)
+
+
+def test_multiple_start_nodes():
+    validation = validate_workflow([START, node('start-2', 'start'), node('a', 'answer')],
+                                   [edge('start-1', 'a'), edge('start-2', 'a')])
+    assert codes(validation.errors) == [MULTIPLE_START_NODES]
+    assert validation.errors[0].node_ids == ('start-1', 'start-2')
+
+
+def ifelse_diamond(**ifelse_settings):
+    settings = {'conditions': [{'left': '{{start-1.input}}', 'operator': 'eq', 'right': 'yes'}],
+                'nextSteps': {'if': 'yes', 'else': 'no'}}
+    settings.update(ifelse_settings)
+    nodes = [START, node('if-1', 'ifelse', **settings), node('yes', 'llm'), node('no', 'llm'), node('join', 'answer')]
+    edges = [edge('start-1', 'if-1'), edge('if-1', 'yes', 'if'), edge('if-1', 'no', 'else'),
+             edge('yes', 'join'), edge('no', 'join')]
+    return nodes, edges
+
+
+def test_ifelse_diamond_into_a_join_is_unsatisfiable():
+    validation = validate_workflow(*ifelse_diamond())
+    assert codes(validation.errors) == [UNSATISFIABLE_JOIN]
+    assert validation.errors[0].node_ids == ('join',)
+    assert validation.pruned_ids == {'join'}
+
+
+def classifier_diamond(**classifier_settings):
+    settings = {'classes': [{'name': 'A'}, {'name': 'B'}], 'nextSteps': {'A': 'a', 'B': 'b'}}
+    settings.update(classifier_settings)
+    nodes = [START, node('cls', 'classifier', **settings), node('a', 'llm'), node('b', 'llm'), node('join', 'answer')]
+    edges = [edge('start-1', 'cls'), edge('cls', 'a', 'A'), edge('cls', 'b', 'B'), edge('a', 'join'), edge('b', 'join')]
+    return nodes, edges
+
+
+def test_classifier_diamond_into_a_join_is_unsatisfiable():
+    validation = validate_workflow(*classifier_diamond())
+    assert codes(validation.errors) == [UNSATISFIABLE_JOIN]
+
+
+def test_classifier_fallback_branch_without_target_releases_every_successor():
+    # The fallback class has no target, so a failed classifier runs both branches and the join
+    validation = validate_workflow(*classifier_diamond(fallbackBranch='Unknown'))
+    assert validation.is_valid and not validation.pruned_ids
+
+
+def test_classifier_fallback_branch_with_target_keeps_branches_exclusive():
+    validation = validate_workflow(*classifier_diamond(fallbackBranch='A'))
+    assert codes(validation.errors) == [UNSATISFIABLE_JOIN]
+
+
+def test_unreachable_nodes_are_pruned():
+    nodes = [START, node('a', 'llm'), node('island', 'llm'), node('after-island', 'answer')]
+    edges = [edge('start-1', 'a'), edge('island', 'after-island')]
+    validation = validate_workflow(nodes, edges)
+    assert validation.is_valid
+    assert codes(validation.warnings) == [UNREACHABLE_NODE]
+    assert validation.pruned_ids == {'island', 'after-island'}
+
+    plan = compile_workflow(SimpleNamespace(uuid='wf', updated_at=None, nodes=nodes, edges=edges))
+    assert plan.levels == (('start-1',), ('a',))
+
+
+def test_update_workflow_rejects_invalid_graph(app_context):
+    from app.routes.studio import workflow_service
+    nodes = [START, node('ans', 'answer')]
+    workflow = workflow_service.create_workflow('valid', 'validation test', nodes, [edge('start-1', 'ans')])
+
+    with pytest.raises(WorkflowValidationError) as raised:
+        workflow_service.update_workflow(workflow.uuid, *ifelse_diamond())
+    assert codes(raised.value.errors) == [UNSATISFIABLE_JOIN]
+    assert raised.value.to_dict()['errors'][0]['node_ids'] == ['join']
+
+    calls_itself = node('sub', 'subworkflow')
+    calls_itself['data']['workflow_id'] = str(workflow.uuid)
+    with pytest.raises(WorkflowValidationError) as raised:
+        workflow_service.update_workflow(workflow.uuid, [START, calls_itself], [edge('start-1', 'sub')])
+    assert codes(raised.value.errors) == [SUBWORKFLOW_CYCLE]
+
+    # The rejected graphs were not saved
+    saved = workflow_service.get_workflow(workflow.uuid)
+    assert [n['id'] for n in saved.nodes] == ['start-1', 'ans']
+
+
+def test_metadata_update_of_a_workflow_that_no_longer_validates(app_context):
+    from app import db
+    from app.routes.studio import workflow_service
+    nodes, edges = [START, node('ans', 'answer')], [edge('start-1', 'ans')]
+    workflow = workflow_service.create_workflow('legacy', 'validation test', nodes, edges)
+    # Saved before the edge check existed
+    workflow.edges = edges + [edge('ans', 'removed-node')]
+    db.session.commit()
+
+    workflow = workflow_service.update_workflow(workflow.uuid, name='renamed', description='still runs')
+    assert (workflow.name, workflow.description) == ('renamed', 'still runs')
+    assert workflow.validation['valid'] is False
+    assert [e['code'] for e in workflow.validation['errors']] == [DANGLING_EDGE]
+
+    # A graph sent with the update is still enforced
+    with pytest.raises(WorkflowValidationError):
+        workflow_service.update_workflow(workflow.uuid, edges=workflow.edges, name='again')
+    assert workflow_service.get_workflow(workflow.uuid).name == 'renamed'